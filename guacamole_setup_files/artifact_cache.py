@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+# Local cache of the files the Dockerfiles install (guacamole-server, the guacamole war, the guacamole
+# extensions and the mysql connector). Every file is downloaded once into the artifact_cache folder and
+# its SHA-256 is verified against a pin. The verified files are linked into the build context before
+# the image is built and the Dockerfiles COPY them, so repeated builds do not need the network.
+#
+# Pins are looked up in settings.ARTIFACT_SHA256 first. A file without a pin there is checked against
+# the checksum file published by the project over https (the .sha256 files of Apache, the .sha1 files of
+# Maven Central), and its verified SHA-256 is recorded in artifact_cache/pins.json along with the checksum
+# url. A file is never trusted on first use: without a pin or a published checksum which could be fetched,
+# it is not added to the cache.
+
+import hashlib
+import json
+import os
+import re
+import shutil
+from collections import namedtuple
+
+import requests
+
+import settings
+
+PINS_FILE_NAME = 'pins.json'
+
+DOWNLOAD_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+
+# name, download urls tried in order, url of the published checksum (or None) and the build contexts using it
+Artifact = namedtuple('Artifact', ['name', 'urls', 'checksum_url', 'contexts'])
+
+# Only https mirrors are used, so a file can only be swapped by the mirror itself
+APACHE_MIRRORS = [
+    'https://archive.apache.org/dist/guacamole/{version}/{kind}/{name}',
+]
+APACHE_CHECKSUM = 'https://archive.apache.org/dist/guacamole/{version}/{kind}/{name}.sha256'
+
+# The connector jar comes from Maven Central, which publishes a checksum for it, unlike the MySQL downloads
+MYSQL_CONNECTOR_MIRRORS = [
+    'https://repo1.maven.org/maven2/mysql/mysql-connector-java/{version}/{name}',
+    'https://repo.maven.apache.org/maven2/mysql/mysql-connector-java/{version}/{name}',
+]
+MYSQL_CONNECTOR_CHECKSUM = 'https://repo1.maven.org/maven2/mysql/mysql-connector-java/{version}/{name}.sha1'
+
+# Hash algorithm of a published checksum file by the extension of its url
+CHECKSUM_ALGORITHMS = {'.sha256': 'sha256', '.sha512': 'sha512', '.sha1': 'sha1'}
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def apache_artifact(kind, name, contexts):
+    values = {'version': settings.GUACAMOLE_VERSION, 'kind': kind, 'name': name}
+    return Artifact(name, [url.format(**values) for url in APACHE_MIRRORS], APACHE_CHECKSUM.format(**values),
+                    contexts)
+
+
+# Returns the artifacts for the versions configured in settings.py
+def artifacts():
+    version = settings.GUACAMOLE_VERSION
+    connector = {'version': settings.MYSQL_CONNECTOR_VERSION,
+                 'name': 'mysql-connector-java-{}.jar'.format(settings.MYSQL_CONNECTOR_VERSION)}
+
+    return [
+        apache_artifact('source', 'guacamole-server-{}.tar.gz'.format(version), [settings.DIRECTORY_GUACD]),
+        apache_artifact('binary', 'guacamole-{}.war'.format(version), [settings.DIRECTORY_GUACAMOLE]),
+        apache_artifact('binary', 'guacamole-auth-header-{}.tar.gz'.format(version), [settings.DIRECTORY_GUACAMOLE]),
+        apache_artifact('binary', 'guacamole-auth-jdbc-{}.tar.gz'.format(version),
+                        [settings.DIRECTORY_GUACAMOLE, settings.DIRECTORY_DATABASE]),
+        Artifact(connector['name'], [url.format(**connector) for url in MYSQL_CONNECTOR_MIRRORS],
+                 MYSQL_CONNECTOR_CHECKSUM.format(**connector), [settings.DIRECTORY_GUACAMOLE]),
+    ]
+
+
+def cache_path(directories):
+    path = directories[settings.DIRECTORY_ARTIFACTS]
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def read_pins(directory):
+    pins_file = os.path.join(directory, PINS_FILE_NAME)
+    if not os.path.isfile(pins_file):
+        return {}
+
+    try:
+        with open(pins_file, 'r') as file_object:
+            return json.load(file_object)
+    except ValueError:
+        raise ArtifactError('The file {} is corrupt. Remove it to record the hashes again.'.format(pins_file))
+
+
+def write_pins(directory, pins):
+    pins_file = os.path.join(directory, PINS_FILE_NAME)
+    with open(pins_file + '.tmp', 'w') as file_object:
+        json.dump(pins, file_object, indent=4, sort_keys=True)
+    os.replace(pins_file + '.tmp', pins_file)
+
+
+def file_digest(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as file_object:
+        for chunk in iter(lambda: file_object.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_sha256(path):
+    return file_digest(path, 'sha256')
+
+
+# Returns the hash algorithm of a published checksum by the extension of its url
+def checksum_algorithm(checksum_url):
+    for extension, algorithm in CHECKSUM_ALGORITHMS.items():
+        if checksum_url.endswith(extension):
+            return algorithm
+    raise ArtifactError('The hash algorithm of the checksum {} is unknown'.format(checksum_url))
+
+
+# Reads the hash out of a published checksum file. Both the sha256sum format (hash followed by the
+# file name, or the hash alone) and the gpg --print-md format (file name, colon, hash in groups) are
+# understood.
+def parse_checksum(text, algorithm='sha256'):
+    text = text.strip()
+    if not text:
+        return None
+
+    if ':' in text.splitlines()[0]:
+        digest = ''.join(text.split(':', 1)[1].split())
+    else:
+        digest = text.split()[0]
+
+    digest = digest.lower()
+    digest_length = hashlib.new(algorithm).digest_size * 2
+    return digest if re.match(r'^[0-9a-f]{%d}$' % digest_length, digest) else None
+
+
+# Returns the pinned hash of the artifact and where the pin comes from, or (None, None). Only the entries
+# of pins.json verified against a published checksum count, older entries recorded on first use do not.
+def pinned_hash(artifact, pins):
+    if artifact.name in settings.ARTIFACT_SHA256:
+        return settings.ARTIFACT_SHA256[artifact.name].lower(), 'settings.py'
+
+    pin = pins.get(artifact.name)
+    if isinstance(pin, dict) and pin.get('sha256') and artifact.checksum_url is not None \
+            and pin.get('checksum_url') == artifact.checksum_url:
+        return pin['sha256'], PINS_FILE_NAME
+    return None, None
+
+
+# Returns the hash algorithm and the hash published for the artifact. Raises ArtifactError if the artifact
+# has no published checksum or it cannot be fetched.
+def published_hash(artifact, session):
+    if artifact.checksum_url is None:
+        raise ArtifactError('{} has no published checksum. Download it from {}, verify it and add its SHA-256 to '
+                            'ARTIFACT_SHA256 in settings.py'.format(artifact.name, artifact.urls[0]))
+
+    try:
+        response = session.get(artifact.checksum_url, timeout=DOWNLOAD_TIMEOUT)
+    except requests.RequestException as error:
+        raise ArtifactError('Unable to fetch the checksum of {} from {}. {}'.format(
+            artifact.name, artifact.checksum_url, error))
+
+    if response.status_code != 200:
+        raise ArtifactError('Unable to fetch the checksum of {}, {} returned {}'.format(
+            artifact.name, artifact.checksum_url, response.status_code))
+
+    algorithm = checksum_algorithm(artifact.checksum_url)
+    digest = parse_checksum(response.text, algorithm)
+    if digest is None:
+        raise ArtifactError('{} does not hold a {} checksum'.format(artifact.checksum_url, algorithm.upper()))
+    return algorithm, digest
+
+
+def download(artifact, destination, session):
+    errors = []
+
+    for url in artifact.urls:
+        try:
+            response = session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+            try:
+                if response.status_code != 200:
+                    errors.append('{} returned {}'.format(url, response.status_code))
+                    continue
+                with open(destination, 'wb') as file_object:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        file_object.write(chunk)
+            finally:
+                response.close()
+            return url
+        except (requests.RequestException, OSError) as error:
+            errors.append('{}: {}'.format(url, error))
+
+    raise ArtifactError('Unable to download {}. {}'.format(artifact.name, '; '.join(errors)))
+
+
+# This method makes sure the artifact is in the cache and matches its pin, downloading it if needed.
+# Returns a short description of what was done. Raises ArtifactError if the artifact cannot be verified.
+def ensure_artifact(artifact, directory, pins, session):
+    path = os.path.join(directory, artifact.name)
+    expected_hash, pin_source = pinned_hash(artifact, pins)
+    algorithm = 'sha256'
+
+    if os.path.isfile(path) and expected_hash is not None:
+        if file_sha256(path) == expected_hash:
+            return 'cached, verified against {}'.format(pin_source)
+        print('[WARNING] The cached {} does not match its pin, downloading it again'.format(artifact.name))
+
+    if expected_hash is None:
+        algorithm, expected_hash = published_hash(artifact, session)
+        pin_source = 'the published checksum'
+
+    download_path = path + '.part'
+    url = download(artifact, download_path, session)
+    actual_hash = file_digest(download_path, algorithm)
+
+    if actual_hash != expected_hash:
+        os.remove(download_path)
+        raise ArtifactError('{} downloaded from {} has the {} {} but {} expects {}'.format(
+            artifact.name, url, algorithm.upper(), actual_hash, pin_source, expected_hash))
+
+    os.replace(download_path, path)
+    if pin_source == 'the published checksum':
+        # The pin is always a SHA-256, whatever the algorithm of the published checksum
+        pins[artifact.name] = {'sha256': file_sha256(path), 'checksum_url': artifact.checksum_url}
+
+    return 'downloaded, verified against {}'.format(pin_source)
+
+
+# Returns whether every artifact is in the cache and matches its pin. Does not use the network.
+def cache_verified(directories):
+    directory = cache_path(directories)
+    pins = read_pins(directory)
+
+    for artifact in artifacts():
+        path = os.path.join(directory, artifact.name)
+        expected_hash, _ = pinned_hash(artifact, pins)
+        if expected_hash is None or not os.path.isfile(path) or file_sha256(path) != expected_hash:
+            return False
+    return True
+
+
+# This method fetches and verifies every artifact. Returns a list of (artifact name, description).
+# Raises ArtifactError on the first artifact which cannot be verified.
+def ensure_artifacts(directories, session=None):
+    directory = cache_path(directories)
+    pins = read_pins(directory)
+    session = session or requests.Session()
+    results = []
+
+    try:
+        for artifact in artifacts():
+            results.append((artifact.name, ensure_artifact(artifact, directory, pins, session)))
+    finally:
+        write_pins(directory, pins)
+
+    return results
+
+
+# Returns the cached artifacts used by a build context, file name to path in the cache. Nothing is written.
+# Raises ArtifactError if one is not downloaded yet.
+def staged_files(directories, context):
+    directory = directories[settings.DIRECTORY_ARTIFACTS]
+    files = {}
+
+    for artifact in artifacts():
+        if context not in artifact.contexts:
+            continue
+
+        source = os.path.join(directory, artifact.name)
+        if not os.path.isfile(source):
+            raise ArtifactError('{} is missing from {}. Run tests.py to fetch it.'.format(artifact.name, directory))
+        files[artifact.name] = source
+
+    return files
+
+
+# This method links the cached artifacts used by a build context into the context directory.
+# Returns the paths created, to be removed with unstage once the image is built.
+def stage(directories, context):
+    staged = []
+
+    for name, source in sorted(staged_files(directories, context).items()):
+        destination = os.path.join(directories[context], name)
+        if os.path.lexists(destination):
+            os.remove(destination)
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copyfile(source, destination)
+        staged.append(destination)
+
+    return staged
+
+
+def unstage(staged):
+    for path in staged:
+        if os.path.lexists(path):
+            os.remove(path)
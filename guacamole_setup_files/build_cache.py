@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+# Skips image builds when nothing that goes into the image changed.
+# The fingerprint of an image is a sha256 over the build arguments and every file of the build context,
+# Dockerfile included. It is stored as a label on the image, and the next setup run only rebuilds the
+# image when the fingerprint it computes differs from the label.
+
+import hashlib
+import json
+import os
+
+FINGERPRINT_LABEL = 'minidmz.build.fingerprint'
+
+CHUNK_SIZE = 64 * 1024
+
+
+# Returns the fingerprint of the build context directory and the build arguments.
+# overrides is a dictionary of file name to content (bytes) of files at the top of the context which are
+# about to be written, they are fingerprinted with that content whether they exist yet or not.
+# staged_files is a dictionary of file name to the path of files about to be copied to the top of the
+# context, such as the cached artifacts, they are fingerprinted from that path.
+def context_fingerprint(context_directory, build_args, overrides=None, staged_files=None):
+    overrides = overrides or {}
+    staged_files = staged_files or {}
+    fingerprint = hashlib.sha256()
+    fingerprint.update(json.dumps(build_args or {}, sort_keys=True).encode('utf-8'))
+
+    for directory, directory_names, file_names in os.walk(context_directory):
+        # Walk in a fixed order so the same context always gives the same fingerprint
+        directory_names.sort()
+        if directory == context_directory:
+            file_names = set(file_names) | set(overrides) | set(staged_files)
+
+        for file_name in sorted(file_names):
+            file_path = os.path.join(directory, file_name)
+            relative_path = os.path.relpath(file_path, context_directory)
+            file_path = staged_files.get(relative_path, file_path)
+
+            if relative_path in overrides:
+                fingerprint.update('\0{}\0{}\0'.format(relative_path, 0).encode('utf-8'))
+                fingerprint.update(overrides[relative_path])
+                continue
+
+            executable = os.access(file_path, os.X_OK)
+            fingerprint.update('\0{}\0{}\0'.format(relative_path, int(executable)).encode('utf-8'))
+            with open(file_path, 'rb') as file_object:
+                for chunk in iter(lambda: file_object.read(CHUNK_SIZE), b''):
+                    fingerprint.update(chunk)
+
+    return fingerprint.hexdigest()
+
+
+# Returns the fingerprint label of the image, or None if the image does not exist or has no label
+def image_fingerprint(docker, tag):
+    image = docker.inspect_image(tag)
+    if image is None:
+        return None
+
+    return (image['Config'].get('Labels') or {}).get(FINGERPRINT_LABEL)
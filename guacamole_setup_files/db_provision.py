@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+# Provisions the guacamole database of the sql container over a single mysql connection.
+# The accounts, the guacamole schema (installed in the image by the Dockerfile) and the seed data are
+# streamed through one mysql client started with docker exec. The passwords are passed in the environment
+# and in a file readable only by root, never on a command line. The seed data is inserted in one
+# transaction with multi-row inserts, the ids of the new connections and administrator are resolved once.
+#
+# Every equipment gets its own rdp connection named after its mac address, so the connection keeps its
+# users when the dhcp server gives the equipment a new address. With a pool of guacd containers every
+# connection is assigned to one of them through its proxy hostname.
+#
+# Mysql commits the CREATE and GRANT statements of the accounts and the schema implicitly, so they cannot
+# be rolled back. Whoever calls provision_database must remove the database volume when it fails.
+
+from collections import namedtuple
+
+SCHEMA_FILES = '/docker-entrypoint-initdb.d/*.sql'
+PROVISION_DIRECTORY = '/tmp'
+ACCOUNTS_FILE_NAME = 'minidmz_accounts.sql'
+SEED_FILE_NAME = 'minidmz_seed.sql'
+UPDATE_FILE_NAME = 'minidmz_update.sql'
+
+DATABASE_NAME = 'guacamole_db'
+DATABASE_USER = 'guacamole_user'
+CONNECTION_NAME = 'RDP_Connection'
+RDP_PORT = '3389'
+DEFAULT_ADMINISTRATOR = 'guacadmin'
+GUACD_PORT = 4822
+
+SYSTEM_PERMISSIONS = ['ADMINISTER', 'CREATE_USER', 'CREATE_SHARING_PROFILE', 'CREATE_CONNECTION_GROUP',
+                      'CREATE_CONNECTION']
+SELF_PERMISSIONS = ['ADMINISTER', 'UPDATE', 'READ']
+
+
+# The guacd containers, hostnames are their container names which all start with name_prefix
+GuacdPool = namedtuple('GuacdPool', ['name_prefix', 'hostnames'])
+
+
+class ProvisionError(Exception):
+    pass
+
+
+# Returns the value as a quoted sql string literal
+def sql_string(value):
+    escaped = str(value).replace('\\', '\\\\').replace("'", "\\'").replace('\0', '\\0')
+    escaped = escaped.replace('\n', '\\n').replace('\r', '\\r')
+    return "'{}'".format(escaped)
+
+
+# Returns a multi-row insert statement. rows are tuples of sql expressions which are already quoted.
+def insert_rows(table, columns, rows):
+    return 'INSERT INTO {} ({}) VALUES\n    {};'.format(
+        table, ', '.join(columns), ',\n    '.join('({})'.format(', '.join(row)) for row in rows))
+
+
+# Returns the name of the rdp connection to the equipment with the mac address. Equipment without a known
+# mac address uses the name of the single connection created by earlier versions of the setup.
+def connection_name(mac_address):
+    if mac_address is None:
+        return CONNECTION_NAME
+    return '{}_{}'.format(CONNECTION_NAME, mac_address.lower())
+
+
+# Returns the parameters of the rdp connection to the equipment, other than the hostname
+def connection_parameters():
+    return [
+        ('port', RDP_PORT),
+        ('enable-drive', 'true'),
+        ('drive-path', '/home/virtual_drive/'),
+        ('create-drive-path', 'true'),
+    ]
+
+
+# Returns a derived table of the rows, usable in the FROM clause of a select
+def rows_table(columns, rows):
+    selects = ['SELECT {}'.format(', '.join('{} AS {}'.format(value, column) for value, column in zip(row, columns)))
+               for row in rows]
+    return '({}) AS rows_table'.format(' UNION ALL '.join(selects))
+
+
+# Returns the sql creating the missing rdp connections of the equipment and setting their hostname.
+# equipment is a list of (mac address, ip address). The connection ids are resolved by name in the same
+# statements, existing connections only get their hostname updated and missing parameters added.
+# Without equipment there is nothing to create and the sql is empty.
+def connections_script(equipment):
+    if not equipment:
+        return ''
+
+    names = [(sql_string(connection_name(mac_address)),) for mac_address, _ in equipment]
+    hostnames = [(sql_string(connection_name(mac_address)), "'hostname'", sql_string(ip_address))
+                 for mac_address, ip_address in equipment]
+    parameters = [(sql_string(connection_name(mac_address)), sql_string(name), sql_string(value))
+                  for mac_address, _ in equipment for name, value in connection_parameters()]
+    parameter_columns = ['connection_name', 'parameter_name', 'parameter_value']
+
+    return '\n'.join([
+        "INSERT INTO guacamole_connection (connection_name, protocol, max_connections_per_user) "
+        "SELECT connection_name, 'rdp', '0' FROM {} "
+        "WHERE connection_name NOT IN "
+        "(SELECT connection_name FROM guacamole_connection WHERE parent_id IS NULL);".format(
+            rows_table(['connection_name'], names)),
+
+        "INSERT INTO guacamole_connection_parameter (connection_id, parameter_name, parameter_value) "
+        "SELECT connection_id, parameter_name, parameter_value FROM guacamole_connection JOIN {} "
+        "USING (connection_name) WHERE parent_id IS NULL "
+        "ON DUPLICATE KEY UPDATE guacamole_connection_parameter.parameter_value = VALUES(parameter_value);".format(
+            rows_table(parameter_columns, hostnames)),
+
+        # Parameters changed by the administrator are kept
+        "INSERT IGNORE INTO guacamole_connection_parameter (connection_id, parameter_name, parameter_value) "
+        "SELECT connection_id, parameter_name, parameter_value FROM guacamole_connection JOIN {} "
+        "USING (connection_name) WHERE parent_id IS NULL;".format(rows_table(parameter_columns, parameters)),
+    ])
+
+
+# Returns the sql assigning the connections to the guacd containers of the pool, by connection id. Only
+# the connections without a proxy or with one of the pool are changed, so proxies set by the administrator
+# are kept. With a single guacd the connections use the guacd of guacamole.properties.
+def proxies_script(guacd_pool):
+    name_pattern = guacd_pool.name_prefix.replace('\\', '\\\\').replace('_', '\\_').replace('%', '\\%') + '%'
+    managed = 'proxy_hostname LIKE {}'.format(sql_string(name_pattern))
+
+    if len(guacd_pool.hostnames) <= 1:
+        return 'UPDATE guacamole_connection SET proxy_hostname = NULL, proxy_port = NULL WHERE {};'.format(managed)
+
+    return ('UPDATE guacamole_connection SET proxy_hostname = ELT(MOD(connection_id, {}) + 1, {}), '
+            'proxy_port = {} WHERE proxy_hostname IS NULL OR {};').format(
+        len(guacd_pool.hostnames), ', '.join(sql_string(hostname) for hostname in guacd_pool.hostnames),
+        GUACD_PORT, managed)
+
+
+# Returns the sql creating the database and the account guacamole connects with
+def accounts_script(mysql_user_password):
+    statements = ['CREATE DATABASE {};'.format(DATABASE_NAME)]
+    for host in ['%', 'localhost']:
+        account = '{}@{}'.format(sql_string(DATABASE_USER), sql_string(host))
+        statements.append('CREATE USER {} IDENTIFIED BY {};'.format(account, sql_string(mysql_user_password)))
+        statements.append('GRANT SELECT,INSERT,UPDATE,DELETE ON {}.* TO {};'.format(DATABASE_NAME, account))
+    statements.append('FLUSH PRIVILEGES;')
+    statements.append('USE {};'.format(DATABASE_NAME))
+    return '\n'.join(statements) + '\n'
+
+
+# Returns the sql inserting the rdp connections and the administrator, and removing the default administrator
+def seed_script(administrator, equipment, guacd_pool):
+    statements = [
+        'START TRANSACTION;',
+
+        # Stores our RDP connection data and enables file transfer
+        connections_script(equipment),
+        proxies_script(guacd_pool),
+
+        # Creates the administrator with all system permissions and all permissions over itself
+        'INSERT INTO guacamole_user (username, password_date) VALUES ({}, NOW());'.format(
+            sql_string(administrator)),
+        'SET @user_id = LAST_INSERT_ID();',
+        insert_rows('guacamole_system_permission', ['user_id', 'permission'],
+                    [('@user_id', sql_string(permission)) for permission in SYSTEM_PERMISSIONS]),
+        insert_rows('guacamole_user_permission', ['user_id', 'affected_user_id', 'permission'],
+                    [('@user_id', '@user_id', sql_string(permission)) for permission in SELF_PERMISSIONS]),
+
+        # Removes the default administrator created by the schema and all permissions granted to it
+        'SET @default_user_id = (SELECT user_id FROM guacamole_user WHERE username = {});'.format(
+            sql_string(DEFAULT_ADMINISTRATOR)),
+        'DELETE FROM guacamole_system_permission WHERE user_id = @default_user_id;',
+        'DELETE FROM guacamole_user_permission WHERE user_id = @default_user_id;',
+        'DELETE FROM guacamole_user WHERE user_id = @default_user_id;',
+
+        'COMMIT;',
+    ]
+    return '\n'.join(statements) + '\n'
+
+
+# Runs the mysql client in the container. Returns its output. Raises ProvisionError with the client output
+# if it fails.
+def run_mysql(docker, container_name, command, password, description):
+    exit_code, output = docker.exec_run(container_name, command, environment={'MYSQL_PWD': password},
+                                        stream_output=False)
+    output = output.decode('utf-8', 'replace')
+    if exit_code != 0:
+        raise ProvisionError('{} failed with exit code {}. {}'.format(description, exit_code, output.strip()))
+    return output
+
+
+# Returns the sql updating the hostname of the existing connections of the equipment. The script prints the
+# names of the connections which exist.
+def hostnames_script(equipment):
+    statements = ['START TRANSACTION;']
+    for mac_address, ip_address in equipment:
+        statements.append(
+            "UPDATE guacamole_connection_parameter JOIN guacamole_connection USING (connection_id) "
+            "SET parameter_value = {} WHERE connection_name = {} AND parent_id IS NULL "
+            "AND parameter_name = 'hostname';".format(sql_string(ip_address),
+                                                      sql_string(connection_name(mac_address))))
+    statements.append('COMMIT;')
+    statements.append('SELECT connection_name FROM guacamole_connection WHERE parent_id IS NULL AND '
+                      'connection_name IN ({});'.format(', '.join(sql_string(connection_name(mac_address))
+                                                                  for mac_address, _ in equipment)))
+    return '\n'.join(statements) + '\n'
+
+
+# Returns the sql updating the connections of an existing database to the equipment and the guacd pool.
+# Without equipment only the guacd containers of the connections are updated.
+def update_script(equipment, guacd_pool):
+    statements = ['START TRANSACTION;']
+
+    # The single connection of earlier versions of the setup becomes the connection of the first equipment,
+    # unless that equipment already has its own connection. Its users and their permissions are kept.
+    mac_address = equipment[0][0] if equipment else None
+    if mac_address is not None:
+        statements.extend([
+            'SET @connection_exists = (SELECT COUNT(*) FROM guacamole_connection '
+            'WHERE connection_name = {} AND parent_id IS NULL);'.format(sql_string(connection_name(mac_address))),
+            'UPDATE guacamole_connection SET connection_name = {} '
+            'WHERE connection_name = {} AND parent_id IS NULL AND @connection_exists = 0;'.format(
+                sql_string(connection_name(mac_address)), sql_string(CONNECTION_NAME)),
+        ])
+
+    statements.append(connections_script(equipment))
+    statements.append(proxies_script(guacd_pool))
+    statements.append('COMMIT;')
+    return '\n'.join(statements) + '\n'
+
+
+# Runs the mysql client in the container on the generated scripts and returns the rows it printed.
+# The generated scripts are copied into the container and piped to mysql in order, with the files in
+# extra_files (a shell glob) after the first script. The scripts are removed whatever the outcome, they
+# may contain passwords.
+def run_scripts(docker, container_name, user, password, scripts, description, extra_files='', database=''):
+    docker.put_files(container_name, PROVISION_DIRECTORY,
+                     {name: script.encode('utf-8') for name, script in scripts})
+
+    paths = ['{}/{}'.format(PROVISION_DIRECTORY, name) for name, _ in scripts]
+    sources = paths[:1] + ([extra_files] if extra_files else []) + paths[1:]
+
+    # The exit status of a pipe is the one of mysql, so the sources are checked before they are piped. A glob
+    # which matches nothing is left as it is by the shell and is reported as missing.
+    # The guacamole tables are utf8, the literals of the scripts must have the same character set to be compared
+    command = ('status=0; for file in {sources}; do if [ ! -r "$file" ]; then echo "$file is missing"; status=1; fi; '
+               'done; if [ $status -eq 0 ]; then cat {sources} | mysql --user={user} --default-character-set=utf8 '
+               '--batch --skip-column-names {database}; status=$?; fi; rm -f {paths}; exit $status').format(
+        sources=' '.join(sources), user=user, database=database, paths=' '.join(paths))
+    return run_mysql(docker, container_name, ['sh', '-c', command], password, description).splitlines()
+
+
+# This method creates the guacamole database, its account, an rdp connection to every equipment and the
+# administrator in a newly created sql container. equipment is a list of (mac address, ip address) and
+# guacd_pool the GuacdPool serving the connections. Raises ProvisionError if any statement fails.
+def provision_database(docker, container_name, mysql_root_password, mysql_user_password, administrator,
+                       equipment, guacd_pool):
+    # The mysql client stops at the first failing statement and the open seed transaction is rolled back
+    run_scripts(docker, container_name, 'root', mysql_root_password,
+                [(ACCOUNTS_FILE_NAME, accounts_script(mysql_user_password)),
+                 (SEED_FILE_NAME, seed_script(administrator, equipment, guacd_pool))],
+                'Provisioning the database', extra_files=SCHEMA_FILES)
+
+
+# Creates the connections of new equipment and updates the ip address of known equipment in an existing
+# database, and assigns the connections to the guacd pool. equipment is a list of (mac address, ip address),
+# possibly empty. Raises ProvisionError if it fails.
+def update_equipment(docker, container_name, mysql_user_password, equipment, guacd_pool):
+    run_scripts(docker, container_name, DATABASE_USER, mysql_user_password,
+                [(UPDATE_FILE_NAME, update_script(equipment, guacd_pool))],
+                'Updating the connections to the equipment', database=DATABASE_NAME)
+
+
+# Updates the ip address of the existing connections of the equipment, without creating connections.
+# equipment is a list of (mac address, ip address). Returns the mac addresses which have a connection.
+# Raises ProvisionError if it fails.
+def update_hostnames(docker, container_name, mysql_user_password, equipment):
+    connection_names = set(run_scripts(docker, container_name, DATABASE_USER, mysql_user_password,
+                                       [(UPDATE_FILE_NAME, hostnames_script(equipment))],
+                                       'Updating the ip addresses of the equipment', database=DATABASE_NAME))
+    return [mac_address for mac_address, _ in equipment if connection_name(mac_address) in connection_names]
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+# Parser of the isc-dhcp-server lease file.
+# dhcpd appends a new lease block to /var/lib/dhcp/dhcpd.leases whenever a lease changes, so the last block
+# of an ip address is its current state. The file is parsed once and on later refreshes only the appended
+# tail is read. dhcpd also rewrites the whole file on start and from time to time; a new inode or a
+# shorter file is detected and the file is parsed again from the start.
+
+import calendar
+import os
+import re
+import time
+from collections import namedtuple
+
+DHCPD_LEASES_FILE = '/var/lib/dhcp/dhcpd.leases'
+
+BINDING_ACTIVE = 'active'
+
+# ends, starts and cltt are unix timestamps, ends is None for a lease which never expires
+Lease = namedtuple('Lease', ['ip_address', 'mac_address', 'binding_state', 'starts', 'ends', 'cltt',
+                             'client_hostname'])
+
+LEASE_START_PATTERN = re.compile(r'^lease\s+(\S+)\s*\{\s*$')
+BLOCK_END = '}'
+
+# Dates are written as "4 2018/05/03 18:00:00" in UTC, or as "epoch 1525370400;" with db-time-format local
+DATE_PATTERN = re.compile(r'^\d\s+(\d{4}/\d{2}/\d{2}\s+\d{2}:\d{2}:\d{2})$')
+EPOCH_PATTERN = re.compile(r'^epoch\s+(\d+)')
+
+
+# Returns the unix timestamp of a lease date, None for never or an unknown format
+def parse_date(value):
+    match = EPOCH_PATTERN.match(value)
+    if match:
+        return int(match.group(1))
+
+    match = DATE_PATTERN.match(value)
+    if match:
+        return calendar.timegm(time.strptime(match.group(1), '%Y/%m/%d %H:%M:%S'))
+
+    return None
+
+
+# Returns the lease described by the statements of a lease block
+def parse_lease(ip_address, statements):
+    values = {}
+    for statement in statements:
+        statement = statement.strip().rstrip(';').strip()
+        if statement.startswith('binding state '):
+            values['binding_state'] = statement[len('binding state '):]
+        elif statement.startswith('hardware ethernet '):
+            values['mac_address'] = statement[len('hardware ethernet '):].lower()
+        elif statement.startswith('client-hostname '):
+            values['client_hostname'] = statement[len('client-hostname '):].strip('"')
+        else:
+            name, _, value = statement.partition(' ')
+            if name in ('starts', 'ends', 'cltt'):
+                values[name] = parse_date(value)
+
+    return Lease(ip_address, values.get('mac_address'), values.get('binding_state'), values.get('starts'),
+                 values.get('ends'), values.get('cltt'), values.get('client_hostname'))
+
+
+# This method appends the leases of the lease file text to leases in file order. Returns the length of the
+# text parsed, which ends after the last complete lease block, so an incomplete block is parsed later.
+def parse_leases(text, leases):
+    parsed_length = 0
+    position = 0
+    ip_address = None
+    statements = []
+
+    for line in text.splitlines(True):
+        position += len(line)
+        if not line.endswith('\n'):
+            break
+        stripped = line.strip()
+
+        if ip_address is None:
+            match = LEASE_START_PATTERN.match(stripped)
+            if match:
+                ip_address = match.group(1)
+                statements = []
+            elif not stripped.endswith('{'):
+                # Statements outside of a block (server-duid, authoring-byte-order) are complete lines
+                parsed_length = position
+            continue
+
+        if stripped == BLOCK_END:
+            leases.append(parse_lease(ip_address, statements))
+            ip_address = None
+            parsed_length = position
+        else:
+            statements.append(stripped)
+
+    return parsed_length
+
+
+class LeaseFile:
+
+    def __init__(self, path=DHCPD_LEASES_FILE):
+        self.path = path
+        self.inode = None
+        self.offset = 0
+        # Latest lease of every ip address in any binding state
+        self.by_ip = {}
+        # Position of the latest lease of every ip address in the file, later leases have larger numbers
+        self.sequence = {}
+        self.count = 0
+
+    # This method reads the lease blocks appended since the last refresh. Returns the number of lease blocks
+    # read. Raises FileNotFoundError if the lease file does not exist.
+    def refresh(self):
+        with open(self.path, 'rb') as file_object:
+            status = os.fstat(file_object.fileno())
+            if status.st_ino != self.inode or status.st_size < self.offset:
+                self.inode = status.st_ino
+                self.offset = 0
+                self.by_ip = {}
+                self.sequence = {}
+
+            file_object.seek(self.offset)
+            # latin-1 maps every byte to one character, so lengths of the text are offsets in the file
+            text = file_object.read().decode('latin-1')
+
+        leases = []
+        self.offset += parse_leases(text, leases)
+        for lease in leases:
+            self.count += 1
+            self.by_ip[lease.ip_address] = lease
+            self.sequence[lease.ip_address] = self.count
+
+        return len(leases)
+
+    # Returns the active leases which have not expired, the newest lease of every mac address only.
+    # Leases are compared by their start time and then by their position in the file.
+    def active_by_mac(self, now=None):
+        now = time.time() if now is None else now
+        active = {}
+        for lease in self.by_ip.values():
+            if lease.binding_state != BINDING_ACTIVE or lease.mac_address is None:
+                continue
+            if lease.ends is not None and lease.ends <= now:
+                continue
+            current = active.get(lease.mac_address)
+            if current is None or self._newer(lease, current):
+                active[lease.mac_address] = lease
+
+        return active
+
+    def _newer(self, lease, other):
+        return ((lease.starts or 0), self.sequence[lease.ip_address]) > \
+            ((other.starts or 0), self.sequence[other.ip_address])
+
+    # Returns the active leases which have not expired by ip address
+    def active_by_ip(self, now=None):
+        return {lease.ip_address: lease for lease in self.active_by_mac(now).values()}
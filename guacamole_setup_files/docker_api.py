@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+
+# A small client for the Docker Engine API. It talks HTTP to the docker daemon over its unix socket,
+# which avoids starting a docker CLI process for every docker operation. The HTTP connection is kept
+# open and reused for all requests made from the same thread.
+
+import http.client
+import io
+import json
+import select
+import socket
+import struct
+import sys
+import tarfile
+import tempfile
+import threading
+from urllib.parse import quote, urlencode
+
+DOCKER_SOCKET = '/var/run/docker.sock'
+API_VERSION = 'v1.25'
+
+# Requests which are sent again when the connection fails before the response is read
+IDEMPOTENT_METHODS = ('GET', 'HEAD')
+
+
+# Returns true if the peer closed an idle connection. An idle connection has nothing to read, a closed one
+# reads the end of the stream.
+def idle_connection_closed(sock):
+    readable, _, _ = select.select([sock], [], [], 0)
+    return bool(readable)
+
+
+class DockerError(Exception):
+
+    def __init__(self, status, message):
+        super().__init__('Docker API error {}: {}'.format(status, message))
+        self.status = status
+        self.message = message
+
+
+# HTTP connection over the docker unix socket
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DockerClient:
+
+    # timeout is the socket timeout in seconds. The default of None waits as long as a build takes.
+    # request_tracer, when set, is called with the method and path of every request and returns a context
+    # manager the request runs in, such as tracing.request.
+    def __init__(self, socket_path=DOCKER_SOCKET, timeout=None, request_tracer=None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.request_tracer = request_tracer
+        self._local = threading.local()
+
+    # Returns the connection of the calling thread. It is reopened automatically after the daemon closes it.
+    def _connection(self):
+        if getattr(self._local, 'connection', None) is None:
+            self._local.connection = UnixHTTPConnection(self.socket_path, self.timeout)
+        return self._local.connection
+
+    def close(self):
+        if getattr(self._local, 'connection', None) is not None:
+            self._local.connection.close()
+            self._local.connection = None
+
+    # Sends a request and returns the response. Raises DockerError for error responses.
+    # The caller must read the response completely before the next request.
+    def _request(self, method, path, query=None, body=None, headers=None):
+        if self.request_tracer is None:
+            return self._send(method, path, query, body, headers)
+        with self.request_tracer('docker {} {}'.format(method, path)):
+            return self._send(method, path, query, body, headers)
+
+    # Sends a request on the connection of the calling thread, see _request
+    def _send(self, method, path, query, body, headers):
+        url = '/{}{}'.format(API_VERSION, path)
+        if query:
+            url += '?' + urlencode(query)
+
+        request_headers = {}
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode('utf-8')
+            request_headers['Content-Type'] = 'application/json'
+        request_headers.update(headers or {})
+
+        connection = self._connection()
+        # A connection the daemon closed while it was idle is replaced before anything is sent
+        if connection.sock is not None and idle_connection_closed(connection.sock):
+            connection.close()
+
+        try:
+            connection.request(method, url, body=body, headers=request_headers)
+        except (http.client.HTTPException, ConnectionError):
+            # The request did not reach the daemon, it is sent again on a new connection
+            self._resend(connection, method, url, body, request_headers)
+
+        try:
+            response = connection.getresponse()
+        except (http.client.HTTPException, ConnectionError):
+            # The daemon may have acted on the request, only requests without side effects are sent again.
+            # A retried POST could create a container twice or run an exec twice.
+            connection.close()
+            if method not in IDEMPOTENT_METHODS:
+                raise
+            self._resend(connection, method, url, body, request_headers)
+            response = connection.getresponse()
+
+        if response.status >= 400:
+            content = response.read().decode('utf-8', 'replace')
+            try:
+                message = json.loads(content)['message']
+            except (ValueError, KeyError, TypeError):
+                message = content.strip()
+            raise DockerError(response.status, message)
+
+        return response
+
+    # Sends the request again on a new connection
+    def _resend(self, connection, method, url, body, headers):
+        connection.close()
+        if hasattr(body, 'seek'):
+            body.seek(0)
+        connection.request(method, url, body=body, headers=headers)
+
+    # Sends a request and returns the decoded json response. Returns None for an empty response.
+    def _json(self, method, path, query=None, body=None):
+        content = self._request(method, path, query, body).read()
+        if not content:
+            return None
+        return json.loads(content.decode('utf-8'))
+
+    # Same as _json but returns None if the object does not exist
+    def _inspect(self, path):
+        try:
+            return self._json('GET', path)
+        except DockerError as error:
+            if error.status == 404:
+                return None
+            raise
+
+    def ping(self):
+        return self._request('GET', '/_ping').read() == b'OK'
+
+    # Containers
+
+    def inspect_container(self, name):
+        return self._inspect('/containers/{}/json'.format(quote(name)))
+
+    def containers(self, all_containers=True, filters=None):
+        query = {'all': int(all_containers)}
+        if filters:
+            query['filters'] = json.dumps(filters)
+        return self._json('GET', '/containers/json', query)
+
+    def remove_container(self, name, force=False):
+        self._json('DELETE', '/containers/{}'.format(quote(name)), {'force': int(force)})
+
+    def start_container(self, name):
+        self._json('POST', '/containers/{}/start'.format(quote(name)))
+
+    # Creates and starts a container, the equivalent of docker run -d. Returns the container id.
+    # environment is a dictionary, binds a list of 'source:destination' strings and
+    # ports a dictionary of container port ('8080/tcp') to (host ip, host port).
+    # memory_mb limits the memory of the container, docker ignores it when the memory cgroup is disabled.
+    # cpuset is the list of cores the container runs on ('0', '0-1') and cpu_shares its relative cpu weight.
+    def run(self, name, image, network=None, environment=None, binds=None, ports=None, tty=False, log_config=None,
+            memory_mb=None, cpuset=None, cpu_shares=None, labels=None):
+        host_config = {}
+        if memory_mb:
+            host_config['Memory'] = memory_mb * 1024 * 1024
+        if cpuset is not None:
+            host_config['CpusetCpus'] = cpuset
+        if cpu_shares:
+            host_config['CpuShares'] = cpu_shares
+        if network:
+            host_config['NetworkMode'] = network
+        if binds:
+            host_config['Binds'] = binds
+        if ports:
+            host_config['PortBindings'] = {
+                container_port: [{'HostIp': host_ip, 'HostPort': str(host_port)}]
+                for container_port, (host_ip, host_port) in ports.items()
+            }
+        if log_config:
+            host_config['LogConfig'] = log_config
+
+        container_config = {
+            'Image': image,
+            'Tty': tty,
+            'Env': ['{}={}'.format(key, value) for key, value in (environment or {}).items()],
+            'ExposedPorts': {container_port: {} for container_port in (ports or {})},
+            'HostConfig': host_config,
+        }
+        if labels:
+            container_config['Labels'] = labels
+
+        container = self._json('POST', '/containers/create', {'name': name}, container_config)
+        self.start_container(container['Id'])
+        return container['Id']
+
+    # Returns the processes of a running container, the equivalent of docker top. The result has the column
+    # names in 'Titles' and a list of rows in 'Processes'. Returns None if the container is not running.
+    def top(self, name):
+        try:
+            return self._json('GET', '/containers/{}/top'.format(quote(name)))
+        except DockerError as error:
+            if error.status in (404, 409):
+                return None
+            raise
+
+    # Runs a command in a running container, the equivalent of docker exec.
+    # The output is printed as it arrives unless stream_output is False, in which case it is returned.
+    # Returns the exit code of the command and the collected output.
+    def exec_run(self, container, command, environment=None, stream_output=True):
+        exec_config = {
+            'Cmd': command,
+            'AttachStdout': True,
+            'AttachStderr': True,
+            'Env': ['{}={}'.format(key, value) for key, value in (environment or {}).items()],
+        }
+        exec_id = self._json('POST', '/containers/{}/exec'.format(quote(container)), body=exec_config)['Id']
+
+        response = self._request('POST', '/exec/{}/start'.format(exec_id), body={'Detach': False, 'Tty': False})
+
+        # Without a tty the output is multiplexed in frames of an 8 byte header followed by the payload
+        output = []
+        while True:
+            header = response.read(8)
+            if len(header) < 8:
+                break
+            _, frame_size = struct.unpack('>BxxxL', header)
+            frame = response.read(frame_size)
+            if stream_output:
+                sys.stdout.write(frame.decode('utf-8', 'replace'))
+                sys.stdout.flush()
+            else:
+                output.append(frame)
+
+        exit_code = self._json('GET', '/exec/{}/json'.format(exec_id))['ExitCode']
+        return exit_code, b''.join(output)
+
+    # Copies files into a container, the equivalent of docker cp. files is a dictionary of file name to
+    # content (bytes). The files are created with the given mode in the directory path, which must exist.
+    def put_files(self, container, path, files, mode=0o600):
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode='w') as archive_tar:
+            for name, content in sorted(files.items()):
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                info.mode = mode
+                archive_tar.addfile(info, io.BytesIO(content))
+
+        self._request('PUT', '/containers/{}/archive'.format(quote(container)), {'path': path},
+                      body=archive.getvalue(), headers={'Content-Type': 'application/x-tar'}).read()
+
+    # Images
+
+    def inspect_image(self, name):
+        return self._inspect('/images/{}/json'.format(quote(name)))
+
+    def images(self, name=None):
+        query = {}
+        if name:
+            query['filters'] = json.dumps({'reference': [name]})
+        return self._json('GET', '/images/json', query)
+
+    def remove_image(self, name, force=False):
+        self._json('DELETE', '/images/{}'.format(quote(name)), {'force': int(force)})
+
+    # Builds an image from the context directory, the equivalent of docker build.
+    # The build output is streamed to stdout, every line starting with output_prefix so parallel
+    # builds can be told apart. Raises DockerError if the build fails.
+    def build(self, context_directory, tag, build_args=None, labels=None, output_prefix=''):
+        query = {'t': tag, 'rm': 1}
+        if build_args:
+            query['buildargs'] = json.dumps(build_args)
+        if labels:
+            query['labels'] = json.dumps(labels)
+
+        # The build context is sent as a tar archive. It is staged in a temporary file to keep memory low.
+        with tempfile.TemporaryFile() as context_file:
+            with tarfile.open(fileobj=context_file, mode='w') as context_tar:
+                context_tar.add(context_directory, arcname='.')
+            context_size = context_file.tell()
+            context_file.seek(0)
+
+            response = self._request('POST', '/build', query, body=context_file,
+                                     headers={'Content-Type': 'application/x-tar',
+                                              'Content-Length': str(context_size)})
+
+            error_message = None
+            for line in response:
+                line = line.strip()
+                if not line:
+                    continue
+                progress = json.loads(line.decode('utf-8'))
+                if 'stream' in progress:
+                    sys.stdout.write(''.join(output_prefix + stream_line
+                                             for stream_line in progress['stream'].splitlines(True)))
+                    sys.stdout.flush()
+                if 'error' in progress:
+                    error_message = progress['error']
+
+        if error_message is not None:
+            raise DockerError(500, error_message.strip())
+
+    # Volumes
+
+    def volumes(self):
+        volumes = self._json('GET', '/volumes')['Volumes'] or []
+        return [volume['Name'] for volume in volumes]
+
+    def create_volume(self, name):
+        self._json('POST', '/volumes/create', body={'Name': name})
+
+    def remove_volume(self, name):
+        self._json('DELETE', '/volumes/{}'.format(quote(name)))
+
+    # Networks
+
+    def inspect_network(self, name):
+        return self._inspect('/networks/{}'.format(quote(name)))
+
+    def networks(self):
+        return self._json('GET', '/networks')
+
+    def create_network(self, name, driver='bridge'):
+        return self._json('POST', '/networks/create', body={'Name': name, 'Driver': driver,
+                                                              'CheckDuplicate': True})['Id']
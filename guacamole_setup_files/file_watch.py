@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+# Minimal inotify wrapper built on ctypes, so the watch daemons need no extra packages.
+# A process using it sleeps in select() until the kernel reports a change, which keeps it idle on the pi.
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct('iIII')
+EVENT_BUFFER_SIZE = 64 * 1024
+
+_libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+
+def _check(result):
+    if result < 0:
+        error_number = ctypes.get_errno()
+        raise OSError(error_number, os.strerror(error_number))
+    return result
+
+
+class Inotify:
+
+    def __init__(self):
+        self.fd = _check(_libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    # Watches a file or a directory. Returns the watch descriptor.
+    def add_watch(self, path, mask):
+        return _check(_libc.inotify_add_watch(self.fd, os.fsencode(str(path)), ctypes.c_uint32(mask)))
+
+    def remove_watch(self, watch_descriptor):
+        _libc.inotify_rm_watch(self.fd, watch_descriptor)
+
+    # Waits up to timeout seconds for events. Returns a list of (watch descriptor, mask, name) tuples.
+    # name is the name of the file inside a watched directory, or an empty string.
+    def read_events(self, timeout=None):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            buffer = os.read(self.fd, EVENT_BUFFER_SIZE)
+        except OSError as error:
+            if error.errno == errno.EAGAIN:
+                return []
+            raise
+
+        events = []
+        position = 0
+        while position + EVENT_HEADER.size <= len(buffer):
+            watch_descriptor, mask, _, name_length = EVENT_HEADER.unpack_from(buffer, position)
+            position += EVENT_HEADER.size
+            name = buffer[position:position + name_length].rstrip(b'\0').decode('utf-8', 'replace')
+            position += name_length
+            events.append((watch_descriptor, mask, name))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# Long running watcher which keeps the hostname of the Guacamole connections in step with the dhcp leases
+# of the equipment. It is started on boot by cron.
+#
+# The process sleeps on inotify until dhcpd writes its lease file, then reads the appended leases only.
+# When the address of an equipment changes, the new address is probed for RDP and the hostname of the
+# connection of that equipment is updated in the database. An equipment whose RDP port is not open yet,
+# because it is still booting, is probed again until it answers or PENDING_LIMIT passes.
+
+import os
+import sys
+import time
+
+import db_provision
+import dhcp_leases
+import file_watch
+import rdp_scan
+import settings
+from docker_api import DockerClient, DockerError
+
+WATCH_MASK = file_watch.IN_MODIFY | file_watch.IN_CLOSE_WRITE | file_watch.IN_CREATE | file_watch.IN_MOVED_TO
+
+# dhcpd writes a lease in several writes, the file is read once it has been quiet this long
+SETTLE_SECONDS = 0.5
+
+# How often equipment which did not answer on the RDP port is probed again, and for how long
+RETRY_INTERVAL = 15
+PENDING_LIMIT = 15 * 60
+
+
+# Returns the password of the guacamole database user written by setup.py
+def read_user_password(directories):
+    with open(directories[settings.DIRECTORY_GENERATED_FILES] + '/mysql_user_pass', 'r') as file_object:
+        return file_object.read().strip()
+
+
+class LeaseWatcher:
+
+    def __init__(self, mysql_user_password, lease_file_path=dhcp_leases.DHCPD_LEASES_FILE):
+        self.mysql_user_password = mysql_user_password
+        self.lease_file = dhcp_leases.LeaseFile(lease_file_path)
+        self.docker = DockerClient()
+        self.inotify = file_watch.Inotify()
+        # The directory is watched rather than the file, dhcpd replaces the file when it rewrites it
+        self.inotify.add_watch(os.path.dirname(lease_file_path), WATCH_MASK)
+
+        # Address of every equipment as last written to the database. Empty on start, so the addresses
+        # are checked once after a reboot of the pi.
+        self.applied = {}
+        # Equipment waiting for its RDP port to open, mac address to (ip address, first seen)
+        self.pending = {}
+
+    # Returns the equipment whose active lease differs from the address in the database
+    def changed_leases(self):
+        try:
+            self.lease_file.refresh()
+        except FileNotFoundError:
+            return {}
+
+        return {mac_address: lease.ip_address for mac_address, lease in self.lease_file.active_by_mac().items()
+                if self.applied.get(mac_address) != lease.ip_address}
+
+    # This method probes the pending equipment for RDP and updates the connections of the equipment which
+    # answers. Equipment which does not answer stays pending.
+    def update_pending(self):
+        now = time.time()
+        for mac_address, (ip_address, first_seen) in list(self.pending.items()):
+            if now - first_seen > PENDING_LIMIT:
+                print('[WARNING] {} at {} did not open the RDP port, giving up'.format(mac_address, ip_address))
+                del self.pending[mac_address]
+
+        if not self.pending:
+            return
+
+        candidates = sorted(self.pending.items())
+        results = rdp_scan.scan([ip_address for _, (ip_address, _) in candidates])
+        reachable = [(mac_address, ip_address) for (mac_address, (ip_address, _)), result in zip(candidates, results)
+                     if result.open]
+        if not reachable:
+            return
+
+        try:
+            connected = db_provision.update_hostnames(self.docker, settings.SQL_CONTAINER_NAME,
+                                                      self.mysql_user_password, reachable)
+        except (db_provision.ProvisionError, DockerError, OSError) as error:
+            # The sql container may not be running yet after a reboot, the update is retried
+            print('[WARNING] Unable to update the connections. {}'.format(error))
+            return
+
+        for mac_address, ip_address in reachable:
+            if mac_address in connected:
+                print('[INFO] The connection of {} now points to {}'.format(mac_address, ip_address))
+            else:
+                print('[INFO] {} at {} has no connection, run setup.py to add it'.format(mac_address, ip_address))
+            self.applied[mac_address] = ip_address
+            del self.pending[mac_address]
+
+    def check(self):
+        now = time.time()
+        for mac_address, ip_address in self.changed_leases().items():
+            pending = self.pending.get(mac_address)
+            if pending is None or pending[0] != ip_address:
+                self.pending[mac_address] = (ip_address, now)
+
+        self.update_pending()
+
+    # This method sleeps until the lease file changes and has been quiet for SETTLE_SECONDS, or until the
+    # pending equipment is due to be probed again.
+    def wait_for_change(self):
+        lease_file_name = os.path.basename(self.lease_file.path)
+        events = self.inotify.read_events(RETRY_INTERVAL if self.pending else None)
+        if any(mask & file_watch.IN_Q_OVERFLOW or name == lease_file_name for _, mask, name in events):
+            # Wait for dhcpd to finish writing
+            while self.inotify.read_events(SETTLE_SECONDS):
+                pass
+
+    def run(self):
+        print('Watching {} for address changes of the equipment'.format(self.lease_file.path))
+        self.check()
+
+        while True:
+            self.wait_for_change()
+            self.check()
+
+
+def watch_leases():
+    directories = settings.fetch_file_directories()
+    try:
+        mysql_user_password = read_user_password(directories)
+    except FileNotFoundError:
+        print('[Error] The database password is missing. Run setup.py before starting the lease watcher.')
+        sys.exit()
+
+    LeaseWatcher(mysql_user_password).run()
+
+
+if __name__ == '__main__':
+    watch_leases()
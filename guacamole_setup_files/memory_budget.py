@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+
+# Plans how the memory and cpus of the raspberry pi are shared between the host and the containers.
+# The total memory and the model of the pi are detected and a budget is computed for the java heap and
+# garbage collector of tomcat, the rdp sessions of the guacd containers, the buffer pool and connections of
+# mysql and an optional zram swap. Tomcat gets a lower cpu weight than guacd, which decodes the sessions,
+# and a pool of guacd containers gets a core for every instance. setup.py applies the budget as container
+# memory and cpu limits, CATALINA_OPTS and a mysql option file, and records it in generated_files so the
+# status email can compare the real memory use of the containers against the plan.
+#
+# Only the standard library is used, the module is also imported by the status email.
+
+import json
+import os
+import time
+from collections import OrderedDict
+
+MEMINFO_FILE = '/proc/meminfo'
+MODEL_FILE = '/proc/device-tree/model'
+CPUINFO_FILE = '/proc/cpuinfo'
+
+PLAN_FILE_NAME = 'memory_budget.json'
+MYSQL_CONFIG_FILE_NAME = 'mysql_memory.cnf'
+ZRAM_SCRIPT_FILE_NAME = 'zram_swap.sh'
+
+# Path of the mysql option file in the sql container, the option files of conf.d are read last
+MYSQL_CONFIG_PATH = '/etc/mysql/conf.d/minidmz_memory.cnf'
+
+ROLE_GUACAMOLE = 'guacamole'
+ROLE_GUACD = 'guacd'
+ROLE_MYSQL = 'mysql'
+
+# Memory kept for the kernel, apache, shibboleth, dockerd and the watch daemons, in MB or percent of the
+# total, whichever is larger
+SYSTEM_RESERVE_MB = 256
+SYSTEM_RESERVE_PERCENT = 20
+
+# guacd needs a few MB of its own and a process per rdp session, which grows with the screen size
+GUACD_BASE_MB = 32
+GUACD_SESSION_MB = 48
+
+# Relative cpu weight of tomcat when the cores are busy, docker gives every container 1024
+TOMCAT_CPU_SHARES = 512
+
+# Metaspace, code cache, thread stacks and the native memory of the jvm, on top of the heap
+JVM_OVERHEAD_MB = 128
+MIN_HEAP_MB = 64
+MAX_HEAP_MB = 512
+METASPACE_MB = 64
+CODE_CACHE_MB = 32
+# Above this heap the parallel collector is used on a pi with several cores
+SERIAL_GC_MAX_HEAP_MB = 256
+
+# The guacamole jdbc extension keeps at most 10 connections in its pool
+MYSQL_MAX_CONNECTIONS = 20
+MYSQL_CONNECTION_MB = 1
+MYSQL_OVERHEAD_MB = 64
+MIN_BUFFER_POOL_MB = 16
+MAX_BUFFER_POOL_MB = 128
+
+# Pi with at most this much memory get a zram swap of the given share of their memory
+ZRAM_SHARES = [(1024, 2), (2048, 4)]
+
+
+def clamp(value, lowest, highest):
+    return max(lowest, min(highest, value))
+
+
+# Returns the fields of /proc/meminfo in kB
+def read_meminfo(meminfo_file=MEMINFO_FILE):
+    fields = {}
+    with open(meminfo_file, 'r') as file_object:
+        for line in file_object:
+            name, _, value = line.partition(':')
+            value = value.split()
+            if value and value[0].isdigit():
+                fields[name] = int(value[0])
+    return fields
+
+
+# Returns the model of the raspberry pi, or the machine type on other hardware
+def read_model():
+    try:
+        with open(MODEL_FILE, 'rb') as file_object:
+            return file_object.read().decode('utf-8', 'replace').strip('\0 \n')
+    except OSError:
+        pass
+
+    try:
+        with open(CPUINFO_FILE, 'r') as file_object:
+            for line in file_object:
+                name, _, value = line.partition(':')
+                if name.strip() in ('Model', 'Hardware'):
+                    return value.strip()
+    except OSError:
+        pass
+
+    return os.uname().machine
+
+
+# Returns the java options of a tomcat with the given heap. The serial collector has the smallest
+# footprint and pauses short enough for a small heap, larger heaps on several cores use the parallel one.
+def java_options(heap_mb, cpus):
+    if heap_mb <= SERIAL_GC_MAX_HEAP_MB or cpus < 2:
+        collector = ['-XX:+UseSerialGC']
+    else:
+        collector = ['-XX:+UseParallelGC', '-XX:ParallelGCThreads={}'.format(min(2, cpus))]
+
+    return ' '.join(['-Xms{}m'.format(max(MIN_HEAP_MB, heap_mb // 4)), '-Xmx{}m'.format(heap_mb), '-Xss512k',
+                     '-XX:MaxMetaspaceSize={}m'.format(METASPACE_MB),
+                     '-XX:ReservedCodeCacheSize={}m'.format(CODE_CACHE_MB)] + collector)
+
+
+# Returns the size in MB of the zram swap of a pi with total_mb of memory, 0 for none
+def zram_size(total_mb):
+    for highest_mb, share in ZRAM_SHARES:
+        if total_mb <= highest_mb:
+            return total_mb // share // 16 * 16
+    return 0
+
+
+# Returns the memory budget of a pi with total_mb of memory and the given number of cpus, for the given
+# number of concurrent rdp sessions. containers is a dictionary of role (ROLE_GUACAMOLE, ROLE_GUACD,
+# ROLE_MYSQL) to the list of container names. Every size is in MB.
+def compute_budget(total_mb, model, cpus, sessions, containers, zram_enabled=True):
+    reserve_mb = max(SYSTEM_RESERVE_MB, total_mb * SYSTEM_RESERVE_PERCENT // 100)
+    available_mb = total_mb - reserve_mb
+
+    buffer_pool_mb = clamp(available_mb // 16 // 8 * 8, MIN_BUFFER_POOL_MB, MAX_BUFFER_POOL_MB)
+    mysql_mb = buffer_pool_mb + MYSQL_OVERHEAD_MB + MYSQL_MAX_CONNECTIONS * MYSQL_CONNECTION_MB
+
+    # All the sessions of a connection run on one guacd instance, so every instance is allowed all the
+    # sessions while the sessions are only counted once in the total
+    guacd_instances = containers[ROLE_GUACD]
+    instance_mb = GUACD_BASE_MB + sessions * GUACD_SESSION_MB
+    guacd_mb = len(guacd_instances) * GUACD_BASE_MB + sessions * GUACD_SESSION_MB
+
+    # The heap gets what is left once guacd and mysql are served
+    heap_mb = clamp((available_mb - mysql_mb - guacd_mb - JVM_OVERHEAD_MB) // 16 * 16, MIN_HEAP_MB, MAX_HEAP_MB)
+    guacamole_mb = heap_mb + JVM_OVERHEAD_MB
+
+    plan = OrderedDict()
+    plan['created'] = int(time.time())
+    plan['model'] = model
+    plan['total_mb'] = total_mb
+    plan['cpus'] = cpus
+    plan['sessions'] = sessions
+    plan['system_reserve_mb'] = reserve_mb
+    plan['over_budget_mb'] = max(0, mysql_mb + guacd_mb + guacamole_mb - available_mb)
+    plan['zram_mb'] = zram_size(total_mb) if zram_enabled else 0
+
+    plan['containers'] = []
+    for container_name in containers[ROLE_GUACAMOLE]:
+        plan['containers'].append(OrderedDict([
+            ('container', container_name),
+            ('role', ROLE_GUACAMOLE),
+            ('limit_mb', guacamole_mb),
+            ('heap_mb', heap_mb),
+            ('java_options', java_options(heap_mb, cpus)),
+            ('cpu_shares', TOMCAT_CPU_SHARES),
+        ]))
+    for index, container_name in enumerate(guacd_instances):
+        plan['containers'].append(OrderedDict([
+            ('container', container_name),
+            ('role', ROLE_GUACD),
+            ('limit_mb', instance_mb),
+            # A single instance may use every core
+            ('cpuset', str(index % cpus) if len(guacd_instances) > 1 else None),
+        ]))
+    for container_name in containers[ROLE_MYSQL]:
+        plan['containers'].append(OrderedDict([
+            ('container', container_name),
+            ('role', ROLE_MYSQL),
+            ('limit_mb', mysql_mb),
+            ('innodb_buffer_pool_mb', buffer_pool_mb),
+            ('max_connections', MYSQL_MAX_CONNECTIONS),
+        ]))
+    return plan
+
+
+# Returns the budget of the container
+def container_budget(plan, container_name):
+    for budget in plan['containers']:
+        if budget['container'] == container_name:
+            return budget
+    raise KeyError(container_name)
+
+
+# Returns the mysql option file of the budget. The buffers allocated for every connection are kept small,
+# the guacamole queries are simple.
+def mysql_config(plan):
+    mysql = [budget for budget in plan['containers'] if budget['role'] == ROLE_MYSQL][0]
+    return '\n'.join([
+        '# Generated by setup.py from the memory budget in {}'.format(PLAN_FILE_NAME),
+        '[mysqld]',
+        'innodb_buffer_pool_size = {}M'.format(mysql['innodb_buffer_pool_mb']),
+        'innodb_log_buffer_size = 4M',
+        'max_connections = {}'.format(mysql['max_connections']),
+        'key_buffer_size = 8M',
+        'query_cache_size = 0',
+        'query_cache_type = 0',
+        'table_open_cache = 64',
+        'thread_cache_size = 4',
+        'thread_stack = 192K',
+        'sort_buffer_size = 256K',
+        'read_buffer_size = 128K',
+        'read_rnd_buffer_size = 128K',
+        'join_buffer_size = 128K',
+        'tmp_table_size = 8M',
+        'max_heap_table_size = 8M',
+        'performance_schema = 0',
+    ]) + '\n'
+
+
+# Returns the shell script enabling a zram swap of size_mb. The swap gets a higher priority than the swap
+# file on the SD card, so pages are compressed in memory before they are written to the card.
+def zram_script(size_mb):
+    return '\n'.join([
+        '#!/bin/sh',
+        '# Generated by setup.py from the memory budget in {}'.format(PLAN_FILE_NAME),
+        'grep -q /dev/zram0 /proc/swaps && exit 0',
+        'modprobe zram num_devices=1 || exit 1',
+        'echo lz4 > /sys/block/zram0/comp_algorithm 2>/dev/null',
+        'echo {}M > /sys/block/zram0/disksize || exit 1'.format(size_mb),
+        'mkswap /dev/zram0 > /dev/null && swapon -p 100 /dev/zram0',
+    ]) + '\n'
+
+
+# Returns true if the budgets are the same, whenever they were planned
+def same_budget(plan, other):
+    def without_created(budget):
+        return json.dumps({name: value for name, value in budget.items() if name != 'created'}, sort_keys=True)
+
+    return without_created(plan) == without_created(other)
+
+
+# Returns the files recording and applying the budget as a list of (file name, content, mode). The content
+# is None for a file which is not needed, the zram script of a budget without zram swap. A budget equal to
+# the one recorded in the directory takes the time of the recorded one, so its files do not change.
+def budget_files(directory, plan):
+    recorded = read_plan(directory)
+    if recorded is not None and same_budget(plan, recorded):
+        plan['created'] = recorded['created']
+
+    return [
+        (PLAN_FILE_NAME, json.dumps(plan, indent=4), 0o644),
+        # mysql ignores option files which anyone can write
+        (MYSQL_CONFIG_FILE_NAME, mysql_config(plan), 0o644),
+        (ZRAM_SCRIPT_FILE_NAME, zram_script(plan['zram_mb']) if plan['zram_mb'] else None, 0o755),
+    ]
+
+
+# This method writes the budget and the files applying it into the directory. Files which did not change
+# are not rewritten and files which are not needed are removed.
+def write_files(directory, plan):
+    for file_name, content, mode in budget_files(directory, plan):
+        file_path = os.path.join(directory, file_name)
+        if content is None:
+            if os.path.isfile(file_path):
+                os.remove(file_path)
+            continue
+
+        if os.path.isfile(file_path):
+            with open(file_path, 'r') as file_object:
+                if file_object.read() == content:
+                    continue
+
+        with open(file_path, 'w') as file_object:
+            file_object.write(content)
+        os.chmod(file_path, mode)
+
+
+# Returns the budget recorded in the directory, None if there is none
+def read_plan(directory):
+    try:
+        with open(os.path.join(directory, PLAN_FILE_NAME), 'r') as file_object:
+            return json.load(file_object, object_pairs_hook=OrderedDict)
+    except (OSError, ValueError):
+        return None
+
+
+# Returns the summary of the budget printed by the setup
+def describe(plan):
+    lines = ['Memory budget for {} with {} MB and {} cpus, {} MB kept for the system, {} rdp sessions'.format(
+        plan['model'], plan['total_mb'], plan['cpus'], plan['system_reserve_mb'], plan['sessions'])]
+
+    for budget in plan['containers']:
+        if budget['role'] == ROLE_GUACAMOLE:
+            details = 'java heap {} MB ({})'.format(budget['heap_mb'], budget['java_options'])
+        elif budget['role'] == ROLE_GUACD:
+            details = 'cpu {}'.format(budget['cpuset']) if budget['cpuset'] is not None else 'all cpus'
+        else:
+            details = 'innodb buffer pool {} MB, {} connections'.format(budget['innodb_buffer_pool_mb'],
+                                                                      budget['max_connections'])
+        lines.append('    {}: {} MB, {}'.format(budget['container'], budget['limit_mb'], details))
+
+    if plan['zram_mb']:
+        lines.append('    zram swap: {} MB'.format(plan['zram_mb']))
+    return '\n'.join(lines)
+
+
+# Returns the resident memory in MB of the processes of a running container, None if it is not running.
+# The processes are listed by the docker daemon and their VmRSS read from /proc of the host, which works
+# without the memory cgroup that raspbian leaves disabled.
+def container_rss(docker, container_name):
+    processes = docker.top(container_name)
+    if processes is None:
+        return None
+
+    pid_column = processes['Titles'].index('PID')
+    rss_kb = 0
+    for process in processes['Processes']:
+        try:
+            rss_kb += read_meminfo('/proc/{}/status'.format(process[pid_column])).get('VmRSS', 0)
+        except OSError:
+            # The process ended after it was listed
+            continue
+    return rss_kb // 1024
+
+
+# Returns the memory section of the status email comparing the memory used by the containers against the
+# budget recorded in the directory. Returns None if setup.py did not record a budget. Errors of the docker
+# daemon are raised.
+def memory_report(docker, directory):
+    plan = read_plan(directory)
+    if plan is None:
+        return None
+
+    lines = ['Memory use against the budget planned by setup.py on {} for {} with {} MB:'.format(
+        time.strftime('%Y-%m-%d', time.localtime(plan['created'])), plan['model'], plan['total_mb'])]
+
+    for budget in plan['containers']:
+        rss_mb = container_rss(docker, budget['container'])
+        if rss_mb is None:
+            lines.append('    {:<20} not running'.format(budget['container']))
+            continue
+
+        lines.append('    {:<20} {:>5} MB used of {} MB planned ({:.0f}%){}'.format(
+            budget['container'], rss_mb, budget['limit_mb'], 100.0 * rss_mb / budget['limit_mb'],
+            ' OVER BUDGET' if rss_mb > budget['limit_mb'] else ''))
+
+    meminfo = read_meminfo()
+    swap_used_mb = (meminfo.get('SwapTotal', 0) - meminfo.get('SwapFree', 0)) // 1024
+    lines.append('    {:<20} {:>5} MB available, {} MB of {} MB swap used'.format(
+        'host', meminfo.get('MemAvailable', 0) // 1024, swap_used_mb, meminfo.get('SwapTotal', 0) // 1024))
+    return '\n'.join(lines)
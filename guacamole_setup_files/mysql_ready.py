@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Waits until the mysql server in the sql container accepts connections.
+# The official mysql entrypoint first starts a temporary server without networking to initialise the
+# database and only then starts the real server, so a server answering on the tcp port is really ready.
+# The container is probed with the mysql protocol handshake from the host. If the container address
+# cannot be reached from the host, mysqladmin ping is run inside the container instead.
+
+import socket
+import struct
+import time
+
+MYSQL_PORT = 3306
+
+DEFAULT_TIMEOUT = 180
+
+# The poll interval starts small and grows, so a fast pi is not kept waiting and a slow one is not flooded
+INITIAL_INTERVAL = 0.2
+MAX_INTERVAL = 2.0
+INTERVAL_GROWTH = 1.5
+
+CONNECT_TIMEOUT = 2
+
+# First byte of the initial handshake packet of protocol version 10 and of an error packet
+HANDSHAKE_V10 = 10
+ERROR_PACKET = 0xff
+
+
+class MysqlNotReady(Exception):
+    pass
+
+
+# Returns the ip address of the container on its docker network, or None
+def container_address(container):
+    for network in container['NetworkSettings'].get('Networks', {}).values():
+        if network.get('IPAddress'):
+            return network['IPAddress']
+    return container['NetworkSettings'].get('IPAddress') or None
+
+
+# Reads the first packet sent by the server. Returns true once the server speaks the mysql protocol.
+# An error packet (for example host not allowed or too many connections) also means the server is up.
+# Raises ConnectionRefusedError while nothing listens on the port and OSError if the address
+# cannot be reached at all.
+def handshake(address, port=MYSQL_PORT):
+    with socket.create_connection((address, port), timeout=CONNECT_TIMEOUT) as connection:
+        header = b''
+        try:
+            while len(header) < 5:
+                data = connection.recv(5 - len(header))
+                if not data:
+                    return False
+                header += data
+        except (socket.timeout, ConnectionResetError):
+            return False
+
+    payload_length = struct.unpack('<I', header[:3] + b'\0')[0]
+    return payload_length > 0 and header[4] in (HANDSHAKE_V10, ERROR_PACKET)
+
+
+# Pings the server from inside the container. The tcp protocol is used so the temporary server
+# started by the entrypoint, which only listens on the unix socket, does not count.
+def mysqladmin_ping(docker, container_name):
+    command = ['mysqladmin', 'ping', '--silent', '--protocol=tcp', '-h', '127.0.0.1',
+               '--connect-timeout={}'.format(CONNECT_TIMEOUT)]
+    exit_code, _ = docker.exec_run(container_name, command, stream_output=False)
+    return exit_code == 0
+
+
+# This method polls the container until mysql accepts connections.
+# Returns the number of seconds waited. Raises MysqlNotReady if the container stops or on timeout.
+def wait_for_mysql(docker, container_name, timeout=DEFAULT_TIMEOUT):
+    started = time.monotonic()
+    interval = INITIAL_INTERVAL
+    use_exec = False
+
+    while True:
+        container = docker.inspect_container(container_name)
+        if container is None or not container['State']['Running']:
+            raise MysqlNotReady('The container {} stopped (exit code {}). Check docker logs {}'.format(
+                container_name, container['State']['ExitCode'] if container else None, container_name))
+
+        address = container_address(container)
+        if address is None:
+            use_exec = True
+
+        if not use_exec:
+            try:
+                if handshake(address):
+                    return time.monotonic() - started
+            except ConnectionRefusedError:
+                pass
+            except OSError as error:
+                print('[WARNING] Unable to reach {} ({}). Probing with mysqladmin inside the container.'.format(
+                    address, error))
+                use_exec = True
+        elif mysqladmin_ping(docker, container_name):
+            return time.monotonic() - started
+
+        elapsed = time.monotonic() - started
+        if elapsed >= timeout:
+            raise MysqlNotReady('mysql in {} did not accept connections within {} seconds'.format(
+                container_name, timeout))
+
+        time.sleep(min(interval, timeout - elapsed))
+        interval = min(interval * INTERVAL_GROWTH, MAX_INTERVAL)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# Runs the preflight checks of the setup concurrently.
+# Every check runs in its own thread and has its own timeout, so a slow mirror or a hung docker daemon
+# cannot stall the setup. A check passes by returning a short detail message and fails by raising an
+# exception. A failed check which is not required is reported as a warning and does not fail the run.
+# The outcome of all the checks is printed as one table.
+
+import threading
+import time
+from collections import namedtuple
+
+STATUS_PASSED = 'passed'
+STATUS_FAILED = 'failed'
+STATUS_WARNING = 'warning'
+STATUS_TIMEOUT = 'timeout'
+
+DEFAULT_TIMEOUT = 10
+
+Check = namedtuple('Check', ['name', 'function', 'timeout', 'required'])
+CheckResult = namedtuple('CheckResult', ['name', 'status', 'seconds', 'detail'])
+
+
+# Raised by a check to report a failure with a message instead of a traceback
+class PreflightError(Exception):
+    pass
+
+
+# Returns a check. function takes no arguments, use a lambda to bind them.
+def check(name, function, timeout=DEFAULT_TIMEOUT, required=True):
+    return Check(name, function, timeout, required)
+
+
+class CheckThread(threading.Thread):
+
+    def __init__(self, preflight_check):
+        # Daemon threads, so a check which never returns does not keep the setup from exiting
+        super().__init__(name='preflight {}'.format(preflight_check.name), daemon=True)
+        self.check = preflight_check
+        self.result = None
+
+    def run(self):
+        started = time.monotonic()
+        try:
+            detail = self.check.function()
+            status = STATUS_PASSED
+        except PreflightError as error:
+            detail = str(error)
+            status = STATUS_FAILED
+        except SystemExit:
+            detail = 'exited, see the output above'
+            status = STATUS_FAILED
+        except Exception as error:
+            detail = '{}: {}'.format(type(error).__name__, error)
+            status = STATUS_FAILED
+
+        if status == STATUS_FAILED and not self.check.required:
+            status = STATUS_WARNING
+        self.result = CheckResult(self.check.name, status, time.monotonic() - started, detail or '')
+
+
+# This method runs the checks concurrently and returns their results in the order the checks were given
+def run_checks(checks):
+    started = time.monotonic()
+    threads = [CheckThread(preflight_check) for preflight_check in checks]
+    for thread in threads:
+        thread.start()
+
+    results = []
+    for thread in threads:
+        # All the checks started together, so the deadline of each check counts from the common start
+        thread.join(max(0.0, started + thread.check.timeout - time.monotonic()))
+        if thread.result is not None:
+            results.append(thread.result)
+        else:
+            status = STATUS_TIMEOUT if thread.check.required else STATUS_WARNING
+            results.append(CheckResult(thread.check.name, status, thread.check.timeout,
+                                       'no answer after {} seconds'.format(thread.check.timeout)))
+
+    return results
+
+
+def passed(results):
+    return all(result.status in (STATUS_PASSED, STATUS_WARNING) for result in results)
+
+
+# Prints the outcome of the checks as a table
+def print_results(results):
+    print('\n{:<16} {:<8} {:>9}  {}'.format('Check', 'Status', 'Seconds', 'Detail'))
+    for result in results:
+        print('{:<16} {:<8} {:>9.2f}  {}'.format(result.name, result.status, result.seconds, result.detail))
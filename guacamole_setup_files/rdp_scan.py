@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Finds the equipment answering on the RDP port, without nmap.
+# All the addresses and ports are probed concurrently with asyncio by opening a tcp connection, with a
+# limit on the number of connections in flight and a timeout for every probe. On the RDP port the probe
+# sends the X.224 connection request which starts every RDP session, and the port only counts as open when
+# the equipment answers with a connection confirm, so another service on the port is not taken for RDP.
+# Probes of the other ports are closed as soon as the connection is established, nothing is sent.
+
+import argparse
+import asyncio
+import ipaddress
+import os
+import time
+from collections import namedtuple
+
+RDP_PORT = 3389
+
+DEFAULT_TIMEOUT = 1.0
+DEFAULT_CONCURRENCY = 64
+
+# X.224 connection request with an RDP negotiation request for TLS and CredSSP (MS-RDPBCGR 2.2.1.1)
+RDP_CONNECTION_REQUEST = bytes([0x03, 0x00, 0x00, 0x13, 0x0e, 0xe0, 0x00, 0x00, 0x00, 0x00, 0x00,
+                                0x01, 0x00, 0x08, 0x00, 0x03, 0x00, 0x00, 0x00])
+TPKT_VERSION = 3
+X224_CONNECTION_CONFIRM = 0xd0
+
+# latency is the connect time in seconds of an open port, error the reason a port is not open
+ScanResult = namedtuple('ScanResult', ['ip_address', 'port', 'open', 'latency', 'error'])
+
+
+# Returns whether the peer answers the RDP connection request with an X.224 connection confirm. A server
+# refusing the requested security protocols still sends a confirm, with a negotiation failure.
+async def rdp_confirmed(reader, writer):
+    writer.write(RDP_CONNECTION_REQUEST)
+    await writer.drain()
+    # TPKT header of 4 bytes, then the length and code of the X.224 header
+    header = await reader.readexactly(6)
+    return header[0] == TPKT_VERSION and header[5] & 0xf0 == X224_CONNECTION_CONFIRM
+
+
+async def probe(ip_address, port, timeout, semaphore):
+    async with semaphore:
+        started = time.monotonic()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(ip_address, port), timeout)
+        except asyncio.TimeoutError:
+            return ScanResult(ip_address, port, False, None, 'timeout')
+        except OSError as error:
+            # asyncio puts the address in the message of the error, the errno tells what happened
+            return ScanResult(ip_address, port, False, None, os.strerror(error.errno) if error.errno else str(error))
+
+        latency = time.monotonic() - started
+        error = None
+        if port == RDP_PORT:
+            try:
+                if not await asyncio.wait_for(rdp_confirmed(reader, writer), timeout):
+                    error = 'not rdp'
+            except asyncio.TimeoutError:
+                error = 'no rdp answer'
+            except (OSError, asyncio.IncompleteReadError):
+                error = 'not rdp'
+        writer.close()
+
+        if error is not None:
+            return ScanResult(ip_address, port, False, None, error)
+        return ScanResult(ip_address, port, True, latency, None)
+
+
+async def probe_all(addresses, ports, timeout, concurrency):
+    # Created in the coroutine so it belongs to the running event loop
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*[probe(ip_address, port, timeout, semaphore)
+                                  for ip_address in addresses for port in ports])
+
+
+# This method probes every port of every address and returns a ScanResult for each, in the order of the
+# addresses and then of the ports
+def scan(addresses, ports=(RDP_PORT,), timeout=DEFAULT_TIMEOUT, concurrency=DEFAULT_CONCURRENCY):
+    if not addresses:
+        return []
+
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(probe_all(addresses, ports, timeout, concurrency))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+# Returns the addresses of the command line targets, which are addresses or networks such as 192.168.7.0/24
+def target_addresses(targets):
+    addresses = []
+    for target in targets:
+        network = ipaddress.ip_network(target, strict=False)
+        hosts = list(network.hosts()) or [network.network_address]
+        addresses.extend(str(address) for address in hosts)
+    return addresses
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Finds the hosts with open RDP or other tcp ports')
+    parser.add_argument('targets', nargs='+', help='Addresses or networks such as 192.168.7.0/24')
+    parser.add_argument('-p', '--ports', type=int, nargs='+', default=[RDP_PORT], help='Ports to probe')
+    parser.add_argument('-t', '--timeout', type=float, default=DEFAULT_TIMEOUT, help='Seconds to wait per probe')
+    parser.add_argument('-c', '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Number of probes in flight')
+    arguments = parser.parse_args()
+
+    started = time.monotonic()
+    results = scan(target_addresses(arguments.targets), arguments.ports, arguments.timeout, arguments.concurrency)
+
+    for result in results:
+        if result.open:
+            print('{:<16} {:>5} open {:>8.1f} ms'.format(result.ip_address, result.port, result.latency * 1000))
+    print('Probed {} ports in {:.1f} seconds'.format(len(results), time.monotonic() - started))
+
+
+if __name__ == '__main__':
+    main()
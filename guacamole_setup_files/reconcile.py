@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# Compares the state the setup wants with the docker objects and files which exist, so a re-run of the
+# setup only changes what differs and leaves the running containers alone otherwise.
+# Every container records the image and options it was created with, and a hash of the host files it
+# mounts, in a label. A container is kept while they are unchanged and its image was not rebuilt, started
+# if it is stopped and recreated otherwise. The changes are printed before they are applied.
+
+import hashlib
+import json
+import os
+from collections import namedtuple
+
+SPEC_LABEL = 'minidmz.container.spec'
+
+ACTION_KEEP = 'keep'
+ACTION_CREATE = 'create'
+ACTION_UPDATE = 'update'
+ACTION_BUILD = 'build'
+ACTION_START = 'start'
+ACTION_RECREATE = 'recreate'
+ACTION_REMOVE = 'remove'
+# Applied on every run, without interrupting the service
+ACTION_REFRESH = 'refresh'
+
+# kind is what changes (container, image, volume, network, file, database), reason why it changes
+Change = namedtuple('Change', ['kind', 'name', 'action', 'reason'])
+
+# Desired state of a container. options are the keyword arguments of DockerClient.run. initial_environment
+# is only passed when the container is created and is not compared, for values only needed the first time.
+# files is a dictionary of the host files the container mounts to their content (bytes), a container is
+# recreated when the content changes.
+ContainerSpec = namedtuple('ContainerSpec', ['name', 'image', 'options', 'initial_environment', 'files'])
+
+
+# Returns the document recorded in the label of a container created from the spec
+def spec_document(spec):
+    document = {
+        'image': spec.image,
+        'options': spec.options,
+        'files': {path: hashlib.sha256(content).hexdigest() for path, content in spec.files.items()},
+    }
+    # Going through json makes the tuples of the options lists, as they are read back from the label
+    return json.loads(json.dumps(document, sort_keys=True))
+
+
+# Returns the names of the options and files which differ between two spec documents
+def spec_differences(recorded, desired):
+    differences = ['image'] if recorded.get('image') != desired['image'] else []
+
+    recorded_options = recorded.get('options') or {}
+    differences.extend(sorted(name for name in set(recorded_options) | set(desired['options'])
+                              if recorded_options.get(name) != desired['options'].get(name)))
+
+    recorded_files = recorded.get('files') or {}
+    differences.extend(sorted(os.path.basename(path) for path in desired['files']
+                              if recorded_files.get(path) != desired['files'][path]))
+    return differences
+
+
+# Returns the change bringing the container to the spec. image_id is the id of the image the container
+# must run, None if the image is rebuilt first. A reason forces the container to be recreated.
+def container_change(docker, spec, image_id, reason=None):
+    container = docker.inspect_container(spec.name)
+    if container is None:
+        return Change('container', spec.name, ACTION_CREATE, 'missing')
+    if reason:
+        return Change('container', spec.name, ACTION_RECREATE, reason)
+    if image_id is None or container['Image'] != image_id:
+        return Change('container', spec.name, ACTION_RECREATE, 'image rebuilt')
+
+    label = (container['Config'].get('Labels') or {}).get(SPEC_LABEL)
+    if label is None:
+        return Change('container', spec.name, ACTION_RECREATE, 'created by an earlier setup')
+
+    try:
+        recorded = json.loads(label)
+    except ValueError:
+        recorded = {}
+    differences = spec_differences(recorded, spec_document(spec))
+    if differences:
+        return Change('container', spec.name, ACTION_RECREATE, '{} changed'.format(', '.join(differences)))
+
+    if not container['State']['Running']:
+        return Change('container', spec.name, ACTION_START, 'stopped')
+    return Change('container', spec.name, ACTION_KEEP, 'up to date')
+
+
+# This method applies the change of a container to its spec
+def apply_container_change(docker, spec, change):
+    if change.action == ACTION_KEEP:
+        return
+    if change.action == ACTION_START:
+        docker.start_container(spec.name)
+        return
+    if change.action == ACTION_RECREATE:
+        docker.remove_container(spec.name, force=True)
+
+    options = dict(spec.options)
+    if spec.initial_environment:
+        options['environment'] = dict(options.get('environment') or {}, **spec.initial_environment)
+    label = json.dumps(spec_document(spec), sort_keys=True, separators=(',', ':'))
+    docker.run(spec.name, spec.image, labels={SPEC_LABEL: label}, **options)
+
+
+# Returns the change writing content (a string) to the file at path, or removing it if content is None
+def file_change(path, content):
+    if not os.path.isfile(path):
+        if content is None:
+            return Change('file', os.path.basename(path), ACTION_KEEP, 'not needed')
+        return Change('file', os.path.basename(path), ACTION_CREATE, 'missing')
+    if content is None:
+        return Change('file', os.path.basename(path), ACTION_REMOVE, 'not needed')
+
+    with open(path, 'r') as file_object:
+        if file_object.read() == content:
+            return Change('file', os.path.basename(path), ACTION_KEEP, 'up to date')
+    return Change('file', os.path.basename(path), ACTION_UPDATE, 'content changed')
+
+
+# This method writes content to the file at path with the given mode if the file differs. Returns true if
+# the file was written. An unchanged file is not touched, so it keeps its modification time.
+def write_file(path, content, mode):
+    if file_change(path, content).action == ACTION_KEEP:
+        return False
+
+    with open(path, 'w') as file_object:
+        file_object.write(content)
+    os.chmod(path, mode)
+    return True
+
+
+def print_plan(changes):
+    print('{:<10} {:<24} {:<9} {}'.format('Kind', 'Name', 'Action', 'Reason'))
+    for change in changes:
+        print('{:<10} {:<24} {:<9} {}'.format(change.kind, change.name, change.action, change.reason))
+
+    count = sum(1 for change in changes if change.action not in (ACTION_KEEP, ACTION_REFRESH))
+    print('{} change{} to apply'.format(count or 'No', '' if count == 1 else 's'))
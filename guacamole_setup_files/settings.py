@@ -8,22 +8,55 @@ DOMAIN_NAME = ''
 GUACAMOLE_VERSION = '0.9.14'
 MYSQL_CONNECTOR_VERSION = '5.1.46'
 
+# SHA-256 pins of the downloaded artifacts by file name, for example
+# 'guacamole-server-0.9.14.tar.gz': '<sha256>'. Pins are optional: artifacts without a pin here are checked
+# against the checksum published over https (by Apache for guacamole, by Maven Central for the mysql
+# connector jar) and their verified SHA-256 is recorded in artifact_cache/pins.json. A pin here takes
+# precedence, so the artifacts can be pinned to hashes verified out of band.
+ARTIFACT_SHA256 = {}
+
+# Other tcp ports probed on the equipment along with RDP (3389) during the setup, for example [22, 5900].
+# The open ones are only reported, every equipment with RDP open gets a Guacamole connection.
+EQUIPMENT_EXTRA_PORTS = []
+
+# Number of rdp sessions the memory budget plans for. Every session runs a guacd process.
+MAX_RDP_SESSIONS = 4
+
+# Whether a compressed swap in memory (zram) is enabled on pi with 2 GB of memory or less
+ZRAM_SWAP = True
+
+# Number of guacd containers. With one, guacd may use every core. With more, every instance is pinned to
+# its own core and the connections are shared between the instances, all the sessions of a connection
+# run on the same instance.
+GUACD_INSTANCES = 1
+
 SQL_CONTAINER_NAME = 'sql_container'
 GUACAMOLE_CONTAINER_NAME = 'guacamole_container'
+# The guacd containers are named guacd_container_0, guacd_container_1, ...
+GUACD_CONTAINER_NAME = 'guacd_container'
 SQL_IMAGE_NAME = 'sql_image'
 GUACAMOLE_IMAGE_NAME = 'guacamole_image'
+GUACD_IMAGE_NAME = 'guacd_image'
+
+# Log rotation of the docker json-file logging driver. Every container keeps at most DOCKER_LOG_MAX_FILE
+# log files of DOCKER_LOG_MAX_SIZE, the rotated ones gzip compressed, so the logs cannot fill the SD card.
+DOCKER_LOG_MAX_SIZE = '10m'
+DOCKER_LOG_MAX_FILE = '5'
 
 DIRECTORY_BASE = 'base'
 DIRECTORY_DATABASE = 'database'
 DIRECTORY_GUACAMOLE = 'guacamole'
+DIRECTORY_GUACD = 'guacd'
 DIRECTORY_GENERATED_FILES = 'generated_files'
 DIRECTORY_LOG_EMAIL = 'log_email'
+DIRECTORY_ARTIFACTS = 'artifacts'
 
 
 # Establishes the file directory to be used
 # base directory is the file path where this python script is located
 # database directory is the file path where files required for building database container are located
 # guacamole directory is the file path where files required for building guacamole container are located
+# guacd directory is the file path where files required for building the guacd container are located
 def fetch_file_directories():
     base_directory = os.path.dirname(os.path.realpath(__file__))
     directories = {
@@ -31,6 +64,13 @@ def fetch_file_directories():
         DIRECTORY_BASE : base_directory,
         DIRECTORY_DATABASE : base_directory + '/db',
         DIRECTORY_GUACAMOLE : base_directory + '/dock',
-        DIRECTORY_GENERATED_FILES : base_directory + '/..' + '/generated_files'
+        DIRECTORY_GUACD : base_directory + '/guacd',
+        DIRECTORY_GENERATED_FILES : base_directory + '/..' + '/generated_files',
+        DIRECTORY_ARTIFACTS : base_directory + '/..' + '/artifact_cache'
     }
     return directories
+
+
+# Returns the names of the guacd containers, one for every instance
+def guacd_container_names():
+    return ['{}_{}'.format(GUACD_CONTAINER_NAME, index) for index in range(GUACD_INSTANCES)]
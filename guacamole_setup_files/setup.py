@@ -2,14 +2,44 @@
 
 import argparse
 import os
-import subprocess
 import sys
-from time import sleep
-
+from collections import namedtuple
+
+import artifact_cache
+import build_cache
+import db_provision
+import dhcp_leases
+import memory_budget
+import rdp_scan
+import reconcile
+from docker_api import DockerClient, DockerError
+from mysql_ready import MysqlNotReady, wait_for_mysql
+from step_runner import Step, StepError, print_results, run_steps, STATUS_OK
 from tests import run_tests
 import settings
 
+# The timeline of the setup is kept with the one of the raspberry pi setup scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'pi_setup_files'))
+import tracing
+
+DOCKER_NETWORK_NAME = 'guacamole_network'
 DOCKER_MYSQL_VOLUME = 'sql_volume'
+# rdp drive of the connections, shared by the guacd containers so a file is found whatever instance serves it
+DOCKER_GUACD_DRIVE_VOLUME = 'guacd_drive_volume'
+
+# Address configured when no equipment is found
+DEFAULT_EQUIPMENT_IP = '192.168.7.2'
+
+Equipment = namedtuple('Equipment', ['mac_address', 'ip_address'])
+
+# An image of the setup, built from the build context directory of the context name
+ImageBuild = namedtuple('ImageBuild', ['name', 'context', 'tag', 'build_args'])
+
+# All docker operations share one connection to the docker daemon
+docker = DockerClient()
+
+# Ids of the images which lost their tag to a rebuilt image, removed once no container uses them
+replaced_images = []
 
 
 # Obtain command line arguments
@@ -17,15 +47,24 @@ def fetch_argument():
     parser = argparse.ArgumentParser(description='Sets up the Guacamole Server')
 
     parser.add_argument('-f', '--force',
-                        help='Forces creation of new instance of application. Removes old data.',
+                        help='Forces creation of new instance of application. Removes old data and rebuilds '
+                             'the images.',
                         action='store_true'
                         )
 
     parser.add_argument('-u', '--username',
-                        help='The CAS username which acts as the Administrator for the Guacamole application',
-                        required=True
+                        help='The CAS username which acts as the Administrator for the Guacamole application'
+                        )
+
+    parser.add_argument('-p', '--plan',
+                        help='Shows the changes the setup would make to the containers, images, volumes and '
+                             'generated files without making them.',
+                        action='store_true'
                         )
     arguments = parser.parse_args()
+
+    if not arguments.plan and not arguments.username:
+        parser.error('the following arguments are required: -u/--username')
     return arguments
 
 
@@ -46,8 +85,8 @@ def user_prompt(prompt_message):
     return valid_choices[choice]
 
 
-# Creates the initial directory structure
-def create_directory_structure(directories):
+# Creates the initial directory structure. A plan only checks it, it writes nothing.
+def create_directory_structure(directories, plan_only=False):
     if not os.path.isfile(directories[settings.DIRECTORY_BASE] + '/tests.py'):
         print((
                   "[Error] tests.py is missing in the {} directory. "
@@ -55,9 +94,15 @@ def create_directory_structure(directories):
               ).format(directories[settings.DIRECTORY_BASE]))
         sys.exit()
 
+    if plan_only:
+        return
+
     if not os.path.exists(directories[settings.DIRECTORY_GENERATED_FILES]):
         os.makedirs(directories[settings.DIRECTORY_GENERATED_FILES])
 
+    if not os.path.exists(directories[settings.DIRECTORY_ARTIFACTS]):
+        os.makedirs(directories[settings.DIRECTORY_ARTIFACTS])
+
 
 # Cleans up after the code finishes executing
 def clean_directory_structure(directories):
@@ -76,8 +121,8 @@ def generate_passwords(generate, directories):
         with open(directories[settings.DIRECTORY_GENERATED_FILES] + '/mysql_user_pass', 'r') as file_object:
             mysql_user_password = file_object.read()
     else:
-        mysql_root_password = subprocess.check_output(["openssl", "rand", "-hex", "18"]).decode("utf-8").strip()
-        mysql_user_password = subprocess.check_output(["openssl", "rand", "-hex", "18"]).decode("utf-8").strip()
+        mysql_root_password = tracing.check_output(["openssl", "rand", "-hex", "18"]).decode("utf-8").strip()
+        mysql_user_password = tracing.check_output(["openssl", "rand", "-hex", "18"]).decode("utf-8").strip()
         with open(directories[settings.DIRECTORY_GENERATED_FILES] + '/mysql_root_pass', 'w') as file_object:
             file_object.write(mysql_root_password)
         os.chmod(directories[settings.DIRECTORY_GENERATED_FILES] + '/mysql_root_pass', 0o660)
@@ -88,144 +133,260 @@ def generate_passwords(generate, directories):
     return mysql_root_password, mysql_user_password
 
 
-# Generates guacamole.properties file
+# Returns the content of the guacamole.properties file
+def guac_properties(mysql_user_password):
+    # Values for guacd. Connections without a guacd of their own use the first guacd container.
+    guacd_values = (
+        'guacd-hostname: {}\n'
+        'guacd-port: {}\n'
+    ).format(settings.guacd_container_names()[0], db_provision.GUACD_PORT)
+    mysql_host = 'mysql-hostname: {}\n'.format(settings.SQL_CONTAINER_NAME)
+    mysql_port = 'mysql-port: 3306\n'
+    mysql_database = 'mysql-database: guacamole_db\n'
+    mysql_username = 'mysql-username: guacamole_user\n'
+    mysql_password = 'mysql-password: {}\n'.format(mysql_user_password)
+    # Values for MYSQL Authentication
+    mysql_values = mysql_host + mysql_port + mysql_database + mysql_username + mysql_password
+
+    return guacd_values + mysql_values
+
+
+# Generates guacamole.properties file. An unchanged file is not rewritten.
 def generate_guac_properties(mysql_user_password, directories):
-    with open(directories[settings.DIRECTORY_GUACAMOLE] + '/guacamole.properties', 'w') as file_object:
-        # Values for guacd
-        guacd_values = (
-            'guacd-hostname: localhost\n'
-            'guacd-port: 4822\n'
-        )
-        mysql_host = 'mysql-hostname: {}\n'.format(settings.SQL_CONTAINER_NAME)
-        mysql_port = 'mysql-port: 3306\n'
-        mysql_database = 'mysql-database: guacamole_db\n'
-        mysql_username = 'mysql-username: guacamole_user\n'
-        mysql_password = 'mysql-password: {}\n'.format(mysql_user_password)
-        # Values for MYSQL Authentication
-        mysql_values = mysql_host + mysql_port + mysql_database + mysql_username + mysql_password
-
-        file_object.write(guacd_values + mysql_values)
-
-    os.chmod(directories[settings.DIRECTORY_GUACAMOLE] + '/guacamole.properties', 0o600)
-
-
-# Removes the guacamole container and sql container if they already exist
+    reconcile.write_file(directories[settings.DIRECTORY_GUACAMOLE] + '/guacamole.properties',
+                         guac_properties(mysql_user_password), 0o600)
+
+
+# Returns the plan of the memory of the containers for this raspberry pi
+def compute_memory_plan():
+    return memory_budget.compute_budget(memory_budget.read_meminfo()['MemTotal'] // 1024, memory_budget.read_model(),
+                                        os.cpu_count() or 1, settings.MAX_RDP_SESSIONS,
+                                        {memory_budget.ROLE_GUACAMOLE: [settings.GUACAMOLE_CONTAINER_NAME],
+                                         memory_budget.ROLE_GUACD: settings.guacd_container_names(),
+                                         memory_budget.ROLE_MYSQL: [settings.SQL_CONTAINER_NAME]},
+                                        settings.ZRAM_SWAP)
+
+
+# Writes the memory plan and the files applying it to the generated files, where the status email finds the plan
+def apply_memory_plan(directories, plan):
+    memory_budget.write_files(directories[settings.DIRECTORY_GENERATED_FILES], plan)
+    print(memory_budget.describe(plan))
+
+    if plan['over_budget_mb']:
+        print('[WARNING] The containers may need {} MB more memory than this raspberry pi can spare. '
+              'Lower MAX_RDP_SESSIONS in settings.py.'.format(plan['over_budget_mb']))
+    if plan['zram_mb']:
+        print('[INFO] The zram swap is enabled on boot, or right away with: sudo sh {}/{}'.format(
+            os.path.realpath(directories[settings.DIRECTORY_GENERATED_FILES]), memory_budget.ZRAM_SCRIPT_FILE_NAME))
+
+
+# Returns the guacd pool serving the connections
+def guacd_pool():
+    return db_provision.GuacdPool(settings.GUACD_CONTAINER_NAME + '_', settings.guacd_container_names())
+
+
+# Removes the guacamole container, the guacd containers and sql container if they already exist
 def remove_containers():
     # Remove all running/stopped containers
-    sql_container_id = subprocess.check_output(["docker", "ps", "--all", "--quiet",
-                                                "--filter", "name=" + settings.SQL_CONTAINER_NAME]).strip()
-    guacamole_container_id = subprocess.check_output(["docker", "ps", "--all", "--quiet",
-                                                      "--filter", "name=" + settings.GUACAMOLE_CONTAINER_NAME]).strip()
+    sql_container = docker.inspect_container(settings.SQL_CONTAINER_NAME)
+    guacamole_container = docker.inspect_container(settings.GUACAMOLE_CONTAINER_NAME)
 
-    if len(sql_container_id) > 0:
+    if sql_container is not None:
         print("Removing the SQL container of the name {}".format(settings.SQL_CONTAINER_NAME))
-        subprocess.check_output(["docker", "rm", "-f", sql_container_id])
+        docker.remove_container(sql_container['Id'], force=True)
 
-    if len(guacamole_container_id) > 0:
+    if guacamole_container is not None:
         print("Removing the Guacamole container of the name {}".format(settings.GUACAMOLE_CONTAINER_NAME))
-        subprocess.check_output(["docker", "rm", "-f", guacamole_container_id])
+        docker.remove_container(guacamole_container['Id'], force=True)
 
+    # All the guacd containers are removed, including those of a larger pool configured before
+    for container_name in guacd_containers():
+        print("Removing the guacd container of the name {}".format(container_name))
+        docker.remove_container(container_name, force=True)
 
-# Removes the existing SQL image and Guacamole image
-def remove_images():
-    sql_image_id = subprocess.check_output(["docker", "images", "--quiet", settings.SQL_IMAGE_NAME]).strip()
-    guacamole_image_id = subprocess.check_output(["docker", "images", "--quiet", settings.GUACAMOLE_IMAGE_NAME]).strip()
 
-    if len(sql_image_id) > 0:
+# Returns the names of the existing guacd containers
+def guacd_containers():
+    containers = docker.containers(filters={'name': [settings.GUACD_CONTAINER_NAME + '_']})
+    return sorted(name for name in (container['Names'][0].lstrip('/') for container in containers)
+                  if name.startswith(settings.GUACD_CONTAINER_NAME + '_'))
+
+
+# Removes the existing SQL image, Guacamole image and guacd image
+def remove_images():
+    if docker.inspect_image(settings.SQL_IMAGE_NAME) is not None:
         print("Removing the SQL Image of the name {}".format(settings.SQL_IMAGE_NAME))
-        subprocess.check_output(["docker", "rmi", settings.SQL_IMAGE_NAME])
+        docker.remove_image(settings.SQL_IMAGE_NAME)
 
-    if len(guacamole_image_id) > 0:
+    if docker.inspect_image(settings.GUACAMOLE_IMAGE_NAME) is not None:
         print("Removing the Guacamole image of the name {}".format(settings.GUACAMOLE_IMAGE_NAME))
-        subprocess.check_output(["docker", "rmi", settings.GUACAMOLE_IMAGE_NAME])
+        docker.remove_image(settings.GUACAMOLE_IMAGE_NAME)
 
+    if docker.inspect_image(settings.GUACD_IMAGE_NAME) is not None:
+        print("Removing the guacd image of the name {}".format(settings.GUACD_IMAGE_NAME))
+        docker.remove_image(settings.GUACD_IMAGE_NAME)
 
-# Builds the sql image
-def build_sql_image(directories):
-    print("Building the SQL image...")
-    subprocess.call(["docker", "build", '--build-arg', 'GUACAMOLE_VERSION={}'.format(settings.GUACAMOLE_VERSION),
-                     "-t", settings.SQL_IMAGE_NAME, directories[settings.DIRECTORY_DATABASE] + '/.'])
-    print("SQL image successfully built!")
+
+# Builds an image unless an image built from the same context and build arguments already exists.
+# The fingerprint of the inputs is kept as a label on the image. force rebuilds the image regardless.
+def build_image(context_directory, tag, build_args, output_prefix, force):
+    fingerprint = build_cache.context_fingerprint(context_directory, build_args)
+    old_image = docker.inspect_image(tag)
+
+    if not force and build_cache.image_fingerprint(docker, tag) == fingerprint:
+        print("The image {} is up to date, skipping the build".format(tag))
+        return False
+
+    docker.build(context_directory, tag, build_args, labels={build_cache.FINGERPRINT_LABEL: fingerprint},
+                 output_prefix=output_prefix)
+
+    # The previous image lost its tag to the new one. It is removed to free the space on the SD card once
+    # its container is recreated.
+    if old_image is not None and old_image['Id'] != docker.inspect_image(tag)['Id']:
+        replaced_images.append((tag, old_image['Id']))
+
+    return True
+
+
+# Removes the images replaced by rebuilt images
+def remove_replaced_images():
+    for tag, image_id in replaced_images:
+        try:
+            docker.remove_image(image_id)
+        except DockerError as error:
+            print("[WARNING] Unable to remove the previous {} image. {}".format(tag, error.message))
+
+
+# Builds the image of a build context with the cached artifacts it needs copied into the context.
+# The artifacts are staged before the fingerprint is taken, so a changed artifact rebuilds the image.
+def build_staged_image(directories, context, tag, build_args, output_prefix, force):
+    try:
+        staged = artifact_cache.stage(directories, context)
+    except artifact_cache.ArtifactError as error:
+        raise StepError(str(error))
+
+    try:
+        return build_image(directories[context], tag, build_args, output_prefix, force)
+    finally:
+        artifact_cache.unstage(staged)
+
+
+# Returns the images of the setup
+def image_builds():
+    return [
+        ImageBuild('sql', settings.DIRECTORY_DATABASE, settings.SQL_IMAGE_NAME,
+                   {'GUACAMOLE_VERSION': settings.GUACAMOLE_VERSION}),
+        ImageBuild('guacamole', settings.DIRECTORY_GUACAMOLE, settings.GUACAMOLE_IMAGE_NAME,
+                   {'GUACAMOLE_VERSION': settings.GUACAMOLE_VERSION,
+                    'MYSQL_CONNECTOR_VERSION': settings.MYSQL_CONNECTOR_VERSION}),
+        ImageBuild('guacd', settings.DIRECTORY_GUACD, settings.GUACD_IMAGE_NAME,
+                   {'GUACAMOLE_VERSION': settings.GUACAMOLE_VERSION}),
+    ]
+
+
+# Builds an image of the setup
+def build_context_image(directories, image_build, force):
+    print("Building the {} image".format(image_build.name))
+    if build_staged_image(directories, image_build.context, image_build.tag, image_build.build_args,
+                          '[{} image] '.format(image_build.name), force):
+        print("{} image successfully built".format(image_build.name))
+
+
+# Returns the change of an image. overrides are the files about to be generated in its build context, as in
+# build_cache.context_fingerprint.
+def image_change(directories, image_build, overrides, force):
+    if force:
+        return reconcile.Change('image', image_build.tag, reconcile.ACTION_BUILD, 'forced')
+
+    # The artifacts are fingerprinted where they are cached, so a plan writes nothing to the build context
+    try:
+        staged_files = artifact_cache.staged_files(directories, image_build.context)
+    except artifact_cache.ArtifactError:
+        return reconcile.Change('image', image_build.tag, reconcile.ACTION_BUILD, 'artifacts not downloaded yet')
+    fingerprint = build_cache.context_fingerprint(directories[image_build.context], image_build.build_args,
+                                                  overrides, staged_files)
+
+    if docker.inspect_image(image_build.tag) is None:
+        return reconcile.Change('image', image_build.tag, reconcile.ACTION_BUILD, 'missing')
+    if build_cache.image_fingerprint(docker, image_build.tag) != fingerprint:
+        return reconcile.Change('image', image_build.tag, reconcile.ACTION_BUILD, 'build inputs changed')
+    return reconcile.Change('image', image_build.tag, reconcile.ACTION_KEEP, 'up to date')
 
 
 # Create a custom network for our containers
 def create_docker_network():
-    docker_network_name = 'guacamole_network'
-    network_id = subprocess.check_output(['docker', 'network', 'ls', '--filter',
-                                          'name={}'.format(docker_network_name), '-q']
-                                         ).strip()
-
-    if len(network_id) == 0:
+    docker_network_name = DOCKER_NETWORK_NAME
+    if docker.inspect_network(docker_network_name) is None:
         print('Creating a new docker network {} for our containers'.format(docker_network_name))
-        subprocess.check_output(['docker', 'network', 'create', '--driver', 'bridge', docker_network_name])
+        docker.create_network(docker_network_name, driver='bridge')
     else:
         print("Containers will be created on the docker network {}".format(docker_network_name))
 
     return docker_network_name
 
 
-# Returns a list of ip addresses connected to the raspberry pi with rdp enabled.
-# If none detected, returns empty list
-def fetch_equipment_ip():
-    print('Fetching equipment IP address')
-
-    # Using a list of ip address for a future case where single raspberry pi is connected to
-    # multiple rdp enabled devices. Obviously return the entire list insted of list[0] for
-    # such a case.
-    ip_address_list = []
-
+# Returns the mac address of every ip address with an active lease, the newest lease of every mac address only
+def fetch_leases():
+    lease_file = dhcp_leases.LeaseFile()
     try:
-        with open('/var/lib/dhcp/dhcpd.leases', 'r') as file_object:
-            dhcpd_leases = file_object.read().strip()
-    except FileNotFoundError as error:
+        lease_file.refresh()
+    except FileNotFoundError:
         print("[Error] dhcp lease file {} not created yet. No leases issued yet! "
-              "\nCheck if dhcpd and if equipment connected")
-        return ip_address_list
-
-    # Fetch list of ip addresses from dhcp lease
-    for line in dhcpd_leases.split('\n'):
-        if 'lease ' in line and ' {' in line:
-            ip_lease_address = line[line.find('lease ') + 6: line.find(' {')]
-            if ip_lease_address not in ip_address_list:
-                ip_address_list.append(ip_lease_address)
+              "\nCheck if dhcpd and if equipment connected".format(lease_file.path))
+        return {}
 
-    if not ip_address_list:
-        print("[ERROR] No lease Issued by dhcpd."
-              "\nCheck dhcpd  and if the equipment is connected")
-        return ip_address_list
+    return {ip_address: lease.mac_address for ip_address, lease in lease_file.active_by_ip().items()}
 
-    # Port scan dhcp addresses present in the dhcpd lease file for RDP device
-    nmap_call_arguments = ['nmap', '-Pn'] + ip_address_list + ['-p', '3389', '--open']
-    nmap_output = subprocess.check_output(nmap_call_arguments).decode("utf-8").strip()
 
-    # Ip address list of RDP enabled devices
-    rdp_enabled_devices = None
-    if '3389/tcp open  ms-wbt-server' not in nmap_output:
-        print("[ERROR] RDP enabled device not connected to raspberry pi.")
-    else:
-        nmap_second_line = nmap_output.split("\n")[1].strip()
-        rdp_enabled_devices = nmap_second_line.split(' ')[-1:]
+# Returns the list of equipment connected to the raspberry pi with rdp enabled, as (mac address, ip address).
+# If none detected, returns empty list
+def fetch_equipment():
+    print('Fetching equipment IP addresses')
 
-    if not rdp_enabled_devices:
-        print('[ERROR] The device connected to the raspberry pi does not have RDP enabled')
+    leases = fetch_leases()
+    if not leases:
+        print("[ERROR] No lease Issued by dhcpd."
+              "\nCheck dhcpd  and if the equipment is connected")
+        return []
+
+    # All the leased addresses are port scanned for RDP together
+    results = rdp_scan.scan(sorted(leases), [rdp_scan.RDP_PORT] + settings.EQUIPMENT_EXTRA_PORTS)
+
+    equipment = []
+    for result in results:
+        if not result.open:
+            continue
+        print('{} port {} is open, connected in {:.1f} ms'.format(result.ip_address, result.port,
+                                                                  result.latency * 1000))
+        if result.port == rdp_scan.RDP_PORT:
+            equipment.append(Equipment(leases[result.ip_address], result.ip_address))
+
+    if not equipment:
+        print('[ERROR] The devices connected to the raspberry pi do not have RDP enabled')
     else:
-        print('Successful extraction of equipment ip address')
+        print('Successful extraction of {} equipment ip addresses'.format(len(equipment)))
 
-    return rdp_enabled_devices
+    return equipment
 
 
-# Builds the sql container from the sql image
-def build_sql_container(docker_network_name, mysql_root_password, mysql_user_password, administrator, new_database):
+# Bounded and compressed json-file log rotation for the containers
+def container_log_config():
+    return {
+        'Type': 'json-file',
+        'Config': {
+            'max-size': settings.DOCKER_LOG_MAX_SIZE,
+            'max-file': settings.DOCKER_LOG_MAX_FILE,
+            'compress': 'true'
+        }
+    }
 
-    ip_address_list = fetch_equipment_ip()
 
-    ip_address = "192.168.7.2"
+# Finds the equipment connected to the raspberry pi. Asks the user whether to continue if none is found,
+# which is why it runs before the parallel build steps. Returns an empty list if the user continues.
+def select_equipment():
+    equipment = fetch_equipment()
 
-    if ip_address_list:
-        # Assuming only one device connected to our raspberry pi for now
-        # In future loop through this list and setup multiple equipments connected
-        # to the raspberry pi.
-        ip_address = ip_address_list[0]
+    if equipment:
         user_choice = True
     else:
         user_choice = user_prompt("There were no valid ip addresses detected for the equipment connected to "
@@ -236,73 +397,152 @@ def build_sql_container(docker_network_name, mysql_root_password, mysql_user_pas
     if not user_choice:
         sys.exit()
 
-    print('Configuring the ip address {} for the equipment'.format(ip_address))
-
-    if new_database:
-        print('Creating docker volume {} for mysql'.format(DOCKER_MYSQL_VOLUME))
-        subprocess.check_output(['docker', 'volume', 'create', DOCKER_MYSQL_VOLUME])
+    for mac_address, ip_address in equipment:
+        print('Configuring the ip address {} for the equipment {}'.format(ip_address, mac_address or ''))
+    return equipment
+
+
+# Returns the desired state of the sql container. The root password is only passed to a new database.
+def sql_container_spec(directories, memory_plan, mysql_root_password, new_database):
+    # The buffers of mysql are sized by the option file of the memory budget
+    mysql_config_file = os.path.realpath(os.path.join(directories[settings.DIRECTORY_GENERATED_FILES],
+                                                      memory_budget.MYSQL_CONFIG_FILE_NAME))
+    options = {
+        'network': DOCKER_NETWORK_NAME,
+        'binds': ['{}:/var/lib/mysql'.format(DOCKER_MYSQL_VOLUME),
+                  '{}:{}:ro'.format(mysql_config_file, memory_budget.MYSQL_CONFIG_PATH)],
+        'log_config': container_log_config(),
+        'memory_mb': memory_budget.container_budget(memory_plan, settings.SQL_CONTAINER_NAME)['limit_mb'],
+    }
+    initial_environment = {'MYSQL_ROOT_PASSWORD': mysql_root_password} if new_database else {}
+    return reconcile.ContainerSpec(settings.SQL_CONTAINER_NAME, settings.SQL_IMAGE_NAME, options,
+                                   initial_environment,
+                                   {mysql_config_file: memory_budget.mysql_config(memory_plan).encode('utf-8')})
+
+
+# Returns the desired state of the guacd containers. They are only reachable on the docker network.
+def guacd_container_specs(memory_plan):
+    specs = []
+    for container_name in settings.guacd_container_names():
+        budget = memory_budget.container_budget(memory_plan, container_name)
+        options = {
+            'network': DOCKER_NETWORK_NAME,
+            'binds': ['{}:/home/virtual_drive'.format(DOCKER_GUACD_DRIVE_VOLUME)],
+            'log_config': container_log_config(),
+            'memory_mb': budget['limit_mb'],
+            'cpuset': budget['cpuset'],
+        }
+        specs.append(reconcile.ContainerSpec(container_name, settings.GUACD_IMAGE_NAME, options, {}, {}))
+    return specs
+
+
+# Returns the desired state of the guacamole container
+def guacamole_container_spec(memory_plan):
+    budget = memory_budget.container_budget(memory_plan, settings.GUACAMOLE_CONTAINER_NAME)
+    options = {
+        'network': DOCKER_NETWORK_NAME,
+        'environment': {'CATALINA_OPTS': budget['java_options']},
+        'ports': {'8080/tcp': ('127.0.0.1', 8080)},
+        'tty': True,
+        'log_config': container_log_config(),
+        'memory_mb': budget['limit_mb'],
+        'cpu_shares': budget['cpu_shares'],
+    }
+    return reconcile.ContainerSpec(settings.GUACAMOLE_CONTAINER_NAME, settings.GUACAMOLE_IMAGE_NAME, options, {}, {})
+
+
+# This method brings a container to its spec, once its image is built. A running container which is up to
+# date is left alone. reason forces the container to be recreated. Returns the change applied.
+def ensure_container(spec, reason=None):
+    change = reconcile.container_change(docker, spec, docker.inspect_image(spec.image)['Id'], reason)
+    if change.action == reconcile.ACTION_KEEP:
+        print("The container {} is up to date".format(spec.name))
+    else:
+        print("The container {} is {}: {}".format(spec.name, {reconcile.ACTION_CREATE: 'created',
+                                                            reconcile.ACTION_RECREATE: 'recreated',
+                                                            reconcile.ACTION_START: 'started'}[change.action],
+                                                   change.reason))
+        reconcile.apply_container_change(docker, spec, change)
+    return change
 
-    print("Creating the SQL container")
-    call_arguments = ["docker", "run", "--network={}".format(docker_network_name),
-                      "--name", settings.SQL_CONTAINER_NAME,
-                      "-v", "{}:/var/lib/mysql".format(DOCKER_MYSQL_VOLUME)
-                      ]
 
-    # Need to send MYSQL Root Password if container created for the first time.
+# Builds the sql container from the sql image
+def build_sql_container(spec, mysql_root_password, mysql_user_password, administrator, new_database, equipment):
     if new_database:
-        call_arguments = call_arguments + ["-e", "MYSQL_ROOT_PASSWORD={}".format(mysql_root_password)]
-
-    call_arguments = call_arguments + ["-d", settings.SQL_IMAGE_NAME]
+        print('Creating docker volume {} for mysql'.format(DOCKER_MYSQL_VOLUME))
+        docker.create_volume(DOCKER_MYSQL_VOLUME)
 
-    subprocess.call(call_arguments)
+    ensure_container(spec, 'new database' if new_database else None)
 
-    print("Waiting for 30 seconds to setup SQL container with Guacamole Scripts")
-    sleep(30)
+    print("Waiting for the SQL container to accept connections")
+    try:
+        waited = wait_for_mysql(docker, settings.SQL_CONTAINER_NAME)
+    except MysqlNotReady as error:
+        raise StepError(str(error))
+    print("The SQL container was ready after {:.1f} seconds".format(waited))
 
-    # Need to update ip address of equipment to be sure
+    # Need to update ip address of equipment to be sure. Without equipment found the connections are kept,
+    # only their guacd containers are updated.
     if not new_database:
-        print("Updating IP address of the equipment")
-        subprocess.call(["docker", "exec", "-it", settings.SQL_CONTAINER_NAME, "bash",
-                         "/docker-entrypoint-initdb.d/ip_update.sh", mysql_user_password, ip_address])
-        print("SQL Container successfully created!")
+        print("Updating IP addresses of the equipment" if equipment else "Updating the guacd of the connections")
+        try:
+            db_provision.update_equipment(docker, settings.SQL_CONTAINER_NAME, mysql_user_password, equipment,
+                                          guacd_pool())
+        except db_provision.ProvisionError as error:
+            raise StepError(str(error))
+        print("SQL Container is ready!")
         return
 
-    # Run the initialization scripts for the database
-    subprocess.call(["docker", "exec", "-it", settings.SQL_CONTAINER_NAME, "bash",
-                     "/docker-entrypoint-initdb.d/db_init_scripts.sh",
-                     mysql_root_password, mysql_user_password, administrator, ip_address])
+    # A connection to the default address is created when no equipment was found
+    equipment = equipment or [Equipment(None, DEFAULT_EQUIPMENT_IP)]
+
+    print("Initializing the database")
+    try:
+        db_provision.provision_database(docker, settings.SQL_CONTAINER_NAME, mysql_root_password,
+                                        mysql_user_password, administrator, equipment, guacd_pool())
+    except (db_provision.ProvisionError, DockerError) as error:
+        # A partly initialized database is never kept, the next run of the setup starts from scratch
+        remove_sql_database()
+        raise StepError('{}. The database was removed, re-run the setup.'.format(error))
     print("SQL Container successfully created!")
 
 
-# Builds the guacamole image
-def build_guacamole_image(directories):
-    print("Building the Guacamole Image")
-    subprocess.call(["docker", "build", '--build-arg', 'GUACAMOLE_VERSION=' + settings.GUACAMOLE_VERSION,
-                     '--build-arg', 'MYSQL_CONNECTOR_VERSION=' + settings.MYSQL_CONNECTOR_VERSION,
-                     "-t", settings.GUACAMOLE_IMAGE_NAME,
-                     directories[settings.DIRECTORY_GUACAMOLE] + '/.'])
-    print("Guacamole image successfully built")
+# Removes the sql container and its database volume
+def remove_sql_database():
+    try:
+        docker.remove_container(settings.SQL_CONTAINER_NAME, force=True)
+        docker.remove_volume(DOCKER_MYSQL_VOLUME)
+    except DockerError as error:
+        print("[WARNING] Unable to remove the SQL container and its volume. {}".format(error.message))
 
 
-# Builds the guacamole container from the guacamole image
-def build_guacamole_container(docker_network_name):
-    print("Creating the Guacamole Container and linking to the SQL container")
-    subprocess.call(["docker", "run", "--network={}".format(docker_network_name),
-                     "--name", settings.GUACAMOLE_CONTAINER_NAME,
-                     "-p", "127.0.0.1:8080:8080",
-                     "-d", "-t", settings.GUACAMOLE_IMAGE_NAME])
+# Builds the guacd containers from the guacd image, and removes the containers of a larger pool configured
+# before
+def build_guacd_containers(specs):
+    if DOCKER_GUACD_DRIVE_VOLUME not in docker.volumes():
+        print('Creating docker volume {} for the rdp drive'.format(DOCKER_GUACD_DRIVE_VOLUME))
+        docker.create_volume(DOCKER_GUACD_DRIVE_VOLUME)
 
-    print("Guacamole container successfully created and linked to SQL Container")
+    for spec in specs:
+        ensure_container(spec)
 
+    for container_name in stale_guacd_containers():
+        print("Removing the guacd container of the name {}".format(container_name))
+        docker.remove_container(container_name, force=True)
 
-# Method checks if the docker volume for mysql exists
-def mysql_volume_exists():
-    existing_volumes = subprocess.check_output(['docker', 'volume', 'ls', '-q']).decode("utf-8")
-    if DOCKER_MYSQL_VOLUME in existing_volumes:
-        print('Mysql will be mounted on the existing docker volume {}'.format(DOCKER_MYSQL_VOLUME))
-        return True
+    print("guacd containers are ready")
+
+
+# Returns the guacd containers which are not part of the pool
+def stale_guacd_containers():
+    return [container_name for container_name in guacd_containers()
+            if container_name not in settings.guacd_container_names()]
 
-    return False
+
+# Builds the guacamole container from the guacamole image
+def build_guacamole_container(spec):
+    ensure_container(spec)
+    print("Guacamole container is ready and linked to the SQL Container")
 
 
 # Checks if previous instances of sql passwords exist
@@ -313,34 +553,166 @@ def sql_passwords_exist(directories):
     return False
 
 
-def new_sql_database(directories, reset_database):
-    if mysql_volume_exists():
-        if sql_passwords_exist(directories) and not reset_database:
-            print('Existing User configuration detected. The administrator provided will be discarded')
-            return False
-        subprocess.check_output(['docker', 'volume', 'rm', DOCKER_MYSQL_VOLUME])
+# Returns whether a new database is created and why. The database is kept unless it is reset or its
+# passwords are missing.
+def database_state(directories, reset_database):
+    if DOCKER_MYSQL_VOLUME not in docker.volumes():
+        return True, 'missing'
+    if reset_database:
+        return True, 'forced'
+    if not sql_passwords_exist(directories):
+        return True, 'passwords missing, the existing data is removed'
+    return False, 'existing'
+
+
+# Removes the existing database before a new one is created
+def reset_sql_database():
+    if DOCKER_MYSQL_VOLUME in docker.volumes():
+        if docker.inspect_container(settings.SQL_CONTAINER_NAME) is not None:
+            docker.remove_container(settings.SQL_CONTAINER_NAME, force=True)
+        docker.remove_volume(DOCKER_MYSQL_VOLUME)
 
-    return True
+
+# Returns the changes which bring the docker objects and the generated files to the desired state, in the
+# order they are applied. mysql_user_password is None for a new database, its password is generated later.
+def plan_changes(directories, force, new_database, database_reason, mysql_user_password, memory_plan, specs,
+                 equipment):
+    changes = []
+    volumes = docker.volumes()
+
+    if new_database:
+        action = reconcile.ACTION_RECREATE if DOCKER_MYSQL_VOLUME in volumes else reconcile.ACTION_CREATE
+        changes.append(reconcile.Change('volume', DOCKER_MYSQL_VOLUME, action, database_reason))
+    else:
+        changes.append(reconcile.Change('volume', DOCKER_MYSQL_VOLUME, reconcile.ACTION_KEEP, 'existing'))
+    changes.append(reconcile.Change('volume', DOCKER_GUACD_DRIVE_VOLUME,
+                                    reconcile.ACTION_KEEP if DOCKER_GUACD_DRIVE_VOLUME in volumes
+                                    else reconcile.ACTION_CREATE, 'existing' if DOCKER_GUACD_DRIVE_VOLUME in volumes
+                                    else 'missing'))
+    network_exists = docker.inspect_network(DOCKER_NETWORK_NAME) is not None
+    changes.append(reconcile.Change('network', DOCKER_NETWORK_NAME,
+                                    reconcile.ACTION_KEEP if network_exists else reconcile.ACTION_CREATE,
+                                    'existing' if network_exists else 'missing'))
+
+    # Generated files
+    properties_file = directories[settings.DIRECTORY_GUACAMOLE] + '/guacamole.properties'
+    if mysql_user_password is None:
+        properties = None
+        changes.append(reconcile.Change('file', os.path.basename(properties_file), reconcile.ACTION_UPDATE,
+                                        'new database password'))
+    else:
+        properties = guac_properties(mysql_user_password)
+        changes.append(reconcile.file_change(properties_file, properties))
+    generated_files = directories[settings.DIRECTORY_GENERATED_FILES]
+    for file_name, content, _ in memory_budget.budget_files(generated_files, memory_plan):
+        changes.append(reconcile.file_change(os.path.join(generated_files, file_name), content))
+
+    # Images, with the guacamole.properties about to be written in the guacamole build context
+    image_changes = {}
+    for image_build in image_builds():
+        if image_build.context != settings.DIRECTORY_GUACAMOLE:
+            change = image_change(directories, image_build, {}, force)
+        elif properties is None:
+            change = reconcile.Change('image', image_build.tag, reconcile.ACTION_BUILD, 'new database password')
+        else:
+            change = image_change(directories, image_build, {'guacamole.properties': properties.encode('utf-8')},
+                                  force)
+        image_changes[image_build.tag] = change
+        changes.append(change)
+
+    # Containers, recreated when their image is rebuilt
+    for spec in specs:
+        rebuilt = image_changes[spec.image].action != reconcile.ACTION_KEEP
+        image = None if rebuilt else docker.inspect_image(spec.image)
+        reason = 'new database' if spec.name == settings.SQL_CONTAINER_NAME and new_database else None
+        changes.append(reconcile.container_change(docker, spec, image['Id'] if image else None, reason))
+    for container_name in stale_guacd_containers():
+        changes.append(reconcile.Change('container', container_name, reconcile.ACTION_REMOVE, 'not in the pool'))
+
+    # The connections are brought up to date on every run, which does not interrupt the sessions
+    if new_database:
+        changes.append(reconcile.Change('database', db_provision.DATABASE_NAME, reconcile.ACTION_CREATE,
+                                        'connections to {} equipment'.format(len(equipment) or 'the default')))
+    else:
+        changes.append(reconcile.Change('database', db_provision.DATABASE_NAME, reconcile.ACTION_REFRESH,
+                                        'connections to {} equipment'.format(len(equipment))))
+    return changes
 
 
 def main():
     directories = settings.fetch_file_directories()
-    create_directory_structure(directories)
     arguments = fetch_argument()
+    create_directory_structure(directories, arguments.plan)
+    # The timeline of a plan is not written, a plan leaves generated_files as it is
+    if not arguments.plan:
+        tracing.start('setup', directories[settings.DIRECTORY_GENERATED_FILES])
+    docker.request_tracer = tracing.request
     administrator = arguments.username
     force = arguments.force
-    run_tests()
-    remove_containers()
-    remove_images()
-    new_database = new_sql_database(directories, force)
-    mysql_root_password, mysql_user_password = generate_passwords(new_database, directories)
-    generate_guac_properties(mysql_user_password, directories)
-    docker_network_name = create_docker_network()
-    build_sql_image(directories)
-    build_sql_container(docker_network_name, mysql_root_password, mysql_user_password, administrator, new_database)
-    build_guacamole_image(directories)
-    build_guacamole_container(docker_network_name)
+
+    # The plan only inspects, the preflight checks download the artifacts
+    if not arguments.plan:
+        with tracing.phase('preflight checks'):
+            run_tests()
+
+    new_database, database_reason = database_state(directories, force)
+    mysql_root_password, mysql_user_password = (None, None) if new_database else generate_passwords(False,
+                                                                                                    directories)
+    memory_plan = compute_memory_plan()
+    with tracing.phase('equipment'):
+        equipment = fetch_equipment() if arguments.plan else select_equipment()
+
+    sql_spec = sql_container_spec(directories, memory_plan, mysql_root_password, new_database)
+    guacd_specs = guacd_container_specs(memory_plan)
+    guacamole_spec = guacamole_container_spec(memory_plan)
+
+    with tracing.phase('plan'):
+        changes = plan_changes(directories, force, new_database, database_reason, mysql_user_password,
+                               memory_plan, [sql_spec] + guacd_specs + [guacamole_spec], equipment)
+    reconcile.print_plan(changes)
+    if arguments.plan:
+        return
+
+    with tracing.phase('generated files'):
+        # Everything is torn down and rebuilt when forced. Otherwise only what changed is replaced.
+        if force:
+            remove_containers()
+            remove_images()
+        if new_database:
+            reset_sql_database()
+            mysql_root_password, mysql_user_password = generate_passwords(True, directories)
+            sql_spec = sql_container_spec(directories, memory_plan, mysql_root_password, new_database)
+        elif administrator:
+            print('Existing User configuration detected. The administrator provided will be discarded')
+
+        generate_guac_properties(mysql_user_password, directories)
+        apply_memory_plan(directories, memory_plan)
+        create_docker_network()
+
+    # The guacd image, which compiles guacamole-server, is built while the other images are built and
+    # the database initialised. Only the guacamole container waits for the sql and guacd containers.
+    # A container is only replaced if it changed, so a re-run without changes keeps the service running.
+    image_steps = [Step('{} image'.format(image_build.name),
+                        lambda image_build=image_build: build_context_image(directories, image_build, force), [])
+                   for image_build in image_builds()]
+    steps = image_steps + [
+        Step('sql container', lambda: build_sql_container(sql_spec, mysql_root_password, mysql_user_password,
+                                                          administrator, new_database, equipment), ['sql image']),
+        Step('guacd containers', lambda: build_guacd_containers(guacd_specs), ['guacd image']),
+        Step('guacamole container', lambda: build_guacamole_container(guacamole_spec),
+             ['guacamole image', 'sql container', 'guacd containers']),
+    ]
+    # Every step is a phase of the timeline
+    results = run_steps([Step(step.name, tracing.traced(step.name, step.function), step.dependencies)
+                         for step in steps])
+    with tracing.phase('remove replaced images'):
+        remove_replaced_images()
     clean_directory_structure(directories)
+    print_results(results)
+
+    if any(result.status != STATUS_OK for result in results):
+        print('[ERROR] The setup did not complete. Fix the errors above and re-run the script.')
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+# Runs the setup steps in parallel while respecting their dependencies.
+# A step starts as soon as all the steps it depends on have finished successfully. A failed step does
+# not stop the independent steps, its dependents are skipped. Every step is timed and the outcome of
+# all the steps is printed as a table at the end.
+
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+
+Step = namedtuple('Step', ['name', 'function', 'dependencies'])
+StepResult = namedtuple('StepResult', ['name', 'status', 'seconds', 'error'])
+
+
+# Raised by a step to report a failure with a message instead of a traceback
+class StepError(Exception):
+    pass
+
+
+def run_step(step):
+    started = time.monotonic()
+    try:
+        step.function()
+    except StepError as error:
+        return StepResult(step.name, STATUS_FAILED, time.monotonic() - started, str(error))
+    except SystemExit:
+        return StepResult(step.name, STATUS_FAILED, time.monotonic() - started, 'exited, see the output above')
+    except Exception as error:
+        traceback.print_exc()
+        return StepResult(step.name, STATUS_FAILED, time.monotonic() - started,
+                          '{}: {}'.format(type(error).__name__, error))
+    return StepResult(step.name, STATUS_OK, time.monotonic() - started, None)
+
+
+# This method runs the steps and returns their results in the order the steps were given
+def run_steps(steps, max_workers=None):
+    steps_by_name = {step.name: step for step in steps}
+    for step in steps:
+        for dependency in step.dependencies:
+            if dependency not in steps_by_name:
+                raise ValueError('The step {} depends on the unknown step {}'.format(step.name, dependency))
+
+    results = {}
+    pending = list(steps)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(steps)) as executor:
+        while pending or running:
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for step in list(pending):
+                    dependency_results = [results.get(dependency) for dependency in step.dependencies]
+                    failed = [result.name for result in dependency_results
+                              if result is not None and result.status != STATUS_OK]
+
+                    if failed:
+                        results[step.name] = StepResult(step.name, STATUS_SKIPPED, 0.0,
+                                                        'depends on {}'.format(', '.join(failed)))
+                    elif all(result is not None for result in dependency_results):
+                        print('[INFO] Starting {}'.format(step.name))
+                        running[executor.submit(run_step, step)] = step
+                    else:
+                        continue
+
+                    pending.remove(step)
+                    scheduled = True
+
+            if not running:
+                if pending:
+                    raise ValueError('The steps {} depend on each other'.format(
+                        ', '.join(step.name for step in pending)))
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                results[result.name] = result
+                del running[future]
+                print('[INFO] Finished {} ({}) in {:.1f} seconds'.format(result.name, result.status, result.seconds))
+
+    return [results[step.name] for step in steps]
+
+
+# Prints the outcome of the steps as a table
+def print_results(results):
+    print('\n{:<24} {:<8} {:>9}  {}'.format('Step', 'Status', 'Seconds', 'Error'))
+    for result in results:
+        print('{:<24} {:<8} {:>9.1f}  {}'.format(result.name, result.status, result.seconds, result.error or ''))
@@ -1,136 +1,239 @@
 #!/usr/bin/env python3
 
+# Preflight checks run before the setup. The checks are independent of each other and run concurrently
+# through preflight.py, each with its own timeout. Every check takes what it talks to (directories,
+# http session, docker client, urls, ports) as arguments so it can be pointed at local stand-ins.
+# requests sessions are not thread safe, so every check using http creates its own.
+
 import os
-import subprocess
+import re
+import socket
 import sys
 
 import requests
 
+import artifact_cache
+import preflight
+import reconcile
 import settings
+from docker_api import DockerClient, DockerError
+from preflight import PreflightError
+
+# A build of the guacamole image needs about a gigabyte for the layers and the compile
+MIN_FREE_DISK_MB = 1024
+DOCKER_ROOT = '/var/lib/docker'
+
+# Port 8080 is published by the guacamole container. The sql container does not publish 3306, so a
+# mysql server on the pi itself is only reported as a warning.
+GUACAMOLE_PORT = 8080
+MYSQL_PORT = 3306
+
+HTTP_TIMEOUT = 10
+HTTP_POOL_SIZE = 8
+DOCKER_TIMEOUT = 5
+
+# Downloading the artifacts on a first run can take minutes on a slow connection
+ARTIFACT_TIMEOUT = 900
+
+
+# Returns a requests session keeping its connections open so the requests of a check to the same host reuse them
+def http_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 # Checks if expected directory structure is present and checks for all the required files
 def check_directories_files(directories):
-    print("Checking if all the required files exist")
-    success = True
-    for _, directory in directories.items():
-        if not os.path.exists(directory):
-            print("Error. The folder " + directory + ' is missing')
-            success = False
-
-    if not os.path.isfile(directories[settings.DIRECTORY_GUACAMOLE] + '/Dockerfile'):
-        print('Error, the setup.sh file is missing from the dock folder')
-        success = False
-
-    if not os.path.isfile(directories[settings.DIRECTORY_DATABASE] + '/Dockerfile'):
-        print('Error, the Dockerfile is missing from the db folder')
-        success = False
-
-    if not os.path.isfile(directories[settings.DIRECTORY_DATABASE] + '/db_init_scripts.sh'):
-        print('Error, the db_init_scripts.sh file is missing from the db folder')
-        success = False
-
-    if not os.path.isfile(directories[settings.DIRECTORY_DATABASE] + '/ip_update.sh'):
-        print('Error, the ip_update.sh file is missing from the db folder')
-        success = False
-
-    if not success:
-        print("Fix the issues and re-run the application")
-        sys.exit()
+    # The artifact cache is created by the artifacts check
+    missing = [directory for name, directory in sorted(directories.items())
+               if name != settings.DIRECTORY_ARTIFACTS and not os.path.exists(directory)]
+
+    required_files = [
+        directories[settings.DIRECTORY_GUACAMOLE] + '/Dockerfile',
+        directories[settings.DIRECTORY_GUACD] + '/Dockerfile',
+        directories[settings.DIRECTORY_DATABASE] + '/Dockerfile',
+    ]
+    missing.extend(file_path for file_path in required_files if not os.path.isfile(file_path))
+
+    if missing:
+        raise PreflightError('missing {}'.format(', '.join(missing)))
+
+    return 'all required files are present'
+
 
-    print("[Success] All required files are present")
+# Checks the values in the settings.py file
+def check_settings():
+    if not len(settings.DOMAIN_NAME):
+        raise PreflightError('valid DOMAIN_NAME missing from settings.py')
 
+    if not settings.GUACAMOLE_VERSION or not settings.MYSQL_CONNECTOR_VERSION:
+        raise PreflightError('GUACAMOLE_VERSION and MYSQL_CONNECTOR_VERSION must be set in settings.py')
 
-def url_exists(url):
+    if not isinstance(settings.GUACD_INSTANCES, int) or settings.GUACD_INSTANCES < 1:
+        raise PreflightError('GUACD_INSTANCES in settings.py must be a number not less than 1')
 
+    if not isinstance(settings.MAX_RDP_SESSIONS, int) or settings.MAX_RDP_SESSIONS < 1:
+        raise PreflightError('MAX_RDP_SESSIONS in settings.py must be a number not less than 1')
+
+    invalid_pins = [name for name, digest in settings.ARTIFACT_SHA256.items()
+                    if not re.match(r'^[0-9a-fA-F]{64}$', digest)]
+    if invalid_pins:
+        raise PreflightError('ARTIFACT_SHA256 in settings.py has invalid hashes for {}'.format(
+            ', '.join(sorted(invalid_pins))))
+
+    return 'domain {}'.format(settings.DOMAIN_NAME)
+
+
+# Checks that every download url answers, so a mirror gone missing is noticed before the cache needs it
+def check_links(session, urls):
+    failures = []
+    for url in urls:
+        try:
+            response = session.head(url, timeout=HTTP_TIMEOUT, allow_redirects=True)
+            if response.status_code != 200:
+                failures.append('{} returned {}'.format(url, response.status_code))
+        except requests.RequestException as error:
+            failures.append('{}: {}'.format(url, type(error).__name__))
+
+    if failures:
+        raise PreflightError('; '.join(failures))
+
+    return '{} links are valid'.format(len(urls))
+
+
+# Returns the download urls of all the artifacts
+def artifact_urls():
+    return [url for artifact in artifact_cache.artifacts() for url in artifact.urls]
+
+
+# Checks the download links of the artifacts. Once every artifact is cached and verified the builds do not
+# need the mirrors, so they are not contacted.
+def check_artifact_links(directories, session, urls):
     try:
-        response_code = requests.head(url).status_code
-    except requests.ConnectionError:
-        print("[Error] There were connection problems.")
-        return False
-    except requests.HTTPError:
-        print("[Error] Http Error.")
-        return False
-    except requests.Timeout:
-        print("[Error] Timeout Occurred.")
-        return False
-    except requests.TooManyRedirects:
-        print("[Error] Too many redirects")
-        return False
-    except requests.RequestException:
-        print("[Error] Generic exception")
-        return False
-
-    if response_code is 200:
-        return True
-
-    return False
-
-
-# This function is used to check if all the links specified in the Dockerfile(s) are valid.
-def check_dockerfile_links():
-    success = True
-    # Following links are present in the guacamole Dockerfile
-    # The guacamole_jdbc link exists in both guacamole Dockerfile and database Dockerfile
-
-    guacamole_server = (
-        'http://apache.mirrors.tds.net/guacamole/{}' 
-        '/source/guacamole-server-{}' 
-        '.tar.gz'
-    ).format(settings.GUACAMOLE_VERSION, settings.GUACAMOLE_VERSION)
-
-    guacamole_client = (
-        'http://apache.mirrors.tds.net/guacamole/{}'
-        '/binary/guacamole-{}.war'
-    ).format(settings.GUACAMOLE_VERSION, settings.GUACAMOLE_VERSION)
-
-    mysql_connector = (
-        'https://cdn.mysql.com//Downloads/Connector-J/mysql-connector-java-{}.tar.gz'
-    ).format(settings.MYSQL_CONNECTOR_VERSION)
-
-    guacamole_jdbc = (
-        'http://apache.mirrors.lucidnetworks.net/guacamole/{}'
-        '/binary/guacamole-auth-jdbc-{}.tar.gz'
-    ).format(settings.GUACAMOLE_VERSION, settings.GUACAMOLE_VERSION)
-
-    if not url_exists(guacamole_server):
-        success = False
-        print('[Error] The link {} specified in the Guacamole Dockerfile is invalid.'.format(guacamole_server))
-
-    if not url_exists(guacamole_client):
-        success = False
-        print('[Error] The link {} specified in the Guacamole Dockerfile is invalid.'.format(guacamole_client))
-
-
-    if not url_exists(mysql_connector):
-        success = False
-        print('[Error] The link {} specified in the Guacamole Dockerfile is invalid.'.format(mysql_connector))
-
-    if not url_exists(guacamole_jdbc):
-        success = False
-        print('[Error] The link {} specified in the Guacamole Dockerfile and in the Database Dockerfile are invalid.'
-              .format(guacamole_jdbc))
-
-    if not success:
-        print('Fix the above errors and re-run the application')
-        sys.exit()
-    else:
-        print('[Success] All links specified in the Dockerfiles are valid')
+        if artifact_cache.cache_verified(directories):
+            return 'skipped, every artifact is cached and verified'
+    except artifact_cache.ArtifactError:
+        pass
 
+    return check_links(session, urls)
 
-# Checks if valid domain name entered in settings.py file
-def check_domain_name(domain_name):
-    if not len(domain_name):
-        print('[ERROR] Valid DOMAIN_NAME missing from settings.py file'
-              '\nModify the value and re-run the script')
-        sys.exit()
+
+# This function fetches the files installed by the Dockerfiles into the local artifact cache and verifies
+# their SHA-256. Files already in the cache are only verified, so this check does not need the network
+# once the cache is complete.
+def check_artifact_cache(directories, session):
+    try:
+        results = artifact_cache.ensure_artifacts(directories, session)
+    except artifact_cache.ArtifactError as error:
+        raise PreflightError(str(error))
+
+    downloaded = [name for name, description in results if description.startswith('downloaded')]
+    for name, description in results:
+        if name in downloaded:
+            print('[INFO] {} : {}'.format(name, description))
+
+    return '{} files verified, {} downloaded'.format(len(results), len(downloaded))
+
+
+# Checks the free space of the filesystems holding the setup files and the docker images
+def check_disk_space(paths, min_free_mb=MIN_FREE_DISK_MB):
+    details = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        status = os.statvfs(path)
+        free_mb = status.f_bavail * status.f_frsize // (1024 * 1024)
+        if free_mb < min_free_mb:
+            raise PreflightError('only {} MB free on {}, at least {} MB are needed'.format(
+                free_mb, path, min_free_mb))
+        details.append('{} MB free on {}'.format(free_mb, path))
+
+    return ', '.join(details)
+
+
+# Checks that the docker daemon answers
+def check_docker(docker):
+    try:
+        if not docker.ping():
+            raise PreflightError('the docker daemon did not answer the ping')
+    except (OSError, DockerError) as error:
+        raise PreflightError('the docker daemon is not reachable at {}. {}'.format(docker.socket_path, error))
+
+    return 'the docker daemon is running'
+
+
+# Returns the running container publishing the port, or None
+def port_owner(docker, port):
+    try:
+        containers = docker.containers(all_containers=False)
+    except (OSError, DockerError):
+        return None
+
+    for container in containers:
+        if any(container_port.get('PublicPort') == port for container_port in container.get('Ports') or []):
+            return container
+    return None
+
+
+# Returns whether the container was created by the setup. Containers of setups older than the spec label
+# are recognised by their name.
+def managed_container(container):
+    return reconcile.SPEC_LABEL in (container.get('Labels') or {}) or \
+        container['Names'][0].lstrip('/') in (settings.GUACAMOLE_CONTAINER_NAME, settings.SQL_CONTAINER_NAME)
+
+
+# Checks that nothing listens on the port. A port held by a container of the setup passes, the setup keeps
+# that container when it is unchanged and recreates it otherwise.
+def check_port_free(port, docker):
+    test_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    test_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        test_socket.bind(('', port))
+    except OSError:
+        owner = port_owner(docker, port)
+        if owner is not None and managed_container(owner):
+            return 'used by {}, a container of the setup'.format(owner['Names'][0].lstrip('/'))
+        raise PreflightError('port {} is in use{}'.format(
+            port, ' by ' + owner['Names'][0].lstrip('/') if owner is not None else ''))
+    finally:
+        test_socket.close()
+
+    return 'port {} is free'.format(port)
+
+
+# Returns the preflight checks of the setup. session_factory returns a new requests session, called by the
+# thread of every check using http.
+def preflight_checks(directories, session_factory, docker):
+    return [
+        preflight.check('files', lambda: check_directories_files(directories)),
+        preflight.check('settings', check_settings),
+        preflight.check('links', lambda: check_artifact_links(directories, session_factory(), artifact_urls()),
+                        timeout=HTTP_TIMEOUT * 3, required=False),
+        preflight.check('artifacts', lambda: check_artifact_cache(directories, session_factory()),
+                        timeout=ARTIFACT_TIMEOUT),
+        preflight.check('disk space', lambda: check_disk_space([directories[settings.DIRECTORY_BASE],
+                                                                DOCKER_ROOT])),
+        preflight.check('docker', lambda: check_docker(docker)),
+        preflight.check('port {}'.format(GUACAMOLE_PORT), lambda: check_port_free(GUACAMOLE_PORT, docker)),
+        preflight.check('port {}'.format(MYSQL_PORT), lambda: check_port_free(MYSQL_PORT, docker), required=False),
+    ]
 
 
 def run_tests():
     directories = settings.fetch_file_directories()
-    check_directories_files(directories)
-    check_domain_name(settings.DOMAIN_NAME)
-    check_dockerfile_links()
+    docker = DockerClient(timeout=DOCKER_TIMEOUT)
+
+    print("Running the preflight checks")
+    results = preflight.run_checks(preflight_checks(directories, http_session, docker))
+    preflight.print_results(results)
+
+    if not preflight.passed(results):
+        print('[Error] Fix the above errors and re-run the application')
+        sys.exit()
+
     print("All tests are complete and were successful")
 
 
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+#######################################################################################################
+#                                                                                                     #
+# Builds the status email on disk instead of in memory. Log files are gzip compressed as they are   #
+# streamed from disk, split into segments that fit the message size budget and written into one or #
+# more MIME messages. The messages are then streamed to the SMTP server line by line, so the memory #
+# used does not depend on the size of the logs.                                                     #
+#                                                                                                     #
+#######################################################################################################
+
+import base64
+import email.utils
+import gzip
+import smtplib
+import uuid
+from email.header import Header
+from email.mime.text import MIMEText
+
+# Default per-message size budget used when email_config.json does not specify one
+DEFAULT_MAX_MESSAGE_SIZE_MB = 10
+
+# Space reserved in every message for the headers, the mail body and the MIME boundaries
+MESSAGE_OVERHEAD = 64 * 1024
+
+# base64 encodes 57 bytes into a line of 76 characters followed by CRLF
+BASE64_LINE_INPUT = 57
+BASE64_LINE_OUTPUT = 78
+
+CHUNK_SIZE = BASE64_LINE_INPUT * 1024
+
+
+# Returns the size of an attachment after base64 encoding
+def encoded_size(file_size):
+    return -(-file_size // BASE64_LINE_INPUT) * BASE64_LINE_OUTPUT
+
+
+# Returns the largest compressed attachment which fits in a single message. Counted in whole base64 lines,
+# since a partial last line takes a full line.
+def segment_limit(max_message_size):
+    return (max_message_size - MESSAGE_OVERHEAD) // BASE64_LINE_OUTPUT * BASE64_LINE_INPUT
+
+
+# This method compresses the log file into gzip segments of at most size_limit bytes.
+# Segments are split on line boundaries and every segment is a complete gzip file.
+# Returns the list of segments in order.
+def compress_attachment(log_file, output_directory, size_limit):
+    segments = []
+    segment_object = None
+    compressed_object = None
+
+    with log_file.open('rb') as file_object:
+        for line in file_object:
+            # The compressor buffers its output, so leave some headroom below the limit
+            if compressed_object is None or segment_object.tell() + len(line) > size_limit - CHUNK_SIZE:
+                if compressed_object is not None:
+                    compressed_object.close()
+                    segment_object.close()
+
+                segment_file = output_directory.joinpath('{}.{}.gz'.format(log_file.name, len(segments) + 1))
+                segments.append(segment_file)
+                segment_object = segment_file.open('wb')
+                compressed_object = gzip.GzipFile(filename=log_file.name, mode='wb', fileobj=segment_object)
+
+            compressed_object.write(line)
+
+    if compressed_object is not None:
+        compressed_object.close()
+        segment_object.close()
+
+    # A log which fits in a single segment keeps its plain name
+    if len(segments) == 1:
+        single_segment = output_directory.joinpath(log_file.name + '.gz')
+        segments[0].replace(single_segment)
+        segments = [single_segment]
+
+    return segments
+
+
+# This method groups the attachments into messages which stay within the size budget.
+# Attachments keep their order. Always returns at least one (possibly empty) group.
+def plan_messages(attachment_files, max_message_size):
+    groups = [[]]
+    group_size = MESSAGE_OVERHEAD
+
+    for attachment_file in attachment_files:
+        attachment_size = encoded_size(attachment_file.stat().st_size)
+
+        if groups[-1] and group_size + attachment_size > max_message_size:
+            groups.append([])
+            group_size = MESSAGE_OVERHEAD
+
+        groups[-1].append(attachment_file)
+        group_size += attachment_size
+
+    return groups
+
+
+# This method writes a MIME message with the body and the gzip attachments to message_file.
+# The attachments are base64 encoded chunk by chunk while they are copied.
+def write_message(message_file, subject, sender_email_id, receiver_email_id, body, attachment_files):
+    boundary = '=' * 15 + uuid.uuid4().hex + '=='
+
+    headers = [
+        'Content-Type: multipart/mixed; boundary="{}"'.format(boundary),
+        'MIME-Version: 1.0',
+        'Subject: {}'.format(Header(subject).encode()),
+        'From: {}'.format(sender_email_id),
+        'To: {}'.format(', '.join(receiver_email_id)),
+        'Date: {}'.format(email.utils.formatdate(localtime=True)),
+        '',
+        'This is the latest device log. Please inspect to check device status',
+    ]
+
+    with message_file.open('wb') as message_object:
+        message_object.write('\r\n'.join(headers).encode('utf-8') + b'\r\n')
+
+        text_part = MIMEText(body)
+        message_object.write('--{}\r\n'.format(boundary).encode('ascii'))
+        message_object.write(text_part.as_bytes().replace(b'\r\n', b'\n').replace(b'\n', b'\r\n') + b'\r\n')
+
+        for attachment_file in attachment_files:
+            part_headers = [
+                '--{}'.format(boundary),
+                'Content-Type: application/gzip',
+                'MIME-Version: 1.0',
+                'Content-Transfer-Encoding: base64',
+                'Content-Disposition: attachment; filename="{}"'.format(attachment_file.name),
+                '',
+                '',
+            ]
+            message_object.write('\r\n'.join(part_headers).encode('utf-8'))
+
+            with attachment_file.open('rb') as attachment_object:
+                while True:
+                    chunk = attachment_object.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    message_object.write(base64.encodebytes(chunk).replace(b'\n', b'\r\n'))
+
+        message_object.write('--{}--\r\n'.format(boundary).encode('ascii'))
+
+
+# This method sends a message written by write_message over an authenticated smtp connection.
+# The message is streamed from disk to the server. Returns the receivers refused by the server.
+def send_message(smtp, sender_email_id, receiver_email_id, message_file):
+    smtp.ehlo_or_helo_if_needed()
+
+    code, response = smtp.mail(sender_email_id)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, response, sender_email_id)
+
+    refused_receivers = {}
+    for receiver in receiver_email_id:
+        code, response = smtp.rcpt(receiver)
+        if code not in (250, 251):
+            refused_receivers[receiver] = (code, response)
+
+    if len(refused_receivers) == len(receiver_email_id):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused(refused_receivers)
+
+    code, response = smtp.docmd('data')
+    if code != 354:
+        raise smtplib.SMTPDataError(code, response)
+
+    buffer = []
+    buffer_size = 0
+    with message_file.open('rb') as message_object:
+        for line in message_object:
+            # Lines starting with a period are escaped and every line ends with CRLF as required by RFC 5321
+            if line.startswith(b'.'):
+                line = b'.' + line
+            if not line.endswith(b'\r\n'):
+                line = line.rstrip(b'\n') + b'\r\n'
+            buffer.append(line)
+            buffer_size += len(line)
+
+            if buffer_size >= CHUNK_SIZE:
+                smtp.send(b''.join(buffer))
+                buffer = []
+                buffer_size = 0
+
+    buffer.append(b'.\r\n')
+    smtp.send(b''.join(buffer))
+
+    code, response = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, response)
+
+    return refused_receivers
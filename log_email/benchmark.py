@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+#######################################################################################################
+#                                                                                                     #
+# Benchmark for the log_email pipeline. Generates synthetic syslog and docker json-file logs of       #
+# the requested sizes (including rotations in the collection window, the older ones gzipped the way   #
+# logrotate does), then times every stage of the status report: collection, digest, compression,      #
+# MIME assembly and the smtp transfer to a stub server. Each stage runs in its own process so its     #
+# peak RSS can be measured. The collected bytes are checked against the generated logs. The results   #
+# are written as json so runs from different commits can be compared. Runs entirely offline.          #
+#                                                                                                     #
+# Example: python3 benchmark.py --sizes 1 16 256 --output results.json                                #
+#                                                                                                     #
+#######################################################################################################
+
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import attachments
+import log_cursor
+import log_digest
+
+DEFAULT_SIZES_MB = [1, 16, 128]
+MEGABYTE = 1024 * 1024
+
+STAGES = ['collect', 'digest', 'compress', 'mime', 'smtp']
+
+# Rotations of the log in the collection window. The collected part ends up in the oldest generation.
+ROTATIONS = 3
+
+SYSLOG_TEMPLATES = [
+    'sshd[{pid}]: Connection closed by {ip} port {port} [preauth]',
+    'sshd[{pid}]: Failed password for invalid user admin from {ip} port {port} ssh2',
+    'dhcpd[{pid}]: DHCPACK on 192.168.7.{octet} to b8:27:eb:{mac} via eth0',
+    'kernel: [{uptime}] iptables denied: IN=eth1 OUT= SRC={ip} DST=10.0.0.2 LEN=60 PROTO=TCP SPT={port} DPT=23',
+    'CRON[{pid}]: (root) CMD (python3 /home/pi/minidmz/log_email/send_status.py)',
+    'dockerd[{pid}]: time="2026-10-18T06:25:{second:02d}.000000000Z" level=info msg="ignoring event"',
+    'systemd[1]: Started Session {pid} of user pi.',
+]
+
+GUACAMOLE_TEMPLATES = [
+    'guacd[{pid}]: INFO:\\tConnection \\"$%08x-1234-4abc-8def-%012x\\" removed.',
+    '{second:02d}:25:01.123 [http-nio-8080-exec-{octet}] INFO  o.a.g.tunnel.TunnelRequestService - User '
+    '\\"admin\\" connected to connection \\"{pid}\\".',
+    'guacd[{pid}]: ERROR:\\tError writing data to socket: Broken pipe',
+]
+
+
+# Obtain command line arguments
+def fetch_arguments():
+    parser = argparse.ArgumentParser(description='Benchmarks the log_email pipeline on synthetic logs')
+
+    parser.add_argument('-s', '--sizes', type=float, nargs='+', default=DEFAULT_SIZES_MB,
+                        help='Sizes of the generated logs in MB (default: {})'.format(
+                            ' '.join(str(size) for size in DEFAULT_SIZES_MB)))
+
+    parser.add_argument('-o', '--output',
+                        help='File the json results are written to. Defaults to benchmark_<time>.json '
+                             'in the current directory')
+
+    parser.add_argument('-w', '--work-directory',
+                        help='Directory for the generated logs. Defaults to a temporary directory')
+
+    parser.add_argument('--seed', type=int, default=1, help='Seed for the synthetic log generator')
+
+    return parser.parse_args()
+
+
+def syslog_line(generator):
+    return 'Oct 18 06:{:02d}:{:02d} raspberrypi {}\n'.format(
+        generator.randrange(60), generator.randrange(60), format_template(generator, SYSLOG_TEMPLATES))
+
+
+def guacamole_line(generator):
+    log = format_template(generator, GUACAMOLE_TEMPLATES)
+    if '%' in log:
+        log = log % (generator.getrandbits(32), generator.getrandbits(48))
+    return '{{"log":"{}\\n","stream":"stdout","time":"2026-10-18T06:25:{:02d}.{:09d}Z"}}\n'.format(
+        log, generator.randrange(60), generator.randrange(10 ** 9))
+
+
+def format_template(generator, templates):
+    return generator.choice(templates).format(
+        pid=generator.randrange(100, 32768), port=generator.randrange(1024, 65536),
+        ip='{}.{}.{}.{}'.format(generator.randrange(1, 224), generator.randrange(256),
+                                generator.randrange(256), generator.randrange(1, 255)),
+        octet=generator.randrange(2, 255), mac=':'.join('{:02x}'.format(generator.randrange(256)) for _ in range(3)),
+        uptime='{}.{:06d}'.format(generator.randrange(10 ** 6), generator.randrange(10 ** 6)),
+        second=generator.randrange(60))
+
+
+# Returns the number of bytes written
+def write_lines(path, line_function, generator, size, mode='w'):
+    written = 0
+    with path.open(mode) as file_object:
+        while written < size:
+            lines = ''.join(line_function(generator) for _ in range(1000))
+            file_object.write(lines)
+            written += len(lines)
+    return written
+
+
+# This method rotates a log the way logrotate does with compress and delaycompress: every compressed
+# generation moves up by one, the previous name.1 is gzipped to name.2.gz and the log becomes name.1
+def rotate_log(log_file):
+    generation = 2
+    while Path('{}.{}.gz'.format(log_file, generation)).exists():
+        generation += 1
+    for older in range(generation - 1, 1, -1):
+        Path('{}.{}.gz'.format(log_file, older)).rename('{}.{}.gz'.format(log_file, older + 1))
+
+    first_generation = Path('{}.1'.format(log_file))
+    if first_generation.exists():
+        with first_generation.open('rb') as source_object, \
+                gzip.open('{}.2.gz'.format(log_file), 'wb') as compressed_object:
+            shutil.copyfileobj(source_object, compressed_object)
+        first_generation.unlink()
+    log_file.rename(first_generation)
+
+
+# This method generates a log whose collection window is about size bytes long and includes ROTATIONS
+# rotations: a small part is collected to create the cursor, then a part of the window is appended
+# before every rotation and the last part is written to the new log. The cursor ends up in the oldest,
+# gzipped generation. Returns the log, the cursors and the number of bytes in the collection window.
+def generate_log(work_path, name, line_function, size, seed):
+    generator = random.Random(seed)
+    log_file = work_path.joinpath(name)
+
+    for path in work_path.glob(name + '*'):
+        if path.is_file():
+            path.unlink()
+
+    write_lines(log_file, line_function, generator, min(64 * 1024, size))
+    cursors = {}
+    log_cursor.collect(name, log_file, None, cursors)
+
+    window = 0
+    part_size = size // (ROTATIONS + 1)
+    for _ in range(ROTATIONS):
+        window += write_lines(log_file, line_function, generator, part_size, mode='a')
+        rotate_log(log_file)
+    window += write_lines(log_file, line_function, generator, size - ROTATIONS * part_size)
+
+    return log_file, cursors, window
+
+
+# Stands in for smtplib.SMTP. Accepts everything and only counts the bytes sent.
+class NullSMTP:
+
+    def __init__(self):
+        self.bytes_sent = 0
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, sender):
+        return 250, b'OK'
+
+    def rcpt(self, receiver):
+        return 250, b'OK'
+
+    def rset(self):
+        return 250, b'OK'
+
+    def docmd(self, command):
+        return 354, b'Go ahead'
+
+    def send(self, data):
+        self.bytes_sent += len(data)
+
+    def getreply(self):
+        return 250, b'OK'
+
+
+# Runs one stage of the pipeline. Returns the number of bytes the stage processed.
+def run_stage(stage, work_path, log_files, cursors):
+    stage_path = work_path.joinpath(stage)
+    stage_path.mkdir()
+    diff_files = [stage_path.joinpath(log_file.name + '_diff.log') for log_file in log_files]
+    max_message_size = attachments.DEFAULT_MAX_MESSAGE_SIZE_MB * MEGABYTE
+
+    if stage == 'collect':
+        return sum(log_cursor.collect(log_file.name, log_file, diff_file, dict(cursors))
+                   for log_file, diff_file in zip(log_files, diff_files))
+
+    if stage == 'digest':
+        processed = 0
+        for log_file in log_files:
+            digest = log_digest.LogDigest(log_file.name)
+            processed += log_cursor.collect(log_file.name, log_file, None, dict(cursors), digest)
+            digest.report()
+        return processed
+
+    # The remaining stages start from the collected diff files
+    for log_file, diff_file in zip(log_files, diff_files):
+        log_cursor.collect(log_file.name, log_file, diff_file, dict(cursors))
+
+    started = time.perf_counter()
+    segments = []
+    for diff_file in diff_files:
+        segments.extend(attachments.compress_attachment(diff_file, stage_path,
+                                                        attachments.segment_limit(max_message_size)))
+    if stage == 'compress':
+        return sum(diff_file.stat().st_size for diff_file in diff_files), started
+
+    started = time.perf_counter()
+    message_files = []
+    for index, group in enumerate(attachments.plan_messages(segments, max_message_size), 1):
+        message_file = stage_path.joinpath('message_{}.eml'.format(index))
+        attachments.write_message(message_file, 'Benchmark (part {})'.format(index), 'pi@localhost',
+                                  ['admin@localhost'], 'Benchmark', group)
+        message_files.append(message_file)
+    if stage == 'mime':
+        return sum(segment.stat().st_size for segment in segments), started
+
+    started = time.perf_counter()
+    smtp = NullSMTP()
+    for message_file in message_files:
+        attachments.send_message(smtp, 'pi@localhost', ['admin@localhost'], message_file)
+    return smtp.bytes_sent, started
+
+
+# Runs in a child process. The child starts with the small memory footprint of the parent,
+# so its peak RSS is a good measure of the memory used by the stage.
+def stage_process(stage, work_path, log_files, cursors, connection):
+    started = time.perf_counter()
+    result = run_stage(stage, work_path, log_files, cursors)
+
+    # Stages which need preparation report when their own work started
+    if isinstance(result, tuple):
+        result, started = result
+
+    connection.send({
+        'seconds': time.perf_counter() - started,
+        'bytes': result,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    })
+    connection.close()
+
+
+def measure_stage(stage, work_path, log_files, cursors):
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=stage_process, args=(stage, work_path, log_files, cursors, sender))
+    process.start()
+    sender.close()
+    result = receiver.recv()
+    process.join()
+    shutil.rmtree(str(work_path.joinpath(stage)))
+    return result
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.realpath(__file__))).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes, work_path, seed):
+    results = []
+
+    for size_mb in sizes:
+        size = int(size_mb * MEGABYTE)
+        print('Generating {} MB of syslog and guacamole logs'.format(size_mb))
+        syslog_file, syslog_cursors, syslog_window = generate_log(work_path, 'syslog', syslog_line, size, seed)
+        guacamole_file, guacamole_cursors, guacamole_window = generate_log(work_path, 'guacamole-json.log',
+                                                                           guacamole_line, size, seed + 1)
+        cursors = dict(syslog_cursors, **guacamole_cursors)
+
+        for stage in STAGES:
+            result = measure_stage(stage, work_path, [syslog_file, guacamole_file], cursors)
+            # Collection reads the plain and the gzipped generations, it must find every generated byte
+            if stage in ('collect', 'digest') and result['bytes'] != syslog_window + guacamole_window:
+                print('[ERROR] The {} stage collected {} bytes of the {} bytes generated after the cursor'.format(
+                    stage, result['bytes'], syslog_window + guacamole_window))
+                sys.exit(1)
+            result.update({
+                'size_mb': size_mb,
+                'stage': stage,
+                'mb_per_second': result['bytes'] / MEGABYTE / result['seconds'] if result['seconds'] else None
+            })
+            results.append(result)
+            print('{:>10} MB  {:<10} {:>9.3f} s  {:>9.1f} MB/s  {:>9} KB peak RSS'.format(
+                size_mb, stage, result['seconds'], result['mb_per_second'] or 0, result['peak_rss_kb']))
+
+    return results
+
+
+def main():
+    arguments = fetch_arguments()
+    output_file = Path(arguments.output or 'benchmark_{}.json'.format(time.strftime('%Y%m%d%H%M%S')))
+
+    if arguments.work_directory:
+        work_path = Path(arguments.work_directory)
+        work_path.mkdir(parents=True, exist_ok=True)
+    else:
+        work_path = Path(tempfile.mkdtemp(prefix='log_email_benchmark_'))
+
+    try:
+        results = run_benchmark(arguments.sizes, work_path, arguments.seed)
+    finally:
+        if not arguments.work_directory:
+            shutil.rmtree(str(work_path))
+
+    with output_file.open('w') as file_object:
+        json.dump({
+            'commit': current_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'results': results
+        }, file_object, indent=4)
+
+    print('Results written to {}'.format(output_file))
+
+
+if __name__ == '__main__':
+    main()
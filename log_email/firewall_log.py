@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#######################################################################################################
+#                                                                                                     #
+# Summarises the packets dropped by the firewall. pi_setup_files/iptables.sh logs them to the kernel  #
+# log with the prefixes "iptables denied: " and "Dropped ICMPv6". The lines are parsed in a single    #
+# streaming pass into counters per source address, destination port and protocol, and into hourly     #
+# buckets. The counters keep at most MAX_KEYS keys each, so a scan from many addresses cannot use     #
+# unbounded memory.                                                                                   #
+#                                                                                                     #
+# Can also be run on its own: python3 firewall_log.py /var/log/kern.log [--json]                      #
+#                                                                                                     #
+#######################################################################################################
+
+import argparse
+import json
+import re
+from collections import OrderedDict
+from pathlib import Path
+
+from log_digest import TopCounter
+
+MAX_KEYS = 1000
+MAX_TIME_BUCKETS = 7 * 24
+DEFAULT_TOP_N = 10
+
+IPTABLES_PREFIX = 'iptables denied: '
+ICMPV6_PREFIX = 'Dropped ICMPv6'
+
+# Selects the complete lines logged by the firewall out of a chunk of the log
+FIREWALL_LINE_PATTERN = re.compile(rb'^.*(?:iptables denied: |Dropped ICMPv6).*$', re.MULTILINE)
+
+# The KEY=value fields written by the LOG target. ICMPv6 lines have no space after the prefix.
+FIELD_PATTERN = re.compile(r'(?:^|\s)([A-Z]+)=(\S*)')
+
+# Syslog timestamp, up to the hour
+HOUR_PATTERN = re.compile(r'^((?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) [ \d]\d \d{2}):')
+
+
+class FirewallLog:
+
+    def __init__(self, capacity=MAX_KEYS):
+        self.packets = 0
+        self.rules = {IPTABLES_PREFIX.rstrip(': '): 0, ICMPV6_PREFIX: 0}
+        self.sources = TopCounter(capacity)
+        self.ports = TopCounter(capacity)
+        self.protocols = TopCounter(capacity)
+        # Hours in the order they appear in the log, syslog timestamps do not sort by name
+        self.hours = OrderedDict()
+
+    # Counts a line of the kernel log. Lines not written by the firewall are ignored.
+    def add(self, line):
+        for prefix in (IPTABLES_PREFIX, ICMPV6_PREFIX):
+            position = line.find(prefix)
+            if position >= 0:
+                break
+        else:
+            return
+
+        fields = dict(FIELD_PATTERN.findall(line[position + len(prefix):]))
+        protocol = fields.get('PROTO', 'unknown')
+
+        self.packets += 1
+        self.rules[prefix.rstrip(': ')] += 1
+        self.sources.add(fields.get('SRC', 'unknown'))
+        self.protocols.add(protocol)
+
+        if 'DPT' in fields:
+            self.ports.add('{}/{}'.format(protocol, fields['DPT']))
+        elif 'TYPE' in fields:
+            self.ports.add('{} type {}'.format(protocol, fields['TYPE']))
+
+        hour = HOUR_PATTERN.match(line)
+        if hour is not None:
+            hour = hour.group(1) + ':00'
+            if hour in self.hours or len(self.hours) < MAX_TIME_BUCKETS:
+                self.hours[hour] = self.hours.get(hour, 0) + 1
+
+    # Adds a chunk of complete lines read from the log. Only the firewall lines are decoded.
+    def feed(self, data):
+        for match in FIREWALL_LINE_PATTERN.finditer(data):
+            self.add(match.group().decode('utf-8', 'replace'))
+
+    # Returns the counters as a dictionary which can be saved as json
+    def summary(self, top_n=DEFAULT_TOP_N):
+        def top(counter):
+            return [{'key': key, 'count': count, 'overestimate': error} for key, count, error in counter.top(top_n)]
+
+        return {
+            'packets': self.packets,
+            'rules': self.rules,
+            'top_sources': top(self.sources),
+            'top_ports': top(self.ports),
+            'protocols': top(self.protocols),
+            'hourly': [{'hour': hour, 'packets': count} for hour, count in self.hours.items()]
+        }
+
+    # Returns the top talkers and the hourly counts as plain text for the mail body
+    def report(self, top_n=DEFAULT_TOP_N):
+        lines = ['Firewall: {} dropped packets logged ({})'.format(
+            self.packets, ', '.join('{} {}'.format(count, rule) for rule, count in sorted(self.rules.items())))]
+
+        if not self.packets:
+            return lines[0] + '\n'
+
+        for title, counter in (('Source', self.sources), ('Port', self.ports), ('Protocol', self.protocols)):
+            lines.append('{:>8}  {}'.format('Packets', title))
+            for key, count, error in counter.top(top_n):
+                lines.append('{:>8}  {}'.format(str(count) if not error else '~{}'.format(count), key))
+
+        lines.append('{:>8}  {}'.format('Packets', 'Hour'))
+        for hour, count in self.hours.items():
+            lines.append('{:>8}  {}'.format(count, hour))
+
+        return '\n'.join(lines) + '\n'
+
+
+# Obtain command line arguments
+def fetch_arguments():
+    parser = argparse.ArgumentParser(description='Summarises the packets dropped by the firewall')
+    parser.add_argument('log_files', nargs='+', help='syslog or kernel log files')
+    parser.add_argument('-n', '--top', type=int, default=DEFAULT_TOP_N, help='Number of top keys listed')
+    parser.add_argument('--json', action='store_true', help='Print the summary as json')
+    return parser.parse_args()
+
+
+def main():
+    arguments = fetch_arguments()
+    firewall_log = FirewallLog()
+
+    for log_file in arguments.log_files:
+        with Path(log_file).open('rb') as file_object:
+            for line in file_object:
+                if b'iptables denied: ' in line or b'Dropped ICMPv6' in line:
+                    firewall_log.add(line.decode('utf-8', 'replace'))
+
+    if arguments.json:
+        print(json.dumps(firewall_log.summary(arguments.top), indent=4))
+    else:
+        print(firewall_log.report(arguments.top))
+
+
+if __name__ == '__main__':
+    main()
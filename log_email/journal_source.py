@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#######################################################################################################
+#                                                                                                     #
+# Incremental log collection from the systemd journal, for images without /var/log/syslog. The        #
+# journal cursor of the last entry sent is remembered and the next run asks journalctl only for       #
+# the entries after it. The entries are filtered by unit on the journal side and streamed as          #
+# syslog style lines into the same diff file and digest as the other logs. Kernel messages belong     #
+# to no unit, they are read by a second query with its own cursor.                                    #
+#                                                                                                     #
+# Journal files copied from another device (or written by systemd-journal-remote) can be read         #
+# instead of the local journal, which is how the collection is tested.                                #
+#                                                                                                     #
+#######################################################################################################
+
+import json
+import subprocess
+import time
+
+import log_cursor
+
+JOURNAL_UNITS = ['docker', 'apache2', 'isc-dhcp-server', 'shibd']
+
+# Journal matches of the kernel messages, which include the packets dropped by the firewall. Unlike -k,
+# the match is not limited to the current boot.
+KERNEL_MATCHES = ['_TRANSPORT=kernel']
+
+# Entries collected on the first run, when there is no cursor yet. Matches the cron frequency.
+FIRST_RUN_SINCE = '-6h'
+
+
+# Builds the journalctl command reading the entries after the cursor. matches are field matches such as
+# KERNEL_MATCHES.
+def journal_command(cursor, units, journal_files, matches=()):
+    command = ['journalctl', '--no-pager', '--output', 'json']
+
+    for journal_file in journal_files or []:
+        command.extend(['--file', str(journal_file)])
+
+    for unit in units:
+        command.extend(['--unit', unit])
+    command.extend(matches)
+
+    if cursor is not None:
+        command.extend(['--after-cursor', cursor])
+    elif not journal_files:
+        command.extend(['--since', FIRST_RUN_SINCE])
+
+    return command
+
+
+# Returns the message of a journal entry as text. Messages which are not valid utf-8 are exported
+# by journalctl as an array of bytes.
+def entry_message(entry):
+    message = entry.get('MESSAGE')
+
+    if isinstance(message, list):
+        return bytes(message).decode('utf-8', 'replace')
+    return message or ''
+
+
+# Formats a journal entry the way rsyslog writes it to /var/log/syslog, so the digest treats it alike
+def syslog_line(entry):
+    timestamp = int(entry.get('__REALTIME_TIMESTAMP', 0)) / 1000000
+    identifier = entry.get('SYSLOG_IDENTIFIER') or entry.get('_COMM') or entry.get('_SYSTEMD_UNIT', 'unknown')
+    process_id = entry.get('_PID')
+
+    return '{} {} {}{}: {}\n'.format(
+        time.strftime('%b %d %H:%M:%S', time.localtime(timestamp)), entry.get('_HOSTNAME', 'localhost'),
+        identifier, '[{}]'.format(process_id) if process_id else '', entry_message(entry).rstrip('\n'))
+
+
+# This method streams the journal entries written since the last run into output_file and the digest.
+# Either of them may be None. The entries are appended to output_file, so several sources can share it.
+# The journal cursor of the source is updated in the cursors dictionary. Returns the number of bytes collected.
+def collect(source_name, output_file, cursors, digest=None, units=JOURNAL_UNITS, journal_files=None, matches=()):
+    cursor = cursors.get(source_name, {}).get('journal_cursor')
+    command = journal_command(cursor, units, journal_files, matches)
+    collected = 0
+
+    try:
+        journal_process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    except OSError as error:
+        print('[ERROR] Unable to run journalctl. {}'.format(error))
+        return 0
+
+    output_object = output_file.open('ab') if output_file is not None else None
+    buffer = []
+    buffer_size = 0
+
+    with journal_process.stdout:
+        for entry_line in journal_process.stdout:
+            try:
+                entry = json.loads(entry_line.decode('utf-8'))
+            except ValueError:
+                continue
+
+            line = syslog_line(entry).encode('utf-8')
+            buffer.append(line)
+            buffer_size += len(line)
+            cursor = entry.get('__CURSOR', cursor)
+
+            if buffer_size >= log_cursor.CHUNK_SIZE:
+                log_cursor.write_lines(b''.join(buffer), output_object, digest)
+                collected += buffer_size
+                buffer = []
+                buffer_size = 0
+
+    log_cursor.write_lines(b''.join(buffer), output_object, digest)
+    collected += buffer_size
+
+    if output_object is not None:
+        output_object.close()
+
+    if journal_process.wait() != 0:
+        print('[WARNING] journalctl exited with code {}'.format(journal_process.returncode))
+
+    if cursor is not None:
+        cursors[source_name] = {'journal_cursor': cursor}
+
+    return collected
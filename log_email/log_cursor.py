@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#######################################################################################################
+#                                                                                                     #
+# Incremental log collection. For every log source we remember the inode, the byte offset up to       #
+# which the log has been sent and a fingerprint of the head of the file. On the next run we seek      #
+# straight to the offset and stream only the appended bytes. Rotation and truncation are detected     #
+# using the inode and the fingerprint. Rotated generations (log.1, log.2.gz, ...) written by          #
+# logrotate or by the docker json-file driver are read in order, gzip segments are decompressed      #
+# while they are streamed.                                                                            #
+#                                                                                                     #
+#######################################################################################################
+
+import gzip
+import hashlib
+import os
+from pathlib import Path
+
+# Number of bytes from the start of the log used to detect a log that was rewritten in place
+FINGERPRINT_SIZE = 1024
+
+CHUNK_SIZE = 64 * 1024
+
+# Most rotated generations of a log which are looked at
+MAX_GENERATIONS = 20
+
+
+def head_fingerprint(file_object, length):
+    file_object.seek(0)
+    return hashlib.sha1(file_object.read(length)).hexdigest()
+
+
+# Returns true if the file still starts with the same bytes it had when the cursor was saved
+def matches_cursor(file_object, cursor):
+    return head_fingerprint(file_object, min(FINGERPRINT_SIZE, cursor['offset'])) == cursor['fingerprint']
+
+
+# Copies the bytes between start and end of the log to the output file and feeds them to the digest.
+# Either of them may be None, and end may be None to copy up to the end of the file. Unless the log is
+# finished (rotated away), copying stops at the last complete line so a line being written by the
+# logger is never split. Returns the offset up to which the log was copied.
+def copy_lines(file_object, start, end, output_object, finished=False, digest=None):
+    file_object.seek(start)
+    position = start
+    pending = b''
+
+    while end is None or position < end:
+        chunk = file_object.read(CHUNK_SIZE if end is None else min(CHUNK_SIZE, end - position))
+        if not chunk:
+            break
+        position += len(chunk)
+
+        data = pending + chunk
+        line_end = data.rfind(b'\n') + 1
+        write_lines(data[:line_end], output_object, digest)
+        pending = data[line_end:]
+
+    if finished:
+        write_lines(pending, output_object, digest)
+        pending = b''
+
+    return position - len(pending)
+
+
+def write_lines(data, output_object, digest):
+    if output_object is not None:
+        output_object.write(data)
+    if digest is not None:
+        digest.feed(data)
+
+
+# Returns the rotated generations of the log, newest first. logrotate renames syslog to syslog.1
+# and compresses older generations to syslog.2.gz. The docker json-file driver with compression
+# enabled names them <id>-json.log.1.gz, <id>-json.log.2.gz and so on.
+def rotated_files(log_file):
+    generations = []
+
+    for generation in range(1, MAX_GENERATIONS + 1):
+        candidate = Path('{}.{}'.format(log_file, generation))
+        compressed_candidate = Path('{}.{}.gz'.format(log_file, generation))
+
+        # A generation being compressed exists under both names for a moment, the plain file is complete
+        if candidate.is_file():
+            generations.append(candidate)
+        elif compressed_candidate.is_file():
+            generations.append(compressed_candidate)
+        else:
+            break
+
+    return generations
+
+
+def open_log(log_file):
+    if log_file.name.endswith('.gz'):
+        return gzip.open(str(log_file), 'rb')
+    return log_file.open('rb')
+
+
+# Returns true if the rotated generation is the file the cursor points to. A renamed file keeps
+# its inode, a compressed one is recognised by the fingerprint of its decompressed head.
+def is_cursor_file(log_file, cursor):
+    try:
+        compressed = log_file.name.endswith('.gz')
+        if not compressed and log_file.stat().st_ino != cursor['inode']:
+            return False
+
+        with open_log(log_file) as file_object:
+            if not matches_cursor(file_object, cursor):
+                return False
+            if not compressed:
+                return os.fstat(file_object.fileno()).st_size >= cursor['offset']
+            # Seeking decompresses up to the cursor and stops early if the generation is shorter
+            return file_object.seek(cursor['offset']) == cursor['offset']
+    except (OSError, EOFError):
+        return False
+
+
+# Returns the index of the rotated generation the cursor points to, or None
+def cursor_generation(generations, cursor):
+    for index, generation in enumerate(generations):
+        if is_cursor_file(generation, cursor):
+            return index
+    return None
+
+
+# Streams the rotated generations appended since the cursor, oldest first. The generation holding the
+# cursor is read from the cursor offset, the newer ones in full. Returns the number of bytes collected.
+def collect_rotated(log_file, cursor, output_object, digest):
+    generations = rotated_files(log_file)
+    collected = 0
+
+    index = cursor_generation(generations, cursor)
+    if index is not None:
+        generations = generations[:index + 1]
+        start = cursor['offset']
+    else:
+        if generations:
+            print('[WARNING] The last collected part of {} is no longer kept. Collecting the {} rotated '
+                  'generation(s) still on disk.'.format(log_file, len(generations)))
+        start = 0
+
+    for generation in reversed(generations):
+        try:
+            with open_log(generation) as file_object:
+                collected += copy_lines(file_object, start, None, output_object, finished=True,
+                                        digest=digest) - start
+        except (OSError, EOFError) as error:
+            print('[WARNING] Unable to read {} completely. {}'.format(generation, error))
+        start = 0
+
+    return collected
+
+
+# This method streams the data appended to log_file since the last run into output_file and the digest.
+# Either of them may be None. The cursor of the source is updated in the cursors dictionary.
+# Returns the number of bytes collected.
+def collect(source_name, log_file, output_file, cursors, digest=None):
+    cursor = cursors.get(source_name)
+    collected = 0
+
+    with log_file.open('rb') as file_object:
+        output_object = output_file.open('wb') if output_file is not None else None
+        file_stat = os.fstat(file_object.fileno())
+        start = 0
+
+        if cursor is not None and cursor['inode'] == file_stat.st_ino:
+            if file_stat.st_size >= cursor['offset'] and matches_cursor(file_object, cursor):
+                start = cursor['offset']
+            elif cursor_generation(rotated_files(log_file), cursor) is not None:
+                # The log was rotated and its old inode, freed once the generation was compressed, was reused
+                print('{} was rotated since the last update.'.format(log_file))
+                collected += collect_rotated(log_file, cursor, output_object, digest)
+            else:
+                print('{} was truncated since the last update. Collecting it from the start.'.format(log_file))
+        elif cursor is not None:
+            # The log was rotated. Collect whatever was appended to the older generations first.
+            print('{} was rotated since the last update.'.format(log_file))
+            collected += collect_rotated(log_file, cursor, output_object, digest)
+
+        offset = copy_lines(file_object, start, file_stat.st_size, output_object, digest=digest)
+        collected += offset - start
+
+        if output_object is not None:
+            output_object.close()
+
+        cursors[source_name] = {
+            'inode': file_stat.st_ino,
+            'offset': offset,
+            'fingerprint': head_fingerprint(file_object, min(FINGERPRINT_SIZE, offset))
+        }
+
+    return collected
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+#######################################################################################################
+#                                                                                                     #
+# Summarises a log window for the status email. Every line is reduced to a template by masking the  #
+# variable parts (timestamps, UUIDs, addresses and numbers) and the templates are counted per        #
+# severity in a single streaming pass. At most MAX_TEMPLATES templates are tracked, so the memory    #
+# used does not depend on the size of the log window.                                               #
+#                                                                                                     #
+#######################################################################################################
+
+import heapq
+import json
+import re
+
+MAX_TEMPLATES = 2000
+DEFAULT_TOP_N = 20
+
+# Longest template and sample shown in the mail body
+MAX_TEMPLATE_LENGTH = 110
+
+SEVERITY_CRITICAL = 'critical'
+SEVERITY_ERROR = 'error'
+SEVERITY_WARNING = 'warning'
+SEVERITY_INFO = 'info'
+SEVERITIES = [SEVERITY_CRITICAL, SEVERITY_ERROR, SEVERITY_WARNING, SEVERITY_INFO]
+
+# Variable parts of a log line. The order matters, earlier masks take precedence.
+MASKS = [
+    ('TIME', r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?(?:Z|[+-]\d{2}:?\d{2})?'),
+    ('TIME', r'\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) [ \d]\d \d{2}:\d{2}:\d{2}'),
+    ('TIME', r'\b\d{1,2}:\d{2}:\d{2}(?:[.,]\d+)?\b'),
+    ('UUID', r'\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b'),
+    ('MAC', r'\b[0-9a-fA-F]{2}(?::[0-9a-fA-F]{2}){5,}\b'),
+    ('IP', r'\b\d{1,3}(?:\.\d{1,3}){3}(?::\d+)?\b'),
+    ('IP', r'\b(?:[0-9a-fA-F]{0,4}:){2,7}[0-9a-fA-F]{0,4}\b'),
+    ('HEX', r'\b0x[0-9a-fA-F]+\b|\b(?=[0-9a-fA-F]*\d)(?=[0-9a-fA-F]*[a-fA-F])[0-9a-fA-F]{8,}\b'),
+    ('NUM', r'\b\d+(?:\.\d+)?\b|(?<=[A-Za-z_])\d{3,}\b'),
+]
+
+# All masks are combined into a single pattern. The lookahead skips words without digits quickly,
+# which roughly halves the time spent per line.
+MASK_PATTERN = re.compile(r'(?=[\w:.-]*\d)(?:' + '|'.join('(?P<{}{}>{})'.format(name, index, pattern)
+                                                          for index, (name, pattern) in enumerate(MASKS)) + ')')
+
+SEVERITY_PATTERN = re.compile(
+    r'\b(?:(?P<critical>emerg|alert|crit(?:ical)?|fatal|panic)'
+    r'|(?P<error>err(?:or)?|severe|fail(?:ed|ure)?|exception|denied|refused)'
+    r'|(?P<warning>warn(?:ing)?))\b', re.IGNORECASE)
+
+# syslog prefix of the form "Oct 18 06:25:01 hostname " which is dropped from the template
+SYSLOG_PREFIX = re.compile(r'^[A-Z][a-z]{2} [ \d]\d \d{2}:\d{2}:\d{2} \S+ ')
+
+
+def mask_token(match):
+    return '<{}>'.format(match.lastgroup.rstrip('0123456789'))
+
+
+# Returns the template of a log message
+def template(message):
+    return MASK_PATTERN.sub(mask_token, message)
+
+
+# Returns the highest severity mentioned in the log message
+def severity(message):
+    found = set(match.lastgroup for match in SEVERITY_PATTERN.finditer(message))
+    for severity_name in SEVERITIES:
+        if severity_name in found:
+            return severity_name
+    return SEVERITY_INFO
+
+
+# Extracts the message of a syslog line or of a line of a docker json-file log
+def log_message(line):
+    if line.startswith('{"log":'):
+        try:
+            return json.loads(line)['log'].rstrip('\n')
+        except (ValueError, KeyError):
+            return line
+    return SYSLOG_PREFIX.sub('', line, count=1)
+
+
+# Bounded counter using the Space-Saving algorithm. At most capacity keys are tracked. When a new key
+# arrives and the counter is full, the key with the lowest count is replaced and the new key inherits
+# that count as its possible overestimate. Keys counted more than total / capacity times are never lost.
+class TopCounter:
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        self._heap = []
+        self._sequence = 0
+
+    # Counts the key. Returns the key that was evicted to make room for it, if any.
+    def add(self, key, count=1):
+        self.total += count
+
+        if key in self.counts:
+            self.counts[key] += count
+            return None
+
+        evicted_key = None
+        error = 0
+        if len(self.counts) >= self.capacity:
+            evicted_key, error = self._evict()
+
+        self.counts[key] = error + count
+        self.errors[key] = error
+        self._sequence += 1
+        heapq.heappush(self._heap, (error + count, self._sequence, key))
+        return evicted_key
+
+    # Removes the key with the lowest count. Heap entries are not updated when a count grows,
+    # so stale entries are pushed back with their current count until the real minimum is found.
+    def _evict(self):
+        while True:
+            count, _, key = heapq.heappop(self._heap)
+            if self.counts[key] == count:
+                del self.counts[key]
+                del self.errors[key]
+                return key, count
+            self._sequence += 1
+            heapq.heappush(self._heap, (self.counts[key], self._sequence, key))
+
+    # Returns the n keys with the highest counts as (key, count, possible overestimate) tuples
+    def top(self, n):
+        keys = heapq.nlargest(n, self.counts, key=self.counts.get)
+        return [(key, self.counts[key], self.errors[key]) for key in keys]
+
+
+class LogDigest:
+
+    def __init__(self, name, capacity=MAX_TEMPLATES):
+        self.name = name
+        self.lines = 0
+        self.severity_counts = dict.fromkeys(SEVERITIES, 0)
+        self.templates = TopCounter(capacity)
+        self.samples = {}
+
+    def add(self, line):
+        message = log_message(line.rstrip('\r\n'))
+        if not message.strip():
+            return
+
+        key = (severity(message), template(message))
+        self.lines += 1
+        self.severity_counts[key[0]] += 1
+
+        evicted_key = self.templates.add(key)
+        if evicted_key is not None:
+            del self.samples[evicted_key]
+        if key not in self.samples:
+            self.samples[key] = message[:MAX_TEMPLATE_LENGTH]
+
+    # Adds a chunk of complete lines read from the log
+    def feed(self, data):
+        for line in data.decode('utf-8', 'replace').splitlines():
+            self.add(line)
+
+    # Returns the digest as a plain text table for the mail body
+    def report(self, top_n=DEFAULT_TOP_N):
+        lines = ['{}: {} lines, {} templates ({})'.format(
+            self.name, self.lines, len(self.templates.counts),
+            ', '.join('{} {}'.format(self.severity_counts[name], name) for name in SEVERITIES))]
+
+        if not self.lines:
+            return lines[0] + '\n'
+
+        lines.append('{:>8}  {:<8}  {}'.format('Count', 'Severity', 'Template'))
+        for (severity_name, template_text), count, error in self.templates.top(top_n):
+            count_text = str(count) if not error else '~{}'.format(count)
+            lines.append('{:>8}  {:<8}  {}'.format(count_text, severity_name, template_text[:MAX_TEMPLATE_LENGTH]))
+
+        # Make sure that rare errors are not hidden behind frequent informational lines
+        shown = set(key for key, _, _ in self.templates.top(top_n))
+        rare_errors = [key for key in self.samples if key[0] != SEVERITY_INFO and key not in shown]
+        if rare_errors:
+            lines.append('Other warnings and errors (example lines):')
+            for key in sorted(rare_errors, key=self.templates.counts.get, reverse=True)[:top_n]:
+                lines.append('{:>8}  {:<8}  {}'.format(self.templates.counts[key], key[0], self.samples[key]))
+
+        return '\n'.join(lines) + '\n'
+
+
+# Feeds the lines of one log to several consumers, for example a LogDigest and a FirewallLog
+class DigestGroup:
+
+    def __init__(self, *digests):
+        self.digests = digests
+
+    def feed(self, data):
+        for digest in self.digests:
+            digest.feed(data)
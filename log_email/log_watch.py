@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+#######################################################################################################
+#                                                                                                     #
+# Long running watcher which follows the syslog, the apache error log and the guacamole and guacd     #
+# container logs and emails an alert as soon as a line matches one of the alert patterns configured   #
+# in the email_config.json file. It is started on boot by cron.                                       #
+#                                                                                                     #
+# The process sleeps on inotify until one of the logs changes. All alert patterns are compiled into   #
+# a single regular expression so most lines are scanned once. Alerts for the same rule are rate       #
+# limited and repeated lines are summarised in the next alert.                                        #
+#                                                                                                     #
+#######################################################################################################
+
+import json
+import os
+import re
+import socket
+import sys
+import time
+from email.mime.text import MIMEText
+from pathlib import Path
+
+sys.path.insert(0, '/home/pi/minidmz/')
+from guacamole_setup_files import docker_api
+from guacamole_setup_files import file_watch
+from guacamole_setup_files import settings
+
+import log_digest
+import outbox
+from send_status import read_config
+
+DEFAULT_ALERT_PATTERNS = {
+    'guacd_error': r'guacd\[\d+\]: (?:ERROR|Error)',
+    'tomcat_severe': r'\bSEVERE\b',
+    'cas_failure': r'(?:mod_auth_cas|\bCAS\b).*(?:[Ff]ail|[Ee]rror|timed out|unreachable)',
+    'docker_error': r'dockerd\[\d+\]: .*level=error',
+    'out_of_memory': r'[Oo]ut of memory|oom-kill|Killed process',
+    'storage_error': r'I/O error|EXT4-fs error|mmcblk0.*error',
+}
+
+DEFAULT_COOLDOWN_MINUTES = 30
+DEFAULT_MAX_ALERTS_PER_HOUR = 6
+
+# How often the daemon wakes up without log activity to send held back alerts and
+# to look for a recreated guacamole container
+IDLE_INTERVAL = 60
+
+# Most distinct lines listed in a single alert
+MAX_ALERT_LINES = 20
+
+READ_SIZE = 64 * 1024
+
+# Numbered or named backreference in an alert pattern
+BACKREFERENCE_PATTERN = re.compile(r'\\[1-9]|\(\?P=')
+
+WATCH_MASK = file_watch.IN_MODIFY | file_watch.IN_CREATE | file_watch.IN_MOVED_TO
+
+
+# This method reads the alert configuration from the alerts section of the email_config.json file
+def read_alert_config(log_email_path):
+    credentials, mail_config = read_config(log_email_path)
+
+    with log_email_path.joinpath('email_config.json').open('r') as json_data_file:
+        alert_config = json.load(json_data_file).get('alerts', {})
+
+    alert_config.setdefault('patterns', DEFAULT_ALERT_PATTERNS)
+    alert_config.setdefault('cooldown_minutes', DEFAULT_COOLDOWN_MINUTES)
+    alert_config.setdefault('max_alerts_per_hour', DEFAULT_MAX_ALERTS_PER_HOUR)
+
+    try:
+        matcher = AlertMatcher(alert_config['patterns'])
+    except re.error as error:
+        print('[Error] Invalid alert pattern in {}. {}'.format('email_config.json', error))
+        sys.exit()
+
+    return credentials, mail_config, alert_config, matcher
+
+
+# Matches a line against all alert patterns. The patterns are combined into one regular expression which
+# skips the lines no rule can match, the rules of a line that passes are then matched one by one, so rules
+# matching overlapping parts of the line are all found.
+class AlertMatcher:
+
+    def __init__(self, patterns):
+        self.rules = [(name, re.compile(patterns[name])) for name in patterns]
+        # Groups are renumbered in the combined expression, a pattern with backreferences or named groups is
+        # matched on its own on every line
+        self.standalone_rules = [(name, rule) for name, rule in self.rules
+                                 if rule.groupindex or BACKREFERENCE_PATTERN.search(rule.pattern)]
+        combined = [rule.pattern for name, rule in self.rules if (name, rule) not in self.standalone_rules]
+        self.prefilter = re.compile('|'.join('(?:{})'.format(pattern) for pattern in combined)) if combined else None
+
+    # Returns the names of the rules matching the line
+    def match(self, line):
+        rules = self.rules if self.prefilter is not None and self.prefilter.search(line) else self.standalone_rules
+        return set(name for name, rule in rules if rule.search(line))
+
+
+# Follows a log file from its current end, the way tail -F does.
+# A rotated or truncated log is detected and the new file is followed from the start.
+class LogFollower:
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = Path(path)
+        self.file_object = None
+        self.inode = None
+        self.pending = b''
+        self.open(at_end=True)
+
+    def open(self, at_end):
+        try:
+            self.file_object = self.path.open('rb')
+        except OSError:
+            self.file_object = None
+            return
+
+        self.inode = os.fstat(self.file_object.fileno()).st_ino
+        if at_end:
+            self.file_object.seek(0, os.SEEK_END)
+
+    def close(self):
+        if self.file_object is not None:
+            self.file_object.close()
+            self.file_object = None
+
+    # Yields the complete lines appended to the log since the last call
+    def read_lines(self):
+        if self.file_object is None:
+            self.open(at_end=False)
+            if self.file_object is None:
+                return
+
+        try:
+            path_stat = self.path.stat()
+        except OSError:
+            path_stat = None
+
+        if path_stat is not None and path_stat.st_size < self.file_object.tell() and \
+                path_stat.st_ino == self.inode:
+            # Truncated in place
+            self.file_object.seek(0)
+            self.pending = b''
+
+        for line in self._read_available():
+            yield line
+
+        if path_stat is not None and path_stat.st_ino != self.inode:
+            # Rotated. The rest of the old file has been read above, continue with the new file.
+            self.close()
+            self.pending = b''
+            self.open(at_end=False)
+            for line in self._read_available():
+                yield line
+
+    def _read_available(self):
+        while True:
+            chunk = self.file_object.read(READ_SIZE)
+            if not chunk:
+                return
+            data = self.pending + chunk
+            line_end = data.rfind(b'\n') + 1
+            self.pending = data[line_end:]
+            for line in data[:line_end].decode('utf-8', 'replace').splitlines():
+                yield line
+
+
+# Decides which alerts are sent. After an alert for a rule, further matches of that rule are held back
+# for the cooldown period and then sent as one summary. Lines are deduplicated by their template.
+class AlertLimiter:
+
+    def __init__(self, cooldown_minutes, max_alerts_per_hour):
+        self.cooldown = cooldown_minutes * 60
+        self.max_alerts_per_hour = max_alerts_per_hour
+        self.last_sent = {}
+        self.held_back = {}
+        self.sent_times = []
+
+    def _can_send(self, rule, now):
+        self.sent_times = [sent_time for sent_time in self.sent_times if now - sent_time < 3600]
+        return (rule not in self.last_sent or now - self.last_sent[rule] >= self.cooldown) and \
+            len(self.sent_times) < self.max_alerts_per_hour
+
+    # Records a matching line. Returns the lines to alert about now, or None if the alert is held back.
+    def record(self, rule, source_name, line, now):
+        held_lines = self.held_back.setdefault(rule, {})
+        key = (source_name, log_digest.template(log_digest.log_message(line)))
+
+        if key in held_lines:
+            held_lines[key][1] += 1
+        elif len(held_lines) < MAX_ALERT_LINES:
+            held_lines[key] = [line, 1]
+
+        if not self._can_send(rule, now):
+            return None
+
+        return self._release(rule, now)
+
+    # Returns the held back alerts whose cooldown has expired as (rule, lines) tuples
+    def expired(self, now):
+        return [(rule, self._release(rule, now)) for rule in list(self.held_back)
+                if self.held_back[rule] and self._can_send(rule, now)]
+
+    def _release(self, rule, now):
+        self.last_sent[rule] = now
+        self.sent_times.append(now)
+        held_lines = self.held_back.pop(rule)
+        return [(source_name, line, count) for (source_name, _), (line, count) in held_lines.items()]
+
+
+# This method queues an alert email in the outbox and sends it using the smtp settings of email_config.json
+def send_alert(generated_files_path, credentials, mail_config, rule, alert_lines):
+    hostname = settings.DOMAIN_NAME or socket.gethostname()
+
+    body = 'Hello,\nThe following log lines on {} matched the alert rule {}.\n\n'.format(hostname, rule)
+    for source_name, line, count in alert_lines:
+        body += '[{}] {}\n'.format(source_name, line)
+        if count > 1:
+            body += '    (repeated {} times)\n'.format(count)
+
+    message = MIMEText(body)
+    message['Subject'] = 'Device alert: {} on {}'.format(rule, hostname)
+    message['From'] = mail_config['sender_email_id']
+    message['To'] = ", ".join(mail_config['receiver_email_id'])
+
+    print('[INFO] Sending alert {}'.format(rule))
+    outbox.enqueue_message(generated_files_path, message, mail_config['sender_email_id'],
+                           mail_config['receiver_email_id'])
+    outbox.drain(generated_files_path, credentials, mail_config)
+
+
+# Returns the path of the docker log of a container, or None if the container does not exist
+def container_log_path(docker, container_name):
+    try:
+        container = docker.inspect_container(container_name)
+    except (OSError, docker_api.DockerError):
+        return None
+
+    if container is None or not container['LogPath']:
+        return None
+    return container['LogPath']
+
+
+class LogWatcher:
+
+    def __init__(self, generated_files_path, credentials, mail_config, alert_config, matcher):
+        self.generated_files_path = generated_files_path
+        self.credentials = credentials
+        self.mail_config = mail_config
+        self.matcher = matcher
+        self.limiter = AlertLimiter(alert_config['cooldown_minutes'], alert_config['max_alerts_per_hour'])
+        self.docker = docker_api.DockerClient()
+        self.inotify = file_watch.Inotify()
+        self.followers = {}
+        self.watches = {}
+
+        self.follow('syslog', '/var/log/syslog')
+        self.follow('apache', '/var/log/apache2/error.log')
+        self.follow_container_logs()
+
+    # Starts following a log. The directory is watched rather than the file so rotation is noticed.
+    # The watch of the log followed before under the name is removed once no other log needs it.
+    def follow(self, name, path):
+        if name in self.followers:
+            self.followers[name].close()
+
+        follower = LogFollower(name, path)
+        self.followers[name] = follower
+
+        try:
+            watch_descriptor = self.inotify.add_watch(follower.path.parent, WATCH_MASK)
+        except OSError as error:
+            print('[WARNING] Unable to watch {}. {}'.format(follower.path, error))
+            watch_descriptor = None
+
+        self.unwatch(name, keep=watch_descriptor)
+        if watch_descriptor is not None:
+            self.watches.setdefault(watch_descriptor, set()).add(name)
+
+    # This method removes the log of the name from its watch, and the watch if no other log uses it.
+    # keep is the watch descriptor the log moves to, inotify returns the same descriptor for the same directory.
+    def unwatch(self, name, keep=None):
+        for watch_descriptor, names in list(self.watches.items()):
+            if name not in names or watch_descriptor == keep:
+                continue
+            names.discard(name)
+            if not names:
+                del self.watches[watch_descriptor]
+                # Fails harmlessly when the kernel already removed the watch of a deleted directory
+                self.inotify.remove_watch(watch_descriptor)
+
+    # The guacamole and guacd containers get a new log file whenever setup.py recreates them
+    def follow_container_logs(self):
+        containers = [('guacamole', settings.GUACAMOLE_CONTAINER_NAME)]
+        containers.extend((container_name, container_name) for container_name in settings.guacd_container_names())
+
+        for name, container_name in containers:
+            log_path = container_log_path(self.docker, container_name)
+            follower = self.followers.get(name)
+
+            if log_path is not None and (follower is None or str(follower.path) != log_path):
+                print('Following the {} container log {}'.format(container_name, log_path))
+                self.follow(name, log_path)
+
+    def check(self, name):
+        follower = self.followers[name]
+        now = time.time()
+
+        for line in follower.read_lines():
+            for rule in self.matcher.match(line):
+                alert_lines = self.limiter.record(rule, name, line, now)
+                if alert_lines:
+                    send_alert(self.generated_files_path, self.credentials, self.mail_config, rule, alert_lines)
+
+    def run(self):
+        print('Watching logs for alerts')
+        last_idle_check = time.time()
+
+        while True:
+            events = self.inotify.read_events(IDLE_INTERVAL)
+
+            changed = set()
+            for watch_descriptor, mask, file_name in events:
+                if mask & file_watch.IN_Q_OVERFLOW:
+                    changed.update(self.followers)
+                    continue
+                for name in self.watches.get(watch_descriptor, ()):
+                    if self.followers[name].path.name == file_name:
+                        changed.add(name)
+
+            for name in changed:
+                self.check(name)
+
+            now = time.time()
+            if now - last_idle_check >= IDLE_INTERVAL:
+                last_idle_check = now
+                self.follow_container_logs()
+                for rule, alert_lines in self.limiter.expired(now):
+                    send_alert(self.generated_files_path, self.credentials, self.mail_config, rule, alert_lines)
+
+                # Retry the queued messages whose backoff has expired
+                outbox.drain(self.generated_files_path, self.credentials, self.mail_config)
+
+
+def watch_logs():
+    directories = settings.fetch_file_directories()
+    credentials, mail_config, alert_config, matcher = read_alert_config(Path(directories[settings.DIRECTORY_LOG_EMAIL]))
+    LogWatcher(Path(directories[settings.DIRECTORY_GENERATED_FILES]), credentials, mail_config, alert_config,
+               matcher).run()
+
+
+if __name__ == '__main__':
+    watch_logs()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+#######################################################################################################
+#                                                                                                     #
+# On-disk outbox for the emails sent by the device. Messages are queued in generated_files/outbox   #
+# and a drain sends every due message over a single authenticated smtp connection. A message which #
+# cannot be sent stays queued and is retried with exponential backoff. Messages which fail          #
+# permanently, or too many times, are moved to the dead letter folder for inspection.               #
+#                                                                                                     #
+#######################################################################################################
+
+import email.policy
+import fcntl
+import json
+import os
+import shutil
+import smtplib
+import time
+import uuid
+
+import attachments
+
+OUTBOX_DIRECTORY = 'outbox'
+QUEUE_DIRECTORY = 'queue'
+DEAD_LETTER_DIRECTORY = 'dead'
+LOCK_FILE_NAME = '.lock'
+
+# Retry delays double from RETRY_BASE_DELAY up to RETRY_MAX_DELAY seconds
+RETRY_BASE_DELAY = 5 * 60
+RETRY_MAX_DELAY = 24 * 60 * 60
+MAX_ATTEMPTS = 10
+
+
+def queue_path(generated_files_path):
+    path = generated_files_path.joinpath(OUTBOX_DIRECTORY, QUEUE_DIRECTORY)
+    if not path.is_dir():
+        path.mkdir(parents=True)
+    return path
+
+
+def dead_letter_path(generated_files_path):
+    path = generated_files_path.joinpath(OUTBOX_DIRECTORY, DEAD_LETTER_DIRECTORY)
+    if not path.is_dir():
+        path.mkdir(parents=True)
+    return path
+
+
+def write_metadata(metadata_file, metadata):
+    temporary_file = metadata_file.with_name(metadata_file.name + '.tmp')
+    with temporary_file.open('w') as file_object:
+        json.dump(metadata, file_object, indent=4)
+    os.replace(str(temporary_file), str(metadata_file))
+
+
+# This method moves a message written by attachments.write_message into the outbox.
+# The message may come from another file system such as tmpfs, in which case it is copied.
+# The message is only visible to the sender once its metadata file has been written.
+def enqueue(generated_files_path, message_file, sender_email_id, receiver_email_id):
+    message_name = '{}-{}'.format(time.strftime('%Y%m%d%H%M%S'), uuid.uuid4().hex[:8])
+    queued_message = queue_path(generated_files_path).joinpath(message_name + '.eml')
+
+    shutil.move(str(message_file), str(queued_message))
+    write_metadata(queued_message.with_suffix('.json'), {
+        'sender_email_id': sender_email_id,
+        'receiver_email_id': receiver_email_id,
+        'created': time.time(),
+        'attempts': 0,
+        'next_attempt': 0,
+        'last_error': None
+    })
+
+    return queued_message
+
+
+# This method queues an email.message.Message object
+def enqueue_message(generated_files_path, message, sender_email_id, receiver_email_id):
+    message_file = queue_path(generated_files_path).joinpath('.{}.eml'.format(uuid.uuid4().hex))
+    with message_file.open('wb') as file_object:
+        file_object.write(message.as_bytes(policy=email.policy.SMTP))
+
+    return enqueue(generated_files_path, message_file, sender_email_id, receiver_email_id)
+
+
+# Returns the queued messages whose next attempt is due, oldest first, as (message file, metadata) tuples
+def due_messages(generated_files_path, now):
+    messages = []
+    for metadata_file in sorted(queue_path(generated_files_path).glob('*.json')):
+        with metadata_file.open('r') as file_object:
+            metadata = json.load(file_object)
+        if metadata['next_attempt'] <= now:
+            messages.append((metadata_file.with_suffix('.eml'), metadata))
+    return messages
+
+
+def remove_message(message_file):
+    message_file.with_suffix('.json').unlink()
+    message_file.unlink()
+
+
+def move_to_dead_letter(generated_files_path, message_file, metadata):
+    print('[ERROR] Giving up on {}. It was moved to the {} folder. Last error: {}'.format(
+        message_file.name, DEAD_LETTER_DIRECTORY, metadata['last_error']))
+    dead_letters = dead_letter_path(generated_files_path)
+    write_metadata(dead_letters.joinpath(message_file.with_suffix('.json').name), metadata)
+    os.replace(str(message_file), str(dead_letters.joinpath(message_file.name)))
+    message_file.with_suffix('.json').unlink()
+
+
+# Records a failed attempt. The message is retried later, or moved to the dead letter folder if the
+# failure is permanent or the message ran out of attempts.
+def record_failure(generated_files_path, message_file, metadata, error, permanent, now):
+    metadata['attempts'] += 1
+    metadata['last_error'] = str(error)
+
+    if permanent or metadata['attempts'] >= MAX_ATTEMPTS:
+        move_to_dead_letter(generated_files_path, message_file, metadata)
+        return
+
+    delay = min(RETRY_BASE_DELAY * 2 ** (metadata['attempts'] - 1), RETRY_MAX_DELAY)
+    metadata['next_attempt'] = now + delay
+    write_metadata(message_file.with_suffix('.json'), metadata)
+    print('[WARNING] Sending {} failed, retrying in {} minutes. {}'.format(message_file.name, delay // 60, error))
+
+
+# Opens an authenticated connection to the smtp server of the email_config.json file.
+# smtp_use_ssl can be disabled to test against a local smtp server such as aiosmtpd. The connection is then
+# upgraded with STARTTLS, and the password is never sent over a connection which is not encrypted.
+def smtp_connection(credentials, mail_config):
+    encrypted = mail_config.get('smtp_use_ssl', True)
+    if encrypted:
+        smtp = smtplib.SMTP_SSL(mail_config['smtp_server_name'])
+    else:
+        smtp = smtplib.SMTP(mail_config['smtp_server_name'])
+        smtp.ehlo()
+        if smtp.has_extn('starttls'):
+            smtp.starttls()
+            smtp.ehlo()
+            encrypted = True
+
+    smtp.ehlo_or_helo_if_needed()
+    if smtp.has_extn('auth'):
+        if not encrypted:
+            smtp.close()
+            raise smtplib.SMTPNotSupportedError('The smtp server does not support STARTTLS. '
+                                                'Not logging in over a connection which is not encrypted.')
+        smtp.login(credentials['username'], credentials['password'])
+    else:
+        print('[WARNING] The smtp server does not support authentication. Sending without logging in.')
+
+    return smtp
+
+
+# This method sends all due messages of the outbox over one smtp connection.
+# Returns the number of messages sent. Only one process drains the outbox at a time.
+def drain(generated_files_path, credentials, mail_config):
+    lock_file = generated_files_path.joinpath(OUTBOX_DIRECTORY, LOCK_FILE_NAME)
+    queue_path(generated_files_path)
+
+    with lock_file.open('w') as lock_object:
+        try:
+            fcntl.flock(lock_object, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            print('The outbox is being sent by another process')
+            return 0
+
+        now = time.time()
+        messages = due_messages(generated_files_path, now)
+        if not messages:
+            return 0
+
+        print('[INFO] Sending {} queued email(s)'.format(len(messages)))
+        sent = 0
+
+        try:
+            smtp = smtp_connection(credentials, mail_config)
+        except smtplib.SMTPAuthenticationError as auth_error:
+            print("[ERROR] The server didn’t accept the username/password combination.")
+            for message_file, metadata in messages:
+                record_failure(generated_files_path, message_file, metadata, auth_error, False, now)
+            return 0
+        except (smtplib.SMTPException, OSError) as connect_error:
+            print("Error connecting to the SMTP Server. Following error was displayed.\n{}".format(connect_error))
+            for message_file, metadata in messages:
+                record_failure(generated_files_path, message_file, metadata, connect_error, False, now)
+            return 0
+
+        with smtp:
+            for index, (message_file, metadata) in enumerate(messages):
+                try:
+                    refused_receivers = attachments.send_message(smtp, metadata['sender_email_id'],
+                                                                 metadata['receiver_email_id'], message_file)
+                except smtplib.SMTPServerDisconnected as disconnect_error:
+                    # The connection is gone, the remaining messages are retried on the next drain
+                    for failed_file, failed_metadata in messages[index:]:
+                        record_failure(generated_files_path, failed_file, failed_metadata, disconnect_error,
+                                       False, now)
+                    break
+                except smtplib.SMTPRecipientsRefused as refused_error:
+                    # Every receiver was refused. Only 5xx replies for all of them are a permanent failure.
+                    permanent = all(code >= 500 for code, _ in refused_error.recipients.values())
+                    record_failure(generated_files_path, message_file, metadata, refused_error, permanent, now)
+                    continue
+                except smtplib.SMTPResponseException as response_error:
+                    # 5xx replies are permanent failures, 4xx replies are worth retrying
+                    try:
+                        smtp.rset()
+                    except smtplib.SMTPException:
+                        pass
+                    record_failure(generated_files_path, message_file, metadata, response_error,
+                                   response_error.smtp_code >= 500, now)
+                    continue
+
+                if refused_receivers:
+                    print('[WARNING] The server refused the receivers {}'.format(', '.join(refused_receivers)))
+                remove_message(message_file)
+                sent += 1
+
+        print('[INFO] Sent {} email(s)'.format(sent))
+        return sent
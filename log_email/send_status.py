@@ -9,21 +9,24 @@
 #                                                                                                     #
 #######################################################################################################
 
-import difflib
 import json
 import os
 from pathlib import Path
-import smtplib
-import subprocess
 import sys
 
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.application import MIMEApplication
-
 sys.path.insert(0, '/home/pi/minidmz/')
+from guacamole_setup_files import docker_api
+from guacamole_setup_files import memory_budget
 from guacamole_setup_files import settings
 
+import attachments
+import firewall_log
+import journal_source
+import log_cursor
+import log_digest
+import outbox
+import state_store
+
 
 # This method reads email related configuration from the email_config.json file
 def read_config(log_email_path):
@@ -52,6 +55,13 @@ def read_config(log_email_path):
         print('[Error] smtp server is missing')
         config_errors = True
 
+    mail_config.setdefault('max_message_size_mb', attachments.DEFAULT_MAX_MESSAGE_SIZE_MB)
+    mail_config.setdefault('digest_top_n', log_digest.DEFAULT_TOP_N)
+    mail_config.setdefault('attach_raw_logs', False)
+    if not isinstance(mail_config['max_message_size_mb'], (int, float)) or mail_config['max_message_size_mb'] < 1:
+        print('[Error] max_message_size_mb must be a number not less than 1')
+        config_errors = True
+
     if config_errors:
         print('Fix {} and re-run the code.'.format(config_file_path.name))
         sys.exit()
@@ -59,79 +69,109 @@ def read_config(log_email_path):
     return credentials,mail_config
 
 
-# This method generates the difference in log between original log file and log backup file.
-def log_generator(generated_files_path, original_log_file, log_backup_file, diff_file_name):
+# This method collects the lines appended to the log file since the last email into the digest.
+# The lines are written to the diff file in the scratch directory only if the raw logs are attached to the mail.
+def log_generator(generated_files_path, scratch_path, cursors, source_name, original_log_file, diff_file_name,
+                  digest, attach_raw_log):
 
-    diff_file = generated_files_path.joinpath(diff_file_name)
+    diff_file = scratch_path.joinpath(diff_file_name) if attach_raw_log else None
 
     try:
-        with original_log_file.open('r') as file_object:
-            original_log_contents = file_object.readlines()
+        collected_bytes = log_cursor.collect(source_name, original_log_file, diff_file, cursors, digest)
     except PermissionError:
         print("[ERROR] Code is executed as a non privileged user."
               "\n[ERROR] Please re-run the script as superuser. [ sudo ./{} ]".format(
             os.path.basename(__file__)))
         sys.exit()
 
-    # Check if a backup file exists, if yes, take a diff between original docker guacamole file
-    # the current guacamole_log_file and send that as mail attachment. Replace the backup file with new contents.
-    if log_backup_file.is_file():
-        with log_backup_file.open('r') as file_object:
-            backup_contents = file_object.readlines()
-        changed_contents = difflib.unified_diff(backup_contents, original_log_contents)
-    else:
-        changed_contents = original_log_contents
-
-    with diff_file.open('w') as file_object:
-        file_object.writelines(changed_contents)
+    # Earlier versions kept full copies of the logs and the diffs in generated_files. They are no longer needed.
+    for legacy_file in (generated_files_path.joinpath(source_name + '_backup.log'),
+                        generated_files_path.joinpath(diff_file_name)):
+        if legacy_file.is_file():
+            legacy_file.unlink()
 
-    # Write the guacamole log from docker to the guacamole_log_backup file.
-    with log_backup_file.open('w') as file_object:
-        file_object.writelines(original_log_contents)
-
-    if diff_file.stat().st_size is 0:
-            print('There has been no changes in {} since last update'.format(diff_file_name))
-            return None
+    if collected_bytes == 0:
+        print('There has been no changes in {} since last update'.format(diff_file_name))
+        if diff_file is not None:
+            diff_file.unlink()
+        return None
 
     return diff_file
 
 
 # This method generates the guacamole log
-def guacamole_log(generated_files_path):
+def guacamole_log(generated_files_path, scratch_path, cursors, digest, attach_raw_log):
     print('Generating the guacamole logs required to be sent over email')
 
-    file_location_commad = ['docker', 'inspect', "--format='{{.LogPath}}'", settings.GUACAMOLE_CONTAINER_NAME]
-
     # Need to obtain the path for the docker's log file for guacamole_container
     try:
-        guacamole_log_file = subprocess.check_output(file_location_commad).decode("utf-8").strip().strip("'")
-    except subprocess.CalledProcessError:
+        guacamole_container = docker_api.DockerClient().inspect_container(settings.GUACAMOLE_CONTAINER_NAME)
+    except (OSError, docker_api.DockerError) as error:
+        print('[ERROR] Unable to reach the docker daemon. {}'.format(error))
+        sys.exit()
+
+    if guacamole_container is None or not guacamole_container['LogPath']:
         print('Error occured while accessing docker log file. Please check if the container is running and '
               'has logged output.')
         sys.exit()
 
+    guacamole_log_file = guacamole_container['LogPath']
+
     # Converting to path object
     guacamole_log_file = Path(guacamole_log_file)
-    guacamole_log_backup = generated_files_path.joinpath('guacamole_backup.log')
     guacamole_diff_file_name = 'guacamole_diff.log'
 
-    return log_generator(generated_files_path, guacamole_log_file, guacamole_log_backup, guacamole_diff_file_name)
+    return log_generator(generated_files_path, scratch_path, cursors, 'guacamole', guacamole_log_file,
+                         guacamole_diff_file_name, digest, attach_raw_log)
 
 
-# This method generates the syslog
-def generate_syslog(generated_files_path):
-    print('Generating the syslog logs required to be sent over email')
+# This method generates the syslog. Images without /var/log/syslog (journald only or volatile syslog)
+# use the systemd journal instead.
+def generate_syslog(generated_files_path, scratch_path, cursors, digest, attach_raw_log):
     syslog_file = Path('/var/log/syslog')
-    syslog_backup = generated_files_path.joinpath('syslog_backup.log')
+    if not syslog_file.is_file():
+        return journal_log(scratch_path, cursors, digest, attach_raw_log)
+
+    print('Generating the syslog logs required to be sent over email')
     syslog_diff_file_name = 'syslog_diff.log'
 
-    return log_generator(generated_files_path, syslog_file, syslog_backup, syslog_diff_file_name)
+    return log_generator(generated_files_path, scratch_path, cursors, 'syslog', syslog_file,
+                         syslog_diff_file_name, digest, attach_raw_log)
+
+
+# This method collects the journal entries of the services running on the pi and the kernel messages since the
+# last email
+def journal_log(scratch_path, cursors, digest, attach_raw_log):
+    print('Generating the journal logs required to be sent over email')
+    journal_diff_file_name = 'journal_diff.log'
+    diff_file = scratch_path.joinpath(journal_diff_file_name) if attach_raw_log else None
+
+    collected = journal_source.collect('journal', diff_file, cursors, digest)
+    # The kernel messages, where the firewall logs the dropped packets, are kept under their own cursor
+    collected += journal_source.collect('journal_kernel', diff_file, cursors, digest, units=[],
+                                        matches=journal_source.KERNEL_MATCHES)
+
+    if collected == 0:
+        print('There has been no changes in {} since last update'.format(journal_diff_file_name))
+        if diff_file is not None:
+            diff_file.unlink()
+        return None
+
+    return diff_file
+
 
+# This method digests the logs and generates the attachments. The syslog is also scanned for the packets
+# dropped by the firewall. Returns the list of attachments (None for logs without changes or not attached),
+# the list of digests and the firewall summary.
+def generate_attachments(generated_files_path, scratch_path, cursors, attach_raw_logs):
+    guacamole_digest = log_digest.LogDigest('Guacamole log')
+    syslog_digest = log_digest.LogDigest('Syslog')
+    firewall_digest = firewall_log.FirewallLog()
 
-# This method generates all the attachments and returns the list of attachments
-def generate_attachments(generated_files_path):
-    attachment_files = [guacamole_log(generated_files_path), generate_syslog(generated_files_path)]
-    return attachment_files
+    attachment_files = [guacamole_log(generated_files_path, scratch_path, cursors, guacamole_digest, attach_raw_logs),
+                        generate_syslog(generated_files_path, scratch_path, cursors,
+                                        log_digest.DigestGroup(syslog_digest, firewall_digest), attach_raw_logs)]
+    return attachment_files, [guacamole_digest, syslog_digest], firewall_digest
 
 
 # This is the main method with sends the email
@@ -140,50 +180,116 @@ def send_device_status():
     directories = settings.fetch_file_directories()
 
     credentials, mail_config = read_config(Path(directories[settings.DIRECTORY_LOG_EMAIL]))
-    username, password = credentials['username'], credentials['password']
     sender_email_id, receiver_email_id = mail_config['sender_email_id'], mail_config['receiver_email_id']
-    smtp_server_name = mail_config['smtp_server_name']
+
+    generated_files_path = Path(directories[settings.DIRECTORY_GENERATED_FILES])
+    max_message_size = int(mail_config['max_message_size_mb'] * 1024 * 1024)
+
+    # Only the cursors are kept between runs. Everything else is staged in a scratch directory on tmpfs
+    # and only the finished messages are written to the SD card.
+    store = state_store.StateStore(generated_files_path)
+    scratch_path = Path(state_store.scratch_directory(generated_files_path))
+    start_write_bytes = state_store.storage_write_bytes()
+
+    try:
+        message_files = write_status_messages(generated_files_path, scratch_path, store, mail_config,
+                                              max_message_size)
+
+        # Queue the messages so a report is not lost when the smtp server cannot be reached.
+        # Messages left over from earlier runs are sent along with them.
+        for message_file in message_files:
+            outbox.enqueue(generated_files_path, message_file, sender_email_id, receiver_email_id)
+    finally:
+        state_store.remove_scratch_directory(scratch_path)
+
+    # The cursors are saved once the report is safely queued
+    store.save()
+
+    outbox.drain(generated_files_path, credentials, mail_config)
+
+    # Measured once the state is saved and the outbox drained, so their writes are counted. Only saving
+    # the measurement itself is left out, and the state is only rewritten when the measurement changed.
+    state_store.record_write_bytes(store, start_write_bytes)
+    store.save()
+
+
+# This method compares the memory used by the containers against the memory budget planned by the setup.
+# Returns None if there is no budget.
+def generate_memory_report(generated_files_path):
+    try:
+        return memory_budget.memory_report(docker_api.DockerClient(), str(generated_files_path))
+    except (OSError, docker_api.DockerError) as error:
+        print('[WARNING] Unable to measure the memory used by the containers. {}'.format(error))
+        return 'The memory used by the containers could not be measured. {}'.format(error)
+
+
+# This method collects the logs and writes the status messages into the scratch directory.
+# Returns the list of message files.
+def write_status_messages(generated_files_path, scratch_path, store, mail_config, max_message_size):
+    sender_email_id, receiver_email_id = mail_config['sender_email_id'], mail_config['receiver_email_id']
+
+    log_files, digests, firewall_digest = generate_attachments(generated_files_path, scratch_path, store.cursors,
+                                                               mail_config['attach_raw_logs'])
 
     # Obtaining log files after removing None data
-    log_files = list(filter(None.__ne__, generate_attachments(Path(directories[settings.DIRECTORY_GENERATED_FILES]))))
+    log_files = list(filter(None.__ne__, log_files))
 
-    if not log_files:
+    # The firewall counters are attached as json so they can be processed further
+    if firewall_digest.packets:
+        firewall_file = scratch_path.joinpath('firewall.json')
+        with firewall_file.open('w') as file_object:
+            json.dump(firewall_digest.summary(mail_config['digest_top_n']), file_object, indent=4)
+        log_files.append(firewall_file)
+
+    if not any(digest.lines for digest in digests):
         mail_body = "Hello,\nThere has been no changes in the log files since the last mail was sent.\n " \
                     "Hence, no logs are attached to this mail."
     else:
-        mail_body = "Hello,\nAny log file changes since the last email has been attached to this mail."
+        mail_body = "Hello,\nSummary of the log file changes since the last email. Variable parts of the log " \
+                    "lines (times, addresses, numbers) are masked.\n\n"
+        mail_body += "\n".join(digest.report(mail_config['digest_top_n']) for digest in digests)
+        if firewall_digest.packets:
+            mail_body += "\n" + firewall_digest.report(mail_config['digest_top_n'])
+        if log_files:
+            mail_body += "\nThe raw log file changes have been attached to this mail as gzip compressed files."
+
+    write_report = state_store.write_report(store)
+    if write_report:
+        mail_body += "\n\n" + write_report
+
+    memory_report = generate_memory_report(generated_files_path)
+    if memory_report:
+        mail_body += "\n\n" + memory_report
+
+    # Compress the logs and split them into as many messages as needed to stay within the size budget
+    attachment_files = []
+    for log_file in log_files:
+        attachment_files.extend(attachments.compress_attachment(log_file, scratch_path,
+                                                                attachments.segment_limit(max_message_size)))
+        log_file.unlink()
 
+    message_groups = attachments.plan_messages(attachment_files, max_message_size)
 
-    # Create the email message.
-    message = MIMEMultipart()
-    message['Subject'] = 'Device status: ' + settings.DOMAIN_NAME
-    message['From'] = sender_email_id
-    message['To'] = ", ".join(receiver_email_id)
-    message.preamble = 'This is the latest device log. Please inspect to check device status'
-    message.attach(MIMEText(mail_body))
+    # Create the email messages.
+    message_files = []
+    for part_number, message_attachments in enumerate(message_groups, 1):
+        subject = 'Device status: ' + settings.DOMAIN_NAME
+        message_body = mail_body
 
-    for log_file in log_files:
+        if len(message_groups) > 1:
+            subject += ' (part {}/{})'.format(part_number, len(message_groups))
+            message_body += "\nThe logs were split into {} messages. This is part {}.".format(
+                len(message_groups), part_number)
 
-        log_file_data = log_file.read_text()
-        attachment = MIMEApplication(log_file_data, _subtype="txt")
-        attachment.add_header('Content-Disposition', 'attachment', filename=log_file.name)
-        message.attach(attachment)
+        message_file = scratch_path.joinpath('status_message_{}.eml'.format(part_number))
+        attachments.write_message(message_file, subject, sender_email_id, receiver_email_id, message_body,
+                                  message_attachments)
+        message_files.append(message_file)
 
-    print("[INFO] Sending email")
-
-    try:
-        with smtplib.SMTP_SSL(smtp_server_name) as smtp:
-            smtp.login(username, password)
-            smtp.sendmail(sender_email_id, receiver_email_id, message.as_string())
-    except smtplib.SMTPConnectError as connect_error:
-        print("Error connecting to the SMTP Server. Following error was displayed.\n{}".format(
-            connect_error.strerror))
-    except smtplib.SMTPAuthenticationError as auth_error:
-        print("[ERROR] The server didn’t accept the username/password combination.")
-    except smtplib.SMTPException as base_exception:
-        print("[ERROR] Something went wrong in SMTP module.")
-        print(base_exception.strerror)
+        for attachment_file in message_attachments:
+            attachment_file.unlink()
 
+    return message_files
 
 if __name__ == '__main__':
     send_device_status()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#######################################################################################################
+#                                                                                                     #
+# Keeps the SD card writes of the status email small. The only state kept between runs is a compact   #
+# json file with the log cursors (inode, offset and head hash of every log) which is rewritten only   #
+# when it changed. Temporary files (log diffs, gzip segments, messages) are staged on tmpfs and       #
+# only the finished messages are moved to the outbox on the SD card.                                  #
+#                                                                                                     #
+#######################################################################################################
+
+import json
+import os
+import shutil
+import tempfile
+
+STATE_FILE_NAME = 'log_state.json'
+
+# Written by earlier versions, migrated on the first run
+LEGACY_CURSOR_FILE_NAME = 'log_cursors.json'
+
+# tmpfs mount used for temporary files when it has at least SCRATCH_MIN_FREE bytes available
+SCRATCH_ROOT = '/dev/shm'
+SCRATCH_MIN_FREE = 64 * 1024 * 1024
+SCRATCH_DIRECTORY = 'scratch'
+
+
+class StateStore:
+
+    def __init__(self, generated_files_path):
+        self.generated_files_path = generated_files_path
+        self.state_file = generated_files_path.joinpath(STATE_FILE_NAME)
+        self.saved = None
+        self.state = self.load()
+
+    def load(self):
+        legacy_file = self.generated_files_path.joinpath(LEGACY_CURSOR_FILE_NAME)
+
+        try:
+            if self.state_file.is_file():
+                self.saved = self.state_file.read_bytes()
+                return json.loads(self.saved.decode('utf-8'))
+            if legacy_file.is_file():
+                return {'cursors': json.loads(legacy_file.read_text())}
+        except ValueError:
+            print('[WARNING] The file {} is corrupt. Logs will be collected from the start.'.format(
+                self.state_file.name))
+
+        return {}
+
+    @property
+    def cursors(self):
+        return self.state.setdefault('cursors', {})
+
+    # This method writes the state if it changed since it was read. The state is written to a temporary
+    # file and renamed, so an interrupted run never leaves behind a half written state file.
+    # Returns true if the file was written.
+    def save(self):
+        data = json.dumps(self.state, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        written = data != self.saved
+
+        if written:
+            temporary_file = self.state_file.with_name(STATE_FILE_NAME + '.tmp')
+            with temporary_file.open('wb') as file_object:
+                file_object.write(data)
+                file_object.flush()
+                os.fsync(file_object.fileno())
+            os.replace(str(temporary_file), str(self.state_file))
+            self.saved = data
+
+        legacy_file = self.generated_files_path.joinpath(LEGACY_CURSOR_FILE_NAME)
+        if legacy_file.is_file():
+            legacy_file.unlink()
+
+        return written
+
+
+# This method creates a directory for the temporary files of a run. tmpfs is used when it has enough
+# room, otherwise the directory is created in generated_files. The caller removes it when done.
+def scratch_directory(generated_files_path):
+    try:
+        file_system = os.statvfs(SCRATCH_ROOT)
+        if file_system.f_bavail * file_system.f_frsize >= SCRATCH_MIN_FREE:
+            return tempfile.mkdtemp(prefix='log_email_', dir=SCRATCH_ROOT)
+    except OSError:
+        pass
+
+    print('[WARNING] {} is not available. Temporary files are written to the SD card.'.format(SCRATCH_ROOT))
+    scratch_root = generated_files_path.joinpath(SCRATCH_DIRECTORY)
+    if not scratch_root.is_dir():
+        scratch_root.mkdir(parents=True)
+    return tempfile.mkdtemp(prefix='log_email_', dir=str(scratch_root))
+
+
+def remove_scratch_directory(scratch_path):
+    shutil.rmtree(str(scratch_path), ignore_errors=True)
+
+
+# Returns the number of bytes this process caused to be written to storage, or None if the kernel
+# does not report it. Writes to tmpfs are not counted, so this measures the writes to the SD card.
+def storage_write_bytes():
+    try:
+        with open('/proc/self/io', 'r') as file_object:
+            for line in file_object:
+                name, _, value = line.partition(':')
+                if name == 'write_bytes':
+                    return int(value)
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+# Returns the line of the status email reporting the bytes written to the SD card by the previous run.
+# The writes of the current run are not finished when the mail is written.
+def write_report(store):
+    previous_run = store.state.get('last_run')
+
+    if previous_run is None or previous_run['write_bytes'] is None:
+        return None
+
+    return 'Data written to the SD card by the previous status email: {:.1f} KB'.format(
+        previous_run['write_bytes'] / 1024)
+
+
+# This method records the bytes written to storage since start_bytes was measured. No time is recorded, so
+# the state of a run which wrote as much as the previous one is unchanged and not rewritten.
+def record_write_bytes(store, start_bytes):
+    end_bytes = storage_write_bytes()
+    write_bytes = end_bytes - start_bytes if start_bytes is not None and end_bytes is not None else None
+
+    store.state['last_run'] = {'write_bytes': write_bytes}
+    if write_bytes is not None:
+        print('[INFO] {:.1f} KB written to the SD card by this run'.format(write_bytes / 1024))
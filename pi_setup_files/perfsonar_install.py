@@ -5,14 +5,16 @@ import os
 import subprocess
 import sys
 
+import tracing
+
 
 def add_dependencies():
     print("Adding dependencies")
     # Get the source to download perfsonar if one not present already
     if not os.path.isfile('/etc/apt/sources.list.d/perfsonar-jessie-release.list'):
         try:
-            subprocess.check_output(['wget', '-P', '/etc/apt/sources.list.d/',
-                                     'http://downloads.perfsonar.net/debian/perfsonar-jessie-release.list'])
+            tracing.check_output(['wget', '-P', '/etc/apt/sources.list.d/',
+                                  'http://downloads.perfsonar.net/debian/perfsonar-jessie-release.list'])
         except subprocess.CalledProcessError as err:
             print("[Error] Error adding source. Cannot continue with perfsonar installation please install it manually")
             print(err)
@@ -22,7 +24,7 @@ def add_dependencies():
 
     # Add key
     try:
-        subprocess.check_call(
+        tracing.check_call(
             ['wget -qO - http://downloads.perfsonar.net/debian/perfsonar-debian-official.gpg.key | apt-key add -'],
             shell=True)
     except subprocess.CalledProcessError as err:
@@ -34,7 +36,7 @@ def add_dependencies():
 
     # Updating apt
     try:
-        subprocess.check_call(['apt-get', '-y', 'update'])
+        tracing.check_call(['apt-get', '-y', 'update'])
     except subprocess.CalledProcessError as err:
         print("[Error] apt update failed. Aborting installation. Please install perfsonar manually")
         print(err)
@@ -46,7 +48,7 @@ def install_perfsonar_testpoint():
 
     try:
         # Install from source added above
-        subprocess.call('sudo apt-get install --no-install-recommends perfsonar-testpoint -y', shell=True)
+        tracing.call('sudo apt-get install --no-install-recommends perfsonar-testpoint -y', shell=True)
     except subprocess.CalledProcessError as err:
         print("[Error] Installation failed. Please install it manually")
         print(err)
@@ -62,7 +64,7 @@ def install_additional_packages():
 
     print('Installing the following packages {}'.format(", ".join(packages)))
     try:
-        subprocess.check_call(['sudo', 'DEBIAN_FRONTEND=noninteractive', 'apt-get', '-y', 'install'] + packages)
+        tracing.check_call(['sudo', 'DEBIAN_FRONTEND=noninteractive', 'apt-get', '-y', 'install'] + packages)
 
     except subprocess.CalledProcessError as err:
         print("[Error] Cannot install additional packages. Please install them manually")
@@ -72,10 +74,14 @@ def install_additional_packages():
 
 def setup_perfsonar():
     # Call all the required functions
-    add_dependencies()
-    install_perfsonar_testpoint()
-    install_additional_packages()
+    with tracing.phase('perfsonar dependencies'):
+        add_dependencies()
+    with tracing.phase('perfsonar testpoint'):
+        install_perfsonar_testpoint()
+    with tracing.phase('perfsonar packages'):
+        install_additional_packages()
 
 
 if __name__ == '__main__':
+    tracing.start('perfsonar_install')
     setup_perfsonar()
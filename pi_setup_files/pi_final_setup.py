@@ -11,6 +11,7 @@ from pathlib import Path
 
 import pi_settings as settings
 import perfsonar_install as perfinst
+import tracing
 
 
 # Fetches arguments from the user
@@ -56,12 +57,12 @@ def fetch_arguments():
 # configure packages before restart causes exceptions.
 def upgrade_packages():
     print('Upgrading existing packages')
-    subprocess.check_call(['apt-get', '-y', 'upgrade'])
+    tracing.check_call(['apt-get', '-y', 'upgrade'])
 
 
 def update_packages():
     print('Updating apt')
-    subprocess.check_call(['apt-get', 'update'])
+    tracing.check_call(['apt-get', 'update'])
 
 
 # Installs all required packages for our application
@@ -76,12 +77,12 @@ def install_packages(http_setup):
 
     update_packages()
 
-    packages = ['isc-dhcp-server', 'nmap', 'git', 'apache2', 'python3-requests',
+    packages = ['isc-dhcp-server', 'git', 'apache2', 'python3-requests',
                 'iptables-persistent']
 
     print('Installing the following packages {}'.format(", ".join(packages)))
     try:
-        subprocess.check_call(['sudo', 'DEBIAN_FRONTEND=noninteractive', 'apt-get', '-y', 'install'] + packages)
+        tracing.check_call(['sudo', 'DEBIAN_FRONTEND=noninteractive', 'apt-get', '-y', 'install'] + packages)
     except subprocess.CalledProcessError as error:
         print("[ERROR] One of the packages is not correctly installed, please check the installation.")
         print(error)
@@ -109,11 +110,11 @@ def isc_dhcp_server_configuration():
     with open(dhcpd_file, 'w') as file_object:
         file_object.write(dhcp_config)
 
-    subprocess.check_output(['sed', '-i', '--',
-                             's|INTERFACESv4=""|INTERFACESv4="eth0"|g',
-                             '/etc/default/isc-dhcp-server'])
+    tracing.check_output(['sed', '-i', '--',
+                          's|INTERFACESv4=""|INTERFACESv4="eth0"|g',
+                          '/etc/default/isc-dhcp-server'])
     print('Restarting the dhcp server service')
-    subprocess.check_output(['service', 'isc-dhcp-server', 'restart'])
+    tracing.check_output(['service', 'isc-dhcp-server', 'restart'])
 
 
 # Sets up https configuration for apache
@@ -124,8 +125,8 @@ def certbot_tls_configuration(email_address, test):
     update_packages()
     # Install certbot package
     try:
-        subprocess.check_call(['sudo','DEBIAN_FRONTEND=noninteractive', 'apt-get', '-y', '--allow-unauthenticated', 'install', 'python-certbot-apache',
-                               '-t', 'stretch-backports'])
+        tracing.check_call(['sudo','DEBIAN_FRONTEND=noninteractive', 'apt-get', '-y', '--allow-unauthenticated', 'install', 'python-certbot-apache',
+                            '-t', 'stretch-backports'])
     except subprocess.CalledProcessError as error:
         print("[ERROR] One of the packages is not correctly installed, please check the installation.")
         print(error)
@@ -137,7 +138,7 @@ def certbot_tls_configuration(email_address, test):
 
     # Update DNS Record before getting certificate
     try:
-        subprocess.check_output('/etc/dns/dynv6.sh')
+        tracing.check_output('/etc/dns/dynv6.sh')
     except OSError:
         if 'No such file or directory':
             print('[Warning] No dynamic dns script detected.')
@@ -151,7 +152,7 @@ def certbot_tls_configuration(email_address, test):
 
     print('Setting up HTTPS support for the website')
     try:
-        subprocess.check_output(certbot_arguments)
+        tracing.check_output(certbot_arguments)
     except subprocess.CalledProcessError as error:
         print('[ERROR] Certbot setup failed due to following error. This setup shall proceed with configuring '
               'self-signed apache reverse proxy as an alternative')
@@ -191,7 +192,7 @@ def apache_http_configuration(proxy_config, auth_config, miscellaneous_headers,
                 file.write(write_contents)
 
     # Enabling the http virtual host
-    subprocess.check_output(['a2ensite', default_config_name])
+    tracing.check_output(['a2ensite', default_config_name])
 
 
 # https configuration common to certbot and self-signed setup
@@ -218,7 +219,7 @@ def apache_self_signed_configuration(ssl_config_file, email_address, domain_name
     # dh_param_file = 'dhparam.pem'
 
     # Enabling rewrite engine for apache2 https redirection
-    subprocess.check_output(['a2enmod', 'rewrite'])
+    tracing.check_output(['a2enmod', 'rewrite'])
 
     # Create folder for certificate and private keys
     try:
@@ -245,7 +246,7 @@ def apache_self_signed_configuration(ssl_config_file, email_address, domain_name
 
     # Generate certificate and key
     print('Generating a Self-Signed Certificate')
-    subprocess.check_output(cert_generation_command, shell=True)
+    tracing.check_output(cert_generation_command, shell=True)
 
     # Write to ssl virtual host file for apache
     contents = '<IfModule mod_ssl.c>\n<VirtualHost *:443>\n\tServerAdmin webmaster@localhost' \
@@ -293,9 +294,9 @@ def apache_https_configuration(proxy_config, auth_config, miscellaneous_headers,
         ssl_config_name = '000-default-minidmz-ssl.conf'
         ssl_config_file = ssl_config_path + ssl_config_name
         apache_self_signed_configuration(ssl_config_file, email_address, settings.DOMAIN_NAME)
-        subprocess.check_output(['a2enmod', 'ssl'])
+        tracing.check_output(['a2enmod', 'ssl'])
         # Enabling the http virtual host
-        subprocess.check_output(['a2ensite', ssl_config_name])
+        tracing.check_output(['a2ensite', ssl_config_name])
     else:
         ssl_config_file = '/etc/apache2/sites-available/000-default-le-ssl.conf'
         # OSCP stapling configured if certbot is used.
@@ -379,32 +380,32 @@ def saml_specific_configuration(domain_name, contact_email):
                         '/L=Bloomington/O=Indiana University/'
                         'OU=UITS/CN={}/emailAddress={}"').format(domain_name, contact_email)
 
-    subprocess.check_output(cert_gen_command, shell=True)
+    tracing.check_output(cert_gen_command, shell=True)
 
     # Setting the application entityID
-    subprocess.check_output(['sed', '-i', '--',
-                             's|ApplicationDefaults entityID="https://sp.example.org/shibboleth"|'
-                             'ApplicationDefaults entityID="{}"|g'.format(application_entity_id),
-                             sibboleth_config_file])
+    tracing.check_output(['sed', '-i', '--',
+                          's|ApplicationDefaults entityID="https://sp.example.org/shibboleth"|'
+                          'ApplicationDefaults entityID="{}"|g'.format(application_entity_id),
+                          sibboleth_config_file])
 
     # Setting the SSO entityID
-    subprocess.check_output(['sed', '-i', '--',
-                             's|SSO entityID="https://idp.example.org/idp/shibboleth"|'
-                             'SSO entityID="{}"|g'.format(sso_entity_id),
-                             sibboleth_config_file])
+    tracing.check_output(['sed', '-i', '--',
+                          's|SSO entityID="https://idp.example.org/idp/shibboleth"|'
+                          'SSO entityID="{}"|g'.format(sso_entity_id),
+                          sibboleth_config_file])
 
     # HTTPS configuration
-    subprocess.check_output(['sed', '-i', '--',
-                             's|handlerSSL="false"|handlerSSL="true"|g',
-                             sibboleth_config_file])
-    subprocess.check_output(['sed', '-i', '--',
-                             's|cookieProps="http"|cookieProps="https"|g',
-                             sibboleth_config_file])
+    tracing.check_output(['sed', '-i', '--',
+                          's|handlerSSL="false"|handlerSSL="true"|g',
+                          sibboleth_config_file])
+    tracing.check_output(['sed', '-i', '--',
+                          's|cookieProps="http"|cookieProps="https"|g',
+                          sibboleth_config_file])
 
     # Error contact configuration
-    subprocess.check_output(['sed', '-i', '--',
-                             's|supportContact="root@localhost"|supportContact="{}"|g'.format(contact_email),
-                             sibboleth_config_file])
+    tracing.check_output(['sed', '-i', '--',
+                          's|supportContact="root@localhost"|supportContact="{}"|g'.format(contact_email),
+                          sibboleth_config_file])
 
     metadata_value = '<MetadataProvider type="XML" reloadInterval="86400" uri="{}"/>'.format(metadata_uri)
 
@@ -412,7 +413,7 @@ def saml_specific_configuration(domain_name, contact_email):
     sed_command = ('s|<!-- Example of remotely supplied batch of signed metadata. -->|'
                    '<!-- Example of remotely supplied batch of signed metadata. -->{}|g').format(metadata_value)
 
-    subprocess.check_output(['sed', '-i', '--', sed_command, sibboleth_config_file])
+    tracing.check_output(['sed', '-i', '--', sed_command, sibboleth_config_file])
 
 
 # Creating configuration to proxy requests to the tomcat container
@@ -453,7 +454,7 @@ def apache_configuration(http_setup, self_signed_cert, email_id, saml):
     else:
         apache_https_configuration(proxy_config, auth_config, miscellaneous_headers, email_id, self_signed_cert)
 
-    subprocess.call(['apt-get', '-y', 'install'] + auth_packages)
+    tracing.call(['apt-get', '-y', 'install'] + auth_packages)
 
     apache_config_file = '/etc/apache2/apache2.conf'
     settings.backup_file(apache_config_file)
@@ -462,12 +463,12 @@ def apache_configuration(http_setup, self_signed_cert, email_id, saml):
         file.write(apache_signature_config)
 
     # Disabling directory browsing
-    subprocess.check_output(['sed', '-i', '--',
-                             's|Options Indexes FollowSymLinks|Options FollowSymLinks|g',
-                             apache_config_file])
+    tracing.check_output(['sed', '-i', '--',
+                          's|Options Indexes FollowSymLinks|Options FollowSymLinks|g',
+                          apache_config_file])
 
     # Enabling modules for proxying, HSTS and CAS
-    subprocess.check_output(['a2enmod', 'proxy_http', 'proxy_wstunnel', 'headers'] + auth_modules)
+    tracing.check_output(['a2enmod', 'proxy_http', 'proxy_wstunnel', 'headers'] + auth_modules)
 
     # Remove index file from /var/www/html
     try:
@@ -481,10 +482,10 @@ def apache_configuration(http_setup, self_signed_cert, email_id, saml):
 # Installing docker
 def docker_install():
     print('Installing Docker module')
-    subprocess.check_call('curl -sSL https://get.docker.com | sh', shell=True)
-    subprocess.check_output(['systemctl', 'enable', 'docker'])
-    subprocess.check_output(['systemctl', 'start', 'docker'])
-    subprocess.check_output(['usermod', '-aG', 'docker', 'pi'])
+    tracing.check_call('curl -sSL https://get.docker.com | sh', shell=True)
+    tracing.check_output(['systemctl', 'enable', 'docker'])
+    tracing.check_output(['systemctl', 'start', 'docker'])
+    tracing.check_output(['usermod', '-aG', 'docker', 'pi'])
 
 
 # Downloading our application from our git repository
@@ -497,8 +498,8 @@ def guacamole_configuration():
 
     git_command = 'git clone --branch master https://github.com/kausrini/Mini-ScienceDMZ.git {}'.format(path)
     print('Fetching the guacamole setup files from git repository')
-    subprocess.check_output(['runuser', '-l', 'pi', '-c', git_command])
-    subprocess.check_output(['chmod', '774', path + '/guacamole_setup_files/setup.py'])
+    tracing.check_output(['runuser', '-l', 'pi', '-c', git_command])
+    tracing.check_output(['chmod', '774', path + '/guacamole_setup_files/setup.py'])
 
 
 def restore_rules():
@@ -523,8 +524,14 @@ def setup_cronjobs():
     # Start docker containers on boot (Todo Python script for this with proper checks of existence of containers)
     cron_jobs_list = [
         '@reboot docker start sql_container\n',
+        '@reboot docker start $(docker ps -aq --filter name=guacd_container_)\n',
         '@reboot docker start guacamole_container\n',
-        '0 */6 * * * python3 /home/pi/minidmz/log_email/send_status.py\n'
+        '0 */6 * * * python3 /home/pi/minidmz/log_email/send_status.py\n',
+        '@reboot python3 /home/pi/minidmz/log_email/log_watch.py\n',
+        '@reboot python3 /home/pi/minidmz/guacamole_setup_files/lease_watch.py\n',
+        # Written by setup.py when the memory budget has a zram swap
+        '@reboot [ -x /home/pi/minidmz/generated_files/zram_swap.sh ] && '
+        '/home/pi/minidmz/generated_files/zram_swap.sh\n'
     ]
 
     # Add cronjob if the dynv6 script exists
@@ -537,12 +544,12 @@ def setup_cronjobs():
     with open(file_path, 'w') as file_object:
         file_object.write(''.join(cron_jobs_list))
 
-    subprocess.check_output(['crontab', file_path])
+    tracing.check_output(['crontab', file_path])
     os.remove(file_path)
 
     if os.path.isfile('/etc/firewall/iptables.sh'):
         # Add firewall rules
-        subprocess.check_output(['/etc/firewall/iptables.sh'])
+        tracing.check_output(['/etc/firewall/iptables.sh'])
 
     if not os.path.isfile('/etc/iptables/rules.v4'):
         open('/etc/iptables/rules.v4', 'a').close()
@@ -550,10 +557,10 @@ def setup_cronjobs():
         open('/etc/iptables/rules.v6', 'a').close()
 
         # Save IPv4 rules
-    subprocess.check_output(['su', 'root', '-c', '/sbin/iptables-save >> /etc/iptables/rules.v4'])
+    tracing.check_output(['su', 'root', '-c', '/sbin/iptables-save >> /etc/iptables/rules.v4'])
 
     # Save IPv6 rules
-    subprocess.check_output(['su', 'root', '-c', '/sbin/ip6tables-save >> /etc/iptables/rules.v6'])
+    tracing.check_output(['su', 'root', '-c', '/sbin/ip6tables-save >> /etc/iptables/rules.v6'])
 
     # These method will make sure that our firewall rules persist on reboot
     restore_rules()
@@ -561,38 +568,51 @@ def setup_cronjobs():
 
 # Rebooting the raspberry pi
 def clean_up_setup():
-    upgrade_packages()
+    with tracing.phase('upgrade packages'):
+        upgrade_packages()
+    tracing.finish()
     print('Rebooting the system in 5 seconds...')
     time.sleep(5)
-    subprocess.check_output(['reboot', 'now'])
+    tracing.check_output(['reboot', 'now'])
 
 
 if __name__ == '__main__':
     arguments = fetch_arguments()
+    tracing.start('pi_final_setup')
     settings.test_values()
-    if not settings.check_internet_connectivity():
-        sys.exit(1)
+    with tracing.phase('internet connectivity'):
+        if not settings.check_internet_connectivity():
+            sys.exit(1)
     email = arguments.email
     self_signed = arguments.self
-    install_packages(arguments.insecure or self_signed)
+    with tracing.phase('install packages'):
+        install_packages(arguments.insecure or self_signed)
 
     if arguments.perfsonar:
         # Installs perfsonar testpoint on the device
-        perfinst.setup_perfsonar()
-
-    isc_dhcp_server_configuration()
-    docker_install()
-    guacamole_configuration()
+        with tracing.phase('perfsonar'):
+            perfinst.setup_perfsonar()
+
+    with tracing.phase('dhcp server configuration'):
+        isc_dhcp_server_configuration()
+    with tracing.phase('docker install'):
+        docker_install()
+    with tracing.phase('guacamole files'):
+        guacamole_configuration()
     if not arguments.insecure or arguments.saml:
         if email is None:
             sys.stdout.write('\n\nPlease enter your email address : ')
             email = input()
         if not self_signed:
-            self_signed = certbot_tls_configuration(email, arguments.testing)
-    apache_configuration(arguments.insecure, self_signed, email, arguments.saml)
+            with tracing.phase('certbot'):
+                self_signed = certbot_tls_configuration(email, arguments.testing)
+    with tracing.phase('apache configuration'):
+        apache_configuration(arguments.insecure, self_signed, email, arguments.saml)
 
     if arguments.saml:
-        saml_specific_configuration(settings.DOMAIN_NAME, email)
+        with tracing.phase('saml configuration'):
+            saml_specific_configuration(settings.DOMAIN_NAME, email)
 
-    setup_cronjobs()
+    with tracing.phase('cron jobs and firewall'):
+        setup_cronjobs()
     clean_up_setup()
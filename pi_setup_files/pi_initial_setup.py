@@ -9,6 +9,7 @@ import time
 import sys
 
 import pi_settings as settings
+import tracing
 
 
 # Obtain absolute location of this python file
@@ -113,7 +114,7 @@ def pi_configuration():
     print('Please change the default Rapberry Pi password')
     while True:
         try:
-            subprocess.check_output('passwd pi', shell=True)
+            tracing.check_output('passwd pi', shell=True)
         except subprocess.CalledProcessError:
             print("[ERROR] Please try again!")
             continue
@@ -125,12 +126,12 @@ def pi_configuration():
         file_object.write('')
 
     # Changing default keyboard layout to 'US'
-    subprocess.check_output(['sed', '-i', '--',
-                             's|pc105|pc104|g',
-                             '/etc/default/keyboard'])
-    subprocess.check_output(['sed', '-i', '--',
-                             's|gb|us|g',
-                             '/etc/default/keyboard'])
+    tracing.check_output(['sed', '-i', '--',
+                          's|pc105|pc104|g',
+                          '/etc/default/keyboard'])
+    tracing.check_output(['sed', '-i', '--',
+                          's|gb|us|g',
+                          '/etc/default/keyboard'])
 
 
 # Create the firewall configuration for the raspberry pi
@@ -151,7 +152,7 @@ def firewall_configuration(base_path):
 
     # Changing file permissions
     os.chmod(firewall_path + firewall_script_name, 0o700)
-    subprocess.check_output(['chown', 'root', firewall_path + firewall_script_name])
+    tracing.check_output(['chown', 'root', firewall_path + firewall_script_name])
 
 
 # Create the dynamic dns configuration for the raspberry pi
@@ -178,7 +179,7 @@ def dns_configuration(base_path, wireless):
 
     # Changing file permissions
     os.chmod(path_name + file_name, 0o700)
-    subprocess.check_output(['chown', 'root', path_name + file_name])
+    tracing.check_output(['chown', 'root', path_name + file_name])
 
     with open(base_path + token_file_name, 'r') as file_object:
         data = file_object.readlines()
@@ -197,17 +198,17 @@ def dns_configuration(base_path, wireless):
                ).format(file_name))
         sys.exit()
 
-    subprocess.check_output(['sed', '-i', '--',
-                             's|token="YOUR_DYNV6_TOKEN_HERE"|token="' + dns_token + '"|g',
-                             path_name + file_name])
+    tracing.check_output(['sed', '-i', '--',
+                          's|token="YOUR_DYNV6_TOKEN_HERE"|token="' + dns_token + '"|g',
+                          path_name + file_name])
 
-    subprocess.check_output(['sed', '-i', '--',
-                             's|hostname="YOUR_DOMAIN_NAME_HERE"|hostname="' + settings.DOMAIN_NAME + '"|g',
-                             path_name + file_name])
+    tracing.check_output(['sed', '-i', '--',
+                          's|hostname="YOUR_DOMAIN_NAME_HERE"|hostname="' + settings.DOMAIN_NAME + '"|g',
+                          path_name + file_name])
 
-    subprocess.check_output(['sed', '-i', '--',
-                             's|device="YOUR_NETWORK_DEVICE_NAME_HERE"|device="' + device + '"|g',
-                             path_name + file_name])
+    tracing.check_output(['sed', '-i', '--',
+                          's|device="YOUR_NETWORK_DEVICE_NAME_HERE"|device="' + device + '"|g',
+                          path_name + file_name])
 
 
 # Create Wifi configuration for connecting to Wireless network or not if wired.
@@ -300,21 +301,29 @@ def network_configuration(wifi_ssid, wpa_username, wpa_password, no_dynamic_dns,
 
 # Rebooting the raspberry pi
 def clean_up_setup():
+    tracing.finish()
     print('Rebooting the system in 5 seconds...')
     time.sleep(5)
-    subprocess.check_output(['reboot', 'now'])
+    tracing.check_output(['reboot', 'now'])
 
 
 if __name__ == '__main__':
     arguments = fetch_argument()
+    tracing.start('pi_initial_setup')
     no_dns = arguments.nodns
     manual = arguments.manual
     settings.test_values()
     base_directory = file_directory()
-    ssid, username, password = fetch_wireless_parameters()
-    pi_configuration()
-    firewall_configuration(base_directory)
+    # Includes the time taken to answer the prompts
+    with tracing.phase('wireless prompts'):
+        ssid, username, password = fetch_wireless_parameters()
+    with tracing.phase('pi configuration'):
+        pi_configuration()
+    with tracing.phase('firewall configuration'):
+        firewall_configuration(base_directory)
     if not no_dns:
-        dns_configuration(base_directory, ssid)
-    network_configuration(ssid, username, password, no_dns, manual)
+        with tracing.phase('dns configuration'):
+            dns_configuration(base_directory, ssid)
+    with tracing.phase('network configuration'):
+        network_configuration(ssid, username, password, no_dns, manual)
     clean_up_setup()
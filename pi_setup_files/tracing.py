@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+# Timeline of a setup script. The phases of the script, the commands run in them and the docker api requests
+# are timed as spans, with the exit code and the size of the captured output of every command. The timeline is
+# written as json to generated_files after every phase, so it is kept when the script fails or reboots the
+# raspberry pi, and the slowest phases are printed as a table when the script ends.
+# Setting the environment variable MINIDMZ_PROFILE=1 also profiles the python code of the main thread with
+# cProfile, the statistics are saved next to the timeline.
+# Only the standard library is used, the raspberry pi setup scripts run it from the boot partition.
+
+import atexit
+import cProfile
+import io
+import json
+import os
+import pstats
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+GENERATED_FILES_DIRECTORY = '/home/pi/minidmz/generated_files'
+# Timelines of the runs before the repository is cloned, moved to generated_files by the first later run
+PENDING_DIRECTORY = '/var/tmp/minidmz_timelines'
+TIMELINE_FILE_NAME = '{}_timeline.json'
+PROFILE_FILE_NAME = '{}.prof'
+PROFILE_ENVIRONMENT = 'MINIDMZ_PROFILE'
+
+KIND_PHASE = 'phase'
+KIND_COMMAND = 'command'
+KIND_REQUEST = 'request'
+# The spans counted as the work done by a phase
+WORK_KINDS = (KIND_COMMAND, KIND_REQUEST)
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+
+# Only the first words of a command are recorded, the other arguments may hold passwords or tokens
+COMMAND_WORDS = 3
+SUMMARY_PHASES = 10
+PROFILE_FUNCTIONS = 15
+
+# State of the run, script is None until start is called
+run = {'script': None, 'directory': None, 'started': time.time(), 'origin': time.perf_counter(),
+       'profiler': None, 'finished': False, 'write_failed': False}
+spans = []
+lock = threading.Lock()
+# Stack of the open phases of every thread
+local = threading.local()
+
+
+# Returns the seconds since the start of the run
+def elapsed():
+    return time.perf_counter() - run['origin']
+
+
+# Returns the open phases of the current thread
+def phase_stack():
+    if not hasattr(local, 'phases'):
+        local.phases = []
+    return local.phases
+
+
+# Returns a new span, child of the innermost open phase of the current thread
+def open_span(name, kind):
+    stack = phase_stack()
+    with lock:
+        span = {
+            'id': len(spans),
+            'parent': stack[-1]['id'] if stack else None,
+            'kind': kind,
+            'name': name,
+            'start': elapsed(),
+            'seconds': None,
+            'status': None,
+            'exit_code': None,
+            'output_bytes': None,
+            'error': None,
+        }
+        spans.append(span)
+    return span
+
+
+def close_span(span, status, exit_code=None, error=None):
+    span['seconds'] = elapsed() - span['start']
+    span['status'] = status
+    span['exit_code'] = exit_code
+    span['error'] = error
+
+
+# Returns the recorded name of a command, its first words
+def command_name(args):
+    words = args.split() if isinstance(args, (str, bytes)) else [str(arg) for arg in args]
+    words = [word.decode('utf-8', 'replace') if isinstance(word, bytes) else word for word in words]
+    return ' '.join(words[:COMMAND_WORDS]) + (' ...' if len(words) > COMMAND_WORDS else '')
+
+
+# Popen recording every command as a span. The output size is only known for the output the script
+# captures, the output of check_call goes to the terminal.
+class TracedPopen(subprocess.Popen):
+
+    def __init__(self, args, *positional, **keywords):
+        self.span = open_span(command_name(args), KIND_COMMAND)
+        try:
+            super().__init__(args, *positional, **keywords)
+        except OSError as error:
+            close_span(self.span, STATUS_FAILED, error=str(error))
+            raise
+
+    def communicate(self, *positional, **keywords):
+        stdout, stderr = super().communicate(*positional, **keywords)
+        outputs = [output.encode('utf-8') if isinstance(output, str) else output
+                   for output in (stdout, stderr) if output is not None]
+        if outputs:
+            self.span['output_bytes'] = sum(len(output) for output in outputs)
+        return stdout, stderr
+
+    def wait(self, *positional, **keywords):
+        returncode = super().wait(*positional, **keywords)
+        if self.span['seconds'] is None:
+            close_span(self.span, STATUS_OK if returncode == 0 else STATUS_FAILED, exit_code=returncode)
+        return returncode
+
+
+# Returns the Popen class running a command for the current thread. Commands are only recorded while the
+# thread has a phase open.
+def popen_class():
+    return TracedPopen if phase_stack() else subprocess.Popen
+
+
+# The commands of the setup scripts run through these, which behave as the functions of the subprocess
+# module of the same name and record the command as a span of the current phase.
+def call(args, **keywords):
+    with popen_class()(args, **keywords) as process:
+        try:
+            return process.wait()
+        except BaseException:
+            process.kill()
+            raise
+
+
+def check_call(args, **keywords):
+    returncode = call(args, **keywords)
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args)
+    return 0
+
+
+def check_output(args, **keywords):
+    with popen_class()(args, stdout=subprocess.PIPE, **keywords) as process:
+        try:
+            output, _ = process.communicate()
+        except BaseException:
+            process.kill()
+            raise
+        returncode = process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, args, output=output)
+    return output
+
+
+# Times a docker api request. Set as the request_tracer of a DockerClient, the span ends when the response
+# headers arrive, a streamed response such as the output of a build is read afterwards.
+@contextmanager
+def request(name):
+    span = open_span(name, KIND_REQUEST)
+    try:
+        yield span
+    except BaseException as error:
+        close_span(span, STATUS_FAILED, error='{}: {}'.format(type(error).__name__, error))
+        raise
+    else:
+        close_span(span, STATUS_OK)
+
+
+# This method starts the timeline of the script. directory is the generated_files directory of the repository.
+# The timeline is written and the summary printed when the script exits, or before by finish.
+def start(script, directory=GENERATED_FILES_DIRECTORY):
+    run['script'] = script
+    run['directory'] = directory
+
+    if os.environ.get(PROFILE_ENVIRONMENT):
+        run['profiler'] = cProfile.Profile()
+        run['profiler'].enable()
+
+    atexit.register(finish)
+
+
+# Times the code of the with block and the commands it runs as a phase of the script. A phase fails when its
+# code raises an exception or exits, the exception is not handled.
+@contextmanager
+def phase(name):
+    span = open_span(name, KIND_PHASE)
+    stack = phase_stack()
+    stack.append(span)
+    try:
+        yield span
+    except SystemExit as error:
+        close_span(span, STATUS_FAILED, error='exited' if error.code is None else 'exited with {}'.format(error.code))
+        raise
+    except BaseException as error:
+        close_span(span, STATUS_FAILED, error='{}: {}'.format(type(error).__name__, error))
+        raise
+    else:
+        close_span(span, STATUS_OK)
+    finally:
+        stack.pop()
+        write_timeline()
+
+
+# Returns the function running function as a phase of the given name
+def traced(name, function):
+    def traced_function(*positional, **keywords):
+        with phase(name):
+            return function(*positional, **keywords)
+    return traced_function
+
+
+# This method gives the path the owner of the reference path, when the script runs as root. The setup
+# scripts run as root, setup.py as the pi user, which must still be able to write to generated_files.
+def match_owner(path, reference):
+    if os.geteuid() == 0:
+        status = os.stat(reference)
+        os.chown(path, status.st_uid, status.st_gid)
+
+
+# Returns the directory the timeline is written to. generated_files is only created once the repository is
+# cloned, the timelines written before are then moved into it.
+def timeline_directory():
+    directory = run['directory']
+    repository = os.path.dirname(os.path.realpath(directory))
+    if not os.path.isdir(repository):
+        os.makedirs(PENDING_DIRECTORY, exist_ok=True)
+        return PENDING_DIRECTORY
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+        match_owner(directory, repository)
+
+    # The pending timelines belong to root, they stay where they are when moved by another user
+    if os.path.isdir(PENDING_DIRECTORY):
+        try:
+            for file_name in os.listdir(PENDING_DIRECTORY):
+                shutil.move(os.path.join(PENDING_DIRECTORY, file_name), os.path.join(directory, file_name))
+                match_owner(os.path.join(directory, file_name), directory)
+            os.rmdir(PENDING_DIRECTORY)
+        except OSError:
+            pass
+    return directory
+
+
+# Returns the timeline document of the run
+def timeline():
+    with lock:
+        recorded = [dict(span, start=round(span['start'], 3),
+                         seconds=None if span['seconds'] is None else round(span['seconds'], 3)) for span in spans]
+    return {
+        'script': run['script'],
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(run['started'])),
+        'seconds': round(elapsed(), 3),
+        'finished': run['finished'],
+        'spans': recorded,
+    }
+
+
+# This method writes the timeline of the run. A timeline which cannot be written never stops the script.
+def write_timeline():
+    if run['script'] is None:
+        return
+
+    try:
+        directory = timeline_directory()
+        path = os.path.join(directory, TIMELINE_FILE_NAME.format(run['script']))
+        # Written aside and renamed, so a reboot never leaves half a timeline
+        with open(path + '.tmp', 'w') as file_object:
+            json.dump(timeline(), file_object, indent=2)
+        os.replace(path + '.tmp', path)
+        match_owner(path, directory)
+    except OSError as error:
+        if not run['write_failed']:
+            run['write_failed'] = True
+            print('[WARNING] Unable to write the timeline of {}. {}'.format(run['script'], error))
+
+
+# Returns the phases of the timeline, slowest first, with the number and seconds of the commands and docker
+# requests run in each phase and the phases it contains
+def slowest_phases(document):
+    by_id = {span['id']: span for span in document['spans']}
+    commands = {}
+    for span in document['spans']:
+        if span['kind'] not in WORK_KINDS:
+            continue
+        parent = by_id.get(span['parent'])
+        while parent is not None:
+            count, seconds = commands.get(parent['id'], (0, 0.0))
+            commands[parent['id']] = (count + 1, seconds + (span['seconds'] or 0.0))
+            parent = by_id.get(parent['parent'])
+
+    phases = [span for span in document['spans'] if span['kind'] == KIND_PHASE]
+    phases.sort(key=lambda span: span['seconds'] or 0.0, reverse=True)
+    return [(span, commands.get(span['id'], (0, 0.0))) for span in phases]
+
+
+# Returns the summary table of the slowest phases of the timeline
+def summary(document, count=SUMMARY_PHASES):
+    lines = ['\n{:<32} {:<8} {:>9} {:>9} {:>9}'.format('Phase', 'Status', 'Seconds', 'Commands', 'In cmds')]
+    for span, (commands, command_seconds) in slowest_phases(document)[:count]:
+        lines.append('{:<32} {:<8} {:>9.1f} {:>9} {:>9.1f}'.format(
+            span['name'][:32], span['status'] or 'running', span['seconds'] or 0.0, commands, command_seconds))
+
+    work_spans = [span for span in document['spans'] if span['kind'] in WORK_KINDS]
+    lines.append('{} took {:.1f} seconds, {:.1f} of them in {} commands and docker requests'.format(
+        document['script'], document['seconds'], sum(span['seconds'] or 0.0 for span in work_spans),
+        len(work_spans)))
+    return '\n'.join(lines)
+
+
+# This method saves the statistics of the profiler and prints the functions which took the most time
+def write_profile(profiler):
+    profiler.disable()
+    statistics_output = io.StringIO()
+    statistics = pstats.Stats(profiler, stream=statistics_output)
+    statistics.sort_stats('cumulative').print_stats(PROFILE_FUNCTIONS)
+    print(statistics_output.getvalue())
+
+    try:
+        path = os.path.join(timeline_directory(), PROFILE_FILE_NAME.format(run['script']))
+        statistics.dump_stats(path)
+        print('[INFO] The profile was saved to {}, read it with: python3 -m pstats {}'.format(path, path))
+    except OSError as error:
+        print('[WARNING] Unable to save the profile of {}. {}'.format(run['script'], error))
+
+
+# This method ends the timeline of the script: writes it and prints the slowest phases. Called before a
+# reboot, the timeline is otherwise finished when the script exits.
+def finish():
+    if run['script'] is None or run['finished']:
+        return
+    run['finished'] = True
+
+    if run['profiler'] is not None:
+        write_profile(run['profiler'])
+    write_timeline()
+    print(summary(timeline()))
+    sys.stdout.flush()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import artifact_cache
+
+CONTENT = b'guacamole archive'
+CONTENT_HASH = hashlib.sha256(CONTENT).hexdigest()
+
+APACHE_ARTIFACT = artifact_cache.Artifact('guacamole-0.9.14.war', ['https://mirror/guacamole-0.9.14.war'],
+                                          'https://archive/guacamole-0.9.14.war.sha256', ['guacamole'])
+CONNECTOR_ARTIFACT = artifact_cache.Artifact('mysql-connector-java-5.1.46.jar',
+                                             ['https://maven/mysql-connector-java-5.1.46.jar'],
+                                             'https://maven/mysql-connector-java-5.1.46.jar.sha1', ['guacamole'])
+UNPUBLISHED_ARTIFACT = artifact_cache.Artifact('guacamole-custom.tar.gz', ['https://mirror/guacamole-custom.tar.gz'],
+                                               None, ['guacamole'])
+
+
+class StubResponse:
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+        self.text = content.decode('utf-8')
+
+    def iter_content(self, chunk_size):
+        return iter([self.content])
+
+    def close(self):
+        pass
+
+
+# Answers every url from a dictionary of url to (status code, content). A missing url fails to connect.
+class StubSession:
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requested = []
+
+    def get(self, url, **keywords):
+        self.requested.append(url)
+        if url not in self.responses:
+            raise requests.ConnectionError('unreachable')
+        return StubResponse(*self.responses[url])
+
+
+class EnsureArtifactTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings_patch = mock.patch.object(artifact_cache.settings, 'ARTIFACT_SHA256', {})
+        self.settings_patch.start()
+
+    def tearDown(self):
+        self.settings_patch.stop()
+        self.directory.cleanup()
+
+    def cached(self, artifact):
+        return os.path.isfile(os.path.join(self.directory.name, artifact.name))
+
+    def test_published_checksum_is_verified_and_recorded(self):
+        pins = {}
+        session = StubSession({APACHE_ARTIFACT.urls[0]: (200, CONTENT),
+                               APACHE_ARTIFACT.checksum_url: (200, '{}  guacamole-0.9.14.war\n'.format(
+                                   CONTENT_HASH).encode('ascii'))})
+
+        description = artifact_cache.ensure_artifact(APACHE_ARTIFACT, self.directory.name, pins, session)
+
+        self.assertEqual(description, 'downloaded, verified against the published checksum')
+        self.assertEqual(pins, {APACHE_ARTIFACT.name: {'sha256': CONTENT_HASH,
+                                                       'checksum_url': APACHE_ARTIFACT.checksum_url}})
+        # The recorded hash verifies the cached file without the network
+        self.assertEqual(artifact_cache.ensure_artifact(APACHE_ARTIFACT, self.directory.name, pins, StubSession({})),
+                         'cached, verified against pins.json')
+
+    def test_unreachable_checksum_is_not_trusted(self):
+        session = StubSession({APACHE_ARTIFACT.urls[0]: (200, CONTENT)})
+
+        with self.assertRaises(artifact_cache.ArtifactError):
+            artifact_cache.ensure_artifact(APACHE_ARTIFACT, self.directory.name, {}, session)
+        self.assertFalse(self.cached(APACHE_ARTIFACT))
+        self.assertEqual(session.requested, [APACHE_ARTIFACT.checksum_url])
+
+    def test_missing_checksum_file_is_not_trusted(self):
+        session = StubSession({APACHE_ARTIFACT.urls[0]: (200, CONTENT), APACHE_ARTIFACT.checksum_url: (404, b'')})
+
+        with self.assertRaises(artifact_cache.ArtifactError):
+            artifact_cache.ensure_artifact(APACHE_ARTIFACT, self.directory.name, {}, session)
+        self.assertFalse(self.cached(APACHE_ARTIFACT))
+
+    def test_sha1_checksum_is_verified_and_recorded_as_sha256(self):
+        pins = {}
+        published = hashlib.sha1(CONTENT).hexdigest().encode('ascii')
+        session = StubSession({CONNECTOR_ARTIFACT.urls[0]: (200, CONTENT),
+                               CONNECTOR_ARTIFACT.checksum_url: (200, published)})
+
+        self.assertEqual(artifact_cache.ensure_artifact(CONNECTOR_ARTIFACT, self.directory.name, pins, session),
+                         'downloaded, verified against the published checksum')
+        self.assertEqual(pins, {CONNECTOR_ARTIFACT.name: {'sha256': CONTENT_HASH,
+                                                          'checksum_url': CONNECTOR_ARTIFACT.checksum_url}})
+
+        session.responses[CONNECTOR_ARTIFACT.checksum_url] = (200, hashlib.sha1(b'other').hexdigest().encode('ascii'))
+        with self.assertRaises(artifact_cache.ArtifactError):
+            artifact_cache.ensure_artifact(CONNECTOR_ARTIFACT, self.directory.name, {}, session)
+
+    def test_artifact_without_checksum_needs_a_pin(self):
+        session = StubSession({UNPUBLISHED_ARTIFACT.urls[0]: (200, CONTENT)})
+
+        with self.assertRaises(artifact_cache.ArtifactError):
+            artifact_cache.ensure_artifact(UNPUBLISHED_ARTIFACT, self.directory.name, {}, session)
+        self.assertFalse(self.cached(UNPUBLISHED_ARTIFACT))
+
+        artifact_cache.settings.ARTIFACT_SHA256[UNPUBLISHED_ARTIFACT.name] = CONTENT_HASH
+        self.assertEqual(artifact_cache.ensure_artifact(UNPUBLISHED_ARTIFACT, self.directory.name, {}, session),
+                         'downloaded, verified against settings.py')
+
+    def test_hash_recorded_on_first_use_is_ignored(self):
+        pins = {UNPUBLISHED_ARTIFACT.name: CONTENT_HASH}
+        with open(os.path.join(self.directory.name, UNPUBLISHED_ARTIFACT.name), 'wb') as file_object:
+            file_object.write(CONTENT)
+
+        with self.assertRaises(artifact_cache.ArtifactError):
+            artifact_cache.ensure_artifact(UNPUBLISHED_ARTIFACT, self.directory.name, pins, StubSession({}))
+
+    def test_mismatching_download_is_removed(self):
+        artifact_cache.settings.ARTIFACT_SHA256[APACHE_ARTIFACT.name] = '0' * 64
+        session = StubSession({APACHE_ARTIFACT.urls[0]: (200, CONTENT)})
+
+        with self.assertRaises(artifact_cache.ArtifactError):
+            artifact_cache.ensure_artifact(APACHE_ARTIFACT, self.directory.name, {}, session)
+        self.assertEqual(os.listdir(self.directory.name), [])
+
+
+class ArtifactsTest(unittest.TestCase):
+
+    def test_every_artifact_comes_over_https_with_a_published_checksum(self):
+        for artifact in artifact_cache.artifacts():
+            self.assertTrue(all(url.startswith('https://') for url in artifact.urls), artifact.name)
+            self.assertTrue(artifact.checksum_url.startswith('https://'), artifact.name)
+            self.assertIn(artifact_cache.checksum_algorithm(artifact.checksum_url), ('sha256', 'sha1'))
+
+    def test_checksum_of_the_expected_length_is_parsed(self):
+        sha1 = hashlib.sha1(CONTENT).hexdigest()
+
+        self.assertEqual(artifact_cache.parse_checksum(sha1, 'sha1'), sha1)
+        self.assertIsNone(artifact_cache.parse_checksum(sha1))
+        self.assertEqual(artifact_cache.parse_checksum('guacamole-0.9.14.war: {}\n'.format(
+            ' '.join(CONTENT_HASH[index:index + 8].upper() for index in range(0, 64, 8)))), CONTENT_HASH)
+
+
+if __name__ == '__main__':
+    unittest.main()
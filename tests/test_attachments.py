@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+import base64
+import email
+import gzip
+import os
+import random
+import smtplib
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'log_email'))
+import attachments
+
+
+# Records the commands of send_message. rcpt_codes gives the reply to every receiver, 250 by default.
+class RecordingSmtp:
+
+    def __init__(self, rcpt_codes=None):
+        self.rcpt_codes = rcpt_codes or {}
+        self.sent = b''
+        self.commands = []
+
+    def ehlo_or_helo_if_needed(self):
+        pass
+
+    def mail(self, sender):
+        self.commands.append('mail')
+        return 250, b'ok'
+
+    def rcpt(self, receiver):
+        self.commands.append('rcpt')
+        return self.rcpt_codes.get(receiver, 250), b'reply'
+
+    def rset(self):
+        self.commands.append('rset')
+
+    def docmd(self, command):
+        self.commands.append(command)
+        return 354, b'go ahead'
+
+    def send(self, data):
+        self.sent += data
+
+    def getreply(self):
+        return 250, b'queued'
+
+
+class AttachmentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.work_path = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Writes a log of random, hardly compressible lines
+    def write_log(self, name, size):
+        generator = random.Random(3)
+        log_file = self.work_path.joinpath(name)
+        with log_file.open('wb') as file_object:
+            written = 0
+            while written < size:
+                line = base64.b64encode(bytes(generator.getrandbits(8) for _ in range(90))) + b'\n'
+                file_object.write(line)
+                written += len(line)
+        return log_file
+
+    def write_file(self, name, size):
+        path = self.work_path.joinpath(name)
+        with path.open('wb') as file_object:
+            file_object.write(b'x' * size)
+        return path
+
+    def test_segments_stay_within_the_limit_and_split_on_lines(self):
+        log_file = self.write_log('syslog_diff.log', 400 * 1024)
+        output_path = self.work_path.joinpath('out')
+        output_path.mkdir()
+        size_limit = attachments.CHUNK_SIZE + 64 * 1024
+
+        segments = attachments.compress_attachment(log_file, output_path, size_limit)
+
+        self.assertGreater(len(segments), 2)
+        self.assertEqual([segment.name for segment in segments],
+                         ['syslog_diff.log.{}.gz'.format(number) for number in range(1, len(segments) + 1)])
+        contents = []
+        for segment in segments:
+            self.assertLessEqual(segment.stat().st_size, size_limit)
+            with gzip.open(str(segment), 'rb') as file_object:
+                contents.append(file_object.read())
+            self.assertTrue(contents[-1].endswith(b'\n'))
+        with log_file.open('rb') as file_object:
+            self.assertEqual(b''.join(contents), file_object.read())
+
+    def test_small_log_keeps_its_plain_name(self):
+        log_file = self.write_log('guacamole_diff.log', 4 * 1024)
+
+        segments = attachments.compress_attachment(log_file, self.work_path, 1024 * 1024)
+
+        self.assertEqual([segment.name for segment in segments], ['guacamole_diff.log.gz'])
+
+    def test_segment_limit_fits_the_encoded_segment_in_the_budget(self):
+        max_message_size = 1024 * 1024
+        limit = attachments.segment_limit(max_message_size)
+
+        self.assertLessEqual(attachments.MESSAGE_OVERHEAD + attachments.encoded_size(limit), max_message_size)
+        self.assertGreater(attachments.MESSAGE_OVERHEAD + attachments.encoded_size(limit + 1024), max_message_size)
+
+    def test_messages_are_packed_in_order_within_the_budget(self):
+        encoded_57k = attachments.encoded_size(57 * 1024)
+        max_message_size = attachments.MESSAGE_OVERHEAD + 2 * encoded_57k
+        files = [self.write_file('log.{}.gz'.format(number), 57 * 1024) for number in range(1, 6)]
+
+        groups = attachments.plan_messages(files, max_message_size)
+
+        self.assertEqual([[path.name for path in group] for group in groups],
+                         [['log.1.gz', 'log.2.gz'], ['log.3.gz', 'log.4.gz'], ['log.5.gz']])
+
+    def test_oversized_attachment_gets_a_message_of_its_own(self):
+        files = [self.write_file('small.gz', 1024), self.write_file('large.gz', 512 * 1024),
+                 self.write_file('tail.gz', 1024)]
+
+        groups = attachments.plan_messages(files, attachments.MESSAGE_OVERHEAD + 64 * 1024)
+
+        self.assertEqual([[path.name for path in group] for group in groups],
+                         [['small.gz'], ['large.gz'], ['tail.gz']])
+        self.assertEqual(attachments.plan_messages([], 1024 * 1024), [[]])
+
+    def test_written_message_carries_the_attachments(self):
+        attachment = self.write_log('syslog_diff.log', 8 * 1024)
+        message_file = self.work_path.joinpath('message.eml')
+
+        attachments.write_message(message_file, 'Device status (part 1/2)', 'pi@example.org',
+                                  ['admin@example.org'], 'Body text', [attachment])
+
+        with message_file.open('rb') as file_object:
+            message = email.message_from_bytes(file_object.read())
+        parts = [part for part in message.walk() if not part.is_multipart()]
+        self.assertEqual(message['Subject'], 'Device status (part 1/2)')
+        self.assertEqual(parts[0].get_payload(decode=True), b'Body text')
+        self.assertEqual(parts[1].get_filename(), 'syslog_diff.log')
+        with attachment.open('rb') as file_object:
+            self.assertEqual(parts[1].get_payload(decode=True), file_object.read())
+
+    def test_data_is_dot_stuffed_and_ends_with_crlf(self):
+        message_file = self.work_path.joinpath('message.eml')
+        with message_file.open('wb') as file_object:
+            file_object.write(b'Subject: test\r\n\r\n.hidden\r\n..two dots\nlast line')
+        smtp = RecordingSmtp()
+
+        refused = attachments.send_message(smtp, 'pi@example.org', ['admin@example.org'], message_file)
+
+        self.assertEqual(refused, {})
+        self.assertEqual(smtp.sent, b'Subject: test\r\n\r\n..hidden\r\n...two dots\r\nlast line\r\n.\r\n')
+        self.assertEqual(smtp.commands, ['mail', 'rcpt', 'data'])
+
+    def test_refused_receivers(self):
+        message_file = self.write_file('message.eml', 10)
+
+        smtp = RecordingSmtp({'gone@example.org': 550})
+        refused = attachments.send_message(smtp, 'pi@example.org', ['admin@example.org', 'gone@example.org'],
+                                           message_file)
+        self.assertEqual(list(refused), ['gone@example.org'])
+
+        smtp = RecordingSmtp({'admin@example.org': 550})
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            attachments.send_message(smtp, 'pi@example.org', ['admin@example.org'], message_file)
+        self.assertEqual(smtp.commands, ['mail', 'rcpt', 'rset'])
+        self.assertEqual(smtp.sent, b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
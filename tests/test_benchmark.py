@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+
+import gzip
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'log_email'))
+import benchmark
+import log_cursor
+
+
+class GenerateLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.work_path = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_rotations_are_gzipped_like_logrotate(self):
+        log_file, _, _ = benchmark.generate_log(self.work_path, 'syslog', benchmark.syslog_line, 256 * 1024, 1)
+
+        self.assertEqual([path.name for path in log_cursor.rotated_files(log_file)],
+                         ['syslog.1'] + ['syslog.{}.gz'.format(generation)
+                                         for generation in range(2, benchmark.ROTATIONS + 1)])
+        for generation in range(2, benchmark.ROTATIONS + 1):
+            with gzip.open(str(self.work_path.joinpath('syslog.{}.gz'.format(generation))), 'rb') as file_object:
+                self.assertTrue(file_object.read().endswith(b'\n'))
+
+    def test_collection_reads_every_generation(self):
+        for name, line_function in (('syslog', benchmark.syslog_line),
+                                    ('guacamole-json.log', benchmark.guacamole_line)):
+            log_file, cursors, window = benchmark.generate_log(self.work_path, name, line_function, 256 * 1024, 1)
+            diff_file = self.work_path.joinpath(name + '_diff.log')
+
+            self.assertEqual(log_cursor.collect(name, log_file, diff_file, cursors), window)
+            self.assertEqual(diff_file.stat().st_size, window)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import build_cache
+
+BUILD_ARGS = {'GUACAMOLE_VERSION': '0.9.14', 'MYSQL_CONNECTOR_VERSION': '5.1.46'}
+
+
+class ContextFingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.context = os.path.join(self.directory.name, 'dock')
+        self.write('Dockerfile', b'FROM guacamole/guacamole\n')
+        self.write('start.sh', b'#!/bin/sh\n', executable=True)
+        self.write(os.path.join('conf', 'guacamole.properties'), b'mysql-hostname: sql\n')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content, executable=False):
+        path = os.path.join(self.context, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file_object:
+            file_object.write(content)
+        os.chmod(path, 0o755 if executable else 0o644)
+
+    def fingerprint(self, build_args=BUILD_ARGS, overrides=None, context=None):
+        return build_cache.context_fingerprint(context or self.context, build_args, overrides)
+
+    def test_fingerprint_is_stable(self):
+        fingerprint = self.fingerprint()
+
+        self.assertEqual(self.fingerprint(), fingerprint)
+        self.assertEqual(self.fingerprint(dict(reversed(list(BUILD_ARGS.items())))), fingerprint)
+
+        # The same context elsewhere, with its files created in another order
+        copy = os.path.join(self.directory.name, 'copy')
+        os.makedirs(os.path.join(copy, 'conf'))
+        for name in (os.path.join('conf', 'guacamole.properties'), 'start.sh', 'Dockerfile'):
+            shutil.copy2(os.path.join(self.context, name), os.path.join(copy, name))
+        self.assertEqual(self.fingerprint(context=copy), fingerprint)
+
+    def test_file_change_changes_the_fingerprint(self):
+        fingerprints = {self.fingerprint()}
+
+        self.write(os.path.join('conf', 'guacamole.properties'), b'mysql-hostname: db\n')
+        fingerprints.add(self.fingerprint())
+        self.write('entrypoint.sh', b'')
+        fingerprints.add(self.fingerprint())
+        os.rename(os.path.join(self.context, 'entrypoint.sh'), os.path.join(self.context, 'conf', 'entrypoint.sh'))
+        fingerprints.add(self.fingerprint())
+        os.chmod(os.path.join(self.context, 'start.sh'), stat.S_IRUSR | stat.S_IWUSR)
+        fingerprints.add(self.fingerprint())
+
+        self.assertEqual(len(fingerprints), 5)
+
+    def test_build_arg_change_changes_the_fingerprint(self):
+        fingerprint = self.fingerprint()
+
+        self.assertNotEqual(self.fingerprint(dict(BUILD_ARGS, GUACAMOLE_VERSION='1.0.0')), fingerprint)
+        self.assertNotEqual(self.fingerprint(dict(BUILD_ARGS, EXTRA='1')), fingerprint)
+        self.assertNotEqual(self.fingerprint(None), fingerprint)
+
+    def test_override_counts_as_the_file_about_to_be_written(self):
+        expected = self.fingerprint(overrides={'user-mapping.xml': b'<user-mapping/>'})
+
+        self.assertNotEqual(self.fingerprint(), expected)
+        self.assertNotEqual(self.fingerprint(overrides={'user-mapping.xml': b'<user-mapping></user-mapping>'}),
+                            expected)
+
+        self.write('user-mapping.xml', b'<user-mapping/>')
+        self.assertEqual(self.fingerprint(), expected)
+        # The written file is replaced by the override
+        self.assertEqual(self.fingerprint(overrides={'user-mapping.xml': b'<user-mapping/>'}), expected)
+        self.assertNotEqual(self.fingerprint(overrides={'user-mapping.xml': b''}), expected)
+
+    def test_staged_file_counts_as_the_file_about_to_be_linked(self):
+        cached = os.path.join(self.directory.name, 'guacamole-0.9.14.war')
+        with open(cached, 'wb') as file_object:
+            file_object.write(b'war')
+        os.chmod(cached, 0o644)
+        expected = build_cache.context_fingerprint(self.context, BUILD_ARGS, staged_files={'guacamole.war': cached})
+
+        self.assertNotEqual(self.fingerprint(), expected)
+        self.assertNotIn('guacamole.war', os.listdir(self.context))
+
+        os.link(cached, os.path.join(self.context, 'guacamole.war'))
+        self.assertEqual(self.fingerprint(), expected)
+
+
+class FakeDocker:
+
+    def __init__(self, images):
+        self.images = images
+
+    def inspect_image(self, tag):
+        return self.images.get(tag)
+
+
+class ImageFingerprintTest(unittest.TestCase):
+
+    def test_label_of_the_image(self):
+        docker = FakeDocker({'minidmz/guacamole': {'Config': {'Labels': {build_cache.FINGERPRINT_LABEL: 'abc'}}},
+                             'minidmz/unlabelled': {'Config': {'Labels': None}}})
+
+        self.assertEqual(build_cache.image_fingerprint(docker, 'minidmz/guacamole'), 'abc')
+        self.assertIsNone(build_cache.image_fingerprint(docker, 'minidmz/unlabelled'))
+        self.assertIsNone(build_cache.image_fingerprint(docker, 'minidmz/missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
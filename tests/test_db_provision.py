@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import re
+import sqlite3
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import db_provision
+import settings
+import setup
+from db_provision import GuacdPool, ProvisionError
+
+HOSTILE_VALUES = ["O'Brien", "x'; DROP TABLE guacamole_user; --", 'back\\slash', "\\'", 'line\nbreak\r', 'nul\0byte',
+                  '%_wildcards', '']
+
+MYSQL_ESCAPES = {'0': '\0', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a', 'b': '\b'}
+MYSQL_LITERAL = re.compile(r"'((?:[^'\\]|\\.)*)'", re.DOTALL)
+
+
+# Decodes the content of a mysql string literal the way the mysql server reads it
+def mysql_unescape(content):
+    return re.sub(r'\\(.)', lambda match: MYSQL_ESCAPES.get(match.group(1), match.group(1)), content, flags=re.DOTALL)
+
+
+# Returns the value as a sqlite string expression. sqlite takes no nul character in the statement text.
+def sqlite_string(value):
+    return ' || char(0) || '.join("'{}'".format(part.replace("'", "''")) for part in value.split('\0'))
+
+
+# Rewrites the mysql statements of db_provision for sqlite: the string literals, START TRANSACTION, INSERT IGNORE,
+# ON DUPLICATE KEY UPDATE and the backslash escape of LIKE. ELT and MOD are registered as functions of the
+# connection.
+def sqlite_statement(statement):
+    if statement == 'START TRANSACTION':
+        return 'BEGIN'
+    statement = MYSQL_LITERAL.sub(lambda match: sqlite_string(mysql_unescape(match.group(1))), statement)
+    statement = statement.replace('INSERT IGNORE INTO', 'INSERT OR IGNORE INTO')
+    statement = statement.replace(
+        'ON DUPLICATE KEY UPDATE guacamole_connection_parameter.parameter_value = VALUES(parameter_value)',
+        'ON CONFLICT (connection_id, parameter_name) DO UPDATE SET parameter_value = excluded.parameter_value')
+    return re.sub(r"(LIKE '(?:[^']|'')*')", r"\1 ESCAPE '\\'", statement)
+
+
+# In-memory database with the guacamole tables the connection scripts use
+def guacamole_database():
+    # Without isolation level the transactions are those of the scripts
+    database = sqlite3.connect(':memory:', isolation_level=None)
+    database.create_function('ELT', -1, lambda index, *values: values[index - 1] if 0 < index <= len(values) else None)
+    database.create_function('MOD', 2, lambda value, divisor: value % divisor)
+    database.executescript('''
+        CREATE TABLE guacamole_connection (
+            connection_id INTEGER PRIMARY KEY AUTOINCREMENT, connection_name TEXT NOT NULL, parent_id INTEGER,
+            protocol TEXT NOT NULL, max_connections_per_user INTEGER, proxy_hostname TEXT, proxy_port INTEGER,
+            UNIQUE (connection_name, parent_id));
+        CREATE TABLE guacamole_connection_parameter (
+            connection_id INTEGER NOT NULL, parameter_name TEXT NOT NULL, parameter_value TEXT NOT NULL,
+            PRIMARY KEY (connection_id, parameter_name));
+    ''')
+    return database
+
+
+def run_script(database, script):
+    for statement in script.split(';\n'):
+        if statement.strip():
+            database.execute(sqlite_statement(statement.strip().rstrip(';')))
+
+
+def connections(database):
+    return database.execute('SELECT connection_name, proxy_hostname FROM guacamole_connection '
+                            'ORDER BY connection_id').fetchall()
+
+
+def parameters(database, name):
+    return dict(database.execute('SELECT parameter_name, parameter_value FROM guacamole_connection_parameter '
+                                 'JOIN guacamole_connection USING (connection_id) WHERE connection_name = ?',
+                                 (name,)).fetchall())
+
+
+class SqlStringTest(unittest.TestCase):
+
+    def test_hostile_values_stay_inside_the_literal(self):
+        for value in HOSTILE_VALUES:
+            literal = db_provision.sql_string(value)
+
+            match = MYSQL_LITERAL.match(literal)
+            self.assertEqual(match.end(), len(literal), literal)
+            self.assertEqual(mysql_unescape(match.group(1)), value)
+            self.assertNotIn('\n', literal)
+
+    def test_hostile_values_are_stored_as_they_are(self):
+        database = guacamole_database()
+        equipment = [('aa:bb:cc:dd:ee:{:02x}'.format(number), value) for number, value in enumerate(HOSTILE_VALUES)]
+
+        run_script(database, db_provision.connections_script(equipment))
+
+        for mac_address, value in equipment:
+            self.assertEqual(parameters(database, db_provision.connection_name(mac_address))['hostname'], value)
+        self.assertEqual(database.execute('SELECT COUNT(*) FROM guacamole_connection').fetchone(),
+                         (len(HOSTILE_VALUES),))
+
+
+class ScriptsTest(unittest.TestCase):
+
+    def test_connection_is_named_after_the_lower_case_mac_address(self):
+        self.assertEqual(db_provision.connection_name('AA:BB:CC:DD:EE:FF'), 'RDP_Connection_aa:bb:cc:dd:ee:ff')
+        self.assertEqual(db_provision.connection_name(None), db_provision.CONNECTION_NAME)
+
+    def test_new_hostname_updates_the_existing_parameter(self):
+        database = guacamole_database()
+        name = db_provision.connection_name('aa:bb:cc:dd:ee:ff')
+
+        run_script(database, db_provision.connections_script([('aa:bb:cc:dd:ee:ff', '10.0.0.5')]))
+        # Changed by the administrator, kept by the next runs
+        database.execute("UPDATE guacamole_connection_parameter SET parameter_value = '/srv/drive' "
+                         "WHERE parameter_name = 'drive-path'")
+        run_script(database, db_provision.connections_script([('aa:bb:cc:dd:ee:ff', '10.0.0.9')]))
+
+        self.assertEqual(connections(database), [(name, None)])
+        self.assertEqual(parameters(database, name), {'hostname': '10.0.0.9', 'port': db_provision.RDP_PORT,
+                                                      'enable-drive': 'true', 'drive-path': '/srv/drive',
+                                                      'create-drive-path': 'true'})
+
+    def test_connection_in_a_group_is_left_alone(self):
+        database = guacamole_database()
+        name = db_provision.connection_name('aa:bb:cc:dd:ee:ff')
+        database.execute("INSERT INTO guacamole_connection (connection_name, parent_id, protocol) "
+                         "VALUES (?, 7, 'rdp')", (name,))
+
+        run_script(database, db_provision.connections_script([('aa:bb:cc:dd:ee:ff', '10.0.0.5')]))
+
+        self.assertEqual(database.execute('SELECT parent_id FROM guacamole_connection WHERE connection_name = ? '
+                                          'ORDER BY connection_id', (name,)).fetchall(), [(7,), (None,)])
+        self.assertEqual(database.execute('SELECT COUNT(*) FROM guacamole_connection_parameter WHERE '
+                                          'connection_id = 1').fetchone(), (0,))
+
+    def test_seed_runs_in_one_transaction(self):
+        script = db_provision.seed_script("admin'--", [('aa:bb:cc:dd:ee:ff', '10.0.0.5')],
+                                          GuacdPool('guacd', ['guacd']))
+        statements = script.strip().split('\n')
+
+        self.assertEqual((statements[0], statements[-1]), ('START TRANSACTION;', 'COMMIT;'))
+        self.assertEqual(script.count('COMMIT;'), 1)
+        self.assertIn("INSERT INTO guacamole_user (username, password_date) VALUES ('admin\\'--', NOW());", script)
+        self.assertLess(script.index('SET @user_id = LAST_INSERT_ID();'),
+                        script.index('INSERT INTO guacamole_system_permission'))
+        self.assertIn("WHERE username = 'guacadmin'", script)
+
+    def test_update_renames_the_connection_of_earlier_setups_once(self):
+        script = db_provision.update_script([('AA:BB:CC:DD:EE:FF', '10.0.0.5'), ('aa:bb:cc:dd:ee:01', '10.0.0.6')],
+                                            GuacdPool('guacd', ['guacd']))
+
+        self.assertIn("SET @connection_exists = (SELECT COUNT(*) FROM guacamole_connection WHERE connection_name = "
+                      "'RDP_Connection_aa:bb:cc:dd:ee:ff' AND parent_id IS NULL);", script)
+        self.assertIn("UPDATE guacamole_connection SET connection_name = 'RDP_Connection_aa:bb:cc:dd:ee:ff' WHERE "
+                      "connection_name = 'RDP_Connection' AND parent_id IS NULL AND @connection_exists = 0;", script)
+        self.assertEqual(script.count('UPDATE guacamole_connection SET connection_name'), 1)
+        self.assertTrue(script.startswith('START TRANSACTION;\n') and script.endswith('COMMIT;\n'))
+
+    def test_update_without_equipment_only_assigns_the_proxies(self):
+        script = db_provision.update_script([], GuacdPool('guacd', ['guacd']))
+
+        self.assertNotIn('INSERT', script)
+        self.assertNotIn('connection_name =', script)
+        self.assertIn('UPDATE guacamole_connection SET proxy_hostname = NULL', script)
+
+    def test_hostnames_are_updated_and_existing_connections_listed(self):
+        script = db_provision.hostnames_script([('aa:bb:cc:dd:ee:ff', "10.0.0.5'"), ('aa:bb:cc:dd:ee:01', '10.0.0.6')])
+        statements = script.strip().split('\n')
+
+        self.assertEqual(statements[0], 'START TRANSACTION;')
+        self.assertEqual(statements[3], 'COMMIT;')
+        self.assertIn("SET parameter_value = '10.0.0.5\\'' WHERE connection_name = 'RDP_Connection_aa:bb:cc:dd:ee:ff'",
+                      statements[1])
+        self.assertNotIn('INSERT', script)
+        self.assertEqual(statements[4], "SELECT connection_name FROM guacamole_connection WHERE parent_id IS NULL AND "
+                                        "connection_name IN ('RDP_Connection_aa:bb:cc:dd:ee:ff', "
+                                        "'RDP_Connection_aa:bb:cc:dd:ee:01');")
+
+
+
+# Returns n equipment with their mac and ip addresses
+def equipment_list(count, network='10.0.0'):
+    return [('aa:bb:cc:dd:ee:{:02x}'.format(number), '{}.{}'.format(network, number + 10)) for number in range(count)]
+
+
+class ConnectionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = guacamole_database()
+
+    def hostnames(self):
+        return [parameters(self.database, name)['hostname'] for name, _ in connections(self.database)]
+
+    def test_no_equipment_changes_nothing(self):
+        self.assertEqual(db_provision.connections_script([]), '')
+
+        run_script(self.database, db_provision.update_script([], setup.guacd_pool()))
+        self.assertEqual(connections(self.database), [])
+
+    def test_every_equipment_gets_one_connection(self):
+        for count in (1, 5):
+            database = guacamole_database()
+            equipment = equipment_list(count)
+
+            run_script(database, db_provision.connections_script(equipment))
+
+            self.assertEqual([name for name, _ in connections(database)],
+                             [db_provision.connection_name(mac_address) for mac_address, _ in equipment])
+            self.assertEqual(database.execute('SELECT COUNT(*) FROM guacamole_connection_parameter').fetchone(),
+                             (count * (len(db_provision.connection_parameters()) + 1),))
+
+    def test_rerun_is_idempotent(self):
+        script = db_provision.connections_script(equipment_list(3))
+
+        run_script(self.database, script)
+        tables = [self.database.execute('SELECT * FROM {} ORDER BY 1, 2'.format(table)).fetchall()
+                  for table in ('guacamole_connection', 'guacamole_connection_parameter')]
+        run_script(self.database, script)
+
+        self.assertEqual([self.database.execute('SELECT * FROM {} ORDER BY 1, 2'.format(table)).fetchall()
+                          for table in ('guacamole_connection', 'guacamole_connection_parameter')], tables)
+
+    def test_new_equipment_is_added_and_known_equipment_moves(self):
+        run_script(self.database, db_provision.connections_script(equipment_list(2)))
+
+        run_script(self.database, db_provision.connections_script(equipment_list(3, network='10.0.1')))
+
+        self.assertEqual(len(connections(self.database)), 3)
+        self.assertEqual(self.hostnames(), ['10.0.1.10', '10.0.1.11', '10.0.1.12'])
+
+    def test_equipment_gone_keeps_its_connection(self):
+        run_script(self.database, db_provision.connections_script(equipment_list(3)))
+
+        run_script(self.database, db_provision.connections_script(equipment_list(1, network='10.0.1')))
+
+        self.assertEqual(self.hostnames(), ['10.0.1.10', '10.0.0.11', '10.0.0.12'])
+
+
+class ProxiesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.database = guacamole_database()
+        run_script(self.database, db_provision.connections_script(equipment_list(6)))
+
+    def assign(self, instances):
+        with mock.patch.object(settings, 'GUACD_INSTANCES', instances):
+            pool = setup.guacd_pool()
+            run_script(self.database, db_provision.proxies_script(pool))
+        return pool
+
+    def proxies(self):
+        return [proxy for _, proxy in connections(self.database)]
+
+    def test_single_guacd_uses_the_guacd_of_the_properties(self):
+        self.assign(1)
+
+        self.assertEqual(self.proxies(), [None] * 6)
+        self.assertEqual(self.database.execute('SELECT DISTINCT proxy_port FROM guacamole_connection').fetchall(),
+                         [(None,)])
+
+    def test_connections_are_spread_over_the_pool(self):
+        pool = self.assign(3)
+
+        self.assertEqual(pool.hostnames, ['guacd_container_0', 'guacd_container_1', 'guacd_container_2'])
+        self.assertEqual(self.proxies(), ['guacd_container_1', 'guacd_container_2', 'guacd_container_0'] * 2)
+        self.assertEqual(self.database.execute('SELECT DISTINCT proxy_port FROM guacamole_connection').fetchall(),
+                         [(db_provision.GUACD_PORT,)])
+
+        self.assign(3)
+        self.assertEqual(self.proxies(), ['guacd_container_1', 'guacd_container_2', 'guacd_container_0'] * 2)
+
+    def test_resized_pool_reassigns_its_connections_only(self):
+        self.assign(3)
+        self.database.execute("UPDATE guacamole_connection SET proxy_hostname = 'remote_guacd' WHERE connection_id = 1")
+        # The underscores of the prefix are not wildcards
+        self.database.execute("UPDATE guacamole_connection SET proxy_hostname = 'guacdXcontainerX9' "
+                              "WHERE connection_id = 2")
+
+        self.assign(2)
+        self.assertEqual(self.proxies(), ['remote_guacd', 'guacdXcontainerX9', 'guacd_container_1',
+                                          'guacd_container_0', 'guacd_container_1', 'guacd_container_0'])
+
+        self.assign(1)
+        self.assertEqual(self.proxies(), ['remote_guacd', 'guacdXcontainerX9', None, None, None, None])
+
+
+# Stand-in mysql client. It records its arguments, password and statements, stops at the first statement
+# containing the failing text like the real client does, and prints the rows for the select of the connections.
+MYSQL = '''#!{python}
+import json
+import os
+import sys
+
+with open({calls!r}, 'a') as file_object:
+    file_object.write(json.dumps({{'arguments': sys.argv[1:], 'password': os.environ.get('MYSQL_PWD')}}) + '\\n')
+
+for statement in sys.stdin.read().split(';\\n'):
+    statement = statement.strip()
+    if not statement:
+        continue
+    with open({statements!r}, 'a') as file_object:
+        file_object.write(json.dumps(statement) + '\\n')
+    if {failing!r} and {failing!r} in statement:
+        sys.stderr.write('ERROR 1146 (42S02) at line 3: Table doesn\\'t exist\\n')
+        sys.exit(1)
+    if statement.startswith('SELECT connection_name'):
+        for row in {rows!r}:
+            print(row)
+'''
+
+
+# Docker client running the commands of docker exec on the host, with the files of put_files in a folder
+class LocalDocker:
+
+    def __init__(self, path):
+        self.path = path
+
+    def put_files(self, container, path, files, mode=0o600):
+        for name, content in files.items():
+            with open(os.path.join(path, name), 'wb') as file_object:
+                file_object.write(content)
+            os.chmod(os.path.join(path, name), mode)
+
+    def exec_run(self, container, command, environment=None, stream_output=True):
+        process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 env=dict(environment or {}, PATH=self.path))
+        return process.returncode, process.stdout
+
+
+class RunScriptsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.provision_directory = os.path.join(self.directory.name, 'tmp')
+        self.schema_directory = os.path.join(self.directory.name, 'initdb')
+        self.bin_directory = os.path.join(self.directory.name, 'bin')
+        for path in (self.provision_directory, self.schema_directory, self.bin_directory):
+            os.mkdir(path)
+        with open(os.path.join(self.schema_directory, '001-create-schema.sql'), 'w') as file_object:
+            file_object.write('CREATE TABLE guacamole_connection (connection_id int);\n')
+
+        self.patches = [mock.patch.object(db_provision, 'PROVISION_DIRECTORY', self.provision_directory),
+                        mock.patch.object(db_provision, 'SCHEMA_FILES', os.path.join(self.schema_directory, '*.sql'))]
+        for patch in self.patches:
+            patch.start()
+        self.docker = LocalDocker(self.bin_directory + os.pathsep + os.environ['PATH'])
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.directory.cleanup()
+
+    def install_mysql(self, failing='', rows=()):
+        mysql = os.path.join(self.bin_directory, 'mysql')
+        with open(mysql, 'w') as file_object:
+            file_object.write(MYSQL.format(python=sys.executable, calls=self.path('calls'),
+                                           statements=self.path('statements'), failing=failing, rows=list(rows)))
+        os.chmod(mysql, os.stat(mysql).st_mode | stat.S_IXUSR)
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def read_lines(self, name):
+        if not os.path.exists(self.path(name)):
+            return []
+        with open(self.path(name), 'r') as file_object:
+            return [json.loads(line) for line in file_object]
+
+    def provision(self):
+        db_provision.provision_database(self.docker, 'sql', 'root secret', 'user secret', 'admin',
+                                        [('aa:bb:cc:dd:ee:ff', '10.0.0.5')], GuacdPool('guacd', ['guacd']))
+
+    def test_scripts_and_schema_are_piped_in_order(self):
+        self.install_mysql()
+
+        self.provision()
+
+        statements = self.read_lines('statements')
+        self.assertEqual(statements[0], 'CREATE DATABASE guacamole_db')
+        schema = statements.index('CREATE TABLE guacamole_connection (connection_id int)')
+        self.assertLess(statements.index('USE guacamole_db'), schema)
+        self.assertLess(schema, statements.index('START TRANSACTION'))
+        self.assertEqual(statements[-1], 'COMMIT')
+
+        call, = self.read_lines('calls')
+        self.assertEqual(call['password'], 'root secret')
+        self.assertNotIn('root secret', ' '.join(call['arguments']))
+        self.assertEqual(os.listdir(self.provision_directory), [])
+
+    def test_failing_statement_stops_before_the_commit(self):
+        self.install_mysql(failing='INSERT INTO guacamole_user ')
+
+        with self.assertRaises(ProvisionError) as raised:
+            self.provision()
+
+        self.assertIn('exit code 1', str(raised.exception))
+        self.assertIn('ERROR 1146', str(raised.exception))
+        statements = self.read_lines('statements')
+        self.assertIn('START TRANSACTION', statements)
+        # The client quits without committing, so mysql rolls the seed transaction back
+        self.assertNotIn('COMMIT', statements)
+        self.assertEqual(os.listdir(self.provision_directory), [])
+
+    def test_schema_glob_matching_nothing_fails_before_mysql_runs(self):
+        self.install_mysql()
+        os.remove(os.path.join(self.schema_directory, '001-create-schema.sql'))
+
+        with self.assertRaises(ProvisionError) as raised:
+            self.provision()
+
+        self.assertIn('{} is missing'.format(db_provision.SCHEMA_FILES), str(raised.exception))
+        self.assertEqual(self.read_lines('calls'), [])
+        self.assertEqual(os.listdir(self.provision_directory), [])
+
+    def test_hostnames_of_the_existing_connections_are_returned(self):
+        self.install_mysql(rows=['RDP_Connection_aa:bb:cc:dd:ee:01'])
+
+        known = db_provision.update_hostnames(self.docker, 'sql', 'user secret', [('aa:bb:cc:dd:ee:ff', '10.0.0.5'),
+                                                                                  ('AA:BB:CC:DD:EE:01', '10.0.0.6')])
+
+        self.assertEqual(known, ['AA:BB:CC:DD:EE:01'])
+        call, = self.read_lines('calls')
+        self.assertIn('--user={}'.format(db_provision.DATABASE_USER), call['arguments'])
+        self.assertEqual(call['arguments'][-1], db_provision.DATABASE_NAME)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import dhcp_leases
+
+# Thu May 03 2018 18:00:00 UTC
+NOW = 1525370400
+
+HEADER = '''# The format of this file is documented in the dhcpd.leases(5) manual page.
+# This lease file was written by isc-dhcp-4.3.5
+
+authoring-byte-order little-endian;
+
+'''
+
+
+def lease_block(ip_address, mac_address, starts='epoch {}'.format(NOW - 600), ends='epoch {}'.format(NOW + 600),
+                binding_state='active', hostname=None):
+    lines = ['lease {} {{'.format(ip_address),
+             '  starts {};'.format(starts),
+             '  ends {};'.format(ends),
+             '  cltt {};'.format(starts),
+             '  binding state {};'.format(binding_state),
+             '  next binding state free;',
+             '  hardware ethernet {};'.format(mac_address)]
+    if hostname:
+        lines.append('  client-hostname "{}";'.format(hostname))
+    return '\n'.join(lines + ['}', ''])
+
+
+class ParseDateTest(unittest.TestCase):
+
+    def test_date_forms(self):
+        self.assertEqual(dhcp_leases.parse_date('4 2018/05/03 18:00:00'), NOW)
+        self.assertEqual(dhcp_leases.parse_date('epoch 1525370400'), NOW)
+        self.assertEqual(dhcp_leases.parse_date('epoch 1525370400; # Thu May 03 18:00:00 2018'), NOW)
+        self.assertIsNone(dhcp_leases.parse_date('never'))
+        self.assertIsNone(dhcp_leases.parse_date('tomorrow'))
+
+    def test_lease_statements(self):
+        leases = []
+        text = HEADER + lease_block('10.0.0.5', 'AA:BB:CC:DD:EE:FF', starts='4 2018/05/03 17:50:00', ends='never',
+                                    hostname='plc-1')
+
+        self.assertEqual(dhcp_leases.parse_leases(text, leases), len(text))
+        self.assertEqual(leases, [dhcp_leases.Lease('10.0.0.5', 'aa:bb:cc:dd:ee:ff', 'active', NOW - 600, None,
+                                                    NOW - 600, 'plc-1')])
+
+
+class LeaseFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'dhcpd.leases')
+        self.write(HEADER)
+        self.lease_file = dhcp_leases.LeaseFile(self.path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, text, mode='w'):
+        with open(self.path, mode) as file_object:
+            file_object.write(text)
+
+    def append(self, text):
+        self.write(text, 'a')
+
+    def active(self):
+        return {mac_address: lease.ip_address for mac_address, lease in self.lease_file.active_by_mac(NOW).items()}
+
+    def test_newest_binding_of_a_mac_address_wins(self):
+        self.append(lease_block('10.0.0.7', 'aa:bb:cc:dd:ee:01', starts='epoch {}'.format(NOW - 60)))
+        self.append(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01', starts='epoch {}'.format(NOW - 300)))
+        # Same start time, the later block wins
+        self.append(lease_block('10.0.0.8', 'aa:bb:cc:dd:ee:02'))
+        self.append(lease_block('10.0.0.9', 'aa:bb:cc:dd:ee:02'))
+
+        self.lease_file.refresh()
+
+        self.assertEqual(self.active(), {'aa:bb:cc:dd:ee:01': '10.0.0.7', 'aa:bb:cc:dd:ee:02': '10.0.0.9'})
+        self.assertEqual(set(self.lease_file.active_by_ip(NOW)), {'10.0.0.7', '10.0.0.9'})
+
+    def test_latest_block_of_an_ip_address_is_its_state(self):
+        self.append(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01'))
+        self.append(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01', binding_state='free'))
+        self.append(lease_block('10.0.0.6', 'aa:bb:cc:dd:ee:02', binding_state='free'))
+        self.append(lease_block('10.0.0.6', 'aa:bb:cc:dd:ee:02'))
+
+        self.lease_file.refresh()
+
+        self.assertEqual(self.active(), {'aa:bb:cc:dd:ee:02': '10.0.0.6'})
+
+    def test_expired_and_free_leases_are_excluded(self):
+        self.append(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01', ends='epoch {}'.format(NOW)))
+        self.append(lease_block('10.0.0.6', 'aa:bb:cc:dd:ee:02', binding_state='free'))
+        self.append(lease_block('10.0.0.7', 'aa:bb:cc:dd:ee:03', binding_state='backup'))
+        self.append(lease_block('10.0.0.8', 'aa:bb:cc:dd:ee:04', ends='never'))
+        self.append(lease_block('10.0.0.9', 'aa:bb:cc:dd:ee:05', ends='4 2018/05/03 18:00:01'))
+
+        self.lease_file.refresh()
+
+        self.assertEqual(self.active(), {'aa:bb:cc:dd:ee:04': '10.0.0.8', 'aa:bb:cc:dd:ee:05': '10.0.0.9'})
+
+    def test_appended_tail_is_parsed_incrementally(self):
+        self.append(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01'))
+        self.assertEqual(self.lease_file.refresh(), 1)
+        offset = self.lease_file.offset
+        self.assertEqual(offset, os.path.getsize(self.path))
+
+        # A block dhcpd is still writing is parsed once it is complete
+        block = lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01', binding_state='free')
+        self.append(block[:40])
+        self.assertEqual(self.lease_file.refresh(), 0)
+        self.assertEqual(self.lease_file.offset, offset)
+        self.assertEqual(self.active(), {'aa:bb:cc:dd:ee:01': '10.0.0.5'})
+
+        self.append(block[40:] + lease_block('10.0.0.6', 'aa:bb:cc:dd:ee:01'))
+        self.assertEqual(self.lease_file.refresh(), 2)
+        self.assertEqual(self.active(), {'aa:bb:cc:dd:ee:01': '10.0.0.6'})
+        self.assertEqual(self.lease_file.refresh(), 0)
+
+    def test_rewritten_file_is_parsed_again(self):
+        self.append(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01') + lease_block('10.0.0.6', 'aa:bb:cc:dd:ee:02'))
+        self.lease_file.refresh()
+        inode = os.stat(self.path).st_ino
+
+        # dhcpd writes a new file and renames it over the old one
+        rewritten = self.path + '~'
+        with open(rewritten, 'w') as file_object:
+            file_object.write(HEADER + lease_block('10.0.0.6', 'aa:bb:cc:dd:ee:02') +
+                              lease_block('10.0.0.7', 'aa:bb:cc:dd:ee:03') +
+                              lease_block('10.0.0.8', 'aa:bb:cc:dd:ee:04'))
+        os.replace(rewritten, self.path)
+
+        self.assertNotEqual(os.stat(self.path).st_ino, inode)
+        self.assertEqual(self.lease_file.refresh(), 3)
+        self.assertEqual(self.active(), {'aa:bb:cc:dd:ee:02': '10.0.0.6', 'aa:bb:cc:dd:ee:03': '10.0.0.7',
+                                         'aa:bb:cc:dd:ee:04': '10.0.0.8'})
+
+    def test_shorter_file_is_parsed_again(self):
+        self.append(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01') + lease_block('10.0.0.6', 'aa:bb:cc:dd:ee:02'))
+        self.lease_file.refresh()
+        inode = os.stat(self.path).st_ino
+
+        self.write(HEADER + lease_block('10.0.0.9', 'aa:bb:cc:dd:ee:09'))
+
+        self.assertEqual(os.stat(self.path).st_ino, inode)
+        self.assertEqual(self.lease_file.refresh(), 1)
+        self.assertEqual(self.active(), {'aa:bb:cc:dd:ee:09': '10.0.0.9'})
+
+    def test_missing_file_raises(self):
+        os.remove(self.path)
+
+        with self.assertRaises(FileNotFoundError):
+            self.lease_file.refresh()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+from docker_api import DockerClient, DockerError
+
+# Answer of the stub which drops the connection without a response
+DROP = None
+
+
+# Answers from the scripted answers of the server. Every answer is (status, body, headers, close) or DROP.
+# close shuts down the sending side like a daemon closing an idle connection, later requests get no answer.
+class DockerStubHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.server.connections += 1
+        closed = False
+        while True:
+            request_line = self.rfile.readline()
+            if not request_line:
+                return
+            headers = {}
+            while True:
+                line = self.rfile.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('ascii').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            self.rfile.read(int(headers.get('content-length', 0)))
+
+            method, url = request_line.decode('ascii').split()[:2]
+            path = url.split('?')[0]
+            self.server.requests.append((method, path))
+            if closed:
+                continue
+            answer = self.server.answer(method, path)
+            if answer is DROP:
+                return
+
+            status, body, answer_headers, close = answer
+            response_headers = {'Content-Length': str(len(body))}
+            response_headers.update(answer_headers)
+            if 'Transfer-Encoding' in response_headers:
+                del response_headers['Content-Length']
+            self.wfile.write('HTTP/1.1 {}\r\n{}\r\n'.format(status, ''.join(
+                '{}: {}\r\n'.format(name, value) for name, value in response_headers.items())).encode('ascii'))
+            self.wfile.write(body)
+            self.wfile.flush()
+            if close:
+                self.request.shutdown(socket.SHUT_WR)
+                closed = True
+                self.server.closed.set()
+
+
+class DockerStubServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path):
+        super().__init__(socket_path, DockerStubHandler)
+        self.answers = {}
+        self.requests = []
+        self.connections = 0
+        self.closed = threading.Event()
+
+    # Every (method, path) has a list of answers, the last one is repeated
+    def answer(self, method, path):
+        answers = self.answers.get((method, path), [answer_json('404 Not Found', {'message': 'no such object'})])
+        return answers.pop(0) if len(answers) > 1 else answers[0]
+
+
+def answer_json(status, content, close=False):
+    return status, json.dumps(content).encode('utf-8'), {'Content-Type': 'application/json'}, close
+
+
+# Encodes a body in chunks of the given sizes, the last chunk takes the rest
+def chunked(body, sizes):
+    chunks = []
+    for size in sizes + [len(body)]:
+        chunk, body = body[:size], body[size:]
+        if chunk:
+            chunks.append('{:x}\r\n'.format(len(chunk)).encode('ascii') + chunk + b'\r\n')
+    return b''.join(chunks) + b'0\r\n\r\n'
+
+
+# A frame of the multiplexed exec output, stream 1 is stdout and 2 is stderr
+def exec_frame(stream, payload):
+    return struct.pack('>BxxxL', stream, len(payload)) + payload
+
+
+class DockerClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.directory.name, 'docker.sock')
+        self.server = DockerStubServer(self.socket_path)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.docker = DockerClient(self.socket_path, timeout=5)
+
+    def tearDown(self):
+        self.docker.close()
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_connection_closed_while_idle_is_replaced(self):
+        self.server.answers[('GET', '/v1.25/_ping')] = [('200 OK', b'OK', {}, True)]
+        self.server.answers[('POST', '/v1.25/containers/guacamole/start')] = [('204 No Content', b'', {}, False)]
+
+        self.assertTrue(self.docker.ping())
+        self.assertTrue(self.server.closed.wait(5))
+        # A POST sent on the closed connection would get no answer and is never sent again
+        self.docker.start_container('guacamole')
+
+        self.assertEqual(self.server.connections, 2)
+        self.assertEqual(self.server.requests, [('GET', '/v1.25/_ping'),
+                                                ('POST', '/v1.25/containers/guacamole/start')])
+
+    def test_connection_is_reused(self):
+        self.server.answers[('GET', '/v1.25/_ping')] = [('200 OK', b'OK', {}, False)]
+
+        for _ in range(3):
+            self.assertTrue(self.docker.ping())
+
+        self.assertEqual(self.server.connections, 1)
+
+    def test_post_is_not_sent_again_when_the_connection_drops(self):
+        self.server.answers[('POST', '/v1.25/containers/create')] = [DROP, answer_json('201 Created', {'Id': 'c1'})]
+
+        with self.assertRaises(ConnectionError):
+            self.docker.run('guacamole', 'guacamole/guacamole')
+
+        self.assertEqual(self.server.requests, [('POST', '/v1.25/containers/create')])
+
+    def test_get_is_sent_again_when_the_connection_drops(self):
+        self.server.answers[('GET', '/v1.25/containers/guacamole/json')] = [DROP, answer_json('200 OK', {'Id': 'c1'})]
+
+        self.assertEqual(self.docker.inspect_container('guacamole'), {'Id': 'c1'})
+
+        self.assertEqual(self.server.requests, [('GET', '/v1.25/containers/guacamole/json')] * 2)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_error_response_raises_with_the_daemon_message(self):
+        self.assertIsNone(self.docker.inspect_container('missing'))
+
+        with self.assertRaises(DockerError) as raised:
+            self.docker.start_container('missing')
+        self.assertEqual((raised.exception.status, raised.exception.message), (404, 'no such object'))
+
+    def set_exec_answers(self, output):
+        self.server.answers[('POST', '/v1.25/containers/mysql/exec')] = [answer_json('201 Created', {'Id': 'e1'})]
+        self.server.answers[('POST', '/v1.25/exec/e1/start')] = [
+            ('200 OK', output, {'Content-Type': 'application/vnd.docker.raw-stream'}, False)]
+        self.server.answers[('GET', '/v1.25/exec/e1/json')] = [answer_json('200 OK', {'ExitCode': 3})]
+
+    def test_exec_output_frames_are_decoded(self):
+        self.set_exec_answers(exec_frame(1, b'hello ') + exec_frame(2, b'') + exec_frame(2, b'world\n'))
+
+        self.assertEqual(self.docker.exec_run('mysql', ['true'], stream_output=False), (3, b'hello world\n'))
+
+    def test_exec_frames_split_across_chunks_are_decoded(self):
+        output = exec_frame(1, b'first line\n') + exec_frame(2, b'second line\n')
+        self.set_exec_answers(chunked(output, [3, 9, 5]))
+        self.server.answers[('POST', '/v1.25/exec/e1/start')][0][2]['Transfer-Encoding'] = 'chunked'
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            exit_code, collected = self.docker.exec_run('mysql', ['true'])
+
+        self.assertEqual((exit_code, collected), (3, b''))
+        self.assertEqual(stdout.getvalue(), 'first line\nsecond line\n')
+
+    def context_directory(self):
+        context_directory = os.path.join(self.directory.name, 'context')
+        os.makedirs(context_directory, exist_ok=True)
+        with open(os.path.join(context_directory, 'Dockerfile'), 'w') as file_object:
+            file_object.write('FROM scratch\n')
+        return context_directory
+
+    def build(self, progress):
+        self.server.answers[('POST', '/v1.25/build')] = [
+            ('200 OK', chunked(b''.join(json.dumps(line).encode('utf-8') + b'\r\n' for line in progress), [10]),
+             {'Content-Type': 'application/json', 'Transfer-Encoding': 'chunked'}, False)]
+
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout):
+            try:
+                self.docker.build(self.context_directory(), 'minidmz/test', output_prefix='[test] ')
+            finally:
+                self.build_output = stdout.getvalue()
+
+    def test_build_output_is_prefixed(self):
+        self.build([{'stream': 'Step 1/1 : FROM scratch\n'}, {'stream': ' ---> done\nSuccessfully built\n'}])
+
+        self.assertEqual(self.build_output,
+                         '[test] Step 1/1 : FROM scratch\n[test]  ---> done\n[test] Successfully built\n')
+
+    def test_build_error_is_raised(self):
+        with self.assertRaises(DockerError) as raised:
+            self.build([{'stream': 'Step 1/2 : RUN false\n'},
+                        {'errorDetail': {'code': 1}, 'error': 'The command returned a non-zero code: 1\n'},
+                        {'stream': 'ignored\n'}])
+
+        self.assertEqual((raised.exception.status, raised.exception.message),
+                         (500, 'The command returned a non-zero code: 1'))
+        self.assertIn('[test] Step 1/2 : RUN false\n', self.build_output)
+
+    def test_build_rejected_by_the_daemon_is_raised(self):
+        self.server.answers[('POST', '/v1.25/build')] = [answer_json('400 Bad Request',
+                                                                     {'message': 'dockerfile parse error'})]
+
+        with self.assertRaises(DockerError) as raised:
+            self.docker.build(self.context_directory(), 'minidmz/test')
+        self.assertEqual((raised.exception.status, raised.exception.message), (400, 'dockerfile parse error'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import memory_budget
+import settings
+import setup
+import tests as setup_tests
+from preflight import PreflightError
+
+
+class GuacdPoolTest(unittest.TestCase):
+
+    # Returns the memory plan of a 2 GB pi with the given cores for the guacd containers of the settings
+    def plan(self, cpus):
+        return memory_budget.compute_budget(1872, 'Raspberry Pi 4 Model B', cpus, settings.MAX_RDP_SESSIONS,
+                                            {memory_budget.ROLE_GUACAMOLE: [settings.GUACAMOLE_CONTAINER_NAME],
+                                             memory_budget.ROLE_GUACD: settings.guacd_container_names(),
+                                             memory_budget.ROLE_MYSQL: [settings.SQL_CONTAINER_NAME]})
+
+    def specs(self, instances, cpus):
+        with mock.patch.object(settings, 'GUACD_INSTANCES', instances):
+            return [(spec.name, spec.options['cpuset']) for spec in setup.guacd_container_specs(self.plan(cpus))]
+
+    def test_container_names(self):
+        with mock.patch.object(settings, 'GUACD_INSTANCES', 1):
+            self.assertEqual(settings.guacd_container_names(), ['guacd_container_0'])
+        with mock.patch.object(settings, 'GUACD_INSTANCES', 4):
+            self.assertEqual(settings.guacd_container_names(),
+                             ['guacd_container_0', 'guacd_container_1', 'guacd_container_2', 'guacd_container_3'])
+
+    def test_single_container_uses_every_core(self):
+        self.assertEqual(self.specs(1, 4), [('guacd_container_0', None)])
+
+    def test_container_per_core_is_pinned(self):
+        self.assertEqual(self.specs(4, 4), [('guacd_container_0', '0'), ('guacd_container_1', '1'),
+                                            ('guacd_container_2', '2'), ('guacd_container_3', '3')])
+
+    def test_more_containers_than_cores_share_the_cores(self):
+        self.assertEqual(self.specs(3, 2), [('guacd_container_0', '0'), ('guacd_container_1', '1'),
+                                            ('guacd_container_2', '0')])
+
+    def test_every_container_has_room_for_every_session(self):
+        with mock.patch.object(settings, 'GUACD_INSTANCES', 4), mock.patch.object(settings, 'MAX_RDP_SESSIONS', 2):
+            specs = setup.guacd_container_specs(self.plan(4))
+
+        self.assertEqual({spec.options['memory_mb'] for spec in specs},
+                         {memory_budget.GUACD_BASE_MB + 2 * memory_budget.GUACD_SESSION_MB})
+
+    def test_pool_of_the_connections(self):
+        with mock.patch.object(settings, 'GUACD_INSTANCES', 2):
+            pool = setup.guacd_pool()
+            # Connections without a guacd of their own use the first container
+            properties = setup.guac_properties('secret')
+
+        self.assertEqual(pool.name_prefix, 'guacd_container_')
+        self.assertEqual(pool.hostnames, ['guacd_container_0', 'guacd_container_1'])
+        self.assertIn('guacd-hostname: guacd_container_0\n', properties)
+
+
+class PoolSettingsTest(unittest.TestCase):
+
+    def check_settings(self, **values):
+        values.setdefault('DOMAIN_NAME', 'dmz.example.org')
+        patches = [mock.patch.object(settings, name, value) for name, value in values.items()]
+        for patch in patches:
+            patch.start()
+        try:
+            return setup_tests.check_settings()
+        finally:
+            for patch in patches:
+                patch.stop()
+
+    def test_limits(self):
+        self.assertEqual(self.check_settings(GUACD_INSTANCES=4, MAX_RDP_SESSIONS=1), 'domain dmz.example.org')
+
+        for values in ({'GUACD_INSTANCES': 0}, {'GUACD_INSTANCES': '2'}, {'GUACD_INSTANCES': 1.5}):
+            with self.assertRaises(PreflightError) as raised:
+                self.check_settings(**values)
+            self.assertEqual(str(raised.exception), 'GUACD_INSTANCES in settings.py must be a number not less than 1')
+
+        for values in ({'MAX_RDP_SESSIONS': 0}, {'MAX_RDP_SESSIONS': -4}, {'MAX_RDP_SESSIONS': '4'}):
+            with self.assertRaises(PreflightError) as raised:
+                self.check_settings(**values)
+            self.assertEqual(str(raised.exception), 'MAX_RDP_SESSIONS in settings.py must be a number not less than 1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'log_email'))
+import firewall_log
+import journal_source
+
+# Stand-in journalctl. It records its arguments and prints the kernel entries when asked for the kernel
+# transport, the unit entries otherwise.
+JOURNALCTL = '''#!{python}
+import json
+import sys
+
+arguments = sys.argv[1:]
+with open({calls!r}, 'a') as file_object:
+    file_object.write(json.dumps(arguments) + '\\n')
+
+entries = {kernel_entries!r} if '_TRANSPORT=kernel' in arguments else {unit_entries!r}
+for entry in entries:
+    print(json.dumps(entry))
+'''
+
+UNIT_ENTRIES = [{'__CURSOR': 'unit-1', '__REALTIME_TIMESTAMP': '1500000000000000', '_HOSTNAME': 'pi',
+                 'SYSLOG_IDENTIFIER': 'dockerd', '_PID': '7', 'MESSAGE': 'container started'}]
+KERNEL_ENTRIES = [{'__CURSOR': 'kernel-1', '__REALTIME_TIMESTAMP': '1500000001000000', '_HOSTNAME': 'pi',
+                   'SYSLOG_IDENTIFIER': 'kernel', '_TRANSPORT': 'kernel',
+                   'MESSAGE': 'iptables denied: IN=eth0 OUT= SRC=10.0.0.9 DST=10.0.0.1 PROTO=TCP DPT=22'}]
+
+
+class CollectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.work_path = Path(self.directory.name)
+        self.calls_file = self.work_path.joinpath('calls')
+
+        journalctl = self.work_path.joinpath('journalctl')
+        with journalctl.open('w') as file_object:
+            file_object.write(JOURNALCTL.format(python=sys.executable, calls=str(self.calls_file),
+                                                kernel_entries=KERNEL_ENTRIES, unit_entries=UNIT_ENTRIES))
+        journalctl.chmod(journalctl.stat().st_mode | stat.S_IXUSR)
+
+        self.path_patch = mock.patch.dict(os.environ, {'PATH': str(self.work_path) + os.pathsep + os.environ['PATH']})
+        self.path_patch.start()
+
+    def tearDown(self):
+        self.path_patch.stop()
+        self.directory.cleanup()
+
+    def calls(self):
+        with self.calls_file.open('r') as file_object:
+            return [json.loads(line) for line in file_object]
+
+    def test_kernel_messages_are_kept_under_their_own_cursor(self):
+        diff_file = self.work_path.joinpath('journal_diff.log')
+        cursors = {}
+
+        journal_source.collect('journal', diff_file, cursors)
+        journal_source.collect('journal_kernel', diff_file, cursors, units=[], matches=journal_source.KERNEL_MATCHES)
+
+        self.assertEqual(cursors, {'journal': {'journal_cursor': 'unit-1'},
+                                   'journal_kernel': {'journal_cursor': 'kernel-1'}})
+        unit_call, kernel_call = self.calls()
+        self.assertIn('--unit', unit_call)
+        self.assertNotIn('_TRANSPORT=kernel', unit_call)
+        self.assertNotIn('--unit', kernel_call)
+        self.assertIn('_TRANSPORT=kernel', kernel_call)
+
+        with diff_file.open('r') as file_object:
+            lines = file_object.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn(' pi dockerd[7]: container started', lines[0])
+        self.assertIn(' pi kernel: iptables denied: ', lines[1])
+
+        # The next run continues from each cursor
+        journal_source.collect('journal', None, cursors)
+        journal_source.collect('journal_kernel', None, cursors, units=[], matches=journal_source.KERNEL_MATCHES)
+        unit_call, kernel_call = self.calls()[2:]
+        self.assertEqual(unit_call[unit_call.index('--after-cursor') + 1], 'unit-1')
+        self.assertEqual(kernel_call[kernel_call.index('--after-cursor') + 1], 'kernel-1')
+
+    def test_kernel_line_is_recognised_by_the_firewall_log(self):
+        line = journal_source.syslog_line(KERNEL_ENTRIES[0]).encode('utf-8')
+
+        self.assertEqual(firewall_log.FIREWALL_LINE_PATTERN.findall(line), [line.rstrip(b'\n')])
+
+
+
+# Entries in the journal export format, which systemd-journal-remote turns into a journal file
+EXPORTED_ENTRIES = [
+    {'__REALTIME_TIMESTAMP': '1500000000000000', '__MONOTONIC_TIMESTAMP': '1000000',
+     '_BOOT_ID': '0123456789abcdef0123456789abcdef', '_HOSTNAME': 'pi', '_SYSTEMD_UNIT': 'docker.service',
+     'SYSLOG_IDENTIFIER': 'dockerd', '_PID': '7', 'MESSAGE': 'container started'},
+    {'__REALTIME_TIMESTAMP': '1500000001000000', '__MONOTONIC_TIMESTAMP': '2000000',
+     '_BOOT_ID': '0123456789abcdef0123456789abcdef', '_HOSTNAME': 'pi', '_SYSTEMD_UNIT': 'ssh.service',
+     'SYSLOG_IDENTIFIER': 'sshd', '_PID': '8', 'MESSAGE': 'Accepted publickey for pi'},
+]
+
+
+def journal_remote():
+    for path in ('/lib/systemd/systemd-journal-remote', '/usr/lib/systemd/systemd-journal-remote'):
+        if os.access(path, os.X_OK):
+            return path
+    return shutil.which('systemd-journal-remote')
+
+
+@unittest.skipUnless(shutil.which('journalctl') and journal_remote(),
+                     'journalctl and systemd-journal-remote are needed to read an exported journal file')
+class JournalFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.work_path = Path(self.directory.name)
+
+        export_file = self.work_path.joinpath('entries.export')
+        with export_file.open('w') as file_object:
+            for entry in EXPORTED_ENTRIES:
+                file_object.write(''.join('{}={}\n'.format(name, value) for name, value in entry.items()) + '\n')
+        self.journal_file = self.work_path.joinpath('exported.journal')
+        subprocess.check_call([journal_remote(), '--output', str(self.journal_file), str(export_file)])
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_journal_file_is_read_from_the_start_then_from_the_cursor(self):
+        diff_file = self.work_path.joinpath('journal_diff.log')
+        cursors = {}
+
+        collected = journal_source.collect('journal', diff_file, cursors, units=['ssh.service'],
+                                           journal_files=[self.journal_file])
+
+        with diff_file.open('r') as file_object:
+            lines = file_object.read().splitlines()
+        self.assertEqual(collected, len('\n'.join(lines)) + 1)
+        self.assertEqual(len(lines), 1)
+        self.assertIn(' pi sshd[8]: Accepted publickey for pi', lines[0])
+        self.assertIn('journal_cursor', cursors['journal'])
+
+        self.assertEqual(journal_source.collect('journal', diff_file, cursors, units=['ssh.service'],
+                                                journal_files=[self.journal_file]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import db_provision
+import lease_watch
+import rdp_scan
+
+HEADER = 'authoring-byte-order little-endian;\n\n'
+
+
+def lease_block(ip_address, mac_address, binding_state='active'):
+    now = int(time.time())
+    return '\n'.join(['lease {} {{'.format(ip_address),
+                      '  starts epoch {};'.format(now - 60),
+                      '  ends epoch {};'.format(now + 3600),
+                      '  binding state {};'.format(binding_state),
+                      '  hardware ethernet {};'.format(mac_address),
+                      '}', ''])
+
+
+# Stands in for the sql container. Records the update scripts and prints the connection names which exist.
+class FakeDocker:
+
+    def __init__(self, connections=(), exit_code=0):
+        self.connections = list(connections)
+        self.exit_code = exit_code
+        self.scripts = []
+
+    def put_files(self, container, path, files, mode=0o600):
+        self.scripts.extend(content.decode('utf-8') for content in files.values())
+
+    def exec_run(self, container, command, environment=None, stream_output=True):
+        output = ''.join(db_provision.connection_name(mac_address) + '\n' for mac_address in self.connections)
+        return self.exit_code, output.encode('utf-8')
+
+
+class LeaseWatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'dhcpd.leases')
+        self.write(HEADER)
+        self.watcher = lease_watch.LeaseWatcher('user secret', self.path)
+        self.docker = FakeDocker()
+        self.watcher.docker = self.docker
+        # Addresses answering on the RDP port
+        self.rdp_addresses = set()
+        self.scanned = []
+
+    def tearDown(self):
+        self.watcher.inotify.close()
+        self.directory.cleanup()
+
+    def write(self, text, mode='w'):
+        with open(self.path, mode) as file_object:
+            file_object.write(text)
+
+    def scan(self, addresses, *arguments, **keywords):
+        self.scanned.append(addresses)
+        return [rdp_scan.ScanResult(address, rdp_scan.RDP_PORT, address in self.rdp_addresses, 0.001, None)
+                for address in addresses]
+
+    def check(self):
+        with mock.patch.object(rdp_scan, 'scan', self.scan):
+            self.watcher.check()
+
+    def test_changed_hostname_updates_the_connection(self):
+        self.docker.connections = ['aa:bb:cc:dd:ee:01']
+        self.rdp_addresses = {'10.0.0.5', '10.0.0.9'}
+        self.write(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01'), 'a')
+
+        self.check()
+
+        self.assertEqual(self.watcher.applied, {'aa:bb:cc:dd:ee:01': '10.0.0.5'})
+        self.assertEqual(self.docker.scripts, [db_provision.hostnames_script([('aa:bb:cc:dd:ee:01', '10.0.0.5')])])
+
+        # The same lease renewed changes nothing
+        self.write(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01'), 'a')
+        self.check()
+        self.assertEqual(len(self.docker.scripts), 1)
+
+        self.write(lease_block('10.0.0.9', 'aa:bb:cc:dd:ee:01'), 'a')
+        self.check()
+
+        self.assertEqual(self.watcher.applied, {'aa:bb:cc:dd:ee:01': '10.0.0.9'})
+        self.assertEqual(self.docker.scripts[1:],
+                         [db_provision.hostnames_script([('aa:bb:cc:dd:ee:01', '10.0.0.9')])])
+        self.assertIn("SET parameter_value = '10.0.0.9' WHERE connection_name = 'RDP_Connection_aa:bb:cc:dd:ee:01'",
+                      self.docker.scripts[1])
+        self.assertEqual(self.watcher.pending, {})
+
+    def test_equipment_without_rdp_stays_pending(self):
+        self.write(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01'), 'a')
+
+        self.check()
+        self.check()
+
+        self.assertEqual(self.docker.scripts, [])
+        self.assertEqual(self.scanned, [['10.0.0.5'], ['10.0.0.5']])
+        self.assertEqual(list(self.watcher.pending), ['aa:bb:cc:dd:ee:01'])
+
+        # Once the equipment finished booting
+        self.rdp_addresses = {'10.0.0.5'}
+        self.check()
+
+        self.assertEqual(len(self.docker.scripts), 1)
+        self.assertEqual(self.watcher.applied, {'aa:bb:cc:dd:ee:01': '10.0.0.5'})
+        self.assertEqual(self.watcher.pending, {})
+
+    def test_pending_equipment_is_given_up(self):
+        self.write(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01'), 'a')
+        self.check()
+        ip_address, first_seen = self.watcher.pending['aa:bb:cc:dd:ee:01']
+        self.watcher.pending['aa:bb:cc:dd:ee:01'] = (ip_address, first_seen - lease_watch.PENDING_LIMIT - 1)
+
+        self.check()
+
+        self.assertEqual(self.watcher.pending, {})
+        self.assertEqual(self.scanned, [['10.0.0.5']])
+
+    def test_failed_update_is_retried(self):
+        self.docker.exit_code = 1
+        self.rdp_addresses = {'10.0.0.5'}
+        self.write(lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01'), 'a')
+
+        self.check()
+
+        self.assertEqual(self.watcher.applied, {})
+        self.assertEqual(list(self.watcher.pending), ['aa:bb:cc:dd:ee:01'])
+
+        self.docker.exit_code = 0
+        self.check()
+
+        self.assertEqual(self.watcher.applied, {'aa:bb:cc:dd:ee:01': '10.0.0.5'})
+        self.assertEqual(len(self.docker.scripts), 2)
+
+    def test_missing_lease_file_is_no_change(self):
+        os.remove(self.path)
+
+        self.check()
+
+        self.assertEqual((self.watcher.pending, self.scanned), ({}, []))
+
+
+class WaitForChangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'dhcpd.leases')
+        with open(self.path, 'w') as file_object:
+            file_object.write(HEADER)
+        self.watcher = lease_watch.LeaseWatcher('user secret', self.path)
+
+    def tearDown(self):
+        self.watcher.inotify.close()
+        self.directory.cleanup()
+
+    # Writes the parts to the lease file one after the other, pausing between them
+    def write_later(self, parts, pause):
+        def write():
+            for part in parts:
+                time.sleep(pause)
+                with open(self.path, 'a') as file_object:
+                    file_object.write(part)
+        writer = threading.Thread(target=write)
+        writer.start()
+        self.addCleanup(writer.join)
+        return writer
+
+    def test_returns_once_the_writes_settle(self):
+        block = lease_block('10.0.0.5', 'aa:bb:cc:dd:ee:01')
+        parts = [block[:30], block[30:60], block[60:]]
+
+        with mock.patch.object(lease_watch, 'SETTLE_SECONDS', 0.3):
+            started = time.monotonic()
+            self.write_later(parts, 0.1)
+            self.watcher.wait_for_change()
+            elapsed = time.monotonic() - started
+
+        # The last write is after 0.3 seconds and the file is then quiet for 0.3 seconds
+        self.assertGreaterEqual(elapsed, 0.6)
+        self.assertLess(elapsed, 2.0)
+        self.assertEqual(self.watcher.changed_leases(), {'aa:bb:cc:dd:ee:01': '10.0.0.5'})
+
+    def test_other_files_are_not_waited_for(self):
+        with mock.patch.object(lease_watch, 'SETTLE_SECONDS', 1.0):
+            started = time.monotonic()
+            with open(os.path.join(self.directory.name, 'dhcpd6.leases'), 'w') as file_object:
+                file_object.write(HEADER)
+            self.watcher.wait_for_change()
+
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_pending_equipment_wakes_the_watcher(self):
+        self.watcher.pending['aa:bb:cc:dd:ee:01'] = ('10.0.0.5', time.time())
+
+        with mock.patch.object(lease_watch, 'RETRY_INTERVAL', 0.2):
+            started = time.monotonic()
+            self.watcher.wait_for_change()
+
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import gzip
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'log_email'))
+import log_cursor
+
+
+class CollectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.work_path = Path(self.directory.name)
+        self.log_file = self.work_path.joinpath('syslog')
+        self.diff_file = self.work_path.joinpath('syslog_diff.log')
+        self.cursors = {}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def append(self, data, path=None):
+        with (path or self.log_file).open('ab') as file_object:
+            file_object.write(data)
+
+    def collect(self):
+        collected = log_cursor.collect('syslog', self.log_file, self.diff_file, self.cursors)
+        with self.diff_file.open('rb') as file_object:
+            data = file_object.read()
+        self.assertEqual(collected, len(data))
+        return data
+
+    def test_only_appended_lines_are_collected(self):
+        self.append(b'one\ntwo\n')
+        self.assertEqual(self.collect(), b'one\ntwo\n')
+        self.assertEqual(self.collect(), b'')
+
+        self.append(b'three\n')
+        self.assertEqual(self.collect(), b'three\n')
+        self.assertEqual(self.cursors['syslog']['offset'], len(b'one\ntwo\nthree\n'))
+
+    def test_partial_line_is_left_for_the_next_run(self):
+        self.append(b'one\ntw')
+        self.assertEqual(self.collect(), b'one\n')
+        self.assertEqual(self.cursors['syslog']['offset'], len(b'one\n'))
+
+        self.append(b'o\n')
+        self.assertEqual(self.collect(), b'two\n')
+
+    def test_truncated_log_is_collected_from_the_start(self):
+        self.append(b'one\ntwo\nthree\n')
+        self.collect()
+        inode = self.log_file.stat().st_ino
+
+        with self.log_file.open('r+b') as file_object:
+            file_object.truncate(0)
+        self.append(b'four\n')
+
+        self.assertEqual(self.log_file.stat().st_ino, inode)
+        self.assertEqual(self.collect(), b'four\n')
+
+    def test_log_rewritten_in_place_is_detected_by_its_head(self):
+        self.append(b'one\ntwo\n')
+        self.collect()
+
+        # Same inode and a larger size, only the fingerprint tells the log apart
+        with self.log_file.open('r+b') as file_object:
+            file_object.write(b'ONE\nTWO\nthree\n')
+        self.assertEqual(self.collect(), b'ONE\nTWO\nthree\n')
+
+    def test_rotation_is_detected_by_the_inode(self):
+        self.append(b'one\n')
+        self.collect()
+        self.append(b'two\n')
+
+        self.log_file.rename(self.work_path.joinpath('syslog.1'))
+        self.append(b'three\n')
+
+        self.assertNotEqual(self.cursors['syslog']['inode'], self.log_file.stat().st_ino)
+        self.assertEqual(self.collect(), b'two\nthree\n')
+        self.assertEqual(self.collect(), b'')
+
+    def test_gzip_generations_are_read_in_order(self):
+        self.append(b'one\n')
+        self.collect()
+        self.append(b'two\n')
+
+        # logrotate with delaycompress: syslog becomes syslog.1, then syslog.2.gz one rotation later
+        self.log_file.rename(self.work_path.joinpath('syslog.1'))
+        self.append(b'three\n')
+        with self.work_path.joinpath('syslog.1').open('rb') as source, \
+                gzip.open(str(self.work_path.joinpath('syslog.2.gz')), 'wb') as target:
+            target.write(source.read())
+        # The inode freed here is often reused by the next syslog, which must not look like a truncation
+        self.work_path.joinpath('syslog.1').unlink()
+        self.log_file.rename(self.work_path.joinpath('syslog.1'))
+        self.append(b'four\n')
+
+        self.assertEqual([path.name for path in log_cursor.rotated_files(self.log_file)],
+                         ['syslog.1', 'syslog.2.gz'])
+        self.assertEqual(self.collect(), b'two\nthree\nfour\n')
+
+    def test_generations_are_collected_when_the_cursor_file_is_gone(self):
+        self.append(b'one\n')
+        self.collect()
+
+        # Moved out of the rotation, so its inode is not reused by the new files
+        self.log_file.rename(self.work_path.joinpath('syslog.saved'))
+        self.append(b'two\n', self.work_path.joinpath('syslog.1'))
+        self.append(b'three\n')
+
+        self.assertEqual(self.collect(), b'two\nthree\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import bisect
+import collections
+import itertools
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'log_email'))
+import log_digest
+
+
+class TopCounterTest(unittest.TestCase):
+
+    # Stream over 500 keys where key k is drawn with a weight of 1 / (k + 1), from a fixed seed
+    def zipf_stream(self, length=20000, keys=500):
+        generator = random.Random(7)
+        cumulative_weights = list(itertools.accumulate(1.0 / (key + 1) for key in range(keys)))
+        return [bisect.bisect(cumulative_weights, generator.random() * cumulative_weights[-1])
+                for _ in range(length)]
+
+    def test_space_saving_error_bound(self):
+        stream = self.zipf_stream()
+        true_counts = collections.Counter(stream)
+        capacity = 50
+        counter = log_digest.TopCounter(capacity)
+        for key in stream:
+            counter.add(key)
+
+        self.assertEqual(counter.total, len(stream))
+        self.assertEqual(len(counter.counts), capacity)
+        self.assertEqual(sum(counter.counts.values()), len(stream))
+
+        for key, count in counter.counts.items():
+            # The count overestimates by at most its recorded error, which is at most total / capacity
+            self.assertLessEqual(true_counts[key], count)
+            self.assertLessEqual(count - counter.errors[key], true_counts[key])
+            self.assertLessEqual(counter.errors[key], len(stream) // capacity)
+
+        # Every key seen more than total / capacity times is kept
+        for key, true_count in true_counts.items():
+            if true_count > len(stream) / capacity:
+                self.assertIn(key, counter.counts)
+
+    def test_top_keys_of_a_skewed_stream(self):
+        stream = self.zipf_stream()
+        counter = log_digest.TopCounter(50)
+        for key in stream:
+            counter.add(key)
+
+        self.assertEqual([key for key, _, _ in counter.top(3)], [0, 1, 2])
+
+    def test_exact_below_capacity(self):
+        counter = log_digest.TopCounter(10)
+        for key in 'abracadabra':
+            counter.add(key)
+
+        self.assertEqual(counter.top(2), [('a', 5, 0), ('b', 2, 0)])
+        self.assertEqual(counter.add('z'), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'log_email'))
+import log_watch
+
+
+class AlertMatcherTest(unittest.TestCase):
+
+    def test_overlapping_rules_all_match(self):
+        matcher = log_watch.AlertMatcher(log_watch.DEFAULT_ALERT_PATTERNS)
+
+        self.assertEqual(matcher.match('mod_auth_cas: Out of memory, request failed'),
+                         {'cas_failure', 'out_of_memory'})
+        self.assertEqual(matcher.match('dockerd[7]: oom-kill event level=error'),
+                         {'docker_error', 'out_of_memory'})
+        self.assertEqual(matcher.match('guacd[12]: Connection closed'), set())
+
+    def test_greedy_rule_does_not_hide_a_later_rule(self):
+        matcher = log_watch.AlertMatcher({'everything': r'start.*end', 'middle': r'middle'})
+
+        self.assertEqual(matcher.match('start middle end'), {'everything', 'middle'})
+
+    def test_backreferences_keep_their_groups(self):
+        matcher = log_watch.AlertMatcher({'plain': r'SEVERE', 'repeated': r'(\w+) \1', 'named': r'(?P<word>x)y'})
+
+        self.assertEqual(matcher.match('error error'), {'repeated'})
+        self.assertEqual(matcher.match('error warning'), set())
+        self.assertEqual(matcher.match('SEVERE xy'), {'plain', 'named'})
+
+
+class FakeInotify:
+
+    def __init__(self):
+        self.descriptors = {}
+        self.removed = []
+
+    def add_watch(self, path, mask):
+        return self.descriptors.setdefault(str(path), len(self.descriptors) + 1)
+
+    def remove_watch(self, watch_descriptor):
+        self.removed.append(watch_descriptor)
+
+
+class LogWatcherWatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.watcher = log_watch.LogWatcher.__new__(log_watch.LogWatcher)
+        self.watcher.inotify = FakeInotify()
+        self.watcher.followers = {}
+        self.watcher.watches = {}
+
+    def test_replaced_container_log_removes_the_old_watch(self):
+        self.watcher.follow('guacamole', '/var/lib/docker/containers/old/old-json.log')
+        self.watcher.follow('guacamole', '/var/lib/docker/containers/new/new-json.log')
+
+        self.assertEqual(self.watcher.inotify.removed, [1])
+        self.assertEqual(self.watcher.watches, {2: {'guacamole'}})
+
+    def test_shared_directory_watch_is_kept(self):
+        self.watcher.follow('syslog', '/var/log/syslog')
+        self.watcher.follow('messages', '/var/log/messages')
+        self.watcher.follow('syslog', '/var/log/syslog')
+        self.watcher.follow('messages', '/var/log/other/messages')
+
+        self.assertEqual(self.watcher.inotify.removed, [])
+        self.assertEqual(self.watcher.watches, {1: {'syslog'}, 2: {'messages'}})
+        self.assertEqual(self.watcher.followers['messages'].path, Path('/var/log/other/messages'))
+
+
+if __name__ == '__main__':
+    unittest.main()
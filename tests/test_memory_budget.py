@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import memory_budget
+
+MEMINFO = '''MemTotal:       {} kB
+MemFree:          612340 kB
+MemAvailable:     790412 kB
+Buffers:           20480 kB
+SwapTotal:        102396 kB
+SwapFree:         102396 kB
+HugePages_Total:       0
+Hugepagesize:       2048 kB
+'''
+
+ONE_GUACD = ['guacd_container']
+GUACD_PER_CORE = ['guacd_container_{}'.format(index) for index in range(4)]
+
+# MemTotal in kB of a pi with the default gpu memory, the guacd containers, then the expected system
+# reserve, java heap, innodb buffer pool, zram swap and shortfall in MB
+BUDGETS = [
+    # Pi 2 B and Pi 3 B with 1 GB, the smallest pi the setup supports
+    (949448, ONE_GUACD, 256, 192, 40, 448, 0),
+    (949448, GUACD_PER_CORE, 256, 96, 40, 448, 0),
+    # Pi 4 B with 2 GB
+    (1917292, ONE_GUACD, 374, 512, 88, 464, 0),
+    (1917292, GUACD_PER_CORE, 374, 512, 88, 464, 0),
+    # Pi 4 B with 4 GB and 8 GB, the buffer pool is at its limit and there is no zram swap
+    (3930316, ONE_GUACD, 767, 512, 128, 0, 0),
+    (8000000, GUACD_PER_CORE, 1562, 512, 128, 0, 0),
+    # Pi Zero and Pi 1 with 512 MB get the smallest sizes and do not fit
+    (443504, ONE_GUACD, 256, 64, 16, 208, 339),
+]
+
+
+class MemoryBudgetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Returns the budget setup.py plans for a pi with the given /proc/meminfo and 4 cores
+    def plan(self, mem_total_kb, guacd_containers, sessions=4, zram_enabled=True):
+        meminfo_file = os.path.join(self.directory.name, 'meminfo')
+        with open(meminfo_file, 'w') as file_object:
+            file_object.write(MEMINFO.format(mem_total_kb))
+
+        total_mb = memory_budget.read_meminfo(meminfo_file)['MemTotal'] // 1024
+        return memory_budget.compute_budget(total_mb, 'Raspberry Pi', 4, sessions,
+                                            {memory_budget.ROLE_GUACAMOLE: ['guacamole_container'],
+                                             memory_budget.ROLE_GUACD: guacd_containers,
+                                             memory_budget.ROLE_MYSQL: ['sql_container']}, zram_enabled)
+
+    def test_budget_of_every_pi(self):
+        for mem_total_kb, guacd_containers, reserve_mb, heap_mb, buffer_pool_mb, zram_mb, over_mb in BUDGETS:
+            case = '{} kB, {} guacd'.format(mem_total_kb, len(guacd_containers))
+            plan = self.plan(mem_total_kb, guacd_containers)
+            guacamole = memory_budget.container_budget(plan, 'guacamole_container')
+            mysql = memory_budget.container_budget(plan, 'sql_container')
+
+            self.assertEqual(plan['total_mb'], mem_total_kb // 1024, case)
+            self.assertEqual((plan['system_reserve_mb'], guacamole['heap_mb'], mysql['innodb_buffer_pool_mb'],
+                              plan['zram_mb'], plan['over_budget_mb']),
+                             (reserve_mb, heap_mb, buffer_pool_mb, zram_mb, over_mb), case)
+            self.assertEqual(guacamole['limit_mb'], heap_mb + memory_budget.JVM_OVERHEAD_MB, case)
+            self.assertIn('-Xmx{}m'.format(heap_mb), guacamole['java_options'], case)
+            self.assertIn('innodb_buffer_pool_size = {}M'.format(buffer_pool_mb), memory_budget.mysql_config(plan),
+                          case)
+
+            # Unless the pi is too small, the containers fit in what the system leaves
+            used_mb = sum(budget['limit_mb'] for budget in plan['containers'])
+            used_mb -= (len(guacd_containers) - 1) * memory_budget.GUACD_SESSION_MB * plan['sessions']
+            self.assertEqual(max(0, used_mb - (plan['total_mb'] - reserve_mb)), over_mb, case)
+
+    def test_smallest_pi_fits_the_default_sessions(self):
+        # MAX_RDP_SESSIONS of settings.py is the most a 1 GB pi fits with a guacd container per core
+        self.assertEqual(self.plan(949448, GUACD_PER_CORE, sessions=4)['over_budget_mb'], 0)
+        self.assertEqual(self.plan(949448, GUACD_PER_CORE, sessions=5)['over_budget_mb'], 13)
+        # A 512 MB pi does not fit a single session
+        self.assertEqual(self.plan(443504, ONE_GUACD, sessions=1)['over_budget_mb'], 195)
+
+    def test_guacd_limit_covers_every_session(self):
+        for guacd_containers in (ONE_GUACD, GUACD_PER_CORE):
+            plan = self.plan(1917292, guacd_containers, sessions=3)
+            for container_name in guacd_containers:
+                self.assertEqual(memory_budget.container_budget(plan, container_name)['limit_mb'],
+                                 memory_budget.GUACD_BASE_MB + 3 * memory_budget.GUACD_SESSION_MB)
+
+    def test_zram_swap_can_be_disabled(self):
+        plan = self.plan(949448, ONE_GUACD, zram_enabled=False)
+
+        self.assertEqual(plan['zram_mb'], 0)
+        self.assertEqual(dict((name, content) for name, content, _ in memory_budget.budget_files(
+            self.directory.name, plan))[memory_budget.ZRAM_SCRIPT_FILE_NAME], None)
+
+    def test_garbage_collector_follows_the_heap(self):
+        self.assertIn('-XX:+UseSerialGC', memory_budget.java_options(192, 4))
+        self.assertIn('-XX:+UseSerialGC', memory_budget.java_options(512, 1))
+        self.assertIn('-XX:+UseParallelGC -XX:ParallelGCThreads=2', memory_budget.java_options(512, 4))
+        self.assertIn('-Xms128m -Xmx512m', memory_budget.java_options(512, 4))
+        self.assertIn('-Xms64m -Xmx96m', memory_budget.java_options(96, 4))
+
+    def test_unchanged_budget_keeps_its_files(self):
+        plan = self.plan(949448, ONE_GUACD)
+        memory_budget.write_files(self.directory.name, plan)
+        recorded = memory_budget.read_plan(self.directory.name)
+
+        replanned = self.plan(949448, ONE_GUACD)
+        replanned['created'] = plan['created'] + 60
+        memory_budget.budget_files(self.directory.name, replanned)
+
+        self.assertEqual(replanned['created'], recorded['created'])
+        self.assertTrue(os.path.isfile(os.path.join(self.directory.name, memory_budget.ZRAM_SCRIPT_FILE_NAME)))
+
+        memory_budget.write_files(self.directory.name, self.plan(3930316, ONE_GUACD))
+        self.assertFalse(os.path.isfile(os.path.join(self.directory.name, memory_budget.ZRAM_SCRIPT_FILE_NAME)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import os
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import mysql_ready
+from mysql_ready import MysqlNotReady
+
+
+# A mysql packet: 3 byte payload length, sequence number and payload
+def packet(payload):
+    return struct.pack('<I', len(payload))[:3] + b'\0' + payload
+
+
+GREETING = packet(bytes([mysql_ready.HANDSHAKE_V10]) + b'5.7.22\0' + b'\x01\0\0\0' + b'salt1234\0')
+TOO_MANY_CONNECTIONS = packet(bytes([mysql_ready.ERROR_PACKET]) + struct.pack('<H', 1040) +
+                              b'#08004Too many connections')
+HTTP_GREETING = b'HTTP/1.1 400 Bad Request\r\n\r\n'
+
+
+# Sends the greeting of the server, a list of segments sent a moment apart, then keeps the connection
+# open until the test ends if hold is set
+class MysqlStubHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        for index, segment in enumerate(self.server.greeting):
+            if index:
+                time.sleep(0.05)
+            self.request.sendall(segment)
+        if self.server.hold:
+            self.server.release.wait()
+
+
+class MysqlStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, greeting, hold=False):
+        super().__init__(('127.0.0.1', 0), MysqlStubHandler)
+        self.greeting = greeting
+        self.hold = hold
+        self.release = threading.Event()
+
+
+class HandshakeTest(unittest.TestCase):
+
+    def start(self, greeting, hold=False):
+        server = MysqlStub(greeting if isinstance(greeting, list) else [greeting], hold)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def stop():
+            server.release.set()
+            server.shutdown()
+            server.server_close()
+        self.addCleanup(stop)
+        return server.server_address[1]
+
+    def test_protocol_10_greeting_is_ready(self):
+        self.assertTrue(mysql_ready.handshake('127.0.0.1', self.start(GREETING)))
+
+    def test_greeting_split_across_segments_is_ready(self):
+        self.assertTrue(mysql_ready.handshake('127.0.0.1', self.start([GREETING[:2], GREETING[2:]])))
+
+    def test_truncated_greeting_is_not_ready(self):
+        self.assertFalse(mysql_ready.handshake('127.0.0.1', self.start(GREETING[:3])))
+
+    def test_error_packet_1040_is_ready(self):
+        self.assertTrue(mysql_ready.handshake('127.0.0.1', self.start(TOO_MANY_CONNECTIONS)))
+
+    def test_other_protocol_is_not_ready(self):
+        self.assertFalse(mysql_ready.handshake('127.0.0.1', self.start(HTTP_GREETING)))
+
+    def test_closed_connection_is_not_ready(self):
+        self.assertFalse(mysql_ready.handshake('127.0.0.1', self.start(b'')))
+
+    def test_silent_server_times_out(self):
+        port = self.start(b'', hold=True)
+
+        started = time.monotonic()
+        with mock.patch.object(mysql_ready, 'CONNECT_TIMEOUT', 0.2):
+            self.assertFalse(mysql_ready.handshake('127.0.0.1', port))
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_closed_port_is_refused(self):
+        probe = socket.socket()
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        with self.assertRaises(ConnectionRefusedError):
+            mysql_ready.handshake('127.0.0.1', port)
+
+
+# Docker client of a running container without an address, so mysql is probed with mysqladmin.
+# ping_results are the exit codes of the pings, the last one is repeated.
+class FakeDocker:
+
+    def __init__(self, ping_results, running=True):
+        self.ping_results = ping_results
+        self.running = running
+        self.pings = 0
+
+    def inspect_container(self, name):
+        return {'State': {'Running': self.running, 'ExitCode': 0 if self.running else 1},
+                'NetworkSettings': {'Networks': {'guacamole': {'IPAddress': ''}}}}
+
+    def exec_run(self, container, command, environment=None, stream_output=True):
+        self.pings += 1
+        return self.ping_results[min(self.pings, len(self.ping_results)) - 1], b''
+
+
+class WaitForMysqlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.patch = mock.patch.object(mysql_ready, 'INITIAL_INTERVAL', 0.01)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_waits_until_the_ping_succeeds(self):
+        docker = FakeDocker([1, 1, 0])
+
+        mysql_ready.wait_for_mysql(docker, 'sql', timeout=5)
+        self.assertEqual(docker.pings, 3)
+
+    def test_timeout_raises(self):
+        started = time.monotonic()
+        with self.assertRaises(MysqlNotReady):
+            mysql_ready.wait_for_mysql(FakeDocker([1]), 'sql', timeout=0.3)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_stopped_container_raises_at_once(self):
+        docker = FakeDocker([0], running=False)
+
+        with self.assertRaises(MysqlNotReady) as raised:
+            mysql_ready.wait_for_mysql(docker, 'sql', timeout=5)
+        self.assertIn('exit code 1', str(raised.exception))
+        self.assertEqual(docker.pings, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
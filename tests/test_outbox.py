@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+import unittest
+from email.mime.text import MIMEText
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'log_email'))
+import outbox
+
+NOW = 1500000000.0
+
+
+# Local smtp server without tls. mail_reply is the reply to MAIL FROM and rcpt_replies the reply to RCPT TO
+# per receiver, which lets a test make the server refuse messages temporarily (4xx) or permanently (5xx).
+# extensions are advertised in the EHLO reply and every command is recorded.
+class SmtpStubHandler(socketserver.StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.reply('220 stub ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('ascii', 'replace').strip()
+            self.server.commands.append(command.split()[0].upper())
+            receiver = command[command.find('<') + 1:command.rfind('>')]
+            command = command.upper()
+
+            if command.startswith('EHLO'):
+                lines = ['stub'] + self.server.extensions
+                for line in lines[:-1]:
+                    self.reply('250-' + line)
+                self.reply('250 ' + lines[-1])
+            elif command.startswith('HELO'):
+                self.reply('250 stub')
+            elif command.startswith('MAIL'):
+                self.reply(self.server.mail_reply)
+            elif command.startswith('RCPT'):
+                self.reply(self.server.rcpt_replies.get(receiver, '250 ok'))
+            elif command == 'DATA':
+                self.reply('354 go ahead')
+                message = b''
+                while True:
+                    data_line = self.rfile.readline()
+                    if data_line in (b'.\r\n', b''):
+                        break
+                    message += data_line
+                self.server.messages.append(message)
+                self.reply('250 queued')
+            elif command == 'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+
+class SmtpStub(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), SmtpStubHandler)
+        self.mail_reply = '250 ok'
+        self.rcpt_replies = {}
+        self.extensions = []
+        self.commands = []
+        self.messages = []
+
+
+class OutboxTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.generated_files = Path(self.directory.name)
+        self.server = SmtpStub()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.credentials = {'username': 'pi', 'password': 'secret'}
+        self.mail_config = {'smtp_server_name': '127.0.0.1:{}'.format(self.server.server_address[1]),
+                            'smtp_use_ssl': False}
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def enqueue(self, receivers=('admin@example.org',)):
+        message = MIMEText('status')
+        message['Subject'] = 'Device status'
+        return outbox.enqueue_message(self.generated_files, message, 'pi@example.org', list(receivers))
+
+    def drain(self, now):
+        with mock.patch.object(outbox.time, 'time', return_value=now):
+            return outbox.drain(self.generated_files, self.credentials, self.mail_config)
+
+    def metadata(self, message_file):
+        with message_file.with_suffix('.json').open('r') as file_object:
+            return json.load(file_object)
+
+    def dead_letters(self):
+        return sorted(path.name for path in outbox.dead_letter_path(self.generated_files).iterdir())
+
+    def test_sent_message_leaves_the_queue(self):
+        message_file = self.enqueue()
+
+        self.assertEqual(self.drain(NOW), 1)
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertIn(b'Subject: Device status', self.server.messages[0])
+        self.assertFalse(message_file.exists())
+
+    def test_temporary_failure_backs_off_exponentially(self):
+        message_file = self.enqueue()
+        self.server.mail_reply = '451 try again later'
+
+        self.assertEqual(self.drain(NOW), 0)
+        metadata = self.metadata(message_file)
+        self.assertEqual(metadata['attempts'], 1)
+        self.assertEqual(metadata['next_attempt'], NOW + outbox.RETRY_BASE_DELAY)
+
+        # Not due yet, the server is not contacted
+        self.assertEqual(self.drain(NOW + outbox.RETRY_BASE_DELAY - 1), 0)
+        self.assertEqual(self.metadata(message_file)['attempts'], 1)
+
+        now = NOW + outbox.RETRY_BASE_DELAY
+        self.assertEqual(self.drain(now), 0)
+        self.assertEqual(self.metadata(message_file)['next_attempt'], now + 2 * outbox.RETRY_BASE_DELAY)
+
+        self.server.mail_reply = '250 ok'
+        self.assertEqual(self.drain(now + 2 * outbox.RETRY_BASE_DELAY), 1)
+        self.assertFalse(message_file.exists())
+
+    def test_delay_is_capped(self):
+        message_file = self.enqueue()
+        metadata = self.metadata(message_file)
+        metadata['attempts'] = outbox.MAX_ATTEMPTS - 2
+        outbox.write_metadata(message_file.with_suffix('.json'), metadata)
+        self.server.mail_reply = '451 try again later'
+
+        self.drain(NOW)
+        self.assertEqual(self.metadata(message_file)['next_attempt'], NOW + min(
+            outbox.RETRY_BASE_DELAY * 2 ** (outbox.MAX_ATTEMPTS - 2), outbox.RETRY_MAX_DELAY))
+
+    def test_dead_letter_after_max_attempts(self):
+        message_file = self.enqueue()
+        # Nothing listens on the port once the server is closed
+        self.server.shutdown()
+        self.server.server_close()
+
+        now = NOW
+        for attempt in range(1, outbox.MAX_ATTEMPTS):
+            self.assertEqual(self.drain(now), 0)
+            metadata = self.metadata(message_file)
+            self.assertEqual(metadata['attempts'], attempt)
+            now = metadata['next_attempt']
+
+        self.drain(now)
+        self.assertFalse(message_file.exists())
+        self.assertEqual(self.dead_letters(), [message_file.with_suffix('.eml').name,
+                                               message_file.with_suffix('.json').name])
+        with outbox.dead_letter_path(self.generated_files).joinpath(
+                message_file.with_suffix('.json').name).open('r') as file_object:
+            self.assertEqual(json.load(file_object)['attempts'], outbox.MAX_ATTEMPTS)
+
+    def test_permanent_failure_is_dead_lettered_at_once(self):
+        message_file = self.enqueue()
+        self.server.mail_reply = '550 sender rejected'
+
+        self.drain(NOW)
+        self.assertFalse(message_file.exists())
+        self.assertEqual(len(self.dead_letters()), 2)
+        self.assertEqual(self.server.messages, [])
+
+    def test_receivers_refused_temporarily_are_retried(self):
+        message_file = self.enqueue(['admin@example.org', 'backup@example.org'])
+        self.server.rcpt_replies = {'admin@example.org': '450 mailbox busy',
+                                    'backup@example.org': '550 no such user'}
+
+        self.drain(NOW)
+        self.assertEqual(self.metadata(message_file)['attempts'], 1)
+        self.assertEqual(self.dead_letters(), [])
+
+    def test_receivers_refused_permanently_are_dead_lettered(self):
+        message_file = self.enqueue(['admin@example.org', 'backup@example.org'])
+        self.server.rcpt_replies = {'admin@example.org': '550 no such user',
+                                    'backup@example.org': '553 mailbox name not allowed'}
+
+        self.drain(NOW)
+        self.assertFalse(message_file.exists())
+        self.assertEqual(len(self.dead_letters()), 2)
+
+    def test_message_is_sent_when_some_receivers_are_refused(self):
+        message_file = self.enqueue(['admin@example.org', 'backup@example.org'])
+        self.server.rcpt_replies = {'backup@example.org': '550 no such user'}
+
+        self.assertEqual(self.drain(NOW), 1)
+        self.assertFalse(message_file.exists())
+        self.assertEqual(len(self.server.messages), 1)
+
+    def test_password_is_not_sent_without_tls(self):
+        message_file = self.enqueue()
+        self.server.extensions = ['AUTH PLAIN LOGIN']
+
+        self.assertEqual(self.drain(NOW), 0)
+        self.assertNotIn('AUTH', self.server.commands)
+        self.assertEqual(self.metadata(message_file)['attempts'], 1)
+        self.assertIn('STARTTLS', self.metadata(message_file)['last_error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
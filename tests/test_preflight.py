@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+import hashlib
+import http.server
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import artifact_cache
+import preflight
+import reconcile
+import settings
+import tests as setup_tests
+from preflight import PreflightError
+
+
+def failing_check():
+    raise PreflightError('mirror unreachable')
+
+
+def crashing_check():
+    raise KeyError('version')
+
+
+class RunChecksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+
+    def tearDown(self):
+        # Lets the threads of the checks which timed out finish
+        self.release.set()
+
+    def hung_check(self):
+        self.release.wait()
+        return 'answered late'
+
+    def test_results_keep_the_order_of_the_checks(self):
+        results = preflight.run_checks([preflight.check('slow', lambda: time.sleep(0.2) or 'slow done'),
+                                        preflight.check('fast', lambda: 'fast done')])
+
+        self.assertEqual([(result.name, result.status, result.detail) for result in results],
+                         [('slow', preflight.STATUS_PASSED, 'slow done'),
+                          ('fast', preflight.STATUS_PASSED, 'fast done')])
+        self.assertTrue(preflight.passed(results))
+
+    def test_checks_run_concurrently(self):
+        started = time.monotonic()
+        results = preflight.run_checks([preflight.check(str(number), lambda: time.sleep(0.3) or 'done')
+                                        for number in range(5)])
+
+        self.assertTrue(preflight.passed(results))
+        self.assertLess(time.monotonic() - started, 1.0)
+
+    def test_hung_check_times_out(self):
+        started = time.monotonic()
+        results = preflight.run_checks([preflight.check('hung', self.hung_check, timeout=0.2),
+                                        preflight.check('hung optional', self.hung_check, timeout=0.2,
+                                                        required=False),
+                                        preflight.check('quick', lambda: 'done', timeout=0.2)])
+
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual([result.status for result in results],
+                         [preflight.STATUS_TIMEOUT, preflight.STATUS_WARNING, preflight.STATUS_PASSED])
+        self.assertEqual(results[0].detail, 'no answer after 0.2 seconds')
+        self.assertFalse(preflight.passed(results))
+
+    def test_failing_required_check_fails_the_run(self):
+        results = preflight.run_checks([preflight.check('links', failing_check),
+                                        preflight.check('settings', crashing_check),
+                                        preflight.check('files', lambda: 'present')])
+
+        self.assertEqual([result.status for result in results],
+                         [preflight.STATUS_FAILED, preflight.STATUS_FAILED, preflight.STATUS_PASSED])
+        self.assertEqual(results[0].detail, 'mirror unreachable')
+        self.assertEqual(results[1].detail, "KeyError: 'version'")
+        self.assertFalse(preflight.passed(results))
+
+    def test_failing_check_which_is_not_required_is_a_warning(self):
+        results = preflight.run_checks([preflight.check('port 3306', failing_check, required=False),
+                                        preflight.check('files', lambda: 'present')])
+
+        self.assertEqual(results[0].status, preflight.STATUS_WARNING)
+        self.assertEqual(results[0].detail, 'mirror unreachable')
+        self.assertTrue(preflight.passed(results))
+
+
+# Answers HEAD requests with 200 for the paths in existing_paths and 404 otherwise, and counts them
+class MirrorHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_HEAD(self):
+        self.server.requested.append(self.path)
+        self.send_response(200 if self.path in self.server.existing_paths else 404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *arguments):
+        pass
+
+
+class MirrorServer(http.server.ThreadingHTTPServer if hasattr(http.server, 'ThreadingHTTPServer')
+                   else http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, existing_paths):
+        super().__init__(('127.0.0.1', 0), MirrorHandler)
+        self.existing_paths = existing_paths
+        self.requested = []
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server_address[1], path)
+
+
+class ArtifactLinksTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.directories = {settings.DIRECTORY_ARTIFACTS: self.directory.name}
+        self.server = MirrorServer(['/guacamole-0.9.14.war'])
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.content = b'guacamole archive'
+        self.artifact = artifact_cache.Artifact('guacamole-0.9.14.war', [self.server.url('/guacamole-0.9.14.war')],
+                                                None, ['guacamole'])
+        self.patches = [mock.patch.object(artifact_cache, 'artifacts', return_value=[self.artifact]),
+                        mock.patch.object(artifact_cache.settings, 'ARTIFACT_SHA256',
+                                          {self.artifact.name: hashlib.sha256(self.content).hexdigest()})]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def check_links(self, urls):
+        return setup_tests.check_artifact_links(self.directories, setup_tests.http_session(), urls)
+
+    def test_links_are_checked_while_the_cache_is_incomplete(self):
+        self.assertEqual(self.check_links(self.artifact.urls), '1 links are valid')
+        self.assertEqual(self.server.requested, ['/guacamole-0.9.14.war'])
+
+        with self.assertRaises(PreflightError):
+            self.check_links([self.server.url('/guacamole-0.9.13.war')])
+
+    def test_mirrors_are_not_contacted_once_the_cache_is_verified(self):
+        with open(os.path.join(self.directory.name, self.artifact.name), 'wb') as file_object:
+            file_object.write(self.content)
+
+        self.assertEqual(self.check_links(self.artifact.urls), 'skipped, every artifact is cached and verified')
+        self.assertEqual(self.server.requested, [])
+
+    def test_corrupt_cached_artifact_checks_the_links(self):
+        with open(os.path.join(self.directory.name, self.artifact.name), 'wb') as file_object:
+            file_object.write(b'truncated')
+
+        self.assertEqual(self.check_links(self.artifact.urls), '1 links are valid')
+
+    def test_every_check_gets_its_own_session(self):
+        sessions = []
+
+        def session_factory():
+            session = setup_tests.http_session()
+            sessions.append(session)
+            return session
+
+        with mock.patch.object(setup_tests, 'artifact_urls', return_value=self.artifact.urls):
+            checks = setup_tests.preflight_checks(self.directories, session_factory, docker=None)
+            http_checks = [check for check in checks if check.name in ('links', 'artifacts')]
+            preflight.run_checks(http_checks)
+
+        self.assertEqual(len(sessions), 2)
+        self.assertIsNot(sessions[0], sessions[1])
+
+
+
+# Docker client listing the running containers
+class ContainersDocker:
+
+    def __init__(self, containers):
+        self.running = containers
+
+    def containers(self, all_containers=True, filters=None):
+        return self.running
+
+
+class PortFreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+    def container(self, name, labels=None):
+        return {'Names': ['/' + name], 'Labels': labels, 'Ports': [{'PrivatePort': 8080, 'PublicPort': self.port}]}
+
+    def test_port_held_by_a_container_of_the_setup_passes(self):
+        labelled = ContainersDocker([self.container('guacamole-custom', {reconcile.SPEC_LABEL: '{}'})])
+        self.assertEqual(setup_tests.check_port_free(self.port, labelled),
+                         'used by guacamole-custom, a container of the setup')
+
+        # Containers of setups older than the spec label have no label
+        older_setup = ContainersDocker([self.container(settings.GUACAMOLE_CONTAINER_NAME)])
+        self.assertEqual(setup_tests.check_port_free(self.port, older_setup),
+                         'used by {}, a container of the setup'.format(settings.GUACAMOLE_CONTAINER_NAME))
+
+    def test_port_held_by_anything_else_fails(self):
+        with self.assertRaises(PreflightError) as raised:
+            setup_tests.check_port_free(self.port, ContainersDocker([self.container('nginx', {'other': 'label'})]))
+        self.assertEqual(str(raised.exception), 'port {} is in use by nginx'.format(self.port))
+
+        with self.assertRaises(PreflightError) as raised:
+            setup_tests.check_port_free(self.port, ContainersDocker([]))
+        self.assertEqual(str(raised.exception), 'port {} is in use'.format(self.port))
+
+    def test_free_port_passes(self):
+        self.listener.close()
+        self.assertEqual(setup_tests.check_port_free(self.port, ContainersDocker([])),
+                         'port {} is free'.format(self.port))
+
+
+if __name__ == '__main__':
+    unittest.main()
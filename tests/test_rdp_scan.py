@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import rdp_scan
+
+# X.224 connection confirm with an RDP negotiation response selecting TLS
+CONNECTION_CONFIRM = bytes([0x03, 0x00, 0x00, 0x13, 0x0e, 0xd0, 0x00, 0x00, 0x12, 0x34, 0x00,
+                            0x02, 0x00, 0x08, 0x00, 0x01, 0x00, 0x00, 0x00])
+
+ANSWER_CONFIRM = 'confirm'
+ANSWER_CLOSE = 'close'
+ANSWER_HTTP = 'http'
+ANSWER_SILENT = 'silent'
+
+
+# Answers every connection the way the answer of the server says, after waiting delay seconds. Records what
+# the probes send and the largest number of connections open at once.
+class EquipmentHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.open_connections += 1
+            server.most_connections = max(server.most_connections, server.open_connections)
+        try:
+            self.request.settimeout(2)
+            if server.answer == ANSWER_SILENT:
+                server.release.wait()
+                return
+
+            received = b''
+            if server.answer != ANSWER_CLOSE:
+                while len(received) < len(rdp_scan.RDP_CONNECTION_REQUEST):
+                    data = self.request.recv(64)
+                    if not data:
+                        break
+                    received += data
+            with server.lock:
+                server.received.append(received)
+
+            time.sleep(server.delay)
+            if server.answer == ANSWER_CONFIRM:
+                self.request.sendall(CONNECTION_CONFIRM)
+            elif server.answer == ANSWER_HTTP:
+                self.request.sendall(b'HTTP/1.1 400 Bad Request\r\n\r\n')
+        finally:
+            with server.lock:
+                server.open_connections -= 1
+
+
+class EquipmentServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # Every probe of a scan connects at once
+    request_queue_size = 64
+
+    def __init__(self, answer, delay=0.0):
+        # Every loopback address reaches the server
+        super().__init__(('', 0), EquipmentHandler)
+        self.answer = answer
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.release = threading.Event()
+        self.received = []
+        self.open_connections = 0
+        self.most_connections = 0
+
+
+class ScanTest(unittest.TestCase):
+
+    def start(self, answer, delay=0.0):
+        server = EquipmentServer(answer, delay)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def stop():
+            server.release.set()
+            server.shutdown()
+            server.server_close()
+        self.addCleanup(stop)
+        return server
+
+    # Scans with the port of the server as the RDP port
+    def scan(self, server, addresses=('127.0.0.1',), **keywords):
+        port = server.server_address[1]
+        with mock.patch.object(rdp_scan, 'RDP_PORT', port):
+            return rdp_scan.scan(list(addresses), [port], **keywords)
+
+    def test_connection_confirm_is_rdp(self):
+        server = self.start(ANSWER_CONFIRM)
+
+        result, = self.scan(server)
+
+        self.assertTrue(result.open)
+        self.assertIsNone(result.error)
+        self.assertGreaterEqual(result.latency, 0)
+        self.assertEqual(server.received, [rdp_scan.RDP_CONNECTION_REQUEST])
+
+    def test_other_service_on_the_rdp_port_is_not_rdp(self):
+        for answer in (ANSWER_HTTP, ANSWER_CLOSE):
+            result, = self.scan(self.start(answer))
+
+            self.assertEqual((result.open, result.latency, result.error), (False, None, 'not rdp'), answer)
+
+    def test_closed_port(self):
+        probe = socket.socket()
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        result, = rdp_scan.scan(['127.0.0.1'], [port])
+
+        self.assertFalse(result.open)
+        self.assertEqual(result.error, 'Connection refused')
+
+    def test_other_ports_are_only_connected(self):
+        server = self.start(ANSWER_CLOSE)
+        port = server.server_address[1]
+
+        result, = rdp_scan.scan(['127.0.0.1'], [port])
+
+        self.assertTrue(result.open)
+        # The probe may be closed before the server gets to the connection
+        deadline = time.monotonic() + 2
+        while not server.received and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(server.received, [b''])
+
+    def test_silent_equipment_times_out(self):
+        server = self.start(ANSWER_SILENT)
+        addresses = ['127.0.0.{}'.format(number) for number in range(1, 11)]
+
+        started = time.monotonic()
+        results = self.scan(server, addresses, timeout=0.2, concurrency=10)
+
+        self.assertLess(time.monotonic() - started, 1.0)
+        self.assertEqual([(result.ip_address, result.open, result.error) for result in results],
+                         [(address, False, 'no rdp answer') for address in addresses])
+
+    def test_connections_in_flight_are_limited(self):
+        server = self.start(ANSWER_CONFIRM, delay=0.1)
+        addresses = ['127.0.0.{}'.format(number) for number in range(1, 13)]
+
+        started = time.monotonic()
+        results = self.scan(server, addresses, concurrency=3)
+
+        self.assertTrue(all(result.open for result in results))
+        self.assertEqual([result.ip_address for result in results], addresses)
+        self.assertLessEqual(server.most_connections, 3)
+        self.assertGreaterEqual(time.monotonic() - started, 4 * 0.1)
+
+
+class TargetAddressesTest(unittest.TestCase):
+
+    def test_networks_and_addresses(self):
+        self.assertEqual(rdp_scan.target_addresses(['192.168.7.0/30', '10.0.0.5', '10.0.1.9/32']),
+                         ['192.168.7.1', '192.168.7.2', '10.0.0.5', '10.0.1.9'])
+        self.assertEqual(rdp_scan.scan([]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import artifact_cache
+import build_cache
+import reconcile
+import settings
+import setup
+from reconcile import ContainerSpec
+
+
+# Keeps the containers and images in memory the way the docker daemon reports them
+class FakeDocker:
+
+    def __init__(self):
+        self.containers_by_name = {}
+        self.images = {}
+        self.calls = []
+
+    def inspect_container(self, name):
+        return self.containers_by_name.get(name)
+
+    def containers(self, all_containers=True, filters=None):
+        return [{'Names': ['/' + name]} for name in self.containers_by_name]
+
+    def inspect_image(self, tag):
+        return self.images.get(tag)
+
+    def remove_container(self, name, force=False):
+        self.calls.append(('remove', name))
+        del self.containers_by_name[name]
+
+    def start_container(self, name):
+        self.calls.append(('start', name))
+        self.containers_by_name[name]['State']['Running'] = True
+
+    def run(self, name, image, labels=None, **options):
+        self.calls.append(('run', name, options))
+        self.containers_by_name[name] = {'Image': 'sha256:' + image, 'Config': {'Labels': labels},
+                                         'State': {'Running': True}}
+
+
+def guacd_spec(cpuset='1', memory_mb=224, files=None):
+    return ContainerSpec('guacd_container_1', 'guacd_image',
+                         {'network': 'guacamole_network', 'memory_mb': memory_mb, 'cpuset': cpuset,
+                          'ports': {'4822/tcp': ('127.0.0.1', 4822)}},
+                         {'MYSQL_ROOT_PASSWORD': 'only on create'}, files or {})
+
+
+class ContainerChangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.docker = FakeDocker()
+
+    def change(self, spec, image_id='sha256:guacd_image', reason=None):
+        return reconcile.container_change(self.docker, spec, image_id, reason)
+
+    def apply(self, spec):
+        change = self.change(spec)
+        reconcile.apply_container_change(self.docker, spec, change)
+        return change
+
+    def test_missing_container_is_created_then_kept(self):
+        spec = guacd_spec(files={'/generated_files/mysql_memory.cnf': b'[mysqld]\n'})
+
+        self.assertEqual(self.apply(spec), reconcile.Change('container', 'guacd_container_1',
+                                                            reconcile.ACTION_CREATE, 'missing'))
+        # The initial environment is passed on create only and is not recorded
+        _, _, options = self.docker.calls[-1]
+        self.assertEqual(options['environment'], {'MYSQL_ROOT_PASSWORD': 'only on create'})
+        label = json.loads(self.docker.containers_by_name['guacd_container_1']['Config']['Labels'][
+            reconcile.SPEC_LABEL])
+        self.assertNotIn('environment', label['options'])
+
+        # The tuples of the options read back from the label as lists still compare equal
+        self.assertEqual(self.change(spec).action, reconcile.ACTION_KEEP)
+        self.assertEqual(self.change(guacd_spec(files={'/generated_files/mysql_memory.cnf': b'[mysqld]\n'})
+                                     ._replace(initial_environment={})).action, reconcile.ACTION_KEEP)
+
+    def test_changed_spec_recreates_the_container(self):
+        self.apply(guacd_spec(files={'/generated_files/mysql_memory.cnf': b'[mysqld]\n'}))
+
+        self.assertEqual(self.change(guacd_spec(cpuset='2', memory_mb=272,
+                                                files={'/generated_files/mysql_memory.cnf': b'[mysqld]\n'})),
+                         reconcile.Change('container', 'guacd_container_1', reconcile.ACTION_RECREATE,
+                                          'cpuset, memory_mb changed'))
+        self.assertEqual(self.change(guacd_spec(files={'/generated_files/mysql_memory.cnf': b'[mysqld]\nx\n'}))
+                         .reason, 'mysql_memory.cnf changed')
+        self.assertEqual(self.change(guacd_spec(cpuset=None)).reason, 'cpuset changed')
+        self.assertEqual(self.change(guacd_spec()._replace(image='other_image')).reason, 'image changed')
+
+        spec = guacd_spec(cpuset='2', files={'/generated_files/mysql_memory.cnf': b'[mysqld]\n'})
+        self.apply(spec)
+        self.assertEqual([call[:2] for call in self.docker.calls[-2:]],
+                         [('remove', 'guacd_container_1'), ('run', 'guacd_container_1')])
+        self.assertEqual(self.change(spec).action, reconcile.ACTION_KEEP)
+
+    def test_rebuilt_image_or_reason_recreates_the_container(self):
+        spec = guacd_spec()
+        self.apply(spec)
+
+        self.assertEqual(self.change(spec, image_id='sha256:rebuilt').reason, 'image rebuilt')
+        self.assertEqual(self.change(spec, image_id=None).reason, 'image rebuilt')
+        self.assertEqual(self.change(spec, reason='new database'),
+                         reconcile.Change('container', 'guacd_container_1', reconcile.ACTION_RECREATE,
+                                          'new database'))
+
+    def test_container_of_an_earlier_setup_is_recreated(self):
+        self.docker.containers_by_name['guacd_container_1'] = {
+            'Image': 'sha256:guacd_image', 'Config': {'Labels': None}, 'State': {'Running': True}}
+        self.assertEqual(self.change(guacd_spec()).reason, 'created by an earlier setup')
+
+        self.docker.containers_by_name['guacd_container_1']['Config']['Labels'] = {reconcile.SPEC_LABEL: '{'}
+        self.assertEqual(self.change(guacd_spec()).reason, 'image, cpuset, memory_mb, network, ports changed')
+
+    def test_stopped_container_is_started(self):
+        spec = guacd_spec()
+        self.apply(spec)
+        self.docker.containers_by_name['guacd_container_1']['State']['Running'] = False
+
+        self.assertEqual(self.apply(spec).action, reconcile.ACTION_START)
+        self.assertEqual(self.docker.calls[-1], ('start', 'guacd_container_1'))
+        self.assertEqual(self.change(spec).action, reconcile.ACTION_KEEP)
+
+    def test_containers_outside_the_pool_are_removed(self):
+        for name in ('guacd_container_0', 'guacd_container_1', 'guacd_container_3', 'sql_container'):
+            self.docker.containers_by_name[name] = {}
+
+        with mock.patch.object(setup, 'docker', self.docker), mock.patch.object(settings, 'GUACD_INSTANCES', 2):
+            self.assertEqual(setup.stale_guacd_containers(), ['guacd_container_3'])
+        with mock.patch.object(setup, 'docker', self.docker), mock.patch.object(settings, 'GUACD_INSTANCES', 1):
+            self.assertEqual(setup.stale_guacd_containers(), ['guacd_container_1', 'guacd_container_3'])
+
+
+class FileChangeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'zram_swap.sh')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_actions(self):
+        self.assertEqual(reconcile.file_change(self.path, None).action, reconcile.ACTION_KEEP)
+        self.assertEqual(reconcile.file_change(self.path, '#!/bin/sh\n').action, reconcile.ACTION_CREATE)
+
+        self.assertTrue(reconcile.write_file(self.path, '#!/bin/sh\n', 0o755))
+        self.assertEqual(reconcile.file_change(self.path, '#!/bin/sh\n'),
+                         reconcile.Change('file', 'zram_swap.sh', reconcile.ACTION_KEEP, 'up to date'))
+        self.assertEqual(reconcile.file_change(self.path, '#!/bin/bash\n').action, reconcile.ACTION_UPDATE)
+        self.assertEqual(reconcile.file_change(self.path, None).action, reconcile.ACTION_REMOVE)
+
+    def test_unchanged_file_is_not_written(self):
+        reconcile.write_file(self.path, '#!/bin/sh\n', 0o755)
+        os.utime(self.path, (1000000000, 1000000000))
+
+        self.assertFalse(reconcile.write_file(self.path, '#!/bin/sh\n', 0o700))
+        self.assertEqual(os.stat(self.path).st_mtime, 1000000000)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o755)
+
+
+class PlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.directories = {name: os.path.join(self.directory.name, name)
+                            for name in (settings.DIRECTORY_BASE, settings.DIRECTORY_GUACD,
+                                         settings.DIRECTORY_GENERATED_FILES, settings.DIRECTORY_ARTIFACTS)}
+        for name in (settings.DIRECTORY_BASE, settings.DIRECTORY_GUACD, settings.DIRECTORY_ARTIFACTS):
+            os.mkdir(self.directories[name])
+        self.write(settings.DIRECTORY_BASE, 'tests.py', b'')
+        self.write(settings.DIRECTORY_GUACD, 'Dockerfile', b'FROM debian\nCOPY guacamole-server.tar.gz /tmp/\n')
+
+        artifact = artifact_cache.Artifact('guacamole-server.tar.gz', [], None, [settings.DIRECTORY_GUACD])
+        self.image_build = setup.ImageBuild('guacd', settings.DIRECTORY_GUACD, 'guacd_image', {'VERSION': '1'})
+        self.docker = FakeDocker()
+        self.patches = [mock.patch.object(artifact_cache, 'artifacts', return_value=[artifact]),
+                        mock.patch.object(setup, 'docker', self.docker)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        self.directory.cleanup()
+
+    def write(self, directory, name, content):
+        with open(os.path.join(self.directories[directory], name), 'wb') as file_object:
+            file_object.write(content)
+
+    # Returns the links and modification time of every file and directory, a file linked into a directory and
+    # removed again still changes the time of the directory
+    def snapshot(self):
+        paths = [self.directory.name]
+        for directory, directory_names, file_names in os.walk(self.directory.name):
+            paths.extend(os.path.join(directory, name) for name in directory_names + file_names)
+        return {path: (os.stat(path).st_nlink, os.stat(path).st_mtime_ns) for path in paths}
+
+    # Records the image as build_staged_image labels it, with the artifacts staged in the context
+    def build(self):
+        staged = artifact_cache.stage(self.directories, settings.DIRECTORY_GUACD)
+        try:
+            fingerprint = build_cache.context_fingerprint(self.directories[settings.DIRECTORY_GUACD],
+                                                          self.image_build.build_args)
+        finally:
+            artifact_cache.unstage(staged)
+        self.docker.images['guacd_image'] = {'Config': {'Labels': {build_cache.FINGERPRINT_LABEL: fingerprint}}}
+
+    def change(self):
+        return setup.image_change(self.directories, self.image_build, {}, False)
+
+    def test_image_change_writes_nothing(self):
+        self.write(settings.DIRECTORY_ARTIFACTS, 'guacamole-server.tar.gz', b'source 1')
+        before = self.snapshot()
+        self.assertEqual(self.change().reason, 'missing')
+        self.assertEqual(self.snapshot(), before)
+
+        self.build()
+        before = self.snapshot()
+        self.assertEqual(self.change().action, reconcile.ACTION_KEEP)
+        self.assertEqual(self.snapshot(), before)
+
+    def test_changed_artifact_rebuilds_the_image(self):
+        self.assertEqual(self.change().reason, 'artifacts not downloaded yet')
+
+        self.write(settings.DIRECTORY_ARTIFACTS, 'guacamole-server.tar.gz', b'source 1')
+        self.build()
+        self.write(settings.DIRECTORY_ARTIFACTS, 'guacamole-server.tar.gz', b'source 2')
+
+        self.assertEqual(self.change(), reconcile.Change('image', 'guacd_image', reconcile.ACTION_BUILD,
+                                                         'build inputs changed'))
+
+    def test_plan_creates_no_directories(self):
+        setup.create_directory_structure(self.directories, plan_only=True)
+        self.assertFalse(os.path.exists(self.directories[settings.DIRECTORY_GENERATED_FILES]))
+
+        setup.create_directory_structure(self.directories)
+        self.assertTrue(os.path.isdir(self.directories[settings.DIRECTORY_GENERATED_FILES]))
+
+
+if __name__ == '__main__':
+    unittest.main()
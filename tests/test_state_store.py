@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'log_email'))
+import state_store
+
+
+class StateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.generated_files = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def run_once(self, start_bytes, end_bytes):
+        store = state_store.StateStore(self.generated_files)
+        store.cursors['syslog'] = {'inode': 1, 'offset': 100}
+        store.save()
+        with mock.patch.object(state_store, 'storage_write_bytes', return_value=end_bytes):
+            state_store.record_write_bytes(store, start_bytes)
+        return store.save()
+
+    def test_unchanged_run_does_not_rewrite_the_state(self):
+        self.assertTrue(self.run_once(0, 4096))
+        self.assertFalse(self.run_once(8192, 12288))
+
+    def test_changed_measurement_is_saved(self):
+        self.run_once(0, 4096)
+        self.assertTrue(self.run_once(0, 8192))
+        self.assertEqual(state_store.StateStore(self.generated_files).state['last_run'], {'write_bytes': 8192})
+
+
+if __name__ == '__main__':
+    unittest.main()
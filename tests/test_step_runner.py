@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import step_runner
+from step_runner import Step, StepError
+
+
+class RunStepsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.lock = threading.Lock()
+
+    # Returns a step function which records when it starts and finishes
+    def recorded(self, name, seconds=0.0, error=None):
+        def function():
+            with self.lock:
+                self.events.append(('start', name))
+            time.sleep(seconds)
+            with self.lock:
+                self.events.append(('finish', name))
+            if error is not None:
+                raise error
+        return function
+
+    def statuses(self, results):
+        return [(result.name, result.status) for result in results]
+
+    def test_step_starts_after_its_dependencies(self):
+        steps = [Step('containers', self.recorded('containers'), ['images', 'network']),
+                 Step('images', self.recorded('images', 0.1), []),
+                 Step('network', self.recorded('network'), [])]
+
+        results = step_runner.run_steps(steps)
+
+        self.assertEqual(self.statuses(results), [('containers', step_runner.STATUS_OK),
+                                                  ('images', step_runner.STATUS_OK),
+                                                  ('network', step_runner.STATUS_OK)])
+        start = self.events.index(('start', 'containers'))
+        self.assertLess(self.events.index(('finish', 'images')), start)
+        self.assertLess(self.events.index(('finish', 'network')), start)
+
+    def test_independent_steps_run_concurrently(self):
+        steps = [Step(str(number), self.recorded(str(number), 0.3), []) for number in range(4)]
+
+        started = time.monotonic()
+        step_runner.run_steps(steps)
+        self.assertLess(time.monotonic() - started, 1.0)
+
+        self.assertEqual([event for event, _ in self.events[:4]], ['start'] * 4)
+
+    def test_failure_skips_the_dependents_only(self):
+        steps = [Step('images', self.recorded('images', error=StepError('build failed')), []),
+                 Step('containers', self.recorded('containers'), ['images']),
+                 Step('database', self.recorded('database'), ['containers']),
+                 Step('network', self.recorded('network'), [])]
+
+        results = step_runner.run_steps(steps)
+
+        self.assertEqual(self.statuses(results), [('images', step_runner.STATUS_FAILED),
+                                                  ('containers', step_runner.STATUS_SKIPPED),
+                                                  ('database', step_runner.STATUS_SKIPPED),
+                                                  ('network', step_runner.STATUS_OK)])
+        self.assertEqual([result.error for result in results],
+                         ['build failed', 'depends on images', 'depends on containers', None])
+        self.assertNotIn(('start', 'containers'), self.events)
+        self.assertNotIn(('start', 'database'), self.events)
+
+    def test_exit_and_exceptions_are_failures(self):
+        steps = [Step('exit', self.recorded('exit', error=SystemExit(1)), []),
+                 Step('crash', self.recorded('crash', error=KeyError('version')), [])]
+
+        results = step_runner.run_steps(steps)
+
+        self.assertEqual([(result.status, result.error) for result in results],
+                         [(step_runner.STATUS_FAILED, 'exited, see the output above'),
+                          (step_runner.STATUS_FAILED, "KeyError: 'version'")])
+
+    def test_unknown_dependency_is_rejected_before_anything_runs(self):
+        steps = [Step('containers', self.recorded('containers'), ['images'])]
+
+        with self.assertRaises(ValueError) as raised:
+            step_runner.run_steps(steps)
+        self.assertEqual(str(raised.exception), 'The step containers depends on the unknown step images')
+        self.assertEqual(self.events, [])
+
+    def test_cycle_is_detected(self):
+        steps = [Step('network', self.recorded('network'), []),
+                 Step('images', self.recorded('images'), ['containers']),
+                 Step('containers', self.recorded('containers'), ['images'])]
+
+        with self.assertRaises(ValueError) as raised:
+            step_runner.run_steps(steps)
+        self.assertEqual(str(raised.exception), 'The steps images, containers depend on each other')
+        self.assertEqual(self.events, [('start', 'network'), ('finish', 'network')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import os
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'pi_setup_files'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'guacamole_setup_files'))
+import tracing
+from docker_api import DockerClient, DockerError
+
+ORIGINAL_POPEN = subprocess.Popen
+
+
+class TracingTest(unittest.TestCase):
+
+    def setUp(self):
+        # No script is started, so nothing is written
+        del tracing.spans[:]
+
+    def spans(self, kind):
+        return [span for span in tracing.spans if span['kind'] == kind]
+
+    def test_commands_of_a_phase_are_recorded(self):
+        with tracing.phase('outer') as outer:
+            with tracing.phase('inner') as inner:
+                self.assertEqual(tracing.check_call(['true']), 0)
+            output = tracing.check_output(['echo', 'one', 'two', 'three'])
+            self.assertEqual(tracing.call('exit 3', shell=True), 3)
+
+        self.assertEqual(output, b'one two three\n')
+        commands = self.spans(tracing.KIND_COMMAND)
+        self.assertEqual([(span['name'], span['parent'], span['status'], span['exit_code']) for span in commands],
+                         [('true', inner['id'], tracing.STATUS_OK, 0),
+                          ('echo one two ...', outer['id'], tracing.STATUS_OK, 0),
+                          ('exit 3', outer['id'], tracing.STATUS_FAILED, 3)])
+        self.assertEqual(commands[1]['output_bytes'], len(b'one two three\n'))
+
+    def test_failing_commands_raise_as_subprocess_does(self):
+        with tracing.phase('failing'):
+            with self.assertRaises(subprocess.CalledProcessError) as raised:
+                tracing.check_output('echo partial; exit 2', shell=True)
+            self.assertEqual((raised.exception.returncode, raised.exception.output), (2, b'partial\n'))
+
+            with self.assertRaises(subprocess.CalledProcessError) as raised:
+                tracing.check_call(['false'])
+            self.assertEqual(raised.exception.cmd, ['false'])
+
+            with self.assertRaises(OSError):
+                tracing.check_call(['/nonexistent/command'])
+
+        self.assertEqual([span['status'] for span in self.spans(tracing.KIND_COMMAND)], [tracing.STATUS_FAILED] * 3)
+        self.assertIsNotNone(self.spans(tracing.KIND_COMMAND)[2]['error'])
+
+    def test_subprocess_is_left_alone(self):
+        with tracing.phase('phase'):
+            self.assertIs(subprocess.Popen, ORIGINAL_POPEN)
+            subprocess.check_call(['true'])
+
+        # Outside a phase the helpers run the command without recording it
+        self.assertEqual(tracing.check_output(['echo', 'unrecorded']), b'unrecorded\n')
+        self.assertEqual(self.spans(tracing.KIND_COMMAND), [])
+
+    def test_other_threads_are_not_recorded(self):
+        entered = threading.Event()
+        release = threading.Event()
+        outputs = []
+
+        def step():
+            with tracing.phase('step'):
+                entered.set()
+                release.wait()
+
+        thread = threading.Thread(target=step)
+        thread.start()
+        entered.wait()
+        # A thread without a phase of its own is not recorded while another thread is in a phase
+        worker = threading.Thread(target=lambda: outputs.append(tracing.check_output(['echo', 'worker'])))
+        worker.start()
+        worker.join()
+        release.set()
+        thread.join()
+
+        self.assertEqual(outputs, [b'worker\n'])
+        self.assertEqual(self.spans(tracing.KIND_COMMAND), [])
+
+    def test_failing_phase(self):
+        with self.assertRaises(SystemExit):
+            with tracing.phase('failing'):
+                sys.exit(1)
+
+        self.assertEqual(self.spans(tracing.KIND_PHASE)[0]['error'], 'exited with 1')
+
+
+# Answers every docker api request with the status of the path, /v1.25/_ping with OK and anything else with 404
+class DockerStubHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            request_line = self.rfile.readline()
+            if not request_line:
+                return
+            while self.rfile.readline() not in (b'\r\n', b''):
+                pass
+
+            if request_line.split()[1] == b'/v1.25/_ping':
+                status, body = '200 OK', b'OK'
+            else:
+                status, body = '404 Not Found', b'{"message": "no such container"}'
+            self.wfile.write('HTTP/1.1 {}\r\nContent-Length: {}\r\n\r\n'.format(status, len(body)).encode('ascii'))
+            self.wfile.write(body)
+
+
+class DockerRequestSpanTest(unittest.TestCase):
+
+    def setUp(self):
+        del tracing.spans[:]
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.directory.name, 'docker.sock')
+        self.server = socketserver.ThreadingUnixStreamServer(self.socket_path, DockerStubHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_requests_are_spans_of_the_phase(self):
+        docker = DockerClient(self.socket_path, timeout=5, request_tracer=tracing.request)
+
+        with tracing.phase('docker'):
+            self.assertTrue(docker.ping())
+            with self.assertRaises(DockerError):
+                docker._json('GET', '/containers/guacamole/json')
+        docker.close()
+
+        phase, ping, inspect = tracing.spans
+        self.assertEqual([(span['name'], span['parent'], span['status']) for span in (ping, inspect)],
+                         [('docker GET /_ping', phase['id'], tracing.STATUS_OK),
+                          ('docker GET /containers/guacamole/json', phase['id'], tracing.STATUS_FAILED)])
+        self.assertEqual(tracing.slowest_phases(tracing.timeline())[0][1][0], 2)
+
+    def test_client_without_tracer_records_nothing(self):
+        docker = DockerClient(self.socket_path, timeout=5)
+        self.assertTrue(docker.ping())
+        docker.close()
+
+        self.assertEqual(tracing.spans, [])
+
+
+if __name__ == '__main__':
+    unittest.main()